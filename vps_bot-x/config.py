@@ -15,7 +15,96 @@ DEFAULT_CONFIG = {
     "traffic_limit_gb": 1024,
     "backup_paths": [],
     "daily_report_times": ["08:00", "20:00"],
-    "command_prefix": "kk"  # 命令前缀，默认为"kk"
+    "command_prefix": "kk",  # 命令前缀，默认为"kk"
+    "bulk_parallelism": 4,   # 批量容器操作的并发上限
+    "notify_rate": 1.0,      # 单会话每秒最多推送条数 (令牌桶补充速率)
+    "digest_window": 15,     # 同类告警首条立即发送, 其后该窗口 (秒) 内的合并为摘要; 0 为不合并 (紧急告警从不合并)
+    "concurrent_updates": 16,  # 同时处理的更新数上限
+    "run_mode": "polling",     # 运行模式: polling (长轮询) / webhook
+    "webhook": {
+        "url": "",             # Telegram 可访问的 https 根地址, 如 https://bot.example.com
+        "path": "tg-webhook",  # 推送路径 (完整地址为 url/path)
+        "listen": "0.0.0.0",
+        "port": 8443,          # Telegram 仅支持 443/80/88/8443 (经反向代理时不限)
+        "secret_token": "",    # 留空则由 Bot Token 派生
+        "cert": "",            # 可选: TLS 证书 (自签证书会自动上传给 Telegram)
+        "key": "",             # 可选: TLS 私钥
+        "max_connections": 40,
+        "queue_size": 256      # 更新队列上限
+    },
+    "mode": "standalone",      # 多 VPS: standalone (单机) / controller (汇总) / agent (仅提供 RPC)
+    "agent": {                 # agent 模式监听参数
+        "listen": "0.0.0.0",
+        "port": 9101,
+        "token": ""            # HMAC 共享密钥, controller 的 agents 列表中填写相同值
+    },
+    "agents": [],              # controller 模式: [{"name": "hk-1", "url": "http://10.0.0.2:9101", "token": "..."}]
+    "fleet_include_local": True,  # controller 总览中是否包含本机
+    "backup_dir": "/var/lib/vps_bot/backups",  # 备份归档存放目录
+    "backup_compressor": "auto",  # auto / seekable / zstd / pigz / gzip
+    "backup_seekable": True,   # auto 时写入可随机访问的分帧归档 (支持 /restore 选择性还原)
+    "backup_frame_mb": 4,      # 分帧归档每帧的原始大小 (MB)
+    "backup_level": 3,         # 压缩级别 (zstd 1-19, pigz/gzip 1-9)
+    "backup_threads": 0,       # 压缩线程数, 0 为使用全部 CPU
+    "backup_timeout": 3600,    # 单次备份超时 (秒)
+    "backup_keep": 5,          # 备份目录中保留的归档数量 (增量依赖的归档会额外保留)
+    "backup_mode": "full",     # full (每次全量) / incremental (基于文件清单的增量)
+    "backup_full_every": 7,    # 增量模式下每条链的归档数上限, 达到后重新做全量
+    "backup_repo_dir": "/var/lib/vps_bot/repo",  # repo 模式: 去重仓库目录
+    "backup_workers": 0,       # repo 模式: 分块/压缩进程数, 0 为 CPU 核数
+    "backup_repo_level": 6,    # repo 模式: 块压缩级别 (zlib 1-9)
+    "backup_volume_mb": 48,    # 超过此大小的归档分卷发送 (Bot API 上限 50MB)
+    "backup_upload_parallel": 2,  # 同时上传的分卷数
+    "size_cache_ttl": 600,     # 备份体积估算缓存有效期 (秒), 过期后后台重新统计
+    "size_scan_workers": 8,    # 体积统计的并行 scandir 线程数
+    "backup_catalog": "/var/lib/vps_bot/catalog.db",  # 备份目录库 (SQLite)
+    "backup_retention": {      # 保留策略: 最近 last 个 (默认 backup_keep) + 每日/每周/每月各保留最新一个
+        "daily": 0,
+        "weekly": 0,
+        "monthly": 0
+    },
+    "docker_backup": {         # Docker 卷 / 容器备份 (经 Engine API 归档接口读取, 每个来源单独成档)
+        "volumes": [],         # 卷名
+        "containers": [],      # 容器名 (备份容器文件系统, 不含卷)
+        "pause": False,        # 打包期间暂停相关容器, 获得一致副本
+        "parallel": 2,         # 同时备份的来源数
+        "helper_image": "",    # 读取卷的辅助容器镜像 (只创建不启动), 留空自动选择本地镜像
+        "deliver": True        # 备份后发送到 Telegram
+    },
+    # 远程备份目标: 归档写盘时同时上传, 多个目标并行; 远端的过期清理交给存储桶生命周期规则
+    # {"type": "s3", "name": "minio", "endpoint": "http://127.0.0.1:9000", "bucket": "backups", "prefix": "vps1/",
+    #  "access_key": "", "secret_key": "", "region": "us-east-1", "part_mb": 16, "concurrency": 4}
+    # {"type": "sftp", "name": "nas", "host": "backup@10.0.0.2", "port": 22, "path": "/srv/backups", "identity": ""}
+    "destinations": [],
+    "bot_api": {               # 自建 telegram-bot-api 服务器; base_url 留空则使用官方云端 (下载 20MB / 上传 50MB)
+        "base_url": "",        # 例如 http://127.0.0.1:8081/bot
+        "base_file_url": "",   # 留空时由 base_url 推导为 .../file/bot
+        "local_mode": True,    # 服务器以 --local 运行: 文件直接读写本机磁盘
+        "upload_mb": 2000,
+        "download_mb": 2000
+    },
+    "isolation": {             # Bot 启动的重任务 (tar / 压缩 / apt / journalctl / docker prune) 的资源限制
+        "mode": "auto",        # auto (有 systemd 用临时 scope, 否则 nice+ionice) / systemd / nice / off
+        "cpu_weight": 20,      # CPU 权重 1-10000 (默认进程为 100), 空闲时不限速
+        "cpu_quota": 0,        # 每线程 CPU 硬上限 %, 100 = 一个核, 0 不限 (多线程压缩器按线程数放大)
+        "io_weight": 10,       # IO 权重 1-10000 (默认进程为 100)
+        "read_mbps": 0,        # 读带宽上限 MB/s, 0 不限
+        "write_mbps": 0,       # 写带宽上限 MB/s, 0 不限
+        "io_path": "/",        # 带宽上限作用于该路径所在的块设备
+        "memory_max_mb": 0,    # 内存上限 MB, 0 不限
+        "nice": 10,
+        "ionice_class": 3      # nice 模式: 2 = best-effort, 3 = idle
+    },
+    "upload_reserve_mb": 512,  # 接收上传 / 解压后至少保留的磁盘剩余空间 (MB)
+    "upload_extract_max_mb": 4096,  # 单个压缩包解压总量上限 (MB)
+    "job_limits": {            # 后台任务各类型并发上限, 超出时排队
+        "backup": 1,
+        "restore": 1,
+        "clean": 1,
+        "prune": 1,
+        "docker_exec": 3,
+        "unzip": 2
+    }
 }
 
 def load_config():
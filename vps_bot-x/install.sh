@@ -37,7 +37,7 @@ fi
 
 echo -e "${GREEN}>>> [2/6] 正在安装系统依赖...${NC}"
 apt update -y > /dev/null 2>&1
-apt install -y curl nano git vnstat nethogs iptables net-tools jq > /dev/null 2>&1
+apt install -y curl nano git vnstat nethogs iptables net-tools jq zstd pigz > /dev/null 2>&1
 
 # 配置 vnstat
 systemctl enable vnstat > /dev/null 2>&1
@@ -62,7 +62,7 @@ elif [ ! -f "$TARGET_DIR/main.py" ]; then
 fi
 
 # 安装依赖
-pip3 install python-telegram-bot psutil requests netifaces schedule --break-system-packages > /dev/null 2>&1
+pip3 install "python-telegram-bot[webhooks]" psutil requests netifaces schedule --break-system-packages > /dev/null 2>&1
 
 echo -e "${GREEN}>>> [4/6] 配置初始化...${NC}"
 if [ ! -f "$CONFIG_FILE" ]; then
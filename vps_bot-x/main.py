@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 # main.py (V6.0.0 内网管理版 - 完整修复)
-import os, asyncio, logging, subprocess, json, re
+import os, asyncio, logging, subprocess, json, re, hashlib, html, shlex
 from datetime import datetime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
@@ -14,21 +14,46 @@ import modules.system as sys_mod
 import modules.docker_mgr as dk_mgr 
 import modules.settings as settings_mod
 import modules.backup as bk_mgr
+import modules.backup_repo as repo_mgr
+import modules.volumes as volumes
+import modules.size_cache as size_cache
+import modules.jobs as jobs
+import modules.catalog as catalog
+import modules.uploads as uploads
+import modules.docker_backup as dk_backup
+import modules.destinations as destinations
+import modules.bot_api as bot_api
 import modules.health_check as health_mod
+import modules.view_cache as view_cache
+import modules.notifier as notifier
+import modules.fleet as fleet
 from utils import get_audit_tail
+import router
+import session
+from router import route
 
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logging.getLogger("httpx").setLevel(logging.WARNING)
 
-STATE = None 
-SET_ACTION = None 
-WIZARD_STATE = None
-CURRENT_UPLOAD_DIR = UPLOAD_DIR # 默认上传目录
+session.DEFAULTS['upload_dir'] = UPLOAD_DIR # 默认上传目录
+
+async def edit_view(q, txt, kb):
+    """编辑菜单消息; 内容未变化 (重复点击 / 缓存命中) 时忽略 Telegram 的 "Message is not modified" """
+    try:
+        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+    except Exception as e:
+        if "not modified" not in str(e):
+            raise
 
 # --- 🚀 任务监控 ---
 async def docker_sentinel(app: Application):
-    """Docker 容器异常监控"""
-    cmd = ["docker", "events", "--filter", "event=die", "--filter", "event=oom", "--format", "{{json .}}"]
+    """Docker 容器异常监控 (同时驱动健康评分引擎)"""
+    cmd = ["docker", "events", "--filter", "type=container",
+           "--filter", "event=die", "--filter", "event=oom", "--filter", "event=start",
+           "--filter", "event=restart", "--filter", "event=stop", "--filter", "event=kill",
+           "--filter", "event=pause", "--filter", "event=unpause",
+           "--filter", "event=health_status", "--filter", "event=destroy",
+           "--format", "{{json .}}"]
     try:
         proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE)
         while True:
@@ -36,17 +61,16 @@ async def docker_sentinel(app: Application):
             if not line: break
             try:
                 event = json.loads(line.decode().strip())
+                health_mod.on_docker_event(event)
+                view_cache.invalidate('dk_main', 'health')
+                if event.get('Action') != "die": continue
                 exit_code = event.get('Actor', {}).get('Attributes', {}).get('exitCode')
                 if exit_code and exit_code != "0":
                     name = event.get('Actor', {}).get('Attributes', {}).get('name')
                     cid = event.get('id', '')[:12]
                     txt = f"🚨 <b>预警:容器异常停止</b>\n📦 容器: <code>{name}</code>\n📉 退出码: <code>{exit_code}</code>"
-                    await app.bot.send_message(
-                        chat_id=ALLOWED_USER_ID, 
-                        text=txt, 
-                        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("📄 查看", callback_data=f"dk_view_{cid}")]]), 
-                        parse_mode="HTML"
-                    )
+                    notifier.notify(txt, ALLOWED_USER_IDS, kind="容器异常停止", prio=notifier.PRIO_CRITICAL,
+                                    reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("📄 查看", callback_data=f"dk_view_{cid}")]]))
             except: 
                 continue
     except Exception as e:
@@ -58,9 +82,8 @@ async def start(u: Update, c: ContextTypes.DEFAULT_TYPE):
     if u.effective_user.id not in ALLOWED_USER_IDS: 
         return
     
-    global STATE, WIZARD_STATE
-    STATE = None
-    WIZARD_STATE = None
+    s = session.of(u)
+    session.reset_input(s)
     
     conf = load_config()
     used = sys_mod.get_traffic_stats('month')
@@ -80,13 +103,15 @@ async def start(u: Update, c: ContextTypes.DEFAULT_TYPE):
          InlineKeyboardButton("🧰 工具箱", callback_data="tool_box")],
         [InlineKeyboardButton("⚙️ 实验室设置", callback_data="sent_lab")]
     ]
+    if conf.get('mode') == "controller":
+        kb.insert(0, [InlineKeyboardButton(f"🌐 集群总览 ({len(fleet.get_agents())} 台)", callback_data="fleet_m")])
     
     txt = (f"🛸 <b>{conf.get('server_remark', 'X-Lab')} 控制台</b>\n"
            f"━━━━━━━━━━━━━━━\n"
            f"📈 月流量: <code>{used:.2f} G</code> / <code>{limit} G</code>\n"
            f"⌛️ 进度: <code>{bar}</code>\n"
            f"━━━━━━━━━━━━━━━\n"
-           f"📂 上传目录: <code>{CURRENT_UPLOAD_DIR}</code>")
+           f"📂 上传目录: <code>{s['upload_dir']}</code>")
     
     if u.callback_query:
         await u.callback_query.edit_message_text(txt, reply_markup=InlineKeyboardMarkup(kb), parse_mode="HTML")
@@ -95,29 +120,43 @@ async def start(u: Update, c: ContextTypes.DEFAULT_TYPE):
 
 async def document_handler(u: Update, c: ContextTypes.DEFAULT_TYPE):
     """处理用户发送的文件"""
-    global STATE
     if u.effective_user.id not in ALLOWED_USER_IDS:
         return
+    s = session.of(u)
     
     doc = u.message.document
-    file_name = doc.file_name
-    file_size = doc.file_size / 1024 / 1024
+    file_name = os.path.basename(doc.file_name or "") or f"upload_{doc.file_unique_id}"
+    file_size = (doc.file_size or 0) / 1024 / 1024
+    expected_sha = uploads.parse_checksum(u.message.caption)
+    
+    # 下载前检查剩余空间 (含保留余量), 不足时直接拒收
+    os.makedirs(s['upload_dir'], exist_ok=True)
+    ok, why = uploads.check_space(s['upload_dir'], doc.file_size or 0)
+    if not ok:
+        await u.message.reply_text(why, parse_mode="HTML")
+        return
+    if (doc.file_size or 0) > bot_api.download_limit():
+        hint = "" if bot_api.is_local() else "\n💡 配置自建 Bot API 服务器 (<code>bot_api.base_url</code>) 可接收最大 2000MB 的文件"
+        await u.message.reply_text(f"❌ <b>文件超过下载上限</b> ({bot_api.download_limit() // 1024**2} MB){hint}", parse_mode="HTML")
+        return
     
-    status_msg = await u.message.reply_text(f"📥 <b>开始接收文件:</b><code>{file_name}</code>\n📊 大小: <code>{file_size:.2f} MB</code>", parse_mode="HTML")
+    status_msg = await u.message.reply_text(f"📥 <b>开始接收文件:</b><code>{html.escape(file_name)}</code>\n📊 大小: <code>{file_size:.2f} MB</code>", parse_mode="HTML")
     
     try:
         new_file = await c.bot.get_file(doc.file_id)
-        file_path = os.path.join(CURRENT_UPLOAD_DIR, file_name)
-        await new_file.download_to_drive(file_path)
+        # 先写临时文件, 校验通过后原子改名: 目录中不会出现半截文件
+        file_path, digest, secs = await uploads.receive(new_file, s['upload_dir'], file_name, doc.file_size, expected_sha)
         
-        await status_msg.edit_text(f"✅ <b>文件已送达!</b>\n📂 存放在: <code>{file_path}</code>\n📊 最终大小: <code>{file_size:.2f} MB</code>", parse_mode="HTML")
+        verified = "\n🔐 SHA-256 校验通过" if expected_sha else f"\n🔐 SHA-256: <code>{digest}</code>"
+        await status_msg.edit_text(f"✅ <b>文件已送达!</b>\n📂 存放在: <code>{html.escape(file_path)}</code>\n📊 最终大小: <code>{file_size:.2f} MB</code>"
+                                   f" | ⚡ {bot_api.fmt_rate(doc.file_size or 0, secs)}{verified}", parse_mode="HTML")
         
         # 自动切换回普通状态
-        STATE = None
+        s['state'] = None
         
         # 如果是压缩包,提供解压建议
-        if file_name.endswith(('.zip', '.tar.gz', '.tar')):
-            kb = [[InlineKeyboardButton("📦 立即解压", callback_data=f"tool_unzip_{file_name}"),
+        if uploads.is_archive(file_name):
+            kb = [[InlineKeyboardButton("📦 立即解压", callback_data=f"tool_unzip_{uploads.register(file_path)}"),
                    InlineKeyboardButton("🔙 返回菜单", callback_data="back")]]
             await u.message.reply_text("💡 <b>检测到压缩包，是否需要解压？</b>", reply_markup=InlineKeyboardMarkup(kb), parse_mode="HTML")
         else:
@@ -141,7 +180,7 @@ async def kk_command(u: Update, c: ContextTypes.DEFAULT_TYPE):
     kb = [
         [InlineKeyboardButton("🏠 进入主页", callback_data="back")], 
         [InlineKeyboardButton("🔄 重启机器人", callback_data="sys_restart_bot")],
-        [InlineKeyboardButton("📜 获取日志", callback_data="sys_get_log")]
+        [InlineKeyboardButton("📜 获取日志", callback_data="sys_get_log"), InlineKeyboardButton("📈 路由统计", callback_data="sys_route_stats")]
     ]
     await u.message.reply_text(txt, reply_markup=InlineKeyboardMarkup(kb), parse_mode="HTML")
 
@@ -248,6 +287,46 @@ async def setadminid_command(u: Update, c: ContextTypes.DEFAULT_TYPE):
         parse_mode="HTML"
     )
 
+async def restore_command(u: Update, c: ContextTypes.DEFAULT_TYPE):
+    """
+    选择性还原:
+    /restore                              最近的归档
+    /restore <归档> [目录]                 浏览归档内容 (只读索引)
+    /restore <归档> get <路径>... [--to 目录]  还原文件或子目录
+    """
+    if u.effective_user.id not in ALLOWED_USER_IDS:
+        return
+    try:
+        args = shlex.split(u.message.text)[1:]
+    except ValueError:
+        args = u.message.text.split()[1:]
+    if not args:
+        rows = await asyncio.to_thread(catalog.list_backups, 10)
+        lines = [f"• <code>{html.escape(r['name'])}</code>" for r in rows if r['kind'] != 'repo']
+        await u.message.reply_text(
+            "♻️ <b>选择性还原</b>\n━━━━━━━━━━━━━━━\n" + ("\n".join(lines) or "📭 暂无归档") +
+            "\n\n📝 <b>浏览</b>: <code>/restore 归档名 [目录]</code>"
+            "\n📝 <b>还原</b>: <code>/restore 归档名 get 路径... [--to 目录]</code>", parse_mode="HTML")
+        return
+    name, rest = args[0], args[1:]
+    if not rest or rest[0] != "get":
+        _, txt = await asyncio.to_thread(bk_mgr.list_archive, name, rest[0] if rest else "")
+        await u.message.reply_text(txt[:4000], parse_mode="HTML")
+        return
+    paths, target = rest[1:], None
+    if "--to" in paths:
+        i = paths.index("--to")
+        target = os.path.abspath(paths[i + 1]) if i + 1 < len(paths) else None
+        paths = paths[:i] + paths[i + 2:]
+    status = await u.message.reply_text(f"⏳ <b>准备还原</b> <code>{html.escape(name)}</code>...", parse_mode="HTML")
+    back = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 历史文件", callback_data="bk_history")]])
+
+    async def work():
+        _, msg = await asyncio.to_thread(bk_mgr.restore_paths, name, paths, target)
+        return msg, back
+
+    jobs.submit('restore', f"还原 {html.escape(', '.join(paths))[:40]}", work, c.bot, status.chat_id, status.message_id)
+
 async def setprefix_command(u: Update, c: ContextTypes.DEFAULT_TYPE):
     """直接设置命令前缀命令"""
     if u.effective_user.id not in ALLOWED_USER_IDS: 
@@ -306,10 +385,9 @@ async def setprefix_command(u: Update, c: ContextTypes.DEFAULT_TYPE):
 # --- 📝 文本处理 ---
 async def text_handler(u: Update, c: ContextTypes.DEFAULT_TYPE):
     """处理用户发送的文本消息"""
-    global STATE, SET_ACTION, WIZARD_STATE
-    
     if u.effective_user.id not in ALLOWED_USER_IDS: 
         return
+    s = session.of(u)
     
     text = u.message.text.strip()
     uid = u.effective_user.id
@@ -320,36 +398,36 @@ async def text_handler(u: Update, c: ContextTypes.DEFAULT_TYPE):
         return
 
     # 设置项修改
-    if STATE == "WAIT_SETTING":
-        msg, (txt, kb) = settings_mod.update_setting(SET_ACTION, text)
+    if s['state'] == "WAIT_SETTING":
+        msg, (txt, kb) = settings_mod.update_setting(s['set_action'], text)
         await u.message.reply_text(msg, parse_mode="HTML")
         await u.message.reply_text(txt, reply_markup=kb, parse_mode="HTML")
-        STATE = None
+        s['state'] = None
     
     # 设定上传目录
-    elif STATE == "WAIT_UPLOAD_DIR":
+    elif s['state'] == "WAIT_UPLOAD_DIR":
         if os.path.isabs(text):
             os.makedirs(text, exist_ok=True)
-            global CURRENT_UPLOAD_DIR
-            CURRENT_UPLOAD_DIR = text
+            s['upload_dir'] = text
             await u.message.reply_text(f"✅ <b>上传目录已更改为:</b>\n<code>{text}</code>", parse_mode="HTML")
             await start(u, c)
         else:
             await u.message.reply_text("❌ <b>请输入绝对路径!</b>(例如 <code>/root/myfiles</code>)", parse_mode="HTML")
-        STATE = None
+        s['state'] = None
     
     # 备份路径添加
-    elif STATE == "WAIT_BK_ADD":
+    elif s['state'] == "WAIT_BK_ADD":
         conf = load_config()
         if text not in conf['backup_paths']:
             conf['backup_paths'].append(text)
             save_config(conf)
+            size_cache.refresh([text])
         txt, kb = bk_mgr.get_backup_menu()
         await u.message.reply_text(txt, reply_markup=kb, parse_mode="HTML")
-        STATE = None
+        s['state'] = None
     
     # 自动备份时间设置
-    elif STATE == "WAIT_BK_AUTO_TIME":
+    elif s['state'] == "WAIT_BK_AUTO_TIME":
         conf = load_config()
         if text.lower() == "off":
             conf['auto_backup'] = {"mode": "off", "time": "03:00"}
@@ -366,72 +444,74 @@ async def text_handler(u: Update, c: ContextTypes.DEFAULT_TYPE):
         await u.message.reply_text(msg, parse_mode="HTML")
         txt, kb = bk_mgr.get_backup_menu()
         await u.message.reply_text(txt, reply_markup=kb, parse_mode="HTML")
-        STATE = None
+        s['state'] = None
     
     # Docker 向导 - 修改名称
-    elif WIZARD_STATE == "WIZ_NAME":
+    elif s['wizard'] == "WIZ_NAME":
         txt, kb = dk_mgr.update_wizard_val(uid, 'name', text)
         await u.message.reply_text(txt, reply_markup=kb, parse_mode="HTML")
-        WIZARD_STATE = None
+        s['wizard'] = None
     
     # Docker 向导 - 添加端口
-    elif WIZARD_STATE == "WIZ_PORT":
+    elif s['wizard'] == "WIZ_PORT":
         txt, kb = dk_mgr.update_wizard_val(uid, 'port', text)
         await u.message.reply_text(txt, reply_markup=kb, parse_mode="HTML")
-        WIZARD_STATE = None
+        s['wizard'] = None
     
     # Docker 向导 - 添加挂载
-    elif WIZARD_STATE == "WIZ_VOL":
+    elif s['wizard'] == "WIZ_VOL":
         txt, kb = dk_mgr.update_wizard_val(uid, 'vol', text)
         await u.message.reply_text(txt, reply_markup=kb, parse_mode="HTML")
-        WIZARD_STATE = None
+        s['wizard'] = None
     
     # Docker 向导 - 添加环境变量
-    elif WIZARD_STATE == "WIZ_ENV":
+    elif s['wizard'] == "WIZ_ENV":
         txt, kb = dk_mgr.update_wizard_val(uid, 'env', text)
         await u.message.reply_text(txt, reply_markup=kb, parse_mode="HTML")
-        WIZARD_STATE = None
+        s['wizard'] = None
     
     # 端口添加
-    elif STATE == "WAIT_PORT_ADD":
+    elif s['state'] == "WAIT_PORT_ADD":
         msg = net.add_port_rule(text)
+        view_cache.invalidate('ports')
         await u.message.reply_text(msg, parse_mode="HTML")
-        txt, kb = net.build_port_menu()
+        txt, kb = await view_cache.get_view('ports', net.build_port_menu)
         await u.message.reply_text(txt, reply_markup=kb, parse_mode="HTML")
-        STATE = None
+        s['state'] = None
     
     # 端口删除
-    elif STATE == "WAIT_PORT_DEL":
+    elif s['state'] == "WAIT_PORT_DEL":
         msg = net.del_port_rule(text)
+        view_cache.invalidate('ports')
         await u.message.reply_text(msg, parse_mode="HTML")
-        txt, kb = net.build_port_menu()
+        txt, kb = await view_cache.get_view('ports', net.build_port_menu)
         await u.message.reply_text(txt, reply_markup=kb, parse_mode="HTML")
-        STATE = None
+        s['state'] = None
     
     # 黑名单添加
-    elif STATE == "WAIT_BAN_ADD":
+    elif s['state'] == "WAIT_BAN_ADD":
         msg = net.add_ban_manual(text)
         await u.message.reply_text(msg, parse_mode="HTML")
         txt, kb = net.get_ban_list_view()
         await u.message.reply_text(txt, reply_markup=kb, parse_mode="HTML")
-        STATE = None
+        s['state'] = None
     
     # 黑名单删除
-    elif STATE == "WAIT_BAN_DEL":
+    elif s['state'] == "WAIT_BAN_DEL":
         msg = net.remove_ban_manual(text)
         await u.message.reply_text(msg, parse_mode="HTML")
         txt, kb = net.get_ban_list_view()
         await u.message.reply_text(txt, reply_markup=kb, parse_mode="HTML")
-        STATE = None
+        s['state'] = None
     
     # 黑名单搜索
-    elif STATE == "WAIT_BAN_SEARCH":
+    elif s['state'] == "WAIT_BAN_SEARCH":
         txt, kb = net.get_ban_list_view(page=0, search_query=text)
         await u.message.reply_text(txt, reply_markup=kb, parse_mode="HTML")
-        STATE = None
+        s['state'] = None
 
     # SSH 端口修改
-    elif STATE == "WAIT_SSH_PORT":
+    elif s['state'] == "WAIT_SSH_PORT":
         if text.isdigit() and 1 <= int(text) <= 65535:
             new_port = text
             await u.message.reply_text(f"⏳ <b>正在迁移 SSH 到端口 {new_port}...</b>\n请稍候，这可能需要几秒钟。", parse_mode="HTML")
@@ -459,629 +539,1018 @@ async def text_handler(u: Update, c: ContextTypes.DEFAULT_TYPE):
                 
                 # 3. 重启 SSH 服务
                 subprocess.run("systemctl restart ssh", shell=True)
+                view_cache.invalidate('ports')
                 
                 await u.message.reply_text(f"✅ <b>SSH 端口已修改为:</b> <code>{new_port}</code>\n\n💡 <b>温馨提示:</b>\n请确保您的连接客户端已更新端口。如果连接失败，请检查服务商的安全组设置。", parse_mode="HTML")
             except Exception as e:
                 await u.message.reply_text(f"❌ <b>修改失败:</b>\n<code>{str(e)}</code>", parse_mode="HTML")
         else:
             await u.message.reply_text("❌ <b>请输入有效的端口号!</b> (1-65535)", parse_mode="HTML")
-        STATE = None
+        s['state'] = None
         await start(u, c)
 
+    # Docker 日志搜索
+    elif s['state'] and s['state'].startswith("WAIT_DK_LOG_SEARCH_"):
+        cid = s['state'].replace("WAIT_DK_LOG_SEARCH_", "")
+        s['state'] = None
+        txt, kb = dk_mgr.build_logs_preview(cid, query=text)
+        await u.message.reply_text(txt, reply_markup=kb, parse_mode="HTML")
+
     # Docker 命令执行
-    elif STATE.startswith("WAIT_DK_EXEC_"):
-        cid = STATE.replace("WAIT_DK_EXEC_", "")
-        await u.message.reply_text(f"⏳ <b>正在执行:</b><code>{text}</code>...", parse_mode="HTML")
-        try:
-            cmd = f"docker exec {cid} {text}"
-            res = subprocess.check_output(cmd, shell=True, stderr=subprocess.STDOUT, timeout=15).decode('utf-8')
-            await u.message.reply_text(f"✅ <b>执行结果:</b>\n<code>{res[:3500]}</code>", parse_mode="HTML")
-        except Exception as e:
-            err = e.output.decode() if hasattr(e, 'output') else str(e)
-            await u.message.reply_text(f"❌ <b>执行出错:</b>\n<code>{err[:500]}</code>", parse_mode="HTML")
-        STATE = None
-        await start(u, c)
+    elif s['state'] and s['state'].startswith("WAIT_DK_EXEC_"):
+        cid = s['state'].replace("WAIT_DK_EXEC_", "")
+        s['state'] = None
+        status = await u.message.reply_text(f"⏳ <b>正在执行:</b><code>{html.escape(text)}</code>...", parse_mode="HTML")
+        back = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 返回容器", callback_data=f"dk_view_{cid}")]])
 
-# --- 📘 按钮处理 (完整版) ---
+        async def work():
+            # 后台运行, 不阻塞其它操作; 超时 / 取消时结束 docker exec 进程
+            try:
+                r = await asyncio.to_thread(jobs.run, f"docker exec {cid} {text}", 15)
+            except subprocess.TimeoutExpired:
+                return "⏱️ <b>执行超时</b> (15 秒)", back
+            out = html.escape(r.stdout.decode('utf-8', 'replace'))
+            if r.returncode != 0:
+                return f"❌ <b>执行出错:</b>\n<code>{out[:500]}</code>", back
+            return f"✅ <b>执行结果:</b>\n<code>{out[:3500]}</code>", back
+
+        jobs.submit('docker_exec', f"{cid[:12]}: {html.escape(text[:30])}", work, c.bot, status.chat_id, status.message_id)
+
+# --- 📘 按钮处理 (分发表路由) ---
 async def btn_handler(u: Update, c: ContextTypes.DEFAULT_TYPE):
-    """处理所有按钮点击"""
-    global STATE, SET_ACTION, WIZARD_STATE, CURRENT_UPLOAD_DIR
-    
+    """处理所有按钮点击: 统一应答后交给 router 按 callback_data 分发"""
     q = u.callback_query
-    d = q.data
-    uid = u.effective_user.id
     
     try:
         await q.answer()
     except:
         pass
-
-    # ==================== 流量审计 ====================
-    if d == "sys_traffic_h":
-        txt, kb = net.get_traffic_hourly()
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
     
-    elif d == "sys_traffic_d":
-        txt, kb = net.get_traffic_history()
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    elif d == "sys_traffic_r":
-        await q.answer("⏳...")
-        txt, kb = net.get_traffic_realtime()
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    elif d == "sys_traffic_rank":
-        txt, kb = net.get_traffic_ranking()
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    elif d == "sys_traffic_report_toggle":
-        conf = load_config()
-        curr = conf.get('traffic_daily_report', False)
-        conf['traffic_daily_report'] = not curr
-        save_config(conf)
-        await q.answer(f"{'✅' if not curr else '❌'} 流量日报已{'开启' if not curr else '关闭'}")
-        txt, kb = net.get_traffic_hourly()
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    # ==================== 基础路由 ====================
-    elif d == "sys_report":
-        txt, kb = sys_mod.get_system_report()
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    elif d == "sys_restart_bot":
-        await q.answer("🔄 重启中...")
-        os._exit(0)
-    
-    elif d == "sys_get_log":
-        log_txt = get_audit_tail(50)
-        await q.edit_message_text(
-            f"📜 <b>审计日志 (最近50条)</b>\n<code>{log_txt}</code>", 
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 返回", callback_data="back")]]),
-            parse_mode="HTML"
-        )
-    
-    elif d == "back":
-        await start(u, c)
-    
-    # ==================== 设置中心 ====================
-    elif d == "sent_lab":
-        txt, kb = settings_mod.get_menu()
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    elif d == "set_ssh_security":
-        txt, kb = settings_mod.get_ssh_security_menu()
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-        
-    elif d == "set_ssh_port_warn":
-        txt = ("⚠️ <b>高风险操作确认</b>\n"
-               "━━━━━━━━━━━━━━━\n"
-               "修改 SSH 端口可能会导致您无法连接服务器，请务必确认以下事项：\n\n"
-               "1. 您是否有<b>其他连接方式</b>（如 VNC 控制台）以防万一？\n"
-               "2. 如果您的 VPS 有<b>外部防火墙/安全组</b>（如搬瓦工面板、阿里云），您必须先在面板放行新端口。\n"
-               "3. 修改后，机器人会自动帮您放行系统内部防火墙并重启 SSH。\n\n"
-               "确定要继续吗？")
-        kb = InlineKeyboardMarkup([
-            [InlineKeyboardButton("✅ 我已知晓风险，继续", callback_data="set_ssh_port_input")],
-            [InlineKeyboardButton("❌ 取消返回", callback_data="set_ssh_security")]
-        ])
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+    await router.dispatch(u, c, q.data)
 
-    elif d == "set_ssh_port_input":
-        global STATE
-        STATE = "WAIT_SSH_PORT"
-        await q.edit_message_text("⌨️ <b>请输入新的 SSH 端口号:</b>\n(建议范围: 1024-65535)", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 返回", callback_data="set_ssh_security")]]), parse_mode="HTML")
+# ==================== 流量审计 ====================
+@route("sys_traffic_h")
+async def on_traffic_hourly(u, c):
+    q = u.callback_query
+    txt, kb = net.get_traffic_hourly()
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
 
-    elif d == "set_ssh_dur_list":
-        txt, kb = settings_mod.get_ssh_duration_menu()
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-        
-    elif d.startswith("set_ssh_dur_"):
-        duration = d.replace("set_ssh_dur_", "")
-        conf = load_config()
-        conf['ban_duration'] = duration
-        save_config(conf)
-        await q.answer(f"⏳ 封禁时长已设为: {duration}")
-        txt, kb = settings_mod.get_ssh_security_menu()
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-        
-    elif d.startswith("ssh_fail_ip_"):
-        ip = d.replace("ssh_fail_ip_", "")
-        txt, kb = settings_mod.get_ssh_fail_detail(ip)
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+@route("sys_traffic_d")
+async def on_traffic_history(u, c):
+    q = u.callback_query
+    txt, kb = await view_cache.get_view('traffic_history', net.get_traffic_history)
+    await edit_view(q, txt, kb)
 
-    elif d.startswith("set_"):
-        STATE = "WAIT_SETTING"
-        SET_ACTION = d
-        prompt = settings_mod.get_prompt_text(d)
-        await q.edit_message_text(
-            prompt, 
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙", callback_data="sent_lab")]]), 
-            parse_mode="HTML"
-        )
-    
-    # ==================== 备份管理 ====================
-    elif d == "bk_menu":
-        txt, kb = bk_mgr.get_backup_menu()
-        # 加入上传目录管理按钮
-        kb_list = list(kb.inline_keyboard)
-        kb_list.insert(2, [InlineKeyboardButton("📥 设定上传目录", callback_data="tool_set_upload")])
-        await q.edit_message_text(f"{txt}\n\n📍 当前上传指向: <code>{CURRENT_UPLOAD_DIR}</code>", reply_markup=InlineKeyboardMarkup(kb_list), parse_mode="HTML")
-
-    elif d == "tool_set_upload":
-        STATE = "WAIT_UPLOAD_DIR"
-        await q.edit_message_text("⌨️ <b>请输入新的上传绝对路径:</b>\n(例如 <code>/home/vboxuser/下载</code>)", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙", callback_data="bk_menu")]]), parse_mode="HTML")
-
-    elif d == "tool_upload_start":
-        STATE = "WAIT_UPLOAD_FILE"
-        await q.edit_message_text(f"📤 <b>请现在发送文件到此对话框</b>\n\n文件将会自动存入:\n<code>{CURRENT_UPLOAD_DIR}</code>", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 取消", callback_data="bk_menu")]]), parse_mode="HTML")
-    
-    elif d == "bk_history":
-        txt, kb = bk_mgr.build_history_menu()
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    elif d.startswith("bk_send_"):
-        filename = d.replace("bk_send_", "")
-        filepath = f"/tmp/{filename}"
-        if os.path.exists(filepath):
-            await q.answer("📤 发送中...")
-            with open(filepath, 'rb') as f:
-                await q.message.reply_document(document=f, caption=f"📦 历史备份: <code>{filename}</code>")
-        else:
-            await q.answer("❌ 文件已丢失", show_alert=True)
-    
-    elif d == "bk_do":
-        await q.answer("📦 备份中...")
-        await q.edit_message_text("⏳ <b>正在打包备份...</b>\n请稍候...", parse_mode="HTML")
-        file_path, msg = bk_mgr.run_backup_task()
-        
-        if file_path:
-            try:
-                with open(file_path, 'rb') as f:
-                    await q.message.reply_document(
-                        document=f,
-                        caption=msg,
-                        parse_mode="HTML"
-                    )
-                os.remove(file_path)
-                txt, kb = bk_mgr.get_backup_menu()
-                await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-            except Exception as e:
-                await q.edit_message_text(f"❌ 文件发送失败: {str(e)}", parse_mode="HTML")
-        else:
-            await q.edit_message_text(msg, parse_mode="HTML")
-    
-    elif d == "bk_add":
-        STATE = "WAIT_BK_ADD"
-        await q.edit_message_text("请输入要备份的路径 (如 <code>/etc/wireguard</code>):", parse_mode="HTML")
+@route("sys_traffic_d_rf")
+async def on_traffic_history_refresh(u, c):
+    q = u.callback_query
+    txt, kb = await view_cache.rebuild('traffic_history', net.get_traffic_history)
+    await edit_view(q, txt, kb)
 
-    elif d == "bk_auto_set":
-        STATE = "WAIT_BK_AUTO_TIME"
-        await q.edit_message_text("⌨️ <b>请输入每天自动备份的时间:</b>\n(24小时制, 例如 <code>23:55</code>, 输入 <code>off</code> 禁用)", parse_mode="HTML")
+@route("sys_traffic_r")
+async def on_traffic_realtime(u, c):
+    q = u.callback_query
+    await q.answer("⏳...")
+    txt, kb = net.get_traffic_realtime()
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
 
-    elif d.startswith("bk_del_path_"):
-        idx = int(d.split('_')[3])
-        conf = load_config()
-        paths = conf.get('backup_paths', [])
-        if 0 <= idx < len(paths):
-            removed = paths.pop(idx)
-            save_config(conf)
-            await q.answer(f"🗑️ 已移除: {removed}")
-        txt, kb = bk_mgr.get_backup_menu()
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    # ==================== 工具箱 ====================
-    elif d == "tool_box":
-        kb = [
-            [InlineKeyboardButton("📌 监听", callback_data="tool_listen"), 
-             InlineKeyboardButton("🕵️ 扫鬼", callback_data="tool_ghost")],
-            [InlineKeyboardButton("🧹 清理", callback_data="tool_clean"), 
-             InlineKeyboardButton("🚫 黑名单", callback_data="tool_ban")],
-            [InlineKeyboardButton("🔙", callback_data="back")]
-        ]
-        await q.edit_message_text("🧰 工具箱", reply_markup=InlineKeyboardMarkup(kb), parse_mode="HTML")
-    
-    elif d == "tool_listen":
-        txt, kb = net.get_listen_text()
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    # 容器健康检查
-    elif d == "health_check":
-        await q.answer("🥼 检查中...")
-        txt, kb = health_mod.get_health_report_view()
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    elif d.startswith("health_page_"):
-        page = int(d.split('_')[2])
-        txt, kb = health_mod.get_health_report_view(page)
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    elif d.startswith("health_detail_"):
-        cid = d.split('_')[2]
-        txt, kb = health_mod.get_container_detail_health(cid)
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    # 一键故障诊断
-    elif d == "sys_diagnose":
-        await q.answer("🔧 诊断中...")
-        txt, kb = sys_mod.get_auto_diagnosis()
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    # 扫鬼行动
-    elif d == "tool_ghost":
-        txt, kb = net.get_ghost_process_view()
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    elif d.startswith("ghost_detail_"):
-        parts = d.split('_')
-        proc = parts[2]
-        page = int(parts[3])
-        txt, kb = net.get_ghost_detail_view(proc, page)
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+@route("sys_traffic_rank")
+async def on_traffic_rank(u, c):
+    q = u.callback_query
+    txt, kb = net.get_traffic_ranking()
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
 
-    elif d.startswith("ghost_ban_ip_"):
-        parts = d.split('_')
-        # ghost_ban_ip_进程名_页码_IP
-        proc = parts[3]
-        page = int(parts[4])
-        ip = parts[5]
-        msg = net.add_ban_manual(ip)
-        await q.answer(f"🚫 {ip} 已送入黑名单")
-        txt, kb = net.get_ghost_detail_view(proc, page)
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+@route("sys_traffic_report_toggle")
+async def on_traffic_report_toggle(u, c):
+    q = u.callback_query
+    conf = load_config()
+    curr = conf.get('traffic_daily_report', False)
+    conf['traffic_daily_report'] = not curr
+    save_config(conf)
+    await q.answer(f"{'✅' if not curr else '❌'} 流量日报已{'开启' if not curr else '关闭'}")
+    txt, kb = net.get_traffic_hourly()
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
 
-    elif d.startswith("ghost_proc_"):
-        parts = d.split('_')
-        proc = parts[2]
-        page = int(parts[3])
-        txt, kb = net.get_ghost_detail_view(proc, page)
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    elif d.startswith("ghost_opt_"):
-        parts = d.split('_')
-        ip = parts[2]
-        proc = parts[3]
-        page = int(parts[4])
-        txt, kb = net.get_ban_option_menu(ip, proc, page)
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    elif d.startswith("ghost_ban_"):
-        parts = d.split('_')
-        target = parts[2]
-        ban_type = parts[3]
-        proc = parts[4]
-        page = int(parts[5])
-        msg = net.execute_tactical_ban(target, ban_type)
-        await q.answer(msg[:100])
-        txt, kb = net.get_ghost_detail_view(proc, page)
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+# ==================== 基础路由 ====================
+@route("sys_report")
+async def on_sys_report(u, c, refresh=False):
+    q = u.callback_query
+    if refresh:
+        view_cache.invalidate('sys_report')
+    if view_cache.peek('sys_report'):
+        txt, kb = await view_cache.get_view('sys_report', sys_mod.get_system_report)
+    else:
+        # 无缓存 (或用户点击重新体检) 时渐进渲染: 先展示已返回的数据源, 慢的数据源完成后原地刷新
+        async def partial(txt, kb):
+            await edit_view(q, txt, kb)
+        txt, kb = await sys_mod.get_system_report_async(partial)
+        view_cache.put('sys_report', (txt, kb))
+    await edit_view(q, txt, kb)
 
-    elif d.startswith("ghost_quick_ban_"):
-        ip = d.replace("ghost_quick_ban_", "")
-        msg = net.add_ban_manual(ip) # 使用现有的添加黑名单函数，确保同步记录到日志和iptables
-        await q.answer(f"🚫 {ip} 已送入黑名单")
-        txt, kb = net.get_ghost_process_view()
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    # 清理功能
-    elif d == "tool_clean":
-        txt, kb = sys_mod.get_clean_menu(uid)
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    elif d.startswith("clean_sw_"):
-        txt, kb = sys_mod.toggle_clean_option(uid, d.split("_")[2])
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    elif d == "clean_run":
-        await q.answer("🧹 清理中...")
-        txt, kb = sys_mod.run_smart_clean(uid)
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    # 黑名单
-    elif d == "tool_ban":
-        txt, kb = net.get_ban_list_view()
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    elif d.startswith("net_bl_page_"):
-        parts = d.split('_')
-        page = int(parts[3])
-        search = parts[4] if len(parts) > 4 else None
-        txt, kb = net.get_ban_list_view(page, search)
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    elif d == "net_op_add":
-        STATE = "WAIT_BAN_ADD"
-        await q.edit_message_text("请输入要封禁的 IP 或 CIDR (如 <code>1.2.3.4</code> 或 <code>1.2.3.0/24</code>):", parse_mode="HTML")
-    
-    elif d == "net_op_del":
-        STATE = "WAIT_BAN_DEL"
-        await q.edit_message_text("请输入要解封的 IP 或 CIDR:", parse_mode="HTML")
-    
-    elif d == "net_op_search":
-        STATE = "WAIT_BAN_SEARCH"
-        await q.edit_message_text("🔍 请输入搜索关键词 (IP片段):", parse_mode="HTML")
-    
-    elif d == "net_op_reset_ask":
-        kb = [
-            [InlineKeyboardButton("✅ 确认清空", callback_data="net_op_reset_yes"), 
-             InlineKeyboardButton("❌ 取消", callback_data="tool_ban")]
-        ]
-        await q.edit_message_text("⚠️ <b>危险操作</b>\n\n确定要清空所有黑名单规则吗?", reply_markup=InlineKeyboardMarkup(kb), parse_mode="HTML")
-    
-    elif d == "net_op_reset_yes":
-        msg = net.reset_all_bans()
-        await q.answer(msg[:100])
-        txt, kb = net.get_ban_list_view()
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    # ==================== 端口控制 ====================
-    elif d == "net_ports":
-        txt, kb = net.build_port_menu()
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    elif d.startswith("net_ssh_"):
-        port = d.split('_')[2]
-        msg = net.toggle_ssh(port)
-        await q.answer(msg)
-        txt, kb = net.build_port_menu()
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    elif d == "net_ping":
-        msg = net.toggle_ping()
-        await q.answer(msg)
-        txt, kb = net.build_port_menu()
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    elif d.startswith("net_biz_"):
-        port = d.split('_')[2]
-        msg = net.toggle_port(port)
-        await q.answer(msg)
-        txt, kb = net.build_port_menu()
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    elif d == "net_add":
-        STATE = "WAIT_PORT_ADD"
-        await q.edit_message_text("请输入端口和描述 (格式: <code>8080 Web服务</code>):", parse_mode="HTML")
-    
-    elif d == "net_del":
-        STATE = "WAIT_PORT_DEL"
-        await q.edit_message_text("请输入要删除的端口号:", parse_mode="HTML")
-    
-    elif d == "net_reset":
-        msg = net.set_whitelist_mode(True)
-        await q.answer(msg)
-        txt, kb = net.build_port_menu()
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    elif d == "net_rescue":
-        msg = net.set_whitelist_mode(False)
-        await q.answer(msg)
-        txt, kb = net.build_port_menu()
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    # ==================== 🏠 内网访问管理 (新增核心) ====================
-    elif d == "net_lan_manage":
-        # 进入内网管理,自动初始化默认规则
-        await q.answer("🔍 检测中...")
-        net.init_default_networks()
-        txt, kb = net.get_network_manage_menu()
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    elif d == "net_lan_refresh":
-        # 刷新检测
-        await q.answer("🔄 重新检测...")
-        net.init_default_networks()
-        txt, kb = net.get_network_manage_menu()
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    elif d == "net_lan_add":
-        # 手动添加网段 (暂未实现)
-        await q.answer("⚠️ 此功能正在开发中,请先使用自动检测")
-    
-    elif d.startswith("net_lan_"):
-        # 切换网段状态
-        # 格式: net_lan_192.168.1.0_24
+@route("sys_report_rf")
+async def on_sys_report_refresh(u, c):
+    await on_sys_report(u, c, refresh=True)
+
+@route("sys_restart_bot")
+async def on_restart_bot(u, c):
+    await u.callback_query.answer("🔄 重启中...")
+    os._exit(0)
+
+@route("sys_get_log")
+async def on_get_log(u, c):
+    q = u.callback_query
+    log_txt = get_audit_tail(50)
+    await q.edit_message_text(
+        f"📜 <b>审计日志 (最近50条)</b>\n<code>{log_txt}</code>", 
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 返回", callback_data="back")]]),
+        parse_mode="HTML"
+    )
+
+@route("sys_route_stats")
+async def on_route_stats(u, c):
+    q = u.callback_query
+    kb = InlineKeyboardMarkup([[InlineKeyboardButton("🔄 刷新", callback_data="sys_route_stats"), InlineKeyboardButton("🔙 返回", callback_data="back")]])
+    await q.edit_message_text(router.get_stats_text() + "\n" + notifier.get_stats_text(), reply_markup=kb, parse_mode="HTML")
+
+@route("back")
+async def on_back(u, c):
+    await start(u, c)
+
+# ==================== 🌐 多 VPS 集群 ====================
+@route("fleet_m")
+async def on_fleet_overview(u, c):
+    q = u.callback_query
+    await q.edit_message_text("⏳ <b>正在汇总各主机数据...</b>", parse_mode="HTML")
+    txt, kb = await fleet.build_fleet_overview()
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("fleet_health")
+async def on_fleet_health(u, c):
+    q = u.callback_query
+    txt, kb = await fleet.build_fleet_health()
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("fleet_host_", args=(int,), prefix=True)
+async def on_fleet_host(u, c, idx):
+    q = u.callback_query
+    await q.edit_message_text("⏳ <b>正在获取主机报告...</b>", parse_mode="HTML")
+    txt, kb = await fleet.build_host_view(idx)
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("fleet_diag_", args=(int,), prefix=True)
+async def on_fleet_diag(u, c, idx):
+    q = u.callback_query
+    await q.edit_message_text("⏳ <b>正在远程诊断...</b>", parse_mode="HTML")
+    txt, kb = await fleet.build_host_view(idx, 'system.diagnosis')
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+# ==================== 设置中心 ====================
+@route("sent_lab")
+async def on_settings(u, c):
+    q = u.callback_query
+    txt, kb = settings_mod.get_menu()
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("set_ssh_security")
+async def on_ssh_security(u, c):
+    q = u.callback_query
+    txt, kb = settings_mod.get_ssh_security_menu()
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("set_ssh_port_warn")
+async def on_ssh_port_warn(u, c):
+    q = u.callback_query
+    txt = ("⚠️ <b>高风险操作确认</b>\n"
+           "━━━━━━━━━━━━━━━\n"
+           "修改 SSH 端口可能会导致您无法连接服务器，请务必确认以下事项：\n\n"
+           "1. 您是否有<b>其他连接方式</b>（如 VNC 控制台）以防万一？\n"
+           "2. 如果您的 VPS 有<b>外部防火墙/安全组</b>（如搬瓦工面板、阿里云），您必须先在面板放行新端口。\n"
+           "3. 修改后，机器人会自动帮您放行系统内部防火墙并重启 SSH。\n\n"
+           "确定要继续吗？")
+    kb = InlineKeyboardMarkup([
+        [InlineKeyboardButton("✅ 我已知晓风险，继续", callback_data="set_ssh_port_input")],
+        [InlineKeyboardButton("❌ 取消返回", callback_data="set_ssh_security")]
+    ])
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("set_ssh_port_input")
+async def on_ssh_port_input(u, c):
+    s = session.of(u)
+    q = u.callback_query
+    s['state'] = "WAIT_SSH_PORT"
+    await q.edit_message_text("⌨️ <b>请输入新的 SSH 端口号:</b>\n(建议范围: 1024-65535)", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 返回", callback_data="set_ssh_security")]]), parse_mode="HTML")
+
+@route("set_ssh_dur_list")
+async def on_ssh_dur_list(u, c):
+    q = u.callback_query
+    txt, kb = settings_mod.get_ssh_duration_menu()
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("set_ssh_dur_", args=(str,), prefix=True)
+async def on_ssh_dur_set(u, c, duration):
+    q = u.callback_query
+    conf = load_config()
+    conf['ban_duration'] = duration
+    save_config(conf)
+    await q.answer(f"⏳ 封禁时长已设为: {duration}")
+    txt, kb = settings_mod.get_ssh_security_menu()
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("ssh_fail_ip_", args=(str,), prefix=True)
+async def on_ssh_fail_ip(u, c, ip):
+    q = u.callback_query
+    txt, kb = settings_mod.get_ssh_fail_detail(ip)
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("set_", args=(str,), prefix=True)
+async def on_setting_ask(u, c, key):
+    s = session.of(u)
+    q = u.callback_query
+    s['state'] = "WAIT_SETTING"
+    s['set_action'] = f"set_{key}"
+    prompt = settings_mod.get_prompt_text(s['set_action'])
+    await q.edit_message_text(
+        prompt, 
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙", callback_data="sent_lab")]]), 
+        parse_mode="HTML"
+    )
+
+# ==================== 备份管理 ====================
+@route("bk_menu")
+async def on_backup_menu(u, c):
+    q = u.callback_query
+    s = session.of(u)
+    txt, kb = bk_mgr.get_backup_menu()
+    # 加入上传目录管理按钮
+    kb_list = list(kb.inline_keyboard)
+    kb_list.insert(2, [InlineKeyboardButton("📥 设定上传目录", callback_data="tool_set_upload")])
+    await q.edit_message_text(f"{txt}\n\n📍 当前上传指向: <code>{s['upload_dir']}</code>", reply_markup=InlineKeyboardMarkup(kb_list), parse_mode="HTML")
+
+@route("tool_set_upload")
+async def on_set_upload_dir(u, c):
+    s = session.of(u)
+    q = u.callback_query
+    s['state'] = "WAIT_UPLOAD_DIR"
+    await q.edit_message_text("⌨️ <b>请输入新的上传绝对路径:</b>\n(例如 <code>/home/vboxuser/下载</code>)", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙", callback_data="bk_menu")]]), parse_mode="HTML")
+
+@route("tool_upload_start")
+async def on_upload_start(u, c):
+    s = session.of(u)
+    q = u.callback_query
+    s['state'] = "WAIT_UPLOAD_FILE"
+    await q.edit_message_text(f"📤 <b>请现在发送文件到此对话框</b>\n\n文件将会自动存入:\n<code>{s['upload_dir']}</code>", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 取消", callback_data="bk_menu")]]), parse_mode="HTML")
+
+@route("bk_history")
+async def on_backup_history(u, c):
+    q = u.callback_query
+    txt, kb = bk_mgr.build_history_menu()
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("bk_send_", args=(str,), prefix=True)
+async def on_backup_send(u, c, filename):
+    q = u.callback_query
+    filepath = bk_mgr.resolve_backup_file(filename)
+    if filepath:
+        await q.answer("📤 发送中...")
+        ok, note = await volumes.deliver_file(c.bot, u.effective_chat.id, filepath, f"📦 历史备份: <code>{filename}</code>")
+        if not ok:
+            await q.message.reply_text(note, parse_mode="HTML")
+    else:
+        await q.answer("❌ 文件已丢失", show_alert=True)
+
+@route("bk_do")
+async def on_backup_run(u, c):
+    q = u.callback_query
+    await q.answer("📦 已提交后台备份")
+
+    async def work():
         try:
-            network_parts = d.replace("net_lan_", "").split("_")
-            if len(network_parts) >= 2:
-                # 重建 CIDR 格式: 192.168.1.0/24
-                # 处理点号分隔的IP部分
-                ip_parts = []
-                cidr_part = network_parts[-1]  # 最后一个是CIDR掩码
-                
-                # 重建IP地址
-                for i, part in enumerate(network_parts[:-1]):
-                    ip_parts.append(part)
-                    # 每4个部分加一个点 (IPv4)
-                    if (i + 1) % 1 == 0 and i < len(network_parts) - 2:
-                        pass  # 已经通过split分割了
-                
-                # 拼接完整网段
-                network = ".".join(ip_parts) + "/" + cidr_part
-                
-                msg = net.toggle_network_access(network)
-                await q.answer(msg[:100])
-                txt, kb = net.get_network_manage_menu()
-                await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+            file_path, msg, note = await volumes.backup_and_deliver(c.bot, u.effective_chat.id, "📦 <b>手动备份</b>")
         except Exception as e:
-            await q.answer(f"❌ 操作失败: {str(e)}")
-    
-    # ==================== Docker 管理 ====================
-    elif d == "dk_m":
-        txt, kb = dk_mgr.build_main_menu()
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    elif d == "dk_op_prune":
-        await q.answer("🧹 清理中...")
-        msg = dk_mgr.prune_docker_resources()
-        await q.edit_message_text(msg, reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 返回", callback_data="dk_m")]]), parse_mode="HTML")
-    
-    elif d == "dk_list_cons":
-        txt, kb = dk_mgr.build_container_list()
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    elif d == "dk_list_stacks":
-        txt, kb = dk_mgr.build_stack_menu()
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    elif d == "dk_res_imgs":
-        txt, kb = dk_mgr.build_image_menu()
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    elif d == "dk_store":
-        txt, kb = dk_mgr.build_app_store_menu()
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-        
-    elif d.startswith("dk_store_ask_"):
-        app_key = d.replace("dk_store_ask_", "")
-        txt, kb = dk_mgr.build_app_install_confirm(app_key)
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+            return f"❌ 文件发送失败: {str(e)}", None
+        if file_path:
+            txt, kb = bk_mgr.get_backup_menu()
+            return (f"{note}\n\n{txt}" if note else txt), kb
+        return msg, InlineKeyboardMarkup([[InlineKeyboardButton("🔙 返回备份", callback_data="bk_menu")]])
 
-    elif d.startswith("dk_store_do_"):
-        app_key = d.replace("dk_store_do_", "")
-        await q.answer("🚀 正在初始化安装向导...")
-        # 增加一个中间过渡状态，提升交互感
-        await q.edit_message_text("⌛ <b>正在为您准备安装环境...</b>\n请稍候...", parse_mode="HTML")
-        
-        if dk_mgr.install_app_template(uid, app_key):
-            txt, kb = dk_mgr.get_wizard_menu(uid)
-            await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-        else:
-            await q.answer("❌ 模板不存在", show_alert=True)
-            
-    elif d == "dk_events":
-        events = dk_mgr.get_docker_events()
-        await q.edit_message_text(f"📝 <b>Docker 事件流</b>\n<code>{events}</code>", parse_mode="HTML")
-    
-    # 容器详情
-    elif d.startswith("dk_view_"):
-        cid = d.split('_')[2]
-        txt, kb = dk_mgr.build_container_dashboard(cid)
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+    jobs.submit('backup', "手动备份", work, c.bot, q.message.chat_id, q.message.message_id)
 
-    elif d.startswith("dk_log_v_"):
-        cid = d.split('_')[3]
-        txt, kb = dk_mgr.build_logs_preview(cid)
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+@route("bk_restore_", args=(str,), prefix=True)
+async def on_backup_restore(u, c, filename):
+    q = u.callback_query
+    await q.edit_message_text(f"⏳ <b>正在还原</b> <code>{filename}</code>...\n按 全量 → 增量 顺序回放", parse_mode="HTML")
+    target, msg = await asyncio.to_thread(bk_mgr.restore_backup, filename)
+    await q.edit_message_text(msg, reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 历史文件", callback_data="bk_history")]]), parse_mode="HTML")
 
-    elif d.startswith("dk_op_exec_ask_"):
-        cid = d.replace("dk_op_exec_ask_", "")
-        STATE = f"WAIT_DK_EXEC_{cid}"
-        await q.edit_message_text("💻 <b>请输入要在容器内执行的命令:</b>\n(例如 <code>ls -la</code>, <code>df -h</code>, <code>python --version</code>)", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 取消", callback_data=f"dk_view_{cid}")]]), parse_mode="HTML")
-    
-    # 容器操作
-    elif d.startswith("dk_op_"):
-        parts = d.split('_')
-        action = parts[2]
-        target = parts[3]
-        await q.answer("⏳ 执行中...")
-        success, msg = dk_mgr.docker_action(action, target)
-        await q.answer(f"{'✅' if success else '❌'} {msg}")
-        txt, kb = dk_mgr.build_container_list()
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    # 镜像详情
-    elif d.startswith("dk_img_v_"):
-        iid = d.split('_')[3]
-        txt, kb = dk_mgr.build_image_dashboard(iid)
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    elif d.startswith("dk_img_upd_"):
-        tag = '_'.join(d.split('_')[3:])
-        await q.answer("🔄 更新中...")
-        msg = dk_mgr.update_image(tag)
-        await q.answer(msg[:100])
-        txt, kb = dk_mgr.build_image_menu()
+@route("bk_rsnap_", args=(str,), prefix=True)
+async def on_backup_restore_snapshot(u, c, snap_id):
+    q = u.callback_query
+    await q.edit_message_text(f"⏳ <b>正在还原快照</b> <code>{snap_id}</code>...", parse_mode="HTML")
+    target, msg = await asyncio.to_thread(repo_mgr.restore_snapshot, snap_id)
+    await q.edit_message_text(msg, reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 历史快照", callback_data="bk_history")]]), parse_mode="HTML")
+
+@route("bk_mode")
+async def on_backup_mode(u, c):
+    q = u.callback_query
+    mode = bk_mgr.toggle_backup_mode()
+    await q.answer({'incremental': "🧩 已切换为增量备份", 'repo': "🗃️ 已切换为去重仓库"}.get(mode, "📦 已切换为全量备份"))
+    txt, kb = bk_mgr.get_backup_menu()
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("bk_add")
+async def on_backup_add(u, c):
+    s = session.of(u)
+    s['state'] = "WAIT_BK_ADD"
+    await u.callback_query.edit_message_text("请输入要备份的路径 (如 <code>/etc/wireguard</code>):", parse_mode="HTML")
+
+@route("bk_auto_set")
+async def on_backup_auto_set(u, c):
+    s = session.of(u)
+    s['state'] = "WAIT_BK_AUTO_TIME"
+    await u.callback_query.edit_message_text("⌨️ <b>请输入每天自动备份的时间:</b>\n(24小时制, 例如 <code>23:55</code>, 输入 <code>off</code> 禁用)", parse_mode="HTML")
+
+@route("bk_del_path_", args=(int,), prefix=True)
+async def on_backup_del_path(u, c, idx):
+    q = u.callback_query
+    conf = load_config()
+    paths = conf.get('backup_paths', [])
+    if 0 <= idx < len(paths):
+        removed = paths.pop(idx)
+        save_config(conf)
+        await q.answer(f"🗑️ 已移除: {removed}")
+    txt, kb = bk_mgr.get_backup_menu()
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+# Docker 卷 / 容器备份
+@route("dkb_m")
+async def on_docker_backup_menu(u, c):
+    q = u.callback_query
+    txt, kb = await asyncio.to_thread(dk_backup.build_menu)
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("dkb_t_", args=(str,), prefix=True)
+async def on_docker_backup_toggle(u, c, source_id):
+    q = u.callback_query
+    on = await asyncio.to_thread(dk_backup.toggle_source, source_id)
+    await q.answer({True: "✅ 已加入备份", False: "⬜ 已移出备份"}.get(on, "❌ 来源已不存在"))
+    txt, kb = await asyncio.to_thread(dk_backup.build_menu)
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("dkb_pause")
+async def on_docker_backup_pause(u, c):
+    q = u.callback_query
+    on = dk_backup.toggle_pause()
+    await q.answer("⏸️ 打包期间将暂停容器" if on else "▶️ 打包期间不暂停容器")
+    txt, kb = await asyncio.to_thread(dk_backup.build_menu)
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("dkb_do")
+async def on_docker_backup_run(u, c):
+    q = u.callback_query
+    if not dk_backup.configured_sources():
+        await q.answer("⚠️ 请先勾选要备份的卷或容器", show_alert=True)
+        return
+    await q.answer("🐳 已提交后台备份")
+
+    async def work():
+        _, msg = await dk_backup.backup_and_deliver(c.bot, u.effective_chat.id)
+        return msg, InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Docker 备份", callback_data="dkb_m")]])
+
+    jobs.submit('backup', "Docker 备份", work, c.bot, q.message.chat_id, q.message.message_id)
+
+# 远程备份目标
+@route("dest_m")
+async def on_destinations_menu(u, c):
+    q = u.callback_query
+    txt, kb = destinations.build_menu()
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("dest_test_", args=(int,), prefix=True)
+async def on_destination_test(u, c, idx):
+    q = u.callback_query
+    await q.answer("🧪 正在测试...")
+    res = await asyncio.to_thread(destinations.test_destination, idx)
+    txt, kb = destinations.build_menu()
+    await q.edit_message_text(f"{txt}\n\n{res}", reply_markup=kb, parse_mode="HTML")
+
+# ==================== 工具箱 ====================
+@route("tool_box")
+async def on_toolbox(u, c):
+    kb = [
+        [InlineKeyboardButton("📌 监听", callback_data="tool_listen"), 
+         InlineKeyboardButton("🕵️ 扫鬼", callback_data="tool_ghost")],
+        [InlineKeyboardButton("🧹 清理", callback_data="tool_clean"), 
+         InlineKeyboardButton("🚫 黑名单", callback_data="tool_ban")],
+        [InlineKeyboardButton("🧵 后台任务", callback_data="jobs_m")],
+        [InlineKeyboardButton("🔙", callback_data="back")]
+    ]
+    await u.callback_query.edit_message_text("🧰 工具箱", reply_markup=InlineKeyboardMarkup(kb), parse_mode="HTML")
+
+# 后台任务
+@route("jobs_m")
+async def on_jobs_menu(u, c):
+    txt, kb = jobs.build_jobs_menu()
+    try:
+        await u.callback_query.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+    except Exception:
+        pass  # 刷新时内容未变化
+
+@route("job_cancel_", args=(int,), prefix=True)
+async def on_job_cancel(u, c, job_id):
+    q = u.callback_query
+    if jobs.cancel(job_id):
+        await q.answer(f"🛑 正在取消任务 #{job_id}")
+    else:
+        await q.answer("⚠️ 任务已结束", show_alert=True)
+    # 从任务菜单取消时刷新列表; 进度消息上的取消由任务自身改写为结果
+    if q.message and q.message.text and q.message.text.startswith("🧵"):
+        await on_jobs_menu(u, c)
+
+@route("tool_unzip_", args=(str,), prefix=True)
+async def on_tool_unzip(u, c, upload_id):
+    q = u.callback_query
+    src = uploads.UPLOADS.get(upload_id)
+    if not src or not os.path.isfile(src):
+        await q.answer("❌ 文件已不存在", show_alert=True)
+        return
+    await q.answer("📦 已提交后台解压")
+    # 流式解压: 进度写入任务消息, 超过解压上限或剩余空间不足时中止并清理
+    jobs.submit('unzip', f"解压 {html.escape(os.path.basename(src))}", lambda: asyncio.to_thread(uploads.extract_archive, src),
+                c.bot, q.message.chat_id, q.message.message_id)
+
+@route("tool_listen")
+async def on_tool_listen(u, c):
+    q = u.callback_query
+    txt, kb = net.get_listen_text()
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+# 容器健康检查
+@route("health_check")
+async def on_health_check(u, c):
+    q = u.callback_query
+    await q.answer("🥼 检查中...")
+    txt, kb = await view_cache.get_view('health', health_mod.get_health_report_view, 0)
+    await edit_view(q, txt, kb)
+
+@route("health_rf")
+async def on_health_refresh(u, c):
+    q = u.callback_query
+    # 先重新采样, 评分才会反映当前状态
+    await health_mod.resample()
+    txt, kb = await view_cache.rebuild('health', health_mod.get_health_report_view, 0)
+    await edit_view(q, txt, kb)
+
+@route("health_page_", args=(int,), prefix=True)
+async def on_health_page(u, c, page):
+    q = u.callback_query
+    txt, kb = await view_cache.get_view('health', health_mod.get_health_report_view, page)
+    await edit_view(q, txt, kb)
+
+@route("health_detail_", args=(str,), prefix=True)
+async def on_health_detail(u, c, cid):
+    q = u.callback_query
+    txt, kb = health_mod.get_container_detail_health(cid)
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+# 一键故障诊断
+@route("sys_diagnose")
+async def on_diagnose(u, c):
+    q = u.callback_query
+    await q.answer("🔧 诊断中...")
+    async def partial(txt, kb):
         await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    elif d.startswith("dk_img_hist_"):
-        iid = d.split('_')[3]
-        layers = dk_mgr.get_image_layers(iid)
-        await q.edit_message_text(f"🍰 <b>镜像层信息</b>\n{layers}", parse_mode="HTML")
-    
-    # 向导流程
-    elif d.startswith("dk_wiz_new_"):
-        iid = d.split('_')[3]
-        if dk_mgr.init_wizard(uid, iid):
-            txt, kb = dk_mgr.get_wizard_menu(uid)
+    txt, kb = await sys_mod.get_auto_diagnosis_async(partial)
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+# 扫鬼行动
+@route("tool_ghost")
+async def on_ghost(u, c):
+    q = u.callback_query
+    txt, kb = net.get_ghost_process_view()
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("ghost_detail_", args=(str, int), prefix=True)
+@route("ghost_proc_", args=(str, int), prefix=True)
+async def on_ghost_detail(u, c, proc, page):
+    q = u.callback_query
+    txt, kb = net.get_ghost_detail_view(proc, page)
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("ghost_ban_ip_", args=(str, int, str), prefix=True)
+async def on_ghost_ban_ip(u, c, proc, page, ip):
+    # ghost_ban_ip_进程名_页码_IP
+    q = u.callback_query
+    msg = net.add_ban_manual(ip)
+    await q.answer(f"🚫 {ip} 已送入黑名单")
+    txt, kb = net.get_ghost_detail_view(proc, page)
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("ghost_opt_", args=(str, str, int), prefix=True)
+async def on_ghost_opt(u, c, ip, proc, page):
+    q = u.callback_query
+    txt, kb = net.get_ban_option_menu(ip, proc, page)
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("ghost_ban_", args=(str, str, str, int), prefix=True)
+async def on_ghost_ban(u, c, target, ban_type, proc, page):
+    q = u.callback_query
+    msg = net.execute_tactical_ban(target, ban_type)
+    await q.answer(msg[:100])
+    txt, kb = net.get_ghost_detail_view(proc, page)
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("ghost_quick_ban_", args=(str,), prefix=True)
+async def on_ghost_quick_ban(u, c, ip):
+    q = u.callback_query
+    msg = net.add_ban_manual(ip) # 使用现有的添加黑名单函数，确保同步记录到日志和iptables
+    await q.answer(f"🚫 {ip} 已送入黑名单")
+    txt, kb = net.get_ghost_process_view()
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+# 清理功能
+@route("tool_clean")
+async def on_clean_menu(u, c):
+    q = u.callback_query
+    txt, kb = sys_mod.get_clean_menu(u.effective_user.id)
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("clean_sw_", args=(str,), prefix=True)
+async def on_clean_toggle(u, c, key):
+    q = u.callback_query
+    txt, kb = sys_mod.toggle_clean_option(u.effective_user.id, key)
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("clean_run")
+async def on_clean_run(u, c):
+    q = u.callback_query
+    await q.answer("🧹 已提交后台清理")
+    uid = u.effective_user.id
+    jobs.submit('clean', "智能清理", lambda: asyncio.to_thread(sys_mod.run_smart_clean, uid),
+                c.bot, q.message.chat_id, q.message.message_id)
+
+# 黑名单
+@route("tool_ban")
+async def on_ban_list(u, c):
+    q = u.callback_query
+    txt, kb = net.get_ban_list_view()
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("net_bl_page_", args=(int, str), prefix=True)
+async def on_ban_page(u, c, page, search):
+    q = u.callback_query
+    txt, kb = net.get_ban_list_view(page, search)
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("net_op_add")
+async def on_ban_add(u, c):
+    s = session.of(u)
+    s['state'] = "WAIT_BAN_ADD"
+    await u.callback_query.edit_message_text("请输入要封禁的 IP 或 CIDR (如 <code>1.2.3.4</code> 或 <code>1.2.3.0/24</code>):", parse_mode="HTML")
+
+@route("net_op_del")
+async def on_ban_del(u, c):
+    s = session.of(u)
+    s['state'] = "WAIT_BAN_DEL"
+    await u.callback_query.edit_message_text("请输入要解封的 IP 或 CIDR:", parse_mode="HTML")
+
+@route("net_op_search")
+async def on_ban_search(u, c):
+    s = session.of(u)
+    s['state'] = "WAIT_BAN_SEARCH"
+    await u.callback_query.edit_message_text("🔍 请输入搜索关键词 (IP片段):", parse_mode="HTML")
+
+@route("net_op_reset_ask")
+async def on_ban_reset_ask(u, c):
+    kb = [
+        [InlineKeyboardButton("✅ 确认清空", callback_data="net_op_reset_yes"), 
+         InlineKeyboardButton("❌ 取消", callback_data="tool_ban")]
+    ]
+    await u.callback_query.edit_message_text("⚠️ <b>危险操作</b>\n\n确定要清空所有黑名单规则吗?", reply_markup=InlineKeyboardMarkup(kb), parse_mode="HTML")
+
+@route("net_op_reset_yes")
+async def on_ban_reset(u, c):
+    q = u.callback_query
+    msg = net.reset_all_bans()
+    await q.answer(msg[:100])
+    txt, kb = net.get_ban_list_view()
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+# ==================== 端口控制 ====================
+@route("net_ports")
+async def on_ports(u, c):
+    q = u.callback_query
+    txt, kb = await view_cache.get_view('ports', net.build_port_menu)
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("net_ssh_", args=(str,), prefix=True)
+async def on_port_ssh(u, c, port):
+    q = u.callback_query
+    msg = net.toggle_ssh(port)
+    view_cache.invalidate('ports')
+    await q.answer(msg)
+    txt, kb = await view_cache.get_view('ports', net.build_port_menu)
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("net_ping")
+async def on_port_ping(u, c):
+    q = u.callback_query
+    msg = net.toggle_ping()
+    view_cache.invalidate('ports')
+    await q.answer(msg)
+    txt, kb = await view_cache.get_view('ports', net.build_port_menu)
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("net_biz_", args=(str,), prefix=True)
+async def on_port_biz(u, c, port):
+    q = u.callback_query
+    msg = net.toggle_port(port)
+    view_cache.invalidate('ports')
+    await q.answer(msg)
+    txt, kb = await view_cache.get_view('ports', net.build_port_menu)
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("net_add")
+async def on_port_add(u, c):
+    s = session.of(u)
+    s['state'] = "WAIT_PORT_ADD"
+    await u.callback_query.edit_message_text("请输入端口和描述 (格式: <code>8080 Web服务</code>):", parse_mode="HTML")
+
+@route("net_del")
+async def on_port_del(u, c):
+    s = session.of(u)
+    s['state'] = "WAIT_PORT_DEL"
+    await u.callback_query.edit_message_text("请输入要删除的端口号:", parse_mode="HTML")
+
+@route("net_reset")
+async def on_whitelist_on(u, c):
+    q = u.callback_query
+    msg = net.set_whitelist_mode(True)
+    view_cache.invalidate('ports')
+    await q.answer(msg)
+    txt, kb = await view_cache.get_view('ports', net.build_port_menu)
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("net_rescue")
+async def on_whitelist_off(u, c):
+    q = u.callback_query
+    msg = net.set_whitelist_mode(False)
+    view_cache.invalidate('ports')
+    await q.answer(msg)
+    txt, kb = await view_cache.get_view('ports', net.build_port_menu)
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+# ==================== 🏠 内网访问管理 (新增核心) ====================
+@route("net_lan_manage")
+async def on_lan_manage(u, c):
+    # 进入内网管理,自动初始化默认规则
+    q = u.callback_query
+    await q.answer("🔍 检测中...")
+    net.init_default_networks()
+    txt, kb = net.get_network_manage_menu()
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("net_lan_refresh")
+async def on_lan_refresh(u, c):
+    # 刷新检测
+    q = u.callback_query
+    await q.answer("🔄 重新检测...")
+    net.init_default_networks()
+    txt, kb = net.get_network_manage_menu()
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("net_lan_add")
+async def on_lan_add(u, c):
+    # 手动添加网段 (暂未实现)
+    await u.callback_query.answer("⚠️ 此功能正在开发中,请先使用自动检测")
+
+@route("net_lan_", args=(str,), prefix=True)
+async def on_lan_toggle(u, c, raw):
+    # 切换网段状态
+    # 格式: net_lan_192.168.1.0_24 -> 192.168.1.0/24
+    q = u.callback_query
+    try:
+        ip_part, sep, cidr_part = raw.rpartition("_")
+        if sep:
+            network = f"{ip_part}/{cidr_part}"
+            msg = net.toggle_network_access(network)
+            await q.answer(msg[:100])
+            txt, kb = net.get_network_manage_menu()
             await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-        else:
-            await q.answer("❌ 镜像不存在")
+    except Exception as e:
+        await q.answer(f"❌ 操作失败: {str(e)}")
+
+# ==================== Docker 管理 ====================
+@route("dk_m")
+async def on_docker_menu(u, c):
+    q = u.callback_query
+    txt, kb = await view_cache.get_view('dk_main', dk_mgr.build_main_menu)
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("dk_op_prune")
+async def on_docker_prune(u, c):
+    q = u.callback_query
+    await q.answer("🧹 已提交后台清理")
+
+    async def work():
+        msg = await asyncio.to_thread(dk_mgr.prune_docker_resources)
+        view_cache.invalidate('dk_main')
+        return msg, InlineKeyboardMarkup([[InlineKeyboardButton("🔙 返回", callback_data="dk_m")]])
+
+    jobs.submit('prune', "Docker 资源清理", work, c.bot, q.message.chat_id, q.message.message_id)
+
+@route("dk_list_cons")
+async def on_docker_list(u, c):
+    q = u.callback_query
+    txt, kb = dk_mgr.build_container_list()
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("dk_list_stacks")
+async def on_docker_stacks(u, c):
+    q = u.callback_query
+    txt, kb = dk_mgr.build_stack_menu()
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("dk_res_imgs")
+async def on_docker_images(u, c):
+    q = u.callback_query
+    txt, kb = dk_mgr.build_image_menu()
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("dk_store")
+async def on_app_store(u, c):
+    q = u.callback_query
+    txt, kb = dk_mgr.build_app_store_menu()
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("dk_store_ask_", args=(str,), prefix=True)
+async def on_app_store_ask(u, c, app_key):
+    q = u.callback_query
+    txt, kb = dk_mgr.build_app_install_confirm(app_key)
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("dk_store_do_", args=(str,), prefix=True)
+async def on_app_store_do(u, c, app_key):
+    q = u.callback_query
+    uid = u.effective_user.id
+    await q.answer("🚀 正在初始化安装向导...")
+    # 增加一个中间过渡状态，提升交互感
+    await q.edit_message_text("⌛ <b>正在为您准备安装环境...</b>\n请稍候...", parse_mode="HTML")
     
-    elif d == "dk_wiz_back":
+    if dk_mgr.install_app_template(uid, app_key):
         txt, kb = dk_mgr.get_wizard_menu(uid)
         await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    elif d == "dk_wiz_set_name":
-        WIZARD_STATE = "WIZ_NAME"
-        await q.edit_message_text("请输入容器名称:", parse_mode="HTML")
-    
-    elif d == "dk_wiz_set_port":
-        WIZARD_STATE = "WIZ_PORT"
-        await q.edit_message_text("请输入端口映射 (格式: <code>8080:80</code>):", parse_mode="HTML")
-    
-    elif d == "dk_wiz_set_vol":
-        WIZARD_STATE = "WIZ_VOL"
-        await q.edit_message_text("请输入挂载路径 (格式: <code>/host/path:/container/path</code>):", parse_mode="HTML")
-    
-    elif d == "dk_wiz_set_env":
-        WIZARD_STATE = "WIZ_ENV"
-        await q.edit_message_text("请输入环境变量 (格式: <code>KEY=VALUE</code>):", parse_mode="HTML")
-    
-    elif d == "dk_wiz_net":
-        txt, kb = dk_mgr.get_net_select_menu(uid)
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    elif d.startswith("dk_wiz_val_net_"):
-        net_name = d.split('_')[4]
-        txt, kb = dk_mgr.update_wizard_val(uid, 'net', net_name)
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    elif d == "dk_wiz_adv":
-        txt, kb = dk_mgr.get_advanced_menu(uid)
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    elif d == "dk_wiz_toggle_priv":
-        txt, kb = dk_mgr.update_wizard_val(uid, 'privileged', None)
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    elif d == "dk_wiz_commit":
-        await q.answer("🚀 正在创建容器...")
-        await q.edit_message_text("⏳ <b>正在拉取镜像并部署容器...</b>\n這可能需要幾十秒，請稍候...", parse_mode="HTML")
-        msg = dk_mgr.commit_wizard(uid)
-        await q.edit_message_text(msg, reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 返回列表", callback_data="dk_list_cons")]]), parse_mode="HTML")
-    
-    # Stack 操作
-    elif d.startswith("dk_stack_opt_"):
-        name = d.split('_')[3]
-        txt, kb = dk_mgr.build_stack_dashboard(name)
-        await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    elif d.startswith("dk_sop_"):
-        parts = d.split('_')
-        action = f"stack_{parts[2]}"
-        name = parts[3]
-        await q.answer("⏳ 执行中...")
-        success, msg = dk_mgr.docker_action(action, name)
-        await q.answer(f"{'✅' if success else '❌'} {msg}")
-        txt, kb = dk_mgr.build_stack_menu()
+    else:
+        await q.answer("❌ 模板不存在", show_alert=True)
+
+@route("dk_events")
+async def on_docker_events(u, c):
+    events = dk_mgr.get_docker_events()
+    await u.callback_query.edit_message_text(f"📝 <b>Docker 事件流</b>\n<code>{events}</code>", parse_mode="HTML")
+
+# 批量操作
+@route("dk_bulk")
+async def on_bulk_menu(u, c):
+    q = u.callback_query
+    txt, kb = dk_mgr.build_bulk_menu(u.effective_user.id)
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("dk_bulk_t_", args=(str,), prefix=True)
+async def on_bulk_toggle(u, c, cid):
+    q = u.callback_query
+    dk_mgr.toggle_bulk_item(u.effective_user.id, f"c:{cid}")
+    txt, kb = dk_mgr.build_bulk_menu(u.effective_user.id)
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("dk_bulk_ts_", args=(str,), prefix=True)
+async def on_bulk_toggle_stack(u, c, name):
+    q = u.callback_query
+    dk_mgr.toggle_bulk_item(u.effective_user.id, f"s:{name}")
+    txt, kb = dk_mgr.build_bulk_menu(u.effective_user.id)
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("dk_bulk_all")
+@route("dk_bulk_none")
+async def on_bulk_select_all(u, c):
+    q = u.callback_query
+    dk_mgr.set_bulk_all(u.effective_user.id, q.data == "dk_bulk_all")
+    txt, kb = dk_mgr.build_bulk_menu(u.effective_user.id)
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("dk_bulk_order")
+async def on_bulk_order(u, c):
+    q = u.callback_query
+    dk_mgr.toggle_bulk_order(u.effective_user.id)
+    txt, kb = dk_mgr.build_bulk_menu(u.effective_user.id)
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("dk_bulk_mem")
+async def on_bulk_mem(u, c):
+    q = u.callback_query
+    txt, kb = dk_mgr.build_bulk_mem_menu()
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("dk_bulk_do_", args=(str, str), prefix=True)
+async def on_bulk_do(u, c, action, extra):
+    q = u.callback_query
+    uid = u.effective_user.id
+    targets = await asyncio.to_thread(dk_mgr.resolve_bulk_targets, uid)
+    if not targets:
+        await q.answer("⚠️ 请先选择容器或堆栈", show_alert=True)
+        return
+    await q.edit_message_text(f"⏳ <b>正在对 {len(targets)} 个容器执行批量操作...</b>", parse_mode="HTML")
+    results, total = await dk_mgr.run_bulk_action(action, targets, extra, ordered=dk_mgr.BULK_SELECT[uid]['ordered'])
+    await q.edit_message_text(dk_mgr.format_bulk_report(action, results, total), reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 返回批量操作", callback_data="dk_bulk")]]), parse_mode="HTML")
+
+# 容器详情
+@route("dk_view_", args=(str,), prefix=True)
+async def on_container_view(u, c, cid):
+    q = u.callback_query
+    txt, kb = dk_mgr.build_container_dashboard(cid)
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("dk_log_v_", args=(str,), prefix=True)
+async def on_logs(u, c, cid):
+    q = u.callback_query
+    txt, kb = dk_mgr.build_logs_preview(cid)
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("dk_log_p_", args=(str, int), prefix=True)
+async def on_logs_page(u, c, cid, cursor):
+    q = u.callback_query
+    txt, kb = dk_mgr.build_logs_preview(cid, cursor=cursor)
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("dk_log_s_", args=(str,), prefix=True)
+async def on_logs_search(u, c, cid):
+    s = session.of(u)
+    s['state'] = f"WAIT_DK_LOG_SEARCH_{cid}"
+    await u.callback_query.edit_message_text("🔍 <b>请输入搜索内容</b> (支持正则, 不区分大小写):", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 取消", callback_data=f"dk_log_v_{cid}")]]), parse_mode="HTML")
+
+@route("dk_log_f_", args=(str,), prefix=True)
+async def on_logs_follow(u, c, cid):
+    q = u.callback_query
+    key = (q.message.chat_id, cid)
+    old_task = dk_mgr.LOG_FOLLOWERS.pop(key, None)
+    if old_task: old_task.cancel()
+    async def edit_follow(txt, kb):
         await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    # 资源限制
-    elif d.startswith("dk_lim_menu_"):
-        cid = d.split('_')[3]
-        txt, kb = dk_mgr.build_limit_menu(cid)
+    task = asyncio.create_task(dk_mgr.follow_logs(cid, edit_follow))
+    dk_mgr.LOG_FOLLOWERS[key] = task
+    task.add_done_callback(lambda t: dk_mgr.LOG_FOLLOWERS.pop(key, None) if dk_mgr.LOG_FOLLOWERS.get(key) is t else None)
+    await q.answer("📡 已开启跟随模式")
+
+@route("dk_log_x_", args=(str,), prefix=True)
+async def on_logs_follow_stop(u, c, cid):
+    q = u.callback_query
+    task = dk_mgr.LOG_FOLLOWERS.pop((q.message.chat_id, cid), None)
+    if task: task.cancel()
+    txt, kb = dk_mgr.build_logs_preview(cid)
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("dk_op_exec_ask_", args=(str,), prefix=True)
+async def on_exec_ask(u, c, cid):
+    s = session.of(u)
+    s['state'] = f"WAIT_DK_EXEC_{cid}"
+    await u.callback_query.edit_message_text("💻 <b>请输入要在容器内执行的命令:</b>\n(例如 <code>ls -la</code>, <code>df -h</code>, <code>python --version</code>)", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 取消", callback_data=f"dk_view_{cid}")]]), parse_mode="HTML")
+
+# 容器操作
+@route("dk_op_", args=(str, str), prefix=True)
+async def on_container_op(u, c, action, target):
+    q = u.callback_query
+    await q.answer("⏳ 执行中...")
+    success, msg = dk_mgr.docker_action(action, target)
+    await q.answer(f"{'✅' if success else '❌'} {msg}")
+    txt, kb = dk_mgr.build_container_list()
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+# 镜像详情
+@route("dk_img_v_", args=(str,), prefix=True)
+async def on_image_view(u, c, iid):
+    q = u.callback_query
+    txt, kb = dk_mgr.build_image_dashboard(iid)
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("dk_img_upd_", args=(str,), prefix=True)
+async def on_image_update(u, c, tag):
+    q = u.callback_query
+    await q.answer("🔄 更新中...")
+    msg = dk_mgr.update_image(tag)
+    await q.answer(msg[:100])
+    txt, kb = dk_mgr.build_image_menu()
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("dk_img_hist_", args=(str,), prefix=True)
+async def on_image_history(u, c, iid):
+    layers = dk_mgr.get_image_layers(iid)
+    await u.callback_query.edit_message_text(f"🍰 <b>镜像层信息</b>\n{layers}", parse_mode="HTML")
+
+# 向导流程
+@route("dk_wiz_new_", args=(str,), prefix=True)
+async def on_wizard_new(u, c, iid):
+    q = u.callback_query
+    uid = u.effective_user.id
+    if dk_mgr.init_wizard(uid, iid):
+        txt, kb = dk_mgr.get_wizard_menu(uid)
         await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
-    
-    elif d.startswith("dk_set_lim_"):
-        parts = d.split('_')
-        cid = parts[3]
-        limit = parts[4]
-        await q.answer("⏳ 设置中...")
-        success, msg = dk_mgr.docker_action("update_mem", cid, limit)
-        txt, kb = dk_mgr.build_limit_menu(cid)
-        try:
-            await q.edit_message_text(f"{txt}\n\n{'✅ 设置成功' if success else '❌ ' + msg}", reply_markup=kb, parse_mode="HTML")
-        except: pass
+    else:
+        await q.answer("❌ 镜像不存在")
+
+@route("dk_wiz_back")
+async def on_wizard_back(u, c):
+    q = u.callback_query
+    txt, kb = dk_mgr.get_wizard_menu(u.effective_user.id)
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("dk_wiz_set_name")
+async def on_wizard_set_name(u, c):
+    s = session.of(u)
+    s['wizard'] = "WIZ_NAME"
+    await u.callback_query.edit_message_text("请输入容器名称:", parse_mode="HTML")
+
+@route("dk_wiz_set_port")
+async def on_wizard_set_port(u, c):
+    s = session.of(u)
+    s['wizard'] = "WIZ_PORT"
+    await u.callback_query.edit_message_text("请输入端口映射 (格式: <code>8080:80</code>):", parse_mode="HTML")
+
+@route("dk_wiz_set_vol")
+async def on_wizard_set_vol(u, c):
+    s = session.of(u)
+    s['wizard'] = "WIZ_VOL"
+    await u.callback_query.edit_message_text("请输入挂载路径 (格式: <code>/host/path:/container/path</code>):", parse_mode="HTML")
+
+@route("dk_wiz_set_env")
+async def on_wizard_set_env(u, c):
+    s = session.of(u)
+    s['wizard'] = "WIZ_ENV"
+    await u.callback_query.edit_message_text("请输入环境变量 (格式: <code>KEY=VALUE</code>):", parse_mode="HTML")
+
+@route("dk_wiz_net")
+async def on_wizard_net(u, c):
+    q = u.callback_query
+    txt, kb = dk_mgr.get_net_select_menu(u.effective_user.id)
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("dk_wiz_val_net_", args=(str,), prefix=True)
+async def on_wizard_net_set(u, c, net_name):
+    q = u.callback_query
+    txt, kb = dk_mgr.update_wizard_val(u.effective_user.id, 'net', net_name)
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("dk_wiz_adv")
+async def on_wizard_adv(u, c):
+    q = u.callback_query
+    txt, kb = dk_mgr.get_advanced_menu(u.effective_user.id)
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("dk_wiz_toggle_priv")
+async def on_wizard_priv(u, c):
+    q = u.callback_query
+    txt, kb = dk_mgr.update_wizard_val(u.effective_user.id, 'privileged', None)
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("dk_wiz_commit")
+async def on_wizard_commit(u, c):
+    q = u.callback_query
+    await q.answer("🚀 正在创建容器...")
+    await q.edit_message_text("⏳ <b>正在检查镜像...</b>", parse_mode="HTML")
+    async def pull_progress(txt):
+        await q.edit_message_text(txt, parse_mode="HTML")
+    msg = await dk_mgr.commit_wizard_async(u.effective_user.id, pull_progress)
+    await q.edit_message_text(msg, reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 返回列表", callback_data="dk_list_cons")]]), parse_mode="HTML")
+
+# Stack 操作
+@route("dk_stack_opt_", args=(str,), prefix=True)
+async def on_stack_view(u, c, name):
+    q = u.callback_query
+    txt, kb = dk_mgr.build_stack_dashboard(name)
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("dk_sop_", args=(str, str), prefix=True)
+async def on_stack_op(u, c, op, name):
+    q = u.callback_query
+    await q.answer("⏳ 执行中...")
+    success, msg = dk_mgr.docker_action(f"stack_{op}", name)
+    await q.answer(f"{'✅' if success else '❌'} {msg}")
+    txt, kb = dk_mgr.build_stack_menu()
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+# 资源限制
+@route("dk_lim_menu_", args=(str,), prefix=True)
+async def on_limit_menu(u, c, cid):
+    q = u.callback_query
+    txt, kb = dk_mgr.build_limit_menu(cid)
+    await q.edit_message_text(txt, reply_markup=kb, parse_mode="HTML")
+
+@route("dk_set_lim_", args=(str, str), prefix=True)
+async def on_limit_set(u, c, cid, limit):
+    q = u.callback_query
+    await q.answer("⏳ 设置中...")
+    success, msg = dk_mgr.docker_action("update_mem", cid, limit)
+    txt, kb = dk_mgr.build_limit_menu(cid)
+    try:
+        await q.edit_message_text(f"{txt}\n\n{'✅ 设置成功' if success else '❌ ' + msg}", reply_markup=kb, parse_mode="HTML")
+    except: pass
 
 async def traffic_monitor(app: Application):
     """系统综合监控 (流量 + 资源极限)"""
@@ -1095,14 +1564,15 @@ async def traffic_monitor(app: Application):
                 today_str = datetime.now().strftime("%Y-%m-%d")
                 if conf.get('last_daily_warn_date') != today_str:
                     txt = f"🚨 <b>流量预警</b>\n📉 今日已用: <code>{used:.2f} GB</code>\n🛑 设定阈值: <code>{limit} GB</code>"
-                    for uid in ALLOWED_USER_IDS:
-                        await app.bot.send_message(chat_id=uid, text=txt, parse_mode="HTML")
+                    notifier.notify(txt, ALLOWED_USER_IDS)
                     conf['last_daily_warn_date'] = today_str
                     save_config(conf)
             alerts = sys_mod.check_system_limits()
             if alerts:
-                for uid in ALLOWED_USER_IDS:
-                    await app.bot.send_message(chat_id=uid, text="🛑 <b>系统极限报警</b>\n" + "\n".join(alerts), parse_mode="HTML")
+                firing = any(not a.startswith("✅") for a in alerts)
+                title = "🛑 <b>系统极限报警</b>" if firing else "✅ <b>系统资源恢复</b>"
+                notifier.notify(title + "\n" + "\n".join(alerts), ALLOWED_USER_IDS, kind="系统极限",
+                                prio=notifier.PRIO_CRITICAL if firing else notifier.PRIO_NORMAL)
         except Exception as e:
             logging.error(f"监控异常: {e}")
             await asyncio.sleep(60)
@@ -1122,8 +1592,7 @@ async def ssh_monitor(app: Application):
                 user = parts[parts.index("for") + 1]
                 ip = parts[parts.index("from") + 1]
                 txt = f"🕵️ <b>SSH 安全提醒</b>\n━━━━━━━━━━━━━━━\n👤 用户: <code>{user}</code>\n🌐 来源: <code>{ip}</code>\n⏰ 时间: <code>{datetime.now().strftime('%H:%M:%S')}</code>"
-                for uid in ALLOWED_USER_IDS:
-                    await app.bot.send_message(chat_id=uid, text=txt, parse_mode="HTML")
+                notifier.notify(txt, ALLOWED_USER_IDS, kind="SSH 登录")
     except Exception as e:
         logging.error(f"SSH 监控异常: {e}")
 
@@ -1136,20 +1605,19 @@ async def backup_scheduler(app: Application):
             if auto.get("mode") != "off" and now_hm == auto.get("time", "03:00"):
                 today_str = now.strftime("%Y-%m-%d")
                 if auto.get("last_run") != today_str:
-                    file_path, msg = bk_mgr.run_backup_task(is_auto=True)
-                    if file_path:
-                        for uid in ALLOWED_USER_IDS:
-                            with open(file_path, 'rb') as f:
-                                await app.bot.send_document(chat_id=uid, document=f, caption=f"⏰ <b>自动备份汇报</b>\n{msg}", parse_mode="HTML")
-                        os.remove(file_path)
+                    file_path, msg, note = await volumes.backup_as_job(app.bot, ALLOWED_USER_IDS, "⏰ <b>自动备份汇报</b>", "自动备份")
+                    if file_path and note and not note.startswith("🧩"):
+                        notifier.notify(f"⏰ <b>自动备份</b>\n{note}", ALLOWED_USER_IDS, prio=notifier.PRIO_CRITICAL)
+                    elif not file_path:
+                        title = "⏰ <b>自动备份汇报</b>" if msg.startswith("✅") else "❌ <b>自动备份失败</b>"
+                        notifier.notify(f"{title}\n{msg}", ALLOWED_USER_IDS)
                     auto['last_run'] = today_str; conf['auto_backup'] = auto; save_config(conf)
             if now_hm in conf.get("daily_report_times", ["08:00", "20:00"]):
                 report_key = f"last_report_{now_hm.replace(':','')}"
                 if conf.get(report_key) != now.strftime("%Y-%m-%d"):
-                    txt, kb = sys_mod.get_system_report()
+                    txt, kb = await asyncio.to_thread(sys_mod.get_system_report)
                     prefix = "🌅 <b>系统简报</b>" if now.hour < 12 else "🌃 <b>运行总结</b>"
-                    for uid in ALLOWED_USER_IDS:
-                        await app.bot.send_message(chat_id=uid, text=f"{prefix}\n\n{txt}", parse_mode="HTML")
+                    notifier.notify(f"{prefix}\n\n{txt}", ALLOWED_USER_IDS, prio=notifier.PRIO_LOW)
                     conf[report_key] = now.strftime("%Y-%m-%d"); save_config(conf)
             await asyncio.sleep(60)
         except Exception as e:
@@ -1166,8 +1634,7 @@ async def traffic_daily_push(app: Application):
                     today_str = now.strftime("%Y-%m-%d")
                     if conf.get('last_traffic_report_date') != today_str:
                         txt = net.get_daily_traffic_report()
-                        for uid in ALLOWED_USER_IDS:
-                            await app.bot.send_message(chat_id=uid, text=txt, parse_mode="HTML")
+                        notifier.notify(txt, ALLOWED_USER_IDS, prio=notifier.PRIO_LOW)
                         conf['last_traffic_report_date'] = today_str
                         save_config(conf)
             await asyncio.sleep(60)
@@ -1176,19 +1643,74 @@ async def traffic_daily_push(app: Application):
             await asyncio.sleep(60)
 
 async def post_init(application: Application) -> None:
+    notifier.start(application.bot)
     asyncio.create_task(docker_sentinel(application))
     asyncio.create_task(traffic_monitor(application))
     asyncio.create_task(backup_scheduler(application))
     asyncio.create_task(ssh_monitor(application))
     asyncio.create_task(traffic_daily_push(application))
+    asyncio.create_task(health_mod.health_engine_loop())
+    asyncio.create_task(volumes.resume_uploads(application.bot))
+    size_cache.refresh()    # 预热备份体积缓存, 首次打开备份菜单即可显示
+
+def webhook_secret(wh):
+    """Webhook 校验令牌: 未配置时由 Bot Token 派生 (固定值, 重启后不变)"""
+    secret = wh.get('secret_token') or hashlib.sha256(f"vps_bot_webhook:{TOKEN}".encode()).hexdigest()[:32]
+    return re.sub(r'[^A-Za-z0-9_-]', '', secret)[:256]
+
+def run_bot(app, conf):
+    """
+    按配置选择运行模式
+    polling: 长轮询 (默认)
+    webhook: 内嵌 HTTP 服务接收推送, 校验 X-Telegram-Bot-Api-Secret-Token, 可选 TLS
+    """
+    if conf.get('run_mode', 'polling') != "webhook":
+        app.run_polling()
+        return
+    
+    wh = conf.get('webhook', {})
+    path = wh.get('path', 'tg-webhook').strip('/')
+    base_url = wh.get('url', '').rstrip('/')
+    if not base_url:
+        print("❌ webhook 模式需要配置 webhook.url (Telegram 可访问的 https 地址), 已回退到 polling")
+        app.run_polling()
+        return
+    
+    cert, key = wh.get('cert') or None, wh.get('key') or None
+    print(f"🌐 Webhook 模式: {wh.get('listen', '0.0.0.0')}:{wh.get('port', 8443)}/{path} {'(TLS)' if cert else '(由反向代理终止 TLS)'}")
+    app.run_webhook(
+        listen=wh.get('listen', '0.0.0.0'),
+        port=int(wh.get('port', 8443)),
+        url_path=path,
+        webhook_url=f"{base_url}/{path}",
+        secret_token=webhook_secret(wh),
+        cert=cert,
+        key=key,
+        max_connections=int(wh.get('max_connections', 40)),
+        allowed_updates=Update.ALL_TYPES,
+    )
 
 if __name__ == "__main__":
     net.init_default_networks()
-    app = Application.builder().token(TOKEN).post_init(post_init).build()
     
     # 读取配置获取命令前缀
     from config import load_config
     conf = load_config()
+    
+    # agent 模式: 只提供 RPC 服务, 由 controller 统一经 Telegram 管理
+    if conf.get('mode') == "agent":
+        from modules.agent import run_agent
+        run_agent(conf)
+        raise SystemExit(0)
+    
+    # 并发处理更新: 慢操作 (体检/备份) 不阻塞其他管理员, 对话状态按会话隔离 (session.py)
+    builder = Application.builder().token(TOKEN).post_init(post_init).concurrent_updates(conf.get('concurrent_updates', 16))
+    # 自建 Bot API 服务器 (bot_api.base_url): 文件直接读写本机磁盘, 收发上限提升到 2000MB
+    builder = bot_api.configure(builder)
+    if conf.get('run_mode', 'polling') == "webhook":
+        # 有界更新队列: 突发推送时 HTTP 端等待入队, Telegram 会自动重试, 不会无限堆积内存
+        builder = builder.update_queue(asyncio.Queue(maxsize=conf.get('webhook', {}).get('queue_size', 256)))
+    app = builder.build()
     command_prefix = conf.get('command_prefix', 'kk')
     
     # 注册命令
@@ -1197,6 +1719,7 @@ if __name__ == "__main__":
     app.add_handler(CommandHandler("settoken", settoken_command))
     app.add_handler(CommandHandler("setadminid", setadminid_command))
     app.add_handler(CommandHandler("setprefix", setprefix_command))
+    app.add_handler(CommandHandler("restore", restore_command))
     
     # 如果前缀不是默认的 'kk'，也注册 /kk 作为别名以保持兼容性
     if command_prefix != "kk":
@@ -1209,4 +1732,4 @@ if __name__ == "__main__":
     
     print(f"✅ VPS Bot V6.3-X 启动成功")
     print(f"📝 控制台命令: /{command_prefix} (原 /kk)")
-    app.run_polling()
+    run_bot(app, conf)
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+# modules/agent.py - 多 VPS 模式: agent 端 RPC 服务
+# 轻量 asyncio HTTP 服务 (无额外依赖), 只开放白名单内的模块函数;
+# 每个请求以 HMAC-SHA256 签名 (时间戳 + 随机数 + 请求体), 拒绝过期与重放请求
+import json, time, hmac, hashlib, asyncio, logging, argparse
+
+from config import load_config
+import modules.system as sys_mod
+import modules.network as net
+import modules.docker_mgr as dk_mgr
+import modules.backup as bk_mgr
+import modules.health_check as health_mod
+
+MAX_BODY = 1024 * 1024      # 请求体上限
+MAX_SKEW = 60               # 允许的时间戳偏差 (秒)
+CALL_TIMEOUT = 120          # 单次调用的执行时限
+NONCES = {}                 # {nonce: ts} 重放检测
+
+def _backup_run():
+    # 备份文件留在 agent 本机, 只返回结果说明
+    path, msg = bk_mgr.run_backup_task(is_auto=True)
+    return {'ok': bool(path), 'path': path, 'msg': msg}
+
+def _docker_action(action, target, extra=None):
+    ok, msg = dk_mgr.docker_action(action, target, extra)
+    return {'ok': ok, 'msg': msg}
+
+# 白名单: RPC 方法名 -> 同步函数 (在线程中执行), 返回值必须可 JSON 序列化
+RPC_METHODS = {
+    'ping':               lambda: {'ts': time.time()},
+    'system.summary':     sys_mod.get_summary,
+    'system.traffic':     sys_mod.get_traffic_stats,
+    'system.report':      lambda: sys_mod.get_system_report()[0],
+    'system.diagnosis':   lambda: sys_mod.get_auto_diagnosis()[0],
+    'network.listen':     lambda: net.get_listen_text()[0],
+    'network.ban':        net.add_ban_manual,
+    'network.unban':      net.remove_ban_manual,
+    'docker.containers':  dk_mgr.get_containers,
+    'docker.action':      _docker_action,
+    'health.data':        health_mod.get_container_health_data,
+    'backup.run':         _backup_run,
+}
+
+def sign(token, ts, nonce, body):
+    """签名: HMAC-SHA256(token, "ts.nonce." + body)"""
+    msg = f"{ts}.{nonce}.".encode() + body
+    return hmac.new(token.encode(), msg, hashlib.sha256).hexdigest()
+
+def _verify(token, headers, body):
+    try:
+        ts = float(headers.get('x-agent-ts', '0'))
+    except ValueError:
+        return False
+    nonce = headers.get('x-agent-nonce', '')
+    now = time.time()
+    if not nonce or abs(now - ts) > MAX_SKEW:
+        return False
+    expected = sign(token, headers.get('x-agent-ts', ''), nonce, body)
+    if not hmac.compare_digest(expected, headers.get('x-agent-signature', '')):
+        return False
+    for n in [n for n, t in NONCES.items() if now - t > MAX_SKEW * 2]:
+        NONCES.pop(n, None)
+    if nonce in NONCES:
+        return False
+    NONCES[nonce] = now
+    return True
+
+async def _respond(writer, status, payload):
+    body = json.dumps(payload, ensure_ascii=False, default=str).encode()
+    reason = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found", 413: "Payload Too Large", 500: "Internal Server Error"}.get(status, "OK")
+    writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n"
+                 f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+    await writer.drain()
+
+async def _handle(reader, writer, token):
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 10)
+        lines = head.decode('latin-1').split("\r\n")
+        method, path = lines[0].split()[:2]
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                k, v = line.split(':', 1)
+                headers[k.strip().lower()] = v.strip()
+        length = int(headers.get('content-length', '0'))
+        if length > MAX_BODY:
+            return await _respond(writer, 413, {'error': 'body too large'})
+        body = await asyncio.wait_for(reader.readexactly(length), 10) if length else b""
+
+        if method != "POST" or path != "/rpc":
+            return await _respond(writer, 404, {'error': 'not found'})
+        if not _verify(token, headers, body):
+            logging.warning(f"agent: 拒绝未授权请求 {writer.get_extra_info('peername')}")
+            return await _respond(writer, 401, {'error': 'unauthorized'})
+
+        req = json.loads(body or b"{}")
+        fn = RPC_METHODS.get(req.get('method'))
+        if fn is None:
+            return await _respond(writer, 404, {'error': f"unknown method {req.get('method')}"})
+        try:
+            result = await asyncio.wait_for(asyncio.to_thread(fn, *req.get('args', [])), CALL_TIMEOUT)
+            await _respond(writer, 200, {'result': result})
+        except Exception as e:
+            await _respond(writer, 500, {'error': f"{type(e).__name__}: {e}"[:500]})
+    except (asyncio.IncompleteReadError, asyncio.TimeoutError, asyncio.LimitOverrunError, ValueError) as e:
+        try:
+            await _respond(writer, 400, {'error': str(e)[:200]})
+        except Exception:
+            pass
+    except Exception as e:
+        logging.error(f"agent 请求处理异常: {e}")
+    finally:
+        try:
+            writer.close()
+            await writer.wait_closed()
+        except Exception:
+            pass
+
+async def serve(listen, port, token):
+    if not token:
+        raise RuntimeError("agent.token 未设置, 拒绝启动")
+    server = await asyncio.start_server(lambda r, w: _handle(r, w, token), listen, port)
+    print(f"🛰️ Agent 已启动: {listen}:{port} ({len(RPC_METHODS)} 个方法)")
+    async with server:
+        await server.serve_forever()
+
+def run_agent(conf=None, listen=None, port=None, token=None):
+    """agent 模式入口 (不连接 Telegram)"""
+    conf = conf or load_config()
+    ac = conf.get('agent', {})
+    asyncio.run(serve(listen or ac.get('listen', '0.0.0.0'), int(port or ac.get('port', 9101)), token or ac.get('token', '')))
+
+if __name__ == "__main__":
+    # 本地测试可在不同端口启动多个 agent:
+    #   python3 -m modules.agent --port 9101 --token test
+    #   python3 -m modules.agent --port 9102 --token test
+    parser = argparse.ArgumentParser(description="VPS Bot agent")
+    parser.add_argument("--listen", default=None)
+    parser.add_argument("--port", type=int, default=None)
+    parser.add_argument("--token", default=None)
+    a = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    run_agent(listen=a.listen, port=a.port, token=a.token)
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# modules/alert_state.py - 告警状态机 (去重 / 迟滞 / 持续时间 / 冷却)
+# 以 (告警类型, 对象) 为键: ok -> pending -> firing -> ok
+# 只有状态迁移 (触发 / 恢复) 才产生通知, 持续超限期间不再重复刷屏
+import time
+
+# 默认规则: enter 触发阈值, exit 恢复阈值 (低于 enter 形成迟滞),
+# for 需持续超限的秒数, cooldown 两次触发通知的最小间隔
+ALERT_RULES = {
+    'cpu':            {'enter': 90, 'exit': 80, 'for': 120, 'cooldown': 1800},
+    'ram':            {'enter': 90, 'exit': 85, 'for': 60,  'cooldown': 1800},
+    'disk':           {'enter': 90, 'exit': 88, 'for': 0,   'cooldown': 3600},
+    'disk_critical':  {'enter': 95, 'exit': 92, 'for': 0,   'cooldown': 3600},
+    'container_exit': {'enter': 1,  'exit': 0,  'for': 0,   'cooldown': 3600},
+}
+DEFAULT_RULE = {'enter': 90, 'exit': 80, 'for': 60, 'cooldown': 1800}
+
+ALERTS = {}     # {(type, subject): {'state', 'since', 'fired_at', 'notified_at', 'value', 'peak'}}
+
+FIRING = "firing"
+RESOLVED = "resolved"
+
+def _rule(atype, enter=None, exit=None):
+    r = dict(ALERT_RULES.get(atype, DEFAULT_RULE))
+    if enter is not None:
+        # 调用方覆盖触发阈值时, 恢复阈值保持原有的迟滞间距
+        gap = r['enter'] - r['exit']
+        r['enter'] = enter
+        r['exit'] = enter - gap if exit is None else exit
+    elif exit is not None:
+        r['exit'] = exit
+    return r
+
+def evaluate(atype, subject, value, enter=None, exit=None, now=None):
+    """
+    输入一次采样, 返回本次产生的迁移: FIRING / RESOLVED / None
+    冷却期内的重复触发只更新状态, 不返回 FIRING
+    """
+    now = now or time.time()
+    r = _rule(atype, enter, exit)
+    key = (atype, subject)
+    a = ALERTS.get(key)
+    if a is None:
+        a = ALERTS[key] = {'state': 'ok', 'since': now, 'fired_at': 0, 'notified_at': 0, 'value': value, 'peak': value}
+    a['value'] = value
+
+    if a['state'] == 'ok':
+        if value < r['enter']:
+            return None
+        a['state'], a['since'], a['peak'] = 'pending', now, value
+
+    if a['state'] == 'pending':
+        if value < r['enter']:
+            a['state'], a['since'] = 'ok', now
+            return None
+        a['peak'] = max(a['peak'], value)
+        if now - a['since'] < r['for']:
+            return None
+        a['state'], a['fired_at'] = 'firing', now
+        if a['notified_at'] and now - a['notified_at'] < r['cooldown']:
+            a['silent'] = True
+            return None
+        a['notified_at'], a['silent'] = now, False
+        return FIRING
+
+    # firing: 只有跌破恢复阈值才算恢复
+    a['peak'] = max(a['peak'], value)
+    if value > r['exit']:
+        return None
+    a['state'], a['since'] = 'ok', now
+    return None if a.get('silent') else RESOLVED
+
+def evaluate_flag(atype, subject, active, now=None):
+    """布尔型告警 (如容器异常退出)"""
+    return evaluate(atype, subject, 1 if active else 0, now=now)
+
+def sweep(atype, present, now=None):
+    """
+    对象已消失 (容器被删除/重新启动) 时按恢复处理
+    返回 [(subject, RESOLVED), ...]
+    恢复后的条目保留到冷却期结束, 崩溃循环的容器在冷却期内再次触发时不会重复通知
+    """
+    now = now or time.time()
+    cooldown = _rule(atype)['cooldown']
+    out = []
+    for (t, subject) in list(ALERTS):
+        if t != atype or subject in present:
+            continue
+        if evaluate(atype, subject, 0, now=now) == RESOLVED:
+            out.append((subject, RESOLVED))
+        a = ALERTS[(t, subject)]
+        if a['state'] == 'ok' and now - a['notified_at'] >= cooldown:
+            ALERTS.pop((t, subject), None)
+    return out
+
+def duration_text(atype, subject, now=None):
+    """告警持续时长 (用于恢复通知)"""
+    a = ALERTS.get((atype, subject))
+    if not a or not a.get('fired_at'):
+        return "-"
+    secs = int((now or time.time()) - a['fired_at'])
+    if secs >= 3600:
+        return f"{secs // 3600}h{secs % 3600 // 60}m"
+    return f"{secs // 60}m{secs % 60}s"
+
+def get_firing():
+    """当前处于触发状态的告警列表"""
+    return [(t, s, a) for (t, s), a in ALERTS.items() if a['state'] == 'firing']
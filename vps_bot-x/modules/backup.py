@@ -1,75 +1,598 @@
 # -*- coding: utf-8 -*-
 # modules/backup.py (V5.9.4 优化版 - 增强错误处理)
-import os, subprocess, glob, shutil
+import os, re, html, time, json, gzip, fnmatch, hashlib, tempfile, subprocess, glob, shutil, threading
 from datetime import datetime
 from config import load_config, save_config
 from utils import log_audit, get_path_id
+import modules.catalog as catalog
+import modules.jobs as jobs
+import modules.seekable as seekable
+import modules.isolation as isolation
+import modules.destinations as destinations
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
-def run_backup_task(is_auto=False):
+BACKUP_DIR = "/var/lib/vps_bot/backups"     # 默认备份目录 (可由 backup_dir 配置覆盖)
+BACKUP_PATTERNS = ("backup_*.tar.zst", "backup_*.tar.gz")
+LEGACY_DIR = "/tmp"                          # 旧版本存放位置, 仍纳入历史列表
+RESTORE_DIR = "/var/lib/vps_bot/restore"     # 还原输出目录 (不直接覆盖线上文件)
+MANIFEST_SUFFIX = ".manifest.json.gz"        # 归档旁的清单文件
+HASH_CHUNK = 1024 * 1024
+
+# 压缩器: 命令模板 + 扩展名; {level}/{threads} 由配置填充
+COMPRESSORS = {
+    'zstd': (["zstd", "-q", "-{level}", "-T{threads}"], ".tar.zst", 3),
+    'pigz': (["pigz", "-{level}", "-p", "{threads}"], ".tar.gz", 6),
+    'gzip': (["gzip", "-{level}"], ".tar.gz", 6),
+    # 进程内 zlib 分帧压缩 (多成员 gzip) + 偏移索引, 支持只解压所需帧的选择性还原
+    'seekable': (None, ".tar.gz", 6),
+}
+
+def get_backup_dir():
+    path = load_config().get('backup_dir', BACKUP_DIR)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def pick_compressor(conf):
+    """按配置选择压缩器; auto 时默认使用可随机访问的分帧格式, 关闭 backup_seekable 后优先 zstd, 其次 pigz, 最后单线程 gzip"""
+    name = conf.get('backup_compressor', 'auto')
+    if name == 'seekable' or (name == 'auto' and conf.get('backup_seekable', True)):
+        return 'seekable'
+    if name in COMPRESSORS and shutil.which(name):
+        return name
+    for cand in ('zstd', 'pigz', 'gzip'):
+        if shutil.which(cand):
+            return cand
+    return 'gzip'
+
+def _compressor_cmd(name, conf):
+    tmpl, ext, default_level = COMPRESSORS[name]
+    level = int(conf.get('backup_level', default_level))
+    threads = int(conf.get('backup_threads', 0))
+    if name == 'seekable':
+        # 不是命令行, 而是 seekable.frames 的参数
+        return {'level': max(1, min(level, 9)), 'workers': threads if threads > 0 else None,
+                'frame_size': int(conf.get('backup_frame_mb', 4)) * 1024 * 1024}, ext
+    if name == 'pigz' and threads <= 0:
+        threads = os.cpu_count() or 1
+    level = max(1, min(level, 19 if name == 'zstd' else 9))
+    return [a.format(level=level, threads=threads) for a in tmpl], ext
+
+def _fmt_speed(nbytes, secs):
+    return f"{nbytes / 1024**2 / max(secs, 0.001):.1f} MB/s"
+
+# ==================== 增量清单 ====================
+# 清单记录某一时刻的完整文件集合: {路径: [size, mtime_ns, inode, blake2b]}
+# 全量归档包含全部文件, 增量归档只包含相对上一份清单变化的文件, 并记录被删除的路径;
+# 还原时按 base -> 增量1 -> 增量2 ... 依次解包并执行删除, 得到任意时间点的完整状态
+
+def manifest_path(archive):
+    return archive + MANIFEST_SUFFIX
+
+def load_manifest(archive):
+    try:
+        with gzip.open(manifest_path(archive), 'rt', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+def _save_manifest(archive, data):
+    tmp = manifest_path(archive) + ".part"
+    with gzip.open(tmp, 'wt', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp, manifest_path(archive))
+
+def _file_hash(path):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _excluded(path, patterns):
+    """近似 tar --exclude: 匹配完整路径或任一路径片段"""
+    name = os.path.basename(path)
+    return any(fnmatch.fnmatch(path, p) or fnmatch.fnmatch(name, p) for p in patterns)
+
+def iter_source_files(paths, excludes):
+    """遍历备份路径下的普通文件与符号链接 (应用排除规则, 不跟随目录链接)"""
+    for root_path in paths:
+        if _excluded(root_path, excludes):
+            continue
+        if not os.path.isdir(root_path) or os.path.islink(root_path):
+            yield root_path
+            continue
+        for root, dirs, names in os.walk(root_path):
+            dirs[:] = [d for d in dirs if not _excluded(os.path.join(root, d), excludes)]
+            for d in dirs:
+                # 目录符号链接不展开, 作为链接本身记录
+                if os.path.islink(os.path.join(root, d)):
+                    yield os.path.join(root, d)
+            for n in names:
+                p = os.path.join(root, n)
+                if not _excluded(p, excludes):
+                    yield p
+
+def scan_sources(paths, excludes, prev_files=None):
+    """
+    遍历备份路径, 生成当前清单
+    size/mtime/inode 与上次一致的文件直接沿用旧哈希, 只对变化的文件读盘计算
+    返回: (files, 读盘哈希的文件数)
+    """
+    prev_files = prev_files or {}
+    files, hashed = {}, 0
+    for p in iter_source_files(paths, excludes):
+        try:
+            st = os.lstat(p)
+        except OSError:
+            continue
+        if os.path.islink(p):
+            digest = "link:" + os.readlink(p)
+        elif not os.path.isfile(p):
+            continue
+        else:
+            old = prev_files.get(p)
+            if old and old[:3] == [st.st_size, st.st_mtime_ns, st.st_ino]:
+                digest = old[3]
+            else:
+                try:
+                    digest = _file_hash(p)
+                    hashed += 1
+                except OSError:
+                    continue
+        files[p] = [st.st_size, st.st_mtime_ns, st.st_ino, digest]
+    return files, hashed
+
+def diff_manifest(prev_files, files):
+    """对比两份清单: 返回 (变化的文件, 被删除的文件); 仅 mtime 变化而内容相同的文件不计入"""
+    changed = [p for p, v in files.items() if p not in prev_files or prev_files[p][3] != v[3]]
+    deleted = [p for p in prev_files if p not in files]
+    return sorted(changed), sorted(deleted)
+
+def _latest_manifest():
+    """最近一份带清单的归档: (路径, 清单) 或 (None, None)"""
+    for f in list_backup_files():
+        m = load_manifest(f)
+        if m:
+            return f, m
+    return None, None
+
+def _plan_backup(conf, valid):
+    """决定本次做全量还是增量: 返回 (kind, 上一份归档, 上一份清单)"""
+    if conf.get('backup_mode', 'full') != 'incremental':
+        return 'full', None, None
+    prev_path, prev = _latest_manifest()
+    if not prev or sorted(prev.get('sources', [])) != sorted(valid):
+        return 'full', None, None
+    # 链上任一归档丢失则无法还原, 重新做全量
+    folder = os.path.dirname(prev_path)
+    if not all(os.path.exists(os.path.join(folder, n)) for n in prev.get('chain', [])):
+        return 'full', None, None
+    if len(prev.get('chain', [])) >= max(1, int(conf.get('backup_full_every', 7))):
+        return 'full', None, None
+    return 'incr', prev_path, prev
+
+def get_chain(archive):
+    """还原某个归档所需的完整链 (base 在前)"""
+    m = load_manifest(archive)
+    if not m:
+        return [archive]
+    folder = os.path.dirname(archive)
+    return [os.path.join(folder, n) for n in m.get('chain', [os.path.basename(archive)])]
+
+def _split_output(chunks, out, volume_size, part_path, on_volume, sinks=()):
+    """
+    把压缩输出 (字节块迭代器) 写入归档并计算整体 SHA-256 (返回值), 同时可边写边切卷:
+    每写满 volume_size 字节回调一次 on_volume (卷的偏移/大小/SHA-256)
+    归档小于一卷时不回调; 超过一卷时最后的不满卷在结束时回调并带上整体 SHA-256
+    sinks: 远程目标 (见 modules/destinations.py), 每块写盘后同时分发给它们
+    """
+    if not on_volume or volume_size <= 0:
+        on_volume, volume_size = None, float('inf')
+    whole, vol = hashlib.sha256(), hashlib.sha256()
+    written, vol_start, idx = 0, 0, 1
+    for chunk in chunks:
+        while chunk:
+            # 一个块可能跨越卷边界: 按当前卷剩余容量切开
+            take = int(min(len(chunk), volume_size - (written - vol_start)))
+            buf, chunk = chunk[:take], chunk[take:]
+            out.write(buf)
+            for s in sinks:
+                s.write(buf)
+            whole.update(buf)
+            if on_volume:
+                vol.update(buf)
+            written += len(buf)
+            if written - vol_start == volume_size:
+                out.flush()  # 回调方会按偏移读取已写入的数据
+                on_volume({'path': part_path, 'index': idx, 'offset': vol_start, 'size': volume_size,
+                           'sha256': vol.hexdigest(), 'last': False})
+                idx, vol_start, vol = idx + 1, written, hashlib.sha256()
+    out.flush()
+    if idx > 1:
+        on_volume({'path': part_path, 'index': idx, 'offset': vol_start, 'size': written - vol_start,
+                   'sha256': vol.hexdigest(), 'last': True, 'total': written, 'archive_sha256': whole.hexdigest()})
+    return whole.hexdigest()
+
+def _comp_threads(comp):
+    """外部压缩器的线程数 (isolation 的 CPU 上限按此放大); gzip 为单线程"""
+    if comp == 'gzip':
+        return 1
+    return int(load_config().get('backup_threads', 0)) or os.cpu_count() or 1
+
+def _run_pipeline(tar_cmd, comp, comp_cmd, part_path, timeout, on_volume=None, volume_size=0, index=None, sinks=()):
+    """
+    tar | 压缩器 -> part_path, 返回 (tar 退出码, tar stderr, 耗时, SHA-256)
+    压缩输出经 Python 写盘 (顺带计算校验和); 传入 on_volume 时同时切卷, 每卷产生即可开始上传
+    comp 为 seekable 时不启动外部压缩器: 进程内分帧压缩, 帧与成员偏移写入 index (见 modules/seekable.py)
+    """
+    start = time.time()
+    tar = comp_proc = None
+    timer = chunks = None
+    try:
+        # tar 的 stderr 写入匿名临时文件: 大量告警不会因管道写满而卡住整条流水线
+        with open(part_path, 'wb') as out, tempfile.TemporaryFile() as tar_log:
+            # tar 与外部压缩器按 isolation 配置限制 CPU / IO, 不与业务进程争抢资源
+            tar = subprocess.Popen(isolation.wrap(tar_cmd)[0], stdout=subprocess.PIPE, stderr=tar_log, start_new_session=True)
+            with tempfile.TemporaryFile() as comp_log:
+                if comp == 'seekable':
+                    chunks = seekable.frames(tar.stdout, index, **comp_cmd)
+                else:
+                    comp_proc = subprocess.Popen(isolation.wrap(comp_cmd, threads=_comp_threads(comp))[0], stdin=tar.stdout, stdout=subprocess.PIPE, stderr=comp_log, start_new_session=True)
+                    tar.stdout.close()  # 压缩器提前退出时 tar 能收到 SIGPIPE
+                    chunks = iter(lambda: comp_proc.stdout.read(HASH_CHUNK), b"")
+                jobs.track(tar, comp_proc)  # 作为后台任务运行时, 取消即结束流水线
+                # 读取循环没有超时参数, 由定时器在超时后结束整条流水线
+                timer = threading.Timer(timeout, lambda: [p.kill() for p in (tar, comp_proc) if p and p.poll() is None])
+                timer.start()
+                try:
+                    checksum = _split_output(chunks, out, volume_size, part_path, on_volume, sinks)
+                except Exception:
+                    # 分帧模式下 tar 被超时结束会表现为 tar 流截断
+                    if comp == 'seekable' and not timer.is_alive():
+                        raise subprocess.TimeoutExpired(comp, timeout)
+                    raise
+                if comp_proc:
+                    jobs.wait(comp_proc)
+                comp_log.seek(0)
+                comp_err = comp_log.read()
+            if not timer.is_alive():
+                raise subprocess.TimeoutExpired(comp, timeout)
+            jobs.wait(tar, timeout=max(1, timeout - (time.time() - start)))
+            tar_log.seek(0)
+            tar_err = tar_log.read().decode('utf-8', 'replace')
+
+        # tar 退出码 1 表示打包期间有文件变动, 归档仍可用
+        if tar.returncode not in (0, 1):
+            raise subprocess.CalledProcessError(tar.returncode, "tar", stderr=tar_err)
+        if comp_proc and comp_proc.returncode != 0:
+            raise subprocess.CalledProcessError(comp_proc.returncode, comp, stderr=comp_err.decode('utf-8', 'replace'))
+        return tar.returncode, tar_err, time.time() - start, checksum
+    finally:
+        if timer:
+            timer.cancel()
+        if hasattr(chunks, 'close'):
+            chunks.close()  # 结束分帧生成器, 让索引线程退出
+        for p in (tar, comp_proc):
+            if p and p.poll() is None:
+                p.kill()
+                p.wait()
+
+def run_backup_task(is_auto=False, on_volume=None, volume_size=0):
     """
-    执行备份任务
+    执行备份任务 (流式管道: tar | 多线程压缩 -> 备份目录)
+    归档直接写入 backup_dir, 不在 /tmp 生成中间文件; 完成后原子改名
+    backup_mode=incremental 时只打包相对上次清单变化的文件, 每 backup_full_every 次做一次全量
+    on_volume: 可选, 归档超过 volume_size 时边生成边回调各分卷 (见 modules/volumes.py)
     返回: (文件路径, 消息) 或 (None, 错误消息)
     """
     conf = load_config()
+    if conf.get('backup_mode', 'full') == 'repo':
+        # 仓库模式没有单个归档文件可发送, 只返回结果说明
+        import modules.backup_repo as repo_mgr
+        return None, repo_mgr.run_repo_backup(is_auto)[1]
     ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-    tar_path = f"/tmp/backup_{conf['server_remark']}_{ts}.tar.gz"
-    
-    # 构建排除规则
-    cmd = ["tar", "-czf", tar_path]
-    for exc in conf['backup_exclude']:
-        cmd.append(f"--exclude={exc}")
     
     # 验证备份路径
-    valid = [p for p in conf['backup_paths'] if os.path.exists(p)]
+    valid = [p for p in conf.get('backup_paths', []) if os.path.exists(p)]
     if not valid:
         return None, "⚠️ 无有效备份路径\n\n💡 请先在备份菜单中添加要备份的目录"
     
-    cmd.extend(valid)
+    comp = pick_compressor(conf)
+    comp_cmd, ext = _compressor_cmd(comp, conf)
+    excludes = conf.get('backup_exclude', [])
+    timeout = int(conf.get('backup_timeout', 3600))
+    list_file = None
     
     try:
-        # 执行备份 (5分钟超时)
-        result = subprocess.run(
-            cmd,
-            check=True,
-            timeout=300,
-            capture_output=True,
-            text=True
-        )
+        kind, prev_path, prev = _plan_backup(conf, valid)
+        scan_start = time.time()
+        files, hashed = scan_sources(valid, excludes, (prev or {}).get('files'))
+        scan_secs = time.time() - scan_start
         
-        # 验证文件是否生成
-        if not os.path.exists(tar_path):
-            return None, "❌ 备份文件未生成"
+        suffix = "_inc" if kind == 'incr' else ""
+        out_path = os.path.join(get_backup_dir(), f"backup_{conf.get('server_remark', 'vps')}_{ts}{suffix}{ext}")
+        part_path = out_path + ".part"
         
-        file_size = os.path.getsize(tar_path)
+        # 构建排除规则 (--totals 让 tar 在 stderr 报告写出的原始字节数)
+        tar_cmd = ["tar", "-cf", "-", "--totals"]
+        for exc in excludes:
+            tar_cmd.append(f"--exclude={exc}")
         
-        # 检查文件大小
-        if file_size == 0:
-            os.remove(tar_path)
-            return None, "❌ 备份文件为空，可能没有权限访问某些目录"
+        if kind == 'incr':
+            changed, deleted = diff_manifest(prev['files'], files)
+            if not changed and not deleted:
+                return None, f"✅ 自上次备份以来无文件变化, 已跳过\n📂 {len(files)} 个文件 | 扫描 {scan_secs:.1f}s"
+            # 变化文件列表以 NUL 分隔传给 tar, 兼容任意文件名
+            fd, list_file = tempfile.mkstemp(prefix=".incr_", dir=get_backup_dir())
+            with os.fdopen(fd, 'wb') as lf:
+                lf.write(b"\0".join(os.fsencode(p) for p in changed) + b"\0")
+            tar_cmd += ["--no-recursion", "--null", "-T", list_file]
+            chain = prev['chain'] + [os.path.basename(out_path)]
+        else:
+            changed, deleted = sorted(files), []
+            tar_cmd.extend(valid)
+            chain = [os.path.basename(out_path)]
+        
+        # 远程目标与本地归档同时写入 (各目标独立线程并行上传)
+        sinks = destinations.open_sinks(os.path.basename(out_path), conf)
+        remote = None
+        try:
+            if on_volume:
+                on_volume({'archive': out_path})
+            index = {} if comp == 'seekable' else None
+            tar_rc, tar_err, elapsed, checksum = _run_pipeline(tar_cmd, comp, comp_cmd, part_path, timeout,
+                                                     on_volume, volume_size, index, sinks)
+            file_size = os.path.getsize(part_path)
+            
+            # 检查文件大小
+            if file_size == 0:
+                return None, "❌ 备份文件为空，可能没有权限访问某些目录"
+            
+            # 先写清单再改名: 列表中可见的归档一定带有清单
+            _save_manifest(out_path, {
+                'version': 1, 'kind': kind, 'created': time.time(), 'sources': sorted(valid),
+                'chain': chain, 'parent': os.path.basename(prev_path) if prev_path else None,
+                'changed': len(changed), 'deleted': deleted, 'files': files,
+            })
+            if index is not None:
+                seekable.save_index(out_path, index)
+            os.replace(part_path, out_path)
+            remote = []
+        finally:
+            if sinks and remote is None:
+                destinations.close_sinks(sinks, ok=False)
+            if os.path.exists(part_path):
+                os.remove(part_path)
+        
+        m = re.search(r'Total bytes written: (\d+)', tar_err)
+        raw_size = int(m.group(1)) if m else file_size
         
         # 记录日志
-        prefix = "⏰ 定时备份" if is_auto else "📦 手动备份"
-        log_audit("SYS" if is_auto else "USER", "备份成功", f"文件: {tar_path}")
+        log_audit("SYS" if is_auto else "USER", "备份成功", f"文件: {out_path}")
+        try:
+            catalog.record_backup(os.path.basename(out_path), kind, path=out_path, size=file_size, raw_size=raw_size,
+                                  duration=round(elapsed, 2), checksum=checksum, compressor=comp, sources=valid,
+                                  chain=chain, files={p: files[p][0] for p in changed})
+        except Exception as e:
+            print(f"⚠️ 备份目录记录失败: {e}")
+        if sinks:
+            jobs.report("☁️ 等待远程目标上传完成...")
+            remote = destinations.close_sinks(sinks, sidecars=(manifest_path(out_path), seekable.index_path(out_path)))
+        # 打包时已经读过这些目录, 顺带刷新体积缓存
+        import modules.size_cache as size_cache
+        size_cache.invalidate(*valid)
+        clean_old_backups(conf.get('backup_keep', 5))
         
         # 构建成功消息
+        if kind == 'incr':
+            scope = (f"🧩 增量: <code>{len(changed)}</code> 个变化 / <code>{len(deleted)}</code> 个删除 "
+                     f"(共 {len(files)} 个文件, 链长 {len(chain)})\n")
+        else:
+            scope = f"📂 全量: {len(valid)} 个目录, {len(files)} 个文件\n"
         msg = (f"✅ <b>备份完成</b>\n\n"
-               f"📦 文件: <code>{os.path.basename(tar_path)}</code>\n"
-               f"📊 大小: <code>{file_size / 1024**2:.2f} MB</code>\n"
-               f"📂 包含: {len(valid)} 个目录\n"
+               f"📦 文件: <code>{os.path.basename(out_path)}</code>\n"
+               f"📊 大小: <code>{file_size / 1024**2:.2f} MB</code> (原始 {raw_size / 1024**2:.1f} MB, 压缩率 {file_size / max(raw_size, 1) * 100:.0f}%)\n"
+               f"⚡ 吞吐: <code>{_fmt_speed(raw_size, elapsed)}</code> | 耗时 {elapsed:.1f}s | {comp}\n"
+               f"{scope}"
+               f"🔍 扫描: {scan_secs:.1f}s (重新计算哈希 {hashed} 个)\n"
                f"⏰ 时间: <code>{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</code>")
+        if tar_rc == 1:
+            msg += "\n⚠️ 部分文件在打包期间发生变化"
+        if remote:
+            msg += "\n\n☁️ <b>远程目标</b>\n" + "\n".join(remote)
         
-        return tar_path, msg
+        return out_path, msg
         
     except subprocess.TimeoutExpired:
-        return None, "❌ 备份超时 (超过5分钟)\n\n💡 文件可能过大，建议减少备份内容"
+        return None, f"❌ 备份超时 (超过 {timeout // 60} 分钟)\n\n💡 可调大 backup_timeout 或减少备份内容"
     
     except subprocess.CalledProcessError as e:
         error_msg = e.stderr if e.stderr else str(e)
-        return None, f"❌ 备份失败\n\n<pre>\n{error_msg[:200]}\n</pre>"
+        return None, f"❌ 备份失败\n\n<pre>\n{html.escape(str(error_msg)[:200])}\n</pre>"
     
     except Exception as e:
         return None, f"❌ 备份异常: {str(e)}"
+    
+    finally:
+        if list_file and os.path.exists(list_file):
+            os.remove(list_file)
+
+def _decompress_cmd(archive):
+    if archive.endswith(".zst"):
+        return "zstd -dc"
+    return "pigz -dc" if shutil.which("pigz") else "gzip -dc"
+
+def restore_backup(name, target=None):
+    """
+    还原到某个归档的时间点: 依次解包 base 与各增量, 并删除增量中记录为已删除的文件
+    输出到 target (默认 RESTORE_DIR/<归档名>), 不覆盖线上目录
+    返回: (目标目录, 消息) 或 (None, 错误消息)
+    """
+    archive = resolve_backup_file(name)
+    if not archive:
+        return None, "❌ 归档不存在"
+    chain = get_chain(archive)
+    missing = [os.path.basename(p) for p in chain if not os.path.exists(p)]
+    if missing:
+        return None, f"❌ 还原链不完整, 缺少:\n<code>{html.escape(', '.join(missing))}</code>"
+    
+    target = target or os.path.join(RESTORE_DIR, re.sub(r'\.tar\.(zst|gz)$', '', name))
+    os.makedirs(target, exist_ok=True)
+    start = time.time()
+    removed = 0
+    try:
+        for member in chain:
+            subprocess.run(isolation.wrap(["tar", "-I", _decompress_cmd(member), "-xf", member, "-C", target],
+                                          threads=os.cpu_count() or 1)[0],
+                           check=True, capture_output=True, timeout=int(load_config().get('backup_timeout', 3600)))
+            m = load_manifest(member) or {}
+            for p in m.get('deleted', []):
+                dest = os.path.join(target, p.lstrip('/'))
+                if os.path.lexists(dest) and not os.path.isdir(dest):
+                    os.remove(dest)
+                    removed += 1
+    except subprocess.CalledProcessError as e:
+        err = e.stderr.decode('utf-8', 'replace') if e.stderr else str(e)
+        return None, f"❌ 还原失败 ({os.path.basename(member)})\n<pre>{html.escape(err[:200])}</pre>"
+    except Exception as e:
+        return None, f"❌ 还原异常: {str(e)}"
+    
+    log_audit("USER", "备份还原", f"{name} -> {target}")
+    return target, (f"♻️ <b>还原完成</b>\n\n"
+                    f"📦 时间点: <code>{name}</code>\n"
+                    f"🔗 链: {len(chain)} 个归档 (1 全量 + {len(chain) - 1} 增量)\n"
+                    f"🗑️ 回放删除: {removed} 个文件\n"
+                    f"📂 输出: <code>{target}</code>\n"
+                    f"⏱️ 耗时: {time.time() - start:.1f}s")
+
+def _fmt_bytes(n):
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024 or unit == "GB":
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+
+def list_archive(name, prefix=""):
+    """
+    浏览归档内容 (只读清单 / 索引, 不解压): 显示该时间点 prefix 下一级的目录与文件
+    返回: (条目列表, 消息) 或 (None, 错误消息)
+    """
+    archive = resolve_backup_file(name)
+    if not archive:
+        return None, "❌ 归档不存在"
+    # 清单记录的是该时间点的完整文件集合 (增量归档也一样); 没有清单时退回到帧索引中的成员
+    m = load_manifest(archive)
+    if m:
+        contents = {'members': [[p.lstrip('/'), 0, 0, v[0], '0', None] for p, v in m['files'].items()]}
+    else:
+        contents = seekable.load_index(archive)
+    if not contents:
+        return None, "⚠️ 该归档没有清单或索引 (旧版本生成), 只能整包还原"
+    entries = seekable.list_dir(contents, prefix)
+    shown = "/" + prefix.strip('/')
+    lines = [f"🗂️ <b>{html.escape(name)}</b>", f"📂 <code>{html.escape(shown)}</code> | {len(entries)} 项", "━━━━━━━━━━━━━━━"]
+    for ent, is_dir, size, count in entries[:40]:
+        if is_dir:
+            lines.append(f"📁 <code>{html.escape(ent)}/</code> | {count} 个文件, {_fmt_bytes(size)}")
+        else:
+            lines.append(f"📄 <code>{html.escape(ent)}</code> | {_fmt_bytes(size)}")
+    if len(entries) > 40:
+        lines.append(f"... 另有 {len(entries) - 40} 项")
+    if not entries:
+        lines.append("(空)")
+    return entries, "\n".join(lines)
+
+def restore_paths(name, paths, target=None):
+    """
+    选择性还原: 只取回指定文件或子目录, 按 全量 → 增量 回放到该归档的时间点
+    分帧归档按索引只解压覆盖这些成员的帧; 旧格式归档由 tar 按成员名筛选 (需整包解压)
+    返回: (目标目录, 消息) 或 (None, 错误消息)
+    """
+    archive = resolve_backup_file(name)
+    if not archive:
+        return None, "❌ 归档不存在"
+    wanted = [p.strip('/') for p in paths if p.strip('/')]
+    if not wanted:
+        return None, "⚠️ 请指定要还原的文件或目录"
+    chain = get_chain(archive)
+    missing = [os.path.basename(p) for p in chain if not os.path.exists(p)]
+    if missing:
+        return None, f"❌ 还原链不完整, 缺少:\n<code>{html.escape(', '.join(missing))}</code>"
+    
+    target = target or os.path.join(RESTORE_DIR, re.sub(r'\.tar\.(zst|gz)$', '', name))
+    os.makedirs(target, exist_ok=True)
+    timeout = int(load_config().get('backup_timeout', 3600))
+    start = time.time()
+    picked = removed = used = total = 0
+    scanned = []
+    try:
+        for member in chain:
+            jobs.report(f"📦 {os.path.basename(member)} ({chain.index(member) + 1}/{len(chain)})")
+            index = seekable.load_index(member)
+            if index:
+                sel = seekable.select(index, wanted)
+                if sel:
+                    u, t = seekable.extract(member, index, sel, target, timeout)
+                    picked, used, total = picked + len(sel), used + u, total + t
+            else:
+                r = jobs.run(["tar", "-I", _decompress_cmd(member), "-xf", member, "-C", target, "--"] + wanted,
+                             timeout=timeout, shell=False)
+                out = r.stdout.decode('utf-8', 'replace')
+                # 增量归档中没有这些路径属于正常情况
+                if r.returncode != 0 and "Not found in archive" not in out:
+                    raise subprocess.CalledProcessError(r.returncode, "tar", stderr=out)
+                scanned.append(os.path.basename(member))
+            m = load_manifest(member) or {}
+            for p in m.get('deleted', []):
+                rel = p.lstrip('/')
+                if not any(rel == w or rel.startswith(w + '/') for w in wanted):
+                    continue
+                dest = os.path.join(target, rel)
+                if os.path.lexists(dest) and not os.path.isdir(dest):
+                    os.remove(dest)
+                    removed += 1
+    except jobs.Cancelled:
+        raise
+    except subprocess.CalledProcessError as e:
+        err = e.stderr.decode('utf-8', 'replace') if isinstance(e.stderr, bytes) else str(e.stderr or e)
+        return None, f"❌ 还原失败 ({os.path.basename(member)})\n<pre>{html.escape(err[:200])}</pre>"
+    except Exception as e:
+        return None, f"❌ 还原异常: {html.escape(str(e))}"
+    
+    if not picked and not scanned:
+        return None, f"⚠️ 归档中没有 <code>{html.escape(', '.join('/' + w for w in wanted))}</code>"
+    log_audit("USER", "选择性还原", f"{name}:{','.join(wanted)} -> {target}")
+    msg = (f"♻️ <b>选择性还原完成</b>\n\n"
+           f"📦 时间点: <code>{html.escape(name)}</code>\n"
+           f"🎯 路径: <code>{html.escape(', '.join('/' + w for w in wanted))}</code>\n")
+    if total:
+        msg += f"🧩 成员: {picked} 个 | 解压帧: {used}/{total}\n"
+    if scanned:
+        msg += f"⚠️ 旧格式归档整包扫描: {len(scanned)} 个\n"
+    msg += (f"🗑️ 回放删除: {removed} 个文件\n"
+            f"📂 输出: <code>{html.escape(target)}</code>\n"
+            f"⏱️ 耗时: {time.time() - start:.1f}s")
+    return target, msg
+
+def list_backup_files():
+    """备份目录 (及旧版 /tmp) 中的归档, 按时间倒序"""
+    files = []
+    for d in {get_backup_dir(), LEGACY_DIR}:
+        for pat in BACKUP_PATTERNS:
+            files.extend(glob.glob(os.path.join(d, pat)))
+    files.sort(key=os.path.getmtime, reverse=True)
+    return files
+
+def resolve_backup_file(name):
+    """按文件名查找备份 (只接受纯文件名, 防止路径穿越)"""
+    if os.path.basename(name) != name:
+        return None
+    row = catalog.get_backup(name)
+    if row and row['status'] == 'ok' and row['path'] and os.path.exists(row['path']):
+        return row['path']
+    for f in list_backup_files():
+        if os.path.basename(f) == name:
+            return f
+    return None
 
 def get_backup_menu():
     """构建备份菜单 (交互升级版)"""
@@ -99,38 +622,51 @@ def get_backup_menu():
     auto = conf.get("auto_backup", {})
     mode = auto.get("mode", "off")
     sch = f"📅 每日 {auto.get('time', '03:00')}" if mode == "daily" else "🚫 已禁用"
+    bk_mode = {'incremental': f"🧩 增量 (每 {conf.get('backup_full_every', 7)} 次全量)",
+               'repo': "🗃️ 去重仓库"}.get(conf.get('backup_mode', 'full'), "📦 全量")
 
     txt = (f"☁️ <b>备份资产管理</b>\n"
            f"━━━━━━━━━━━━━━━\n"
            f"📂 <b>备份清单</b> (✅=正常 ❌=失效):\n{paths_display}\n\n"
            f"⏰ <b>自动计划</b>: {sch}\n"
+           f"🔁 <b>备份模式</b>: {bk_mode}\n"
            f"📦 <b>预计体积</b>: <code>{get_backup_size_estimate()}</code>")
     
     kb.append([InlineKeyboardButton("📤 立即上传文件", callback_data="tool_upload_start"),
                InlineKeyboardButton("📥 设定上传目录", callback_data="tool_set_upload")])
     kb.append([InlineKeyboardButton("➕ 新增备份路径", callback_data="bk_add"),
                InlineKeyboardButton("📜 历史文件", callback_data="bk_history")])
-    kb.append([InlineKeyboardButton("⏰ 自动备份设置", callback_data="bk_auto_set")])
+    kb.append([InlineKeyboardButton("⏰ 自动备份设置", callback_data="bk_auto_set"),
+               InlineKeyboardButton("🔁 切换模式", callback_data="bk_mode")])
+    kb.append([InlineKeyboardButton("🐳 Docker 卷 / 容器备份", callback_data="dkb_m")])
+    kb.append([InlineKeyboardButton("☁️ 远程目标", callback_data="dest_m")])
     kb.append([InlineKeyboardButton("🔙 返回主菜单", callback_data="back")])
     
     return txt, InlineKeyboardMarkup(kb)
 
 def build_history_menu():
     """构建历史备份记录菜单"""
-    files = glob.glob("/tmp/backup_*.tar.gz")
-    files.sort(key=os.path.getmtime, reverse=True)
+    if load_config().get('backup_mode', 'full') == 'repo':
+        import modules.backup_repo as repo_mgr
+        return repo_mgr.build_snapshot_menu()
+    rows = catalog.list_backups(limit=8)
     
-    txt = "📜 <b>历史备份文件 (临时存放)</b>\n━━━━━━━━━━━━━━━\n"
+    txt = f"📜 <b>历史备份文件</b>\n📂 <code>{get_backup_dir()}</code>\n━━━━━━━━━━━━━━━\n"
     kb = []
     
-    if not files:
+    if not rows:
         txt += "📭 暂无备份文件。"
     else:
-        for f in files[:8]:
-            name = os.path.basename(f)
-            size = os.path.getsize(f) / 1024**2
-            txt += f"▫️ <code>{name}</code> ({size:.1f}MB)\n"
-            kb.append([InlineKeyboardButton(f"📤 发送 {name[:20]}", callback_data=f"bk_send_{name}")])
+        for r in rows:
+            name = r['name']
+            tag = {'incr': f" 🧩增量 #{len(json.loads(r['chain'] or '[]')) - 1}", 'full': " 📦全量"}.get(r['kind'], "")
+            dests = f" | 📮 {len(r['dests'].split(','))}" if r['dests'] else ""
+            when = datetime.fromtimestamp(r['created']).strftime('%m-%d %H:%M')
+            took = f" | ⏱️ {r['duration']:.0f}s" if r['duration'] is not None else ""
+            txt += (f"▫️ <code>{name}</code>{tag}\n"
+                    f"   {(r['size'] or 0) / 1024**2:.1f}MB | ⏰ {when}{took}{dests}\n")
+            kb.append([InlineKeyboardButton(f"📤 发送 {name[:20]}", callback_data=f"bk_send_{name}"),
+                       InlineKeyboardButton("♻️ 还原", callback_data=f"bk_restore_{name}")])
     
     kb.append([InlineKeyboardButton("🔙 返回", callback_data="bk_menu")])
     return txt, InlineKeyboardMarkup(kb)
@@ -160,6 +696,8 @@ def add_backup_path(path):
     # 添加到列表
     conf['backup_paths'].append(path)
     save_config(conf)
+    import modules.size_cache as size_cache
+    size_cache.refresh([path])
     
     return f"✅ <b>路径已添加</b>\n\n📂 <code>{path}</code>"
 
@@ -194,65 +732,91 @@ def remove_backup_path(index_or_path):
     else:
         return f"❌ 未找到路径: <code>{index_or_path}</code>"
 
+def toggle_backup_mode():
+    """按 全量 -> 增量 -> 去重仓库 循环切换, 返回新模式"""
+    conf = load_config()
+    modes = ['full', 'incremental', 'repo']
+    cur = conf.get('backup_mode', 'full')
+    conf['backup_mode'] = modes[(modes.index(cur) + 1) % len(modes)] if cur in modes else 'full'
+    save_config(conf)
+    return conf['backup_mode']
+
 def get_backup_size_estimate():
     """
     估算备份大小 (用于显示)
+    只读后台统计的缓存, 不阻塞菜单渲染 (见 modules/size_cache.py)
     """
-    conf = load_config()
-    total_size = 0
+    import modules.size_cache as size_cache
+    total_size, done, count, oldest, busy = size_cache.estimate()
     
-    for path in conf.get('backup_paths', []):
-        if not os.path.exists(path):
-            continue
-        
-        try:
-            # 使用 du 命令估算大小
-            result = subprocess.run(
-                ['du', '-sb', path],
-                capture_output=True,
-                text=True,
-                timeout=5
-            )
-            if result.returncode == 0:
-                size = int(result.stdout.split()[0])
-                total_size += size
-        except:
-            continue
+    if count == 0:
+        return "未知"
+    if done == 0:
+        return "⏳ 统计中..."
     
     # 转换为人类可读格式
-    if total_size == 0:
-        return "未知"
-    elif total_size < 1024**2:
-        return f"{total_size / 1024:.1f} KB"
+    if total_size < 1024**2:
+        text = f"{total_size / 1024:.1f} KB"
     elif total_size < 1024**3:
-        return f"{total_size / 1024**2:.1f} MB"
+        text = f"{total_size / 1024**2:.1f} MB"
     else:
-        return f"{total_size / 1024**3:.2f} GB"
+        text = f"{total_size / 1024**3:.2f} GB"
+    
+    age = int(time.time() - oldest)
+    text += f" ({age // 60} 分钟前)" if age >= 60 else " (刚刚)"
+    if done < count:
+        text += f" ({done}/{count} 个路径)"
+    elif busy:
+        text += " 🔄"
+    return text
+
+def sync_catalog():
+    """
+    目录库与磁盘对账: 已不存在的归档标记为删除, 目录库中没有的归档 (旧版本生成) 按清单补录
+    """
+    known = catalog.known_backups()
+    on_disk = {os.path.basename(f): f for f in list_backup_files()}
+    catalog.mark_deleted([n for n, st in known.items() if st == 'ok' and n not in on_disk])
+    for name, f in on_disk.items():
+        if name in known:
+            continue
+        try:
+            st = os.stat(f)
+            m = load_manifest(f) or {}
+            catalog.record_backup(name, m.get('kind', 'full'), path=f, created=m.get('created', st.st_mtime),
+                                  size=st.st_size, sources=m.get('sources', []), chain=m.get('chain'),
+                                  files={p: v[0] for p, v in m.get('files', {}).items()} if m.get('kind') == 'full' else None)
+        except Exception as e:
+            print(f"⚠️ 补录备份失败 {name}: {e}")
 
 def clean_old_backups(keep_count=5):
     """
     清理旧备份文件
-    保留最新的 N 个
+    按保留策略 (最近 N 个 + 每日/每周/每月) 由目录库一次查询得出删除列表;
+    被保留的增量所依赖的全量/增量归档一并保留
     """
     try:
-        backup_files = glob.glob("/tmp/backup_*.tar.gz")
+        sync_catalog()
+        policy = catalog.get_retention()
+        policy['last'] = keep_count
+        keep, drop = catalog.retention_plan(**policy)
         
-        if len(backup_files) <= keep_count:
-            return f"✅ 当前有 {len(backup_files)} 个备份文件，无需清理"
-        
-        # 按修改时间排序
-        backup_files.sort(key=os.path.getmtime, reverse=True)
+        if not drop:
+            return f"✅ 当前有 {len(keep)} 个备份文件，无需清理"
         
         # 删除多余的
-        deleted = 0
-        for old_file in backup_files[keep_count:]:
+        deleted = []
+        for r in drop:
             try:
-                os.remove(old_file)
-                deleted += 1
+                for p in (r['path'], manifest_path(r['path']), seekable.index_path(r['path'])):
+                    if p and os.path.exists(p):
+                        os.remove(p)
+                deleted.append(r['name'])
             except:
                 pass
+        catalog.mark_deleted(deleted)
         
-        return f"✅ 清理完成，删除了 {deleted} 个旧备份"
+        return f"✅ 清理完成，删除了 {len(deleted)} 个旧备份 (保留 {len(keep)} 个)"
     
     except Exception as e:
         return f"❌ 清理失败: {str(e)}"
@@ -279,27 +843,24 @@ def validate_backup_paths():
 def get_backup_history():
     """
     获取备份历史记录
-    读取临时目录中的备份文件
+    读取备份目录库
     """
     try:
-        backup_files = glob.glob("/tmp/backup_*.tar.gz")
+        rows = catalog.list_backups(limit=10)
         
-        if not backup_files:
+        if not rows:
             return "📭 暂无备份历史"
         
-        # 按修改时间排序
-        backup_files.sort(key=os.path.getmtime, reverse=True)
-        
         history = []
-        for i, file_path in enumerate(backup_files[:10], 1):
-            file_name = os.path.basename(file_path)
-            file_size = os.path.getsize(file_path) / 1024**2  # MB
-            mod_time = datetime.fromtimestamp(os.path.getmtime(file_path))
+        for i, r in enumerate(rows, 1):
+            mod_time = datetime.fromtimestamp(r['created'])
+            checksum = f" | 🔐 {r['checksum'][:8]}" if r['checksum'] else ""
+            dests = f"\n    📮 {r['dests']}" if r['dests'] else ""
             
             history.append(
-                f"<code>{i}.</code> {file_name}\n"
-                f"    📊 {file_size:.2f} MB | "
-                f"⏰ {mod_time.strftime('%m-%d %H:%M')}"
+                f"<code>{i}.</code> {r['name']}\n"
+                f"    📊 {(r['size'] or 0) / 1024**2:.2f} MB | "
+                f"⏰ {mod_time.strftime('%m-%d %H:%M')}{checksum}{dests}"
             )
         
         return "📜 <b>备份历史</b> (最近10次):\n\n" + "\n\n".join(history)
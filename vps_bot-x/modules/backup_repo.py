@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+# modules/backup_repo.py - 去重备份仓库 (内容定义分块)
+# 文件按内容定义的切点切成变长块, 以 SHA-256 摘要寻址, 压缩后追加写入 pack 文件;
+# 相同内容的块 (跨路径 / 跨快照) 只存一份, 快照只记录每个文件的块列表
+#
+# 仓库结构:
+#   packs/<id>.pack        压缩块顺序拼接
+#   index/<id>.idx         该 pack 的索引 {摘要: [偏移, 压缩长度, 原始长度]}
+#   snapshots/<id>.json.gz 快照: 来源路径 + 每个文件的元数据与块列表
+import os, re, json, gzip, time, zlib, html, uuid, hashlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from config import load_config
+from utils import log_audit
+import modules.backup as bk_mgr
+import modules.catalog as catalog
+import modules.isolation as isolation
+
+REPO_DIR = "/var/lib/vps_bot/repo"
+MIN_CHUNK = 256 * 1024              # 最小块 (之前不检查切点)
+MAX_CHUNK = 4 * 1024 * 1024         # 最大块 (强制切分)
+AVG_BITS = 20                       # 超过最小块后平均约 1MB 出现一个切点
+WINDOW = 32                         # 切点哈希覆盖的窗口 (字节)
+SEGMENT = 64 * 1024 * 1024          # 大文件按段分给不同进程, 段边界强制切块
+PACK_TARGET = 32 * 1024 * 1024      # 单个 pack 的目标大小
+ZLIB_LEVEL = 6
+
+# 候选切点: 以锚字节结尾的位置 (随机数据中约 1/64), 由正则引擎在 C 中查找, 不逐字节跑解释器循环;
+# 候选处再对最近 WINDOW 字节取 CRC32, 低位全零即切 (1/2^14), 合计约 1/2^20
+# 锚字节与掩码决定切点, 必须在不同进程 / 版本之间保持一致, 否则无法去重
+ANCHORS = b";m\x8f\xd3"
+ANCHOR_RE = re.compile(b"[" + re.escape(ANCHORS) + b"]")
+CUT_MASK = (1 << (AVG_BITS - 6)) - 1
+
+def get_repo_dir():
+    path = load_config().get('backup_repo_dir', REPO_DIR)
+    for sub in ("packs", "index", "snapshots"):
+        os.makedirs(os.path.join(path, sub), exist_ok=True)
+    return path
+
+# ==================== 分块 (在子进程中执行) ====================
+def cut_points(data):
+    """内容定义切分, 返回各块的结束偏移; 不含锚字节的数据退化为按 MAX_CHUNK 定长切分"""
+    n, cuts, start = len(data), [], 0
+    search, crc, mask = ANCHOR_RE.search, zlib.crc32, CUT_MASK
+    while start < n:
+        end = min(start + MAX_CHUNK, n)
+        pos = start + MIN_CHUNK
+        if pos >= end:
+            cuts.append(end)
+            break
+        cut = end
+        while m := search(data, pos, end):
+            pos = m.end()
+            # 切点只取决于窗口内容, 前面插入 / 删除数据后仍落在同一位置
+            if not crc(data[pos - WINDOW:pos]) & mask:
+                cut = pos
+                break
+        cuts.append(cut)
+        start = cut
+    return cuts
+
+def _process_segment(task):
+    """读取文件的一段并分块: 返回 [(摘要, 原始长度, 压缩数据)]"""
+    path, offset, length, level = task
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read(length)
+    out, prev = [], 0
+    for cut in cut_points(data):
+        chunk = data[prev:cut]
+        out.append((hashlib.sha256(chunk).hexdigest(), len(chunk), zlib.compress(chunk, level)))
+        prev = cut
+    return out
+
+# ==================== 仓库读写 ====================
+def load_index(repo):
+    """合并所有 pack 索引: {摘要: [pack, 偏移, 压缩长度, 原始长度]}"""
+    index = {}
+    idx_dir = os.path.join(repo, "index")
+    for name in os.listdir(idx_dir):
+        if not name.endswith(".idx"):
+            continue
+        pack = name[:-4]
+        try:
+            with open(os.path.join(idx_dir, name), encoding='utf-8') as f:
+                for digest, (off, clen, rlen) in json.load(f).items():
+                    index[digest] = [pack, off, clen, rlen]
+        except Exception as e:
+            print(f"⚠️ 索引损坏, 已跳过 {name}: {e}")
+    return index
+
+def _open_pack(repo):
+    pack_id = uuid.uuid4().hex[:16]
+    path = os.path.join(repo, "packs", pack_id + ".pack")
+    return {'id': pack_id, 'path': path, 'f': open(path + ".part", 'wb'), 'entries': {}, 'size': 0}
+
+def _close_pack(repo, pack):
+    """落盘顺序: pack 数据 -> 改名 -> 索引; 中途崩溃只会留下无索引的孤儿 pack"""
+    pack['f'].flush()
+    os.fsync(pack['f'].fileno())
+    pack['f'].close()
+    if not pack['entries']:
+        os.remove(pack['path'] + ".part")
+        return
+    os.replace(pack['path'] + ".part", pack['path'])
+    idx_path = os.path.join(repo, "index", pack['id'] + ".idx")
+    with open(idx_path + ".part", 'w', encoding='utf-8') as f:
+        json.dump(pack['entries'], f, separators=(',', ':'))
+    os.replace(idx_path + ".part", idx_path)
+
+def list_snapshots():
+    """仓库中的快照 (新的在前): [{id, created, files, size, ...}]"""
+    snap_dir = os.path.join(get_repo_dir(), "snapshots")
+    out = []
+    for name in sorted(os.listdir(snap_dir), reverse=True):
+        if name.endswith(".json.gz"):
+            snap = load_snapshot(name[:-8])
+            if snap:
+                snap.pop('files', None)
+                out.append(snap)
+    return out
+
+def load_snapshot(snap_id):
+    if not re.fullmatch(r'[\w-]+', snap_id or ""):
+        return None
+    try:
+        with gzip.open(os.path.join(get_repo_dir(), "snapshots", snap_id + ".json.gz"), 'rt', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+def _save_snapshot(repo, snap):
+    path = os.path.join(repo, "snapshots", snap['id'] + ".json.gz")
+    with gzip.open(path + ".part", 'wt', encoding='utf-8') as f:
+        json.dump(snap, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(path + ".part", path)
+
+def _fmt_size(n):
+    if n < 1024**2:
+        return f"{n / 1024:.1f} KB"
+    if n < 1024**3:
+        return f"{n / 1024**2:.1f} MB"
+    return f"{n / 1024**3:.2f} GB"
+
+# ==================== 备份 / 还原 / 清理 ====================
+def run_repo_backup(is_auto=False):
+    """
+    把 backup_paths 写入去重仓库, 生成一个快照
+    与上一快照 size/mtime/inode 一致的文件直接沿用块列表, 其余文件在进程池中分块、哈希、压缩
+    返回: (快照 ID, 消息) 或 (None, 错误消息)
+    """
+    conf = load_config()
+    valid = [p for p in conf.get('backup_paths', []) if os.path.exists(p)]
+    if not valid:
+        return None, "⚠️ 无有效备份路径\n\n💡 请先在备份菜单中添加要备份的目录"
+
+    start = time.time()
+    repo = get_repo_dir()
+    index = load_index(repo)
+    snaps = list_snapshots()
+    prev = load_snapshot(snaps[0]['id']) if snaps else None
+    prev_files = (prev or {}).get('files', {})
+    workers = int(conf.get('backup_workers', 0)) or os.cpu_count() or 1
+    level = int(conf.get('backup_repo_level', ZLIB_LEVEL))
+
+    files, tasks = {}, []
+    reused = 0
+    for p in bk_mgr.iter_source_files(valid, conf.get('backup_exclude', [])):
+        try:
+            st = os.lstat(p)
+        except OSError:
+            continue
+        meta = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'ino': st.st_ino, 'mode': st.st_mode & 0o7777}
+        if os.path.islink(p):
+            meta['link'] = os.readlink(p)
+            files[p] = meta
+            continue
+        if not os.path.isfile(p):
+            continue
+        old = prev_files.get(p)
+        if (old and [old['size'], old['mtime_ns'], old['ino']] == [st.st_size, st.st_mtime_ns, st.st_ino]
+                and all(d in index for d in old.get('chunks', []))):
+            meta['chunks'] = old['chunks']
+            reused += 1
+        else:
+            meta['chunks'] = []
+            for off in range(0, st.st_size, SEGMENT):
+                tasks.append((p, off, min(SEGMENT, st.st_size - off), level))
+        files[p] = meta
+
+    stats = {'raw': 0, 'new_chunks': 0, 'dup_chunks': 0, 'stored': 0}
+    pack = _open_pack(repo)
+    try:
+        # 滑动窗口提交: 按顺序消费结果, 同时在途的段不超过 workers*2, 内存占用有上限
+        with ProcessPoolExecutor(max_workers=workers, initializer=isolation.lower_thread_priority) as pool:
+            pending, it = deque(), iter(tasks)
+            for task in it:
+                pending.append((task[0], pool.submit(_process_segment, task)))
+                if len(pending) >= workers * 2:
+                    break
+            while pending:
+                path, fut = pending.popleft()
+                try:
+                    chunks = fut.result()
+                except OSError as e:
+                    # 文件在扫描后被删除/无权限: 从快照中剔除
+                    print(f"⚠️ 读取失败, 已跳过 {path}: {e}")
+                    files.pop(path, None)
+                    chunks = []
+                for digest, rlen, blob in chunks:
+                    stats['raw'] += rlen
+                    if path in files:
+                        files[path]['chunks'].append(digest)
+                    if digest in index or digest in pack['entries']:
+                        stats['dup_chunks'] += 1
+                        continue
+                    pack['f'].write(blob)
+                    pack['entries'][digest] = [pack['size'], len(blob), rlen]
+                    index[digest] = [pack['id'], pack['size'], len(blob), rlen]
+                    pack['size'] += len(blob)
+                    stats['new_chunks'] += 1
+                    stats['stored'] += len(blob)
+                    if pack['size'] >= PACK_TARGET:
+                        _close_pack(repo, pack)
+                        pack = _open_pack(repo)
+                nxt = next(it, None)
+                if nxt:
+                    pending.append((nxt[0], pool.submit(_process_segment, nxt)))
+        _close_pack(repo, pack)
+    except Exception as e:
+        try:
+            pack['f'].close()
+            os.remove(pack['path'] + ".part")
+        except OSError:
+            pass
+        return None, f"❌ 仓库备份异常: {html.escape(str(e))}"
+
+    elapsed = time.time() - start
+    total = sum(m['size'] for m in files.values() if 'link' not in m)
+    snap = {
+        'id': datetime.now().strftime("%Y%m%d_%H%M%S"), 'created': time.time(),
+        'host': conf.get('server_remark', 'vps'), 'sources': sorted(valid),
+        'file_count': len(files), 'size': total, 'added': stats['stored'],
+        'duration': round(elapsed, 2), 'files': files,
+    }
+    _save_snapshot(repo, snap)
+    log_audit("SYS" if is_auto else "USER", "仓库备份成功", f"快照: {snap['id']}")
+    try:
+        catalog.record_backup(snap['id'], 'repo', created=snap['created'], size=stats['stored'], raw_size=total,
+                              duration=snap['duration'], sources=valid,
+                              files={p: m['size'] for p, m in files.items()})
+    except Exception as e:
+        print(f"⚠️ 备份目录记录失败: {e}")
+    prune_repo(int(conf.get('backup_keep', 5)))
+
+    msg = (f"✅ <b>仓库备份完成</b>\n\n"
+           f"🗃️ 快照: <code>{snap['id']}</code>\n"
+           f"📂 文件: {len(files)} 个 | 逻辑大小 <code>{_fmt_size(total)}</code>\n"
+           f"♻️ 未变化沿用: {reused} 个文件\n"
+           f"🧱 新块: {stats['new_chunks']} | 重复块: {stats['dup_chunks']}\n"
+           f"💾 本次新增: <code>{_fmt_size(stats['stored'])}</code> (处理 {_fmt_size(stats['raw'])})\n"
+           f"⚡ 耗时 {elapsed:.1f}s | {workers} 进程 | {bk_mgr._fmt_speed(stats['raw'], elapsed)}")
+    return snap['id'], msg
+
+def restore_snapshot(snap_id, target=None):
+    """
+    把快照还原到 target (默认 RESTORE_DIR/repo_<快照ID>), 按需读取各 pack 中的块
+    返回: (目标目录, 消息) 或 (None, 错误消息)
+    """
+    snap = load_snapshot(snap_id)
+    if not snap:
+        return None, "❌ 快照不存在"
+    repo = get_repo_dir()
+    index = load_index(repo)
+    target = target or os.path.join(bk_mgr.RESTORE_DIR, f"repo_{snap_id}")
+    start, written, failed = time.time(), 0, []
+    packs = {}
+    try:
+        for path, meta in snap['files'].items():
+            dest = os.path.join(target, path.lstrip('/'))
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            if 'link' in meta:
+                if os.path.lexists(dest):
+                    os.remove(dest)
+                os.symlink(meta['link'], dest)
+                continue
+            # 缺块的文件整体放弃: 跳过块会让后续内容错位, 不能留下看似完整的文件
+            if any(digest not in index for digest in meta['chunks']):
+                failed.append(path)
+                if os.path.lexists(dest):
+                    os.remove(dest)
+                continue
+            with open(dest, 'wb') as out:
+                for digest in meta['chunks']:
+                    loc = index[digest]
+                    pack_id, off, clen, _ = loc
+                    f = packs.get(pack_id)
+                    if f is None:
+                        f = packs[pack_id] = open(os.path.join(repo, "packs", pack_id + ".pack"), 'rb')
+                    f.seek(off)
+                    data = zlib.decompress(f.read(clen))
+                    out.write(data)
+                    written += len(data)
+            os.chmod(dest, meta.get('mode', 0o644))
+            os.utime(dest, ns=(meta['mtime_ns'], meta['mtime_ns']))
+    except Exception as e:
+        return None, f"❌ 还原异常: {html.escape(str(e))}"
+    finally:
+        for f in packs.values():
+            f.close()
+
+    log_audit("USER", "仓库还原", f"{snap_id} -> {target}")
+    msg = (f"♻️ <b>快照还原完成</b>\n\n"
+           f"🗃️ 快照: <code>{snap_id}</code>\n"
+           f"📂 文件: {len(snap['files']) - len(failed)} 个 | {_fmt_size(written)}\n"
+           f"📍 输出: <code>{target}</code>\n"
+           f"⏱️ 耗时: {time.time() - start:.1f}s")
+    if failed:
+        msg += f"\n⚠️ {len(failed)} 个文件因块缺失未还原:\n" + "\n".join(
+            f"  • <code>{html.escape(p)}</code>" for p in failed[:5])
+        if len(failed) > 5:
+            msg += f"\n  … 另有 {len(failed) - 5} 个"
+    return target, msg
+
+def prune_repo(keep=5):
+    """
+    按保留策略 (最近 N 个 + 每日/每周/每月, 由目录库计算) 删除快照, 并回收不再被引用的 pack
+    仍有部分块被引用的 pack 整体保留 (不做重打包)
+    """
+    repo = get_repo_dir()
+    snaps = list_snapshots()
+    # 补录目录库中没有的快照 (旧版本生成)
+    known = catalog.known_backups('repo')
+    for s in snaps:
+        if s['id'] not in known:
+            catalog.record_backup(s['id'], 'repo', created=s['created'], size=s.get('added'),
+                                  raw_size=s.get('size'), duration=s.get('duration'), sources=s.get('sources', []))
+    policy = catalog.get_retention()
+    policy['last'] = keep
+    _, drop = catalog.retention_plan(family='repo', **policy)
+    for r in drop:
+        try:
+            os.remove(os.path.join(repo, "snapshots", r['name'] + ".json.gz"))
+        except OSError:
+            pass
+    catalog.mark_deleted([r['name'] for r in drop])
+    dropped = {r['name'] for r in drop}
+    snaps = [s for s in snaps if s['id'] not in dropped]
+    referenced = set()
+    for s in snaps:
+        full = load_snapshot(s['id']) or {}
+        for meta in full.get('files', {}).values():
+            referenced.update(meta.get('chunks', []))
+
+    removed = 0
+    idx_dir = os.path.join(repo, "index")
+    for name in os.listdir(idx_dir):
+        if not name.endswith(".idx"):
+            continue
+        try:
+            with open(os.path.join(idx_dir, name), encoding='utf-8') as f:
+                digests = json.load(f)
+        except Exception:
+            continue
+        if referenced.isdisjoint(digests):
+            for p in (os.path.join(idx_dir, name), os.path.join(repo, "packs", name[:-4] + ".pack")):
+                if os.path.exists(p):
+                    os.remove(p)
+            removed += 1
+    # 没有索引的 pack 来自中断的备份
+    indexed = {n[:-4] for n in os.listdir(idx_dir) if n.endswith(".idx")}
+    for name in os.listdir(os.path.join(repo, "packs")):
+        if name.endswith(".pack") and name[:-5] not in indexed:
+            os.remove(os.path.join(repo, "packs", name))
+            removed += 1
+    return removed
+
+def get_repo_stats():
+    """仓库占用与去重效果"""
+    repo = get_repo_dir()
+    pack_dir = os.path.join(repo, "packs")
+    stored = sum(os.path.getsize(os.path.join(pack_dir, n)) for n in os.listdir(pack_dir) if n.endswith(".pack"))
+    logical = sum(s.get('size', 0) for s in list_snapshots())
+    return {'stored': stored, 'logical': logical, 'ratio': logical / stored if stored else 0}
+
+def build_snapshot_menu():
+    """备份历史 (仓库模式): 从快照索引读取"""
+    snaps = list_snapshots()
+    st = get_repo_stats()
+    txt = (f"🗃️ <b>去重仓库快照</b>\n📂 <code>{get_repo_dir()}</code>\n"
+           f"💾 占用 <code>{_fmt_size(st['stored'])}</code> | 逻辑 {_fmt_size(st['logical'])} | 去重比 {st['ratio']:.1f}x\n"
+           f"━━━━━━━━━━━━━━━\n")
+    kb = []
+    if not snaps:
+        txt += "📭 暂无快照。"
+    for s in snaps[:8]:
+        when = datetime.fromtimestamp(s['created']).strftime('%m-%d %H:%M')
+        txt += (f"▫️ <code>{s['id']}</code> ({when})\n"
+                f"   {s.get('file_count', 0)} 个文件 | {_fmt_size(s.get('size', 0))} | 新增 {_fmt_size(s.get('added', 0))}\n")
+        kb.append([InlineKeyboardButton(f"♻️ 还原 {s['id']}", callback_data=f"bk_rsnap_{s['id']}")])
+    kb.append([InlineKeyboardButton("🔙 返回", callback_data="bk_menu")])
+    return txt, InlineKeyboardMarkup(kb)
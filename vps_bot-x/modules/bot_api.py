@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+# modules/bot_api.py - Bot API 端点与传输上限
+# 默认使用官方云端 Bot API (下载 20MB / 上传 50MB);
+# 配置自建 telegram-bot-api 服务器 (--local) 后, 文件收发直接读写本机磁盘, 上限提升到 2000MB
+from pathlib import Path
+from telegram import Bot
+from config import TOKEN, load_config
+
+CLOUD_DOWNLOAD_MB = 20
+CLOUD_UPLOAD_MB = 50
+LOCAL_LIMIT_MB = 2000       # 本地模式服务器的收发上限
+
+def _conf():
+    return load_config().get('bot_api', {}) or {}
+
+def is_local():
+    """是否启用自建服务器的本地模式 (需同时配置 base_url)"""
+    c = _conf()
+    return bool(c.get('base_url') and c.get('local_mode', True))
+
+def endpoint_kwargs():
+    """传给 Bot(...) 的端点参数; 未配置时为空 (云端)"""
+    c = _conf()
+    if not c.get('base_url'):
+        return {}
+    base = c['base_url'].rstrip('/')
+    # 与 PTB 约定一致: base_url 形如 http://host:8081/bot, 末尾拼接 token; 文件地址默认为 .../file/bot
+    file_url = c.get('base_file_url') or (base[:-len('/bot')] + '/file/bot' if base.endswith('/bot') else base)
+    return {'base_url': base, 'base_file_url': file_url.rstrip('/'), 'local_mode': is_local()}
+
+def configure(builder):
+    """为 ApplicationBuilder 应用端点配置"""
+    kw = endpoint_kwargs()
+    if kw:
+        builder = builder.base_url(kw['base_url']).base_file_url(kw['base_file_url']).local_mode(kw['local_mode'])
+    return builder
+
+def make_bot():
+    """独立发送用的 Bot (与主程序使用同一端点)"""
+    return Bot(TOKEN, **endpoint_kwargs())
+
+def upload_limit():
+    """单个文件上传上限 (字节)"""
+    mb = _conf().get('upload_mb', LOCAL_LIMIT_MB) if is_local() else CLOUD_UPLOAD_MB
+    return int(mb * 1024**2)
+
+def download_limit():
+    """单个文件下载上限 (字节)"""
+    mb = _conf().get('download_mb', LOCAL_LIMIT_MB) if is_local() else CLOUD_DOWNLOAD_MB
+    return int(mb * 1024**2)
+
+def local_path(tg_file):
+    """本地模式下 getFile 返回服务器磁盘上的绝对路径, 可直接读取; 否则返回 None"""
+    p = Path(tg_file.file_path or "")
+    return p if is_local() and p.is_absolute() and p.is_file() else None
+
+def fmt_rate(nbytes, secs):
+    return f"{nbytes / 1024**2 / max(secs, 0.001):.1f} MB/s"
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+# modules/catalog.py - 备份目录 (SQLite)
+# 每次备份记录大小 / 耗时 / 校验和 / 来源路径 / 投递目标 / 文件列表;
+# 历史视图与保留策略都从这里读取, 不再 glob 目录再逐个 stat
+import os, json, time, sqlite3, logging
+from datetime import datetime
+from config import load_config
+
+CATALOG_FILE = "/var/lib/vps_bot/catalog.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS backups (
+    id          INTEGER PRIMARY KEY,
+    name        TEXT UNIQUE NOT NULL,
+    path        TEXT,
+    kind        TEXT NOT NULL,              -- full / incr / repo / docker
+    status      TEXT NOT NULL DEFAULT 'ok', -- ok / deleted
+    created     REAL NOT NULL,
+    day         TEXT NOT NULL,              -- 保留策略分桶 (本地时间)
+    week        TEXT NOT NULL,
+    month       TEXT NOT NULL,
+    size        INTEGER,
+    raw_size    INTEGER,
+    duration    REAL,
+    checksum    TEXT,
+    compressor  TEXT,
+    host        TEXT,
+    sources     TEXT,                       -- JSON 数组
+    chain       TEXT,                       -- JSON 数组: 还原所需的归档名 (base 在前)
+    file_count  INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_backups_status_created ON backups(status, created);
+CREATE TABLE IF NOT EXISTS backup_files (
+    backup_id   INTEGER NOT NULL REFERENCES backups(id) ON DELETE CASCADE,
+    path        TEXT NOT NULL,
+    size        INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_files_backup ON backup_files(backup_id);
+CREATE TABLE IF NOT EXISTS destinations (
+    backup_id   INTEGER NOT NULL REFERENCES backups(id) ON DELETE CASCADE,
+    dest        TEXT NOT NULL,              -- telegram:<chat_id> / s3://... / sftp://...
+    ts          REAL NOT NULL,
+    status      TEXT NOT NULL,              -- ok / failed / partial
+    detail      TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_dest_backup ON destinations(backup_id);
+"""
+
+# 归档家族: 全量与增量同属 archive, 各自独立计算保留策略
+FAMILY_SQL = "CASE WHEN kind IN ('full', 'incr') THEN 'archive' ELSE kind END"
+
+# 保留策略: 一次窗口函数查询同时计算 "最近 N 个 / 每日 / 每周 / 每月" 的保留标记
+# Docker 备份每个卷 / 容器一个归档, 按来源 (series) 分别计数
+RETENTION_SQL = f"""
+SELECT id, name, path, kind, chain,
+       (rn <= :last)
+       OR (rd = 1 AND nd <= :daily)
+       OR (rw = 1 AND nw <= :weekly)
+       OR (rm = 1 AND nm <= :monthly) AS keep
+FROM (
+    SELECT id, name, path, kind, chain,
+           ROW_NUMBER() OVER (PARTITION BY series ORDER BY created DESC)              AS rn,
+           ROW_NUMBER() OVER (PARTITION BY series, day ORDER BY created DESC)         AS rd,
+           DENSE_RANK() OVER (PARTITION BY series ORDER BY day DESC)                  AS nd,
+           ROW_NUMBER() OVER (PARTITION BY series, week ORDER BY created DESC)        AS rw,
+           DENSE_RANK() OVER (PARTITION BY series ORDER BY week DESC)                 AS nw,
+           ROW_NUMBER() OVER (PARTITION BY series, month ORDER BY created DESC)       AS rm,
+           DENSE_RANK() OVER (PARTITION BY series ORDER BY month DESC)                AS nm
+    FROM (SELECT *, CASE WHEN kind = 'docker' THEN sources ELSE '' END AS series FROM backups
+          WHERE status = 'ok' AND {FAMILY_SQL} = :family)
+)
+"""
+
+_READY = set()
+
+def _db_path():
+    return load_config().get('backup_catalog', CATALOG_FILE)
+
+def connect():
+    """打开目录库 (首次打开时建表); 调用方负责关闭"""
+    path = _db_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    db = sqlite3.connect(path, timeout=10)
+    db.row_factory = sqlite3.Row
+    db.execute("PRAGMA foreign_keys = ON")
+    if path not in _READY:
+        db.execute("PRAGMA journal_mode = WAL")
+        db.executescript(SCHEMA)
+        _READY.add(path)
+    return db
+
+def _buckets(ts):
+    d = datetime.fromtimestamp(ts)
+    iso = d.isocalendar()
+    return d.strftime("%Y-%m-%d"), f"{iso[0]}-W{iso[1]:02d}", d.strftime("%Y-%m")
+
+def record_backup(name, kind, path=None, created=None, size=None, raw_size=None, duration=None,
+                  checksum=None, compressor=None, sources=(), chain=None, files=None):
+    """
+    记录一次备份, 返回 backup_id
+    files: 归档包含的文件 {路径: 大小} 或 [(路径, 大小)]
+    """
+    created = created or time.time()
+    day, week, month = _buckets(created)
+    items = list(files.items()) if isinstance(files, dict) else list(files or [])
+    db = connect()
+    try:
+        with db:
+            cur = db.execute(
+                "INSERT OR REPLACE INTO backups (name, path, kind, status, created, day, week, month, size, raw_size,"
+                " duration, checksum, compressor, host, sources, chain, file_count)"
+                " VALUES (?, ?, ?, 'ok', ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (name, path, kind, created, day, week, month, size, raw_size, duration, checksum, compressor,
+                 load_config().get('server_remark', 'vps'), json.dumps(sorted(sources), ensure_ascii=False),
+                 json.dumps(chain or [name], ensure_ascii=False), len(items)))
+            backup_id = cur.lastrowid
+            db.executemany("INSERT INTO backup_files (backup_id, path, size) VALUES (?, ?, ?)",
+                           ((backup_id, p, sz) for p, sz in items))
+        return backup_id
+    finally:
+        db.close()
+
+def record_destination(name, dest, status="ok", detail=None):
+    """记录备份被投递到的位置 (Telegram 会话 / 远程存储)"""
+    db = connect()
+    try:
+        with db:
+            row = db.execute("SELECT id FROM backups WHERE name = ?", (name,)).fetchone()
+            if row:
+                db.execute("INSERT INTO destinations (backup_id, dest, ts, status, detail) VALUES (?, ?, ?, ?, ?)",
+                           (row['id'], dest, time.time(), status, detail))
+    except Exception as e:
+        logging.error(f"记录投递目标失败 {name}: {e}")
+    finally:
+        db.close()
+
+def mark_deleted(names):
+    if not names:
+        return
+    db = connect()
+    try:
+        with db:
+            db.executemany("UPDATE backups SET status = 'deleted' WHERE name = ?", ((n,) for n in names))
+            # 已删除归档的文件列表不再需要
+            db.executemany("DELETE FROM backup_files WHERE backup_id = (SELECT id FROM backups WHERE name = ?)",
+                           ((n,) for n in names))
+    finally:
+        db.close()
+
+def list_backups(limit=10, offset=0):
+    """最近的有效备份 (含投递目标汇总)"""
+    db = connect()
+    try:
+        rows = db.execute(
+            "SELECT b.*, (SELECT GROUP_CONCAT(DISTINCT d.dest) FROM destinations d"
+            "             WHERE d.backup_id = b.id AND d.status = 'ok') AS dests"
+            " FROM backups b WHERE b.status = 'ok' ORDER BY b.created DESC LIMIT ? OFFSET ?",
+            (limit, offset)).fetchall()
+        return [dict(r) for r in rows]
+    finally:
+        db.close()
+
+def get_backup(name):
+    db = connect()
+    try:
+        row = db.execute("SELECT * FROM backups WHERE name = ?", (name,)).fetchone()
+        return dict(row) if row else None
+    finally:
+        db.close()
+
+def list_files(name, limit=50):
+    db = connect()
+    try:
+        return [tuple(r) for r in db.execute(
+            "SELECT f.path, f.size FROM backup_files f JOIN backups b ON b.id = f.backup_id"
+            " WHERE b.name = ? ORDER BY f.path LIMIT ?", (name, limit))]
+    finally:
+        db.close()
+
+def retention_plan(last=5, daily=0, weekly=0, monthly=0, family='archive'):
+    """
+    计算保留策略: 返回 (保留的行, 删除的行); family 为 archive (全量+增量) / repo (仓库快照) / docker
+    被保留的增量所依赖的链成员 (全量 / 更早增量) 一并保留
+    """
+    params = {'last': last, 'daily': daily, 'weekly': weekly, 'monthly': monthly, 'family': family}
+    db = connect()
+    try:
+        rows = [dict(r) for r in db.execute(RETENTION_SQL, params)]
+    finally:
+        db.close()
+    keep = [r for r in rows if r['keep']]
+    needed = {n for r in keep for n in json.loads(r['chain'] or '[]')}
+    drop = [r for r in rows if not r['keep'] and r['name'] not in needed]
+    keep += [r for r in rows if not r['keep'] and r['name'] in needed]
+    return keep, drop
+
+def get_retention(conf=None):
+    """保留策略配置; 未配置 daily/weekly/monthly 时等同于只保留最近 backup_keep 个"""
+    conf = conf or load_config()
+    r = conf.get('backup_retention', {})
+    return {'last': int(r.get('last', conf.get('backup_keep', 5))), 'daily': int(r.get('daily', 0)),
+            'weekly': int(r.get('weekly', 0)), 'monthly': int(r.get('monthly', 0))}
+
+def known_backups(family='archive'):
+    """目录库中某一家族的备份: {name: status}"""
+    db = connect()
+    try:
+        return {r['name']: r['status'] for r in
+                db.execute(f"SELECT name, status FROM backups WHERE {FAMILY_SQL} = ?", (family,))}
+    finally:
+        db.close()
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+# modules/destinations.py - 远程备份目标 (S3 兼容对象存储 / SFTP)
+# 归档写盘的同时, 压缩输出经有界队列分发给每个已启用的目标, 各目标在自己的线程中并行上传:
+# S3 分段并发上传 (每段的 SHA-256 / MD5 由服务端校验, 完成后核对整体 ETag 与大小);
+# SFTP 经 ssh 流式写入远端临时文件, 远端 sha256sum 核对一致后改名
+import os, re, html, time, queue, shlex, hashlib, logging, posixpath, tempfile, threading, subprocess
+from concurrent.futures import ThreadPoolExecutor
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from config import load_config
+import modules.catalog as catalog
+import modules.s3 as s3
+
+QUEUE_CHUNKS = 32           # 每个目标待发送的块数上限 (约 32MB): 超出时打包端等待最慢的目标
+PART_MB = 16                # S3 分段大小 (最小 5MB)
+CONCURRENCY = 4             # S3 同时上传的分段数
+SSH_TIMEOUT = 120           # 远端校验 / 清理命令超时 (秒)
+KINDS = {'s3': '🪣 S3', 'sftp': '🔐 SFTP'}
+
+def list_destinations(conf=None):
+    """已启用的目标 (配置 destinations)"""
+    conf = conf or load_config()
+    return [d for d in conf.get('destinations', []) if d.get('enabled', True) and d.get('type') in KINDS]
+
+def dest_url(dest, name=""):
+    """目录库中记录的位置: s3://bucket/prefix/name 或 sftp://host/path/name"""
+    if dest['type'] == 's3':
+        return f"s3://{dest['bucket']}/{dest.get('prefix', '')}{name}"
+    return f"sftp://{dest['host']}{posixpath.join(dest['path'], name)}"
+
+def _fmt_rate(nbytes, secs):
+    return f"{nbytes / 1024**2 / max(secs, 0.001):.1f} MB/s"
+
+def _md5_etag(etag, head):
+    """
+    ETag 是否按 MD5 规则计算: 形如 32 位十六进制 (分段上传带 -段数), 且未使用 SSE-KMS / SSE-C
+    (加密对象与部分兼容实现的 ETag 不是 MD5, 不能据此判定失败)
+    """
+    if head.get('x-amz-server-side-encryption') == 'aws:kms' or head.get('x-amz-server-side-encryption-customer-algorithm'):
+        return False
+    return bool(re.fullmatch(r"[0-9a-f]{32}(-\d+)?", etag))
+
+class _Sink:
+    """
+    一个目标的上传线程: write() 入队 (队列满时阻塞, 形成背压), 线程内逐块发送
+    出错后丢弃后续数据, 不影响打包与其它目标; end() 后由 join() 等待收尾
+    sidecar=True 用于清单 / 索引等附属文件, 不再单独附带 .sha256
+    """
+    def __init__(self, dest, name, sidecar=False):
+        self.dest, self.name, self.url = dest, name, dest_url(dest, name)
+        self.sidecar = sidecar
+        self.q = queue.Queue(maxsize=QUEUE_CHUNKS)
+        self.sha, self.sent, self.secs = hashlib.sha256(), 0, 0
+        self.error, self.aborted, self.detail = None, False, ""
+        self.start = time.time()
+        self.thread = threading.Thread(target=self._loop, daemon=True, name=f"dest:{dest.get('name', dest['type'])}")
+        self.thread.start()
+
+    def write(self, buf):
+        if self.error is None:
+            self.q.put(bytes(buf))
+
+    def _loop(self):
+        ended = False
+        try:
+            self.open()
+            while (buf := self.q.get()) is not None:
+                self.sha.update(buf)
+                self.sent += len(buf)
+                self.feed(buf)
+            ended = True
+            if self.aborted:
+                self.cancel()
+            else:
+                self.finish()
+        except Exception as e:
+            self.error = e
+            logging.error(f"远程目标 {self.url} 上传失败: {e}")
+            try:
+                self.cancel()
+            except Exception:
+                pass
+            # 继续取走队列中的数据, 写入方不会因队列满而卡住
+            while not ended and self.q.get() is not None:
+                pass
+        finally:
+            self.secs = time.time() - self.start
+
+    def end(self, ok=True):
+        self.aborted = not ok
+        self.q.put(None)
+
+    def join(self):
+        self.thread.join()
+        return self.error is None and not self.aborted
+
+    # 子类实现
+    def open(self): pass
+    def feed(self, buf): pass
+    def finish(self): pass
+    def cancel(self): pass
+
+class S3Sink(_Sink):
+    """分段并发上传; 不足一段的小文件改用单次 PUT"""
+    def open(self):
+        d = self.dest
+        self.client = s3.Client(d['endpoint'], d['bucket'], d['access_key'], d['secret_key'], d.get('region'))
+        self.key = d.get('prefix', '') + self.name
+        self.part_size = max(5, int(d.get('part_mb', PART_MB))) * 1024**2
+        conc = max(1, int(d.get('concurrency', CONCURRENCY)))
+        # 在途分段不超过 conc 个: 内存占用约 (conc + 1) × 分段大小
+        self.pool, self.slots = ThreadPoolExecutor(max_workers=conc), threading.Semaphore(conc)
+        self.buf, self.upload_id, self.futs, self.md5s = bytearray(), None, [], []
+
+    def _part(self, number, data):
+        try:
+            return number, self.client.upload_part(self.key, self.upload_id, number, data, hashlib.sha256(data).hexdigest())
+        finally:
+            self.slots.release()
+
+    def _submit(self, data):
+        if self.upload_id is None:
+            self.upload_id = self.client.create_multipart(self.key)
+        self.md5s.append(hashlib.md5(data).digest())
+        self.slots.acquire()
+        self.futs.append(self.pool.submit(self._part, len(self.futs) + 1, data))
+        # 已失败的分段 (重试耗尽) 立即终止, 不再继续上传
+        for f in self.futs:
+            if f.done() and f.exception():
+                raise f.exception()
+
+    def feed(self, buf):
+        self.buf += buf
+        while len(self.buf) >= self.part_size:
+            self._submit(bytes(self.buf[:self.part_size]))
+            del self.buf[:self.part_size]
+
+    def finish(self):
+        if self.upload_id is None:
+            data = bytes(self.buf)
+            etag, expected, parts = self.client.put_object(self.key, data), hashlib.md5(data).hexdigest(), 1
+        else:
+            if self.buf:
+                self._submit(bytes(self.buf))
+            etags = [f.result() for f in self.futs]
+            etag = self.client.complete_multipart(self.key, self.upload_id, etags)
+            self.upload_id = None
+            expected, parts = s3.multipart_etag(self.md5s), len(etags)
+        self.pool.shutdown()
+        head = self.client.head_object(self.key)
+        size = int(head.get('content-length', -1))
+        if size != self.sent:
+            raise ValueError(f"远端大小不符: {size} != {self.sent}")
+        # 每段已由服务端按 Content-MD5 / SHA-256 校验; ETag 只在确定按 MD5 计算时再核对一次整体
+        if etag and etag != expected:
+            if _md5_etag(etag, head):
+                raise ValueError(f"ETag 不符: {etag} != {expected}")
+            logging.info(f"{self.url} 的 ETag 不是 MD5 形式, 跳过整体核对: {etag}")
+        # 与分卷发送一致: 附带 sha256 文件, 可用 sha256sum -c 校验下载结果
+        if not self.sidecar:
+            self.client.put_object(self.key + ".sha256", f"{self.sha.hexdigest()}  {self.name}\n".encode())
+        self.detail = f"{parts} 段, {_fmt_rate(self.sent, time.time() - self.start)}"
+        self.client.close()
+
+    def cancel(self):
+        if getattr(self, 'pool', None):
+            self.pool.shutdown(cancel_futures=True)
+        if getattr(self, 'upload_id', None):
+            self.client.abort_multipart(self.key, self.upload_id)
+            self.upload_id = None
+
+class SftpSink(_Sink):
+    """
+    经 ssh 流式写入远端 <名称>.part, 结束后远端计算 sha256 与本地一致才改名
+    不依赖 sftp 子系统或额外的 Python 包, 只需 ssh 客户端与免密登录
+    """
+    def _ssh(self, remote_cmd):
+        d = self.dest
+        cmd = ["ssh", "-o", "BatchMode=yes", "-o", "StrictHostKeyChecking=accept-new", "-p", str(d.get('port', 22))]
+        if d.get('identity'):
+            cmd += ["-i", d['identity']]
+        return cmd + [d['host'], remote_cmd]
+
+    def open(self):
+        self.remote = posixpath.join(self.dest['path'], self.name)
+        self.tmp = self.remote + ".part"
+        self.log = tempfile.TemporaryFile()
+        self.proc = subprocess.Popen(
+            self._ssh(f"mkdir -p {shlex.quote(self.dest['path'])} && cat > {shlex.quote(self.tmp)}"),
+            stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=self.log)
+
+    def _stderr(self):
+        self.log.seek(0)
+        return self.log.read().decode('utf-8', 'replace').strip()[:200]
+
+    def feed(self, buf):
+        try:
+            self.proc.stdin.write(buf)
+        except BrokenPipeError:
+            self.proc.wait()
+            raise IOError(f"ssh 已退出 ({self.proc.returncode}): {self._stderr()}")
+
+    def finish(self):
+        self.proc.stdin.close()
+        if self.proc.wait() != 0:
+            raise IOError(f"ssh 退出码 {self.proc.returncode}: {self._stderr()}")
+        digest = self.sha.hexdigest()
+        tmp, remote = shlex.quote(self.tmp), shlex.quote(self.remote)
+        check = (f"h=$(sha256sum < {tmp} | cut -d' ' -f1); "
+                 f"if [ \"$h\" != {digest} ]; then echo \"sha256 不符: $h\" >&2; exit 3; fi; "
+                 f"mv -f {tmp} {remote}")
+        if not self.sidecar:
+            check += f" && printf '%s  %s\\n' {digest} {shlex.quote(self.name)} > {remote}.sha256"
+        r = subprocess.run(self._ssh(check), capture_output=True, timeout=SSH_TIMEOUT)
+        if r.returncode != 0:
+            raise IOError(r.stderr.decode('utf-8', 'replace').strip()[:200] or f"远端校验失败 ({r.returncode})")
+        self.detail = f"sha256 已核对, {_fmt_rate(self.sent, time.time() - self.start)}"
+        self.log.close()
+
+    def cancel(self):
+        proc = getattr(self, 'proc', None)
+        if not proc:
+            return
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        try:
+            subprocess.run(self._ssh(f"rm -f {shlex.quote(self.tmp)}"), capture_output=True, timeout=SSH_TIMEOUT)
+        except Exception:
+            pass
+
+SINKS = {'s3': S3Sink, 'sftp': SftpSink}
+
+def open_sinks(name, conf=None):
+    """为归档 name 打开所有已启用目标的上传线程; 没有目标时返回空列表"""
+    return [SINKS[d['type']](d, name) for d in list_destinations(conf)]
+
+def _upload_file(dest, path):
+    """把已存在的小文件 (清单 / 索引) 上传到目标, 返回是否成功"""
+    sink = SINKS[dest['type']](dest, os.path.basename(path), sidecar=True)
+    with open(path, 'rb') as f:
+        while buf := f.read(1024 * 1024):
+            sink.write(buf)
+    sink.end()
+    return sink.join()
+
+def close_sinks(sinks, ok=True, sidecars=()):
+    """
+    结束各目标的上传并等待全部完成 (各目标并行收尾); ok=False 时放弃上传并清理远端临时数据
+    成功后上传归档旁的清单 / 索引, 结果记入目录库; 返回用于备份消息的说明行
+    """
+    for s in sinks:
+        s.end(ok)
+    lines = []
+    for s in sinks:
+        good = s.join()
+        if not ok:
+            continue
+        if good:
+            for p in sidecars:
+                if p and os.path.exists(p) and not _upload_file(s.dest, p):
+                    s.detail += f", {os.path.basename(p)} 上传失败"
+        status = "ok" if good else "failed"
+        detail = s.detail if good else str(s.error)[:200]
+        catalog.record_destination(s.name, s.url, status, detail)
+        icon = "✅" if good else "❌"
+        lines.append(f"{icon} {KINDS[s.dest['type']]} <code>{html.escape(str(s.dest.get('name', s.url)))}</code>: {html.escape(detail)}")
+    return lines
+
+def test_destination(idx):
+    """上传并删除一个小测试对象, 返回结果说明"""
+    dests = load_config().get('destinations', [])
+    if not 0 <= idx < len(dests):
+        return "❌ 目标不存在"
+    d = dests[idx]
+    name = f".vps_bot_test_{int(time.time())}"
+    sink = SINKS[d['type']](d, name)
+    sink.write(b"vps_bot destination test\n")
+    sink.end()
+    if not sink.join():
+        return f"❌ 测试失败: <code>{html.escape(str(sink.error)[:200])}</code>"
+    try:
+        if d['type'] == 's3':
+            c = s3.Client(d['endpoint'], d['bucket'], d['access_key'], d['secret_key'], d.get('region'))
+            for key in (sink.key, sink.key + ".sha256"):
+                c.delete_object(key)
+            c.close()
+        else:
+            subprocess.run(sink._ssh(f"rm -f {shlex.quote(sink.remote)} {shlex.quote(sink.remote)}.sha256"),
+                           capture_output=True, timeout=SSH_TIMEOUT)
+    except Exception as e:
+        logging.warning(f"清理测试对象失败 {sink.url}: {e}")
+    return f"✅ 测试通过: <code>{sink.url}</code> ({sink.secs:.2f}s)"
+
+def build_menu():
+    """远程目标菜单: 已配置的目标、最近一次投递结果与连通性测试"""
+    conf = load_config()
+    dests = conf.get('destinations', [])
+    txt = "☁️ <b>远程备份目标</b>\n━━━━━━━━━━━━━━━\n"
+    kb = []
+    if not dests:
+        txt += "📭 尚未配置远程目标\n\n💡 在 config.json 的 <code>destinations</code> 中添加 S3 兼容存储或 SFTP 主机"
+    for i, d in enumerate(dests):
+        on = d.get('enabled', True)
+        kind = KINDS.get(d.get('type'), d.get('type'))
+        txt += f"{'🟢' if on else '⚪'} {kind} <b>{d.get('name', i + 1)}</b>\n   <code>{dest_url(d) if d.get('type') in KINDS else '?'}</code>\n"
+        if d.get('type') in KINDS:
+            kb.append([InlineKeyboardButton(f"🧪 测试 {d.get('name', i + 1)}"[:40], callback_data=f"dest_test_{i}")])
+    if dests:
+        txt += "\n📤 每次备份时与本地归档同时写入, 多个目标并行上传"
+    kb.append([InlineKeyboardButton("🔙 返回备份", callback_data="bk_menu")])
+    return txt, InlineKeyboardMarkup(kb)
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+# modules/docker_api.py - Docker Engine API 轻量客户端 (通过 unix socket 直连)
+# httpx 随 python-telegram-bot 一起安装, 无需额外依赖
+import os, json, base64, struct
+import httpx
+
+DOCKER_SOCK = os.environ.get("DOCKER_SOCK", "/var/run/docker.sock")
+API_BASE = "http://docker"
+API_TIMEOUT = 15
+
+class DockerAPIError(Exception):
+    """Engine API 返回非 2xx 时抛出"""
+    def __init__(self, status, message):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+        self.message = message
+
+def _raise_for(resp):
+    if resp.status_code >= 400:
+        try:
+            msg = resp.json().get('message', resp.text)
+        except:
+            msg = resp.text
+        raise DockerAPIError(resp.status_code, msg[:300])
+
+def client(timeout=API_TIMEOUT):
+    """同步客户端 (供线程内的菜单构建函数使用)"""
+    return httpx.Client(transport=httpx.HTTPTransport(uds=DOCKER_SOCK), base_url=API_BASE, timeout=timeout)
+
+def aclient(timeout=API_TIMEOUT):
+    """异步客户端 (供事件循环内的长任务使用)"""
+    return httpx.AsyncClient(transport=httpx.AsyncHTTPTransport(uds=DOCKER_SOCK), base_url=API_BASE, timeout=timeout)
+
+def api_get(path, params=None, raw=False, timeout=API_TIMEOUT):
+    with client(timeout) as c:
+        resp = c.get(path, params=params)
+        _raise_for(resp)
+        return resp.content if raw else resp.json()
+
+def api_request(method, path, params=None, json_body=None, timeout=API_TIMEOUT):
+    """同步请求 (工作线程内使用), 返回解析后的 JSON (无内容时返回 None)"""
+    with client(timeout) as c:
+        resp = c.request(method, path, params=params, json=json_body)
+        _raise_for(resp)
+        if not resp.content:
+            return None
+        try:
+            return resp.json()
+        except ValueError:
+            return resp.text
+
+def stream(method, path, params=None, timeout=None):
+    """同步流式读取 (工作线程内下载归档), 逐块产出原始字节"""
+    with client(timeout) as c:
+        with c.stream(method, path, params=params) as resp:
+            if resp.status_code >= 400:
+                resp.read()
+                _raise_for(resp)
+            yield from resp.iter_bytes()
+
+async def arequest(method, path, params=None, json_body=None, timeout=API_TIMEOUT):
+    """异步请求, 返回解析后的 JSON (无内容时返回 None)"""
+    async with aclient(timeout) as c:
+        resp = await c.request(method, path, params=params, json=json_body)
+        _raise_for(resp)
+        if not resp.content:
+            return None
+        try:
+            return resp.json()
+        except ValueError:
+            return resp.text
+
+async def astream(method, path, params=None, timeout=None, headers=None):
+    """
+    异步流式读取 (日志 follow / 镜像拉取进度 / 归档下载)
+    逐块产出原始字节
+    """
+    async with aclient(timeout) as c:
+        async with c.stream(method, path, params=params, headers=headers) as resp:
+            if resp.status_code >= 400:
+                await resp.aread()
+                _raise_for(resp)
+            async for chunk in resp.aiter_bytes():
+                yield chunk
+
+async def astream_json(method, path, params=None, timeout=None, headers=None):
+    """逐行解析 JSON 流 (如 /images/create 的进度消息)"""
+    buf = b""
+    async for chunk in astream(method, path, params, timeout, headers):
+        buf += chunk
+        while b"\n" in buf:
+            line, buf = buf.split(b"\n", 1)
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+    if buf.strip():
+        try:
+            yield json.loads(buf)
+        except ValueError:
+            pass
+
+# ==================== 私有仓库凭据 ====================
+DOCKER_HUB = "https://index.docker.io/v1/"
+
+def _registry_of(image):
+    """镜像所在仓库: 第一段含 . 或 : (或为 localhost) 时是仓库地址, 否则为 Docker Hub"""
+    first, sep, _ = image.partition('/')
+    if sep and ('.' in first or ':' in first or first == "localhost"):
+        return first
+    return DOCKER_HUB
+
+def _strip_scheme(url):
+    return url.split("://", 1)[-1].rstrip('/').split('/')[0]
+
+def registry_auth(image):
+    """
+    按 docker CLI 的 ~/.docker/config.json (或 $DOCKER_CONFIG) 生成 X-Registry-Auth 请求头
+    只支持直接保存在 auths 中的凭据; 使用凭据助手 (credsStore) 或没有匹配项时返回 None
+    """
+    path = os.path.join(os.environ.get("DOCKER_CONFIG") or os.path.expanduser("~/.docker"), "config.json")
+    try:
+        with open(path, encoding='utf-8') as f:
+            auths = json.load(f).get('auths', {})
+    except (OSError, ValueError):
+        return None
+    registry = _registry_of(image)
+    hosts = {"index.docker.io", "registry-1.docker.io", "docker.io"} if registry == DOCKER_HUB else {registry}
+    for key, entry in auths.items():
+        if _strip_scheme(key) not in hosts:
+            continue
+        if entry.get('identitytoken'):
+            cred = {'identitytoken': entry['identitytoken'], 'serveraddress': key}
+        elif entry.get('auth'):
+            try:
+                user, _, pwd = base64.b64decode(entry['auth']).decode('utf-8').partition(':')
+            except ValueError:
+                continue
+            cred = {'username': user, 'password': pwd, 'serveraddress': key}
+        elif entry.get('username'):
+            cred = {'username': entry['username'], 'password': entry.get('password', ''), 'serveraddress': key}
+        else:
+            continue
+        return base64.urlsafe_b64encode(json.dumps(cred).encode()).decode()
+    return None
+
+def demux(buf):
+    """
+    解析非 TTY 容器的多路复用日志帧: [stream(1) 0 0 0 size(4)] + payload
+    返回 (已解析的 payload 列表, 剩余未完整的字节)
+    """
+    out = []
+    while len(buf) >= 8:
+        stream_type = buf[0]
+        size = struct.unpack(">I", buf[4:8])[0]
+        if stream_type not in (0, 1, 2) or len(buf) < 8 + size:
+            break
+        out.append(buf[8:8 + size])
+        buf = buf[8 + size:]
+    return out, buf
+
+def is_tty(cid):
+    try:
+        return bool(api_get(f"/containers/{cid}/json").get('Config', {}).get('Tty'))
+    except Exception:
+        return False
+
+def split_log_bytes(data, tty):
+    """把 /logs 的完整响应体拆成文本行"""
+    if not tty:
+        frames, _ = demux(data)
+        data = b"".join(frames)
+    return data.decode('utf-8', errors='replace').splitlines()
@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+# modules/docker_backup.py - Docker 卷与容器文件系统备份
+# 不依赖 /var/lib/docker 下的实际路径: 通过 Engine API 的归档接口读取 tar 流
+# (卷: 挂载到一个只创建不启动的辅助容器后 GET /containers/{id}/archive; 容器: GET /containers/{id}/export),
+# 直接送入与目录备份相同的分帧压缩流水线; 可选在打包期间暂停相关容器, 多个来源并发备份
+import os, re, html, time, asyncio, logging, threading, contextvars
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from config import load_config, save_config
+from utils import log_audit, get_path_id
+import modules.docker_api as docker_api
+import modules.backup as bk_mgr
+import modules.seekable as seekable
+import modules.catalog as catalog
+import modules.jobs as jobs
+import modules.volumes as volumes
+import modules.destinations as destinations
+
+PARALLEL = 2                # 同时备份的来源数
+STREAM_TIMEOUT = 300        # 归档流单次读取无数据的超时 (秒)
+HELPER_MOUNT = "/volume"    # 卷在辅助容器中的挂载点, 也是归档内的顶层目录名
+HELPER_LABEL = "vps_bot.backup-helper"
+NAME_PREFIX = "docker_"     # 归档文件名前缀 (与目录备份的 backup_* 分开计算保留策略)
+KINDS = {'volume': '💾 卷', 'container': '📦 容器'}
+
+_PAUSED = {}                # {容器ID: 引用计数}: 多个卷共用一个容器时, 最后一个完成后才恢复
+_PAUSE_LOCK = threading.Lock()
+
+def _conf():
+    return load_config().get('docker_backup', {}) or {}
+
+def _fmt_mb(n):
+    return f"{n / 1024**2:.1f} MB"
+
+def source_key(kind, name):
+    return f"{kind}:{name}"
+
+def configured_sources(conf=None):
+    """已选择的来源: [(类型, 名称)]"""
+    conf = conf if conf is not None else _conf()
+    return ([('volume', v) for v in conf.get('volumes', [])] +
+            [('container', c) for c in conf.get('containers', [])])
+
+# ==================== 来源发现 ====================
+def list_sources():
+    """
+    可备份的来源: ({卷名: {'name', 'driver', 'users'}}, {容器名: {'name', 'id', 'state', 'image'}})
+    users 为挂载该卷的容器 (用于暂停与选取辅助镜像)
+    """
+    cons = docker_api.api_request("GET", "/containers/json", params={'all': 1})
+    vols = (docker_api.api_request("GET", "/volumes") or {}).get('Volumes') or []
+    containers, users = {}, {}
+    for c in cons:
+        name = (c.get('Names') or [c['Id'][:12]])[0].lstrip('/')
+        info = {'name': name, 'id': c['Id'], 'state': c.get('State'), 'image': c.get('Image')}
+        containers[name] = info
+        for m in c.get('Mounts', []):
+            if m.get('Type') == 'volume' and m.get('Name'):
+                users.setdefault(m['Name'], []).append(info)
+    volumes = {v['Name']: {'name': v['Name'], 'driver': v.get('Driver'), 'users': users.get(v['Name'], [])}
+               for v in vols}
+    return volumes, containers
+
+# ==================== 一致性: 暂停 ====================
+def _pause(ids):
+    """暂停运行中的容器 (引用计数), 返回实际登记的容器ID"""
+    held = []
+    for cid in ids:
+        with _PAUSE_LOCK:
+            n = _PAUSED.get(cid, 0)
+            if n == 0:
+                try:
+                    docker_api.api_request("POST", f"/containers/{cid}/pause", timeout=60)
+                except docker_api.DockerAPIError as e:
+                    logging.warning(f"暂停容器 {cid[:12]} 失败, 按不暂停继续: {e}")
+                    continue
+            _PAUSED[cid] = n + 1
+        held.append(cid)
+    return held
+
+def _unpause(ids):
+    for cid in ids:
+        with _PAUSE_LOCK:
+            n = _PAUSED.get(cid, 1) - 1
+            if n > 0:
+                _PAUSED[cid] = n
+                continue
+            _PAUSED.pop(cid, None)
+            try:
+                docker_api.api_request("POST", f"/containers/{cid}/unpause", timeout=60)
+            except Exception as e:
+                logging.error(f"恢复容器 {cid[:12]} 失败: {e}")
+
+# ==================== 归档流 ====================
+class _StreamReader:
+    """把 Engine API 的字节块流包装成 read(n) (分帧压缩的输入), 每次读取检查取消与总超时"""
+    def __init__(self, chunks, check, deadline):
+        self.chunks, self.check, self.deadline = chunks, check, deadline
+        self.buf, self.total, self.eof = bytearray(), 0, False
+
+    def read(self, n=-1):
+        self.check()
+        if time.time() > self.deadline:
+            raise TimeoutError("备份超时")
+        n = seekable.READ_CHUNK if n is None or n < 0 else n
+        while len(self.buf) < n and not self.eof:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                self.eof = True
+            else:
+                self.buf += chunk
+        data = bytes(self.buf[:n])
+        del self.buf[:n]
+        self.total += len(data)
+        return data
+
+def _helper_image(vol):
+    """辅助容器只创建不启动, 任意本地镜像即可: 优先配置项, 其次挂载该卷的容器所用镜像"""
+    img = _conf().get('helper_image')
+    if img:
+        return img
+    for c in vol['users']:
+        return c['image']
+    for i in docker_api.api_request("GET", "/images/json"):
+        tags = [t for t in (i.get('RepoTags') or []) if t != '<none>:<none>']
+        if tags:
+            return tags[0]
+    raise ValueError("没有可用的本地镜像, 请配置 docker_backup.helper_image")
+
+def _open_stream(kind, src, held):
+    """返回 (字节块生成器, 辅助容器ID 或 None); 按需暂停相关容器 (写入 held)"""
+    pause = _conf().get('pause', False)
+    if kind == 'container':
+        if pause and src['state'] == 'running':
+            held += _pause([src['id']])
+        return docker_api.stream("GET", f"/containers/{src['id']}/export", timeout=STREAM_TIMEOUT), None
+    if pause:
+        held += _pause([c['id'] for c in src['users'] if c['state'] == 'running'])
+    helper = docker_api.api_request("POST", "/containers/create", json_body={
+        'Image': _helper_image(src), 'Entrypoint': ["true"], 'Cmd': [], 'NetworkDisabled': True,
+        'Labels': {HELPER_LABEL: src['name']},
+        'HostConfig': {'Binds': [f"{src['name']}:{HELPER_MOUNT}:ro"]},
+    }, timeout=60)['Id']
+    return docker_api.stream("GET", f"/containers/{helper}/archive", {'path': HELPER_MOUNT}, timeout=STREAM_TIMEOUT), helper
+
+def _backup_one(kind, src, ts, opts, check, progress):
+    """
+    备份单个来源到 docker_<备注>_<时间>_<类型>-<名称>.tar.gz (分帧归档 + 索引, 可用 /restore 选择性还原)
+    在线程池中运行; 返回结果字典, 失败时带 error
+    """
+    name = src['name']
+    safe = re.sub(r'[^A-Za-z0-9_.-]', '_', name)[:60]
+    out_path = os.path.join(bk_mgr.get_backup_dir(),
+                            f"{NAME_PREFIX}{opts['remark']}_{ts}_{kind}-{safe}.tar.gz")
+    part_path = out_path + ".part"
+    res = {'kind': kind, 'name': name, 'path': None}
+    held, helper, chunks, sinks = [], None, None, []
+    start = time.time()
+    try:
+        chunks, helper = _open_stream(kind, src, held)
+        reader = _StreamReader(chunks, check, start + opts['timeout'])
+        progress[source_key(kind, name)] = reader
+        index = {}
+        sinks = destinations.open_sinks(os.path.basename(out_path))
+        with open(part_path, 'wb') as out:
+            frames = seekable.frames(reader, index, **opts['comp'])
+            try:
+                checksum = bk_mgr._split_output(frames, out, 0, part_path, None, sinks)
+            finally:
+                frames.close()
+        # 归档流读完即可恢复容器, 写索引与登记不必等待
+        _unpause(held)
+        held = []
+        secs = time.time() - start
+        size = os.path.getsize(part_path)
+        seekable.save_index(out_path, index)
+        os.replace(part_path, out_path)
+        catalog.record_backup(os.path.basename(out_path), 'docker', path=out_path, size=size, raw_size=reader.total,
+                              duration=round(secs, 2), checksum=checksum, compressor='seekable',
+                              sources=[source_key(kind, name)],
+                              files={m[0]: m[3] for m in index['members'] if m[4] == '0'})
+        res['remote'] = destinations.close_sinks(sinks, sidecars=(seekable.index_path(out_path),)) if sinks else []
+        sinks = []
+        res.update(path=out_path, size=size, raw=reader.total, secs=secs, files=len(index['members']))
+    except jobs.Cancelled:
+        raise
+    except Exception as e:
+        logging.error(f"Docker 备份失败 {kind}:{name}: {e}")
+        res['error'] = str(e)
+    finally:
+        if sinks:
+            destinations.close_sinks(sinks, ok=False)
+        if chunks:
+            chunks.close()
+        _unpause(held)
+        if helper:
+            try:
+                docker_api.api_request("DELETE", f"/containers/{helper}", params={'force': 1}, timeout=60)
+            except Exception as e:
+                logging.warning(f"删除辅助容器 {helper[:12]} 失败: {e}")
+        if os.path.exists(part_path):
+            os.remove(part_path)
+    return res
+
+def _report(progress, done, total):
+    lines = [f"🐳 Docker 备份 {done}/{total}"]
+    for key, reader in list(progress.items()):
+        lines.append(f"• <code>{html.escape(key)}</code> 已读取 {_fmt_mb(reader.total)}")
+    jobs.report("\n".join(lines))
+
+def run_docker_backup(is_auto=False):
+    """
+    备份已选择的卷与容器 (工作线程中调用), 多个来源按 docker_backup.parallel 并发
+    返回: (归档路径列表, 消息)
+    """
+    conf = load_config()
+    dconf = conf.get('docker_backup', {}) or {}
+    wanted = configured_sources(dconf)
+    if not wanted:
+        return [], "⚠️ 未选择 Docker 备份来源"
+    try:
+        volumes, containers = list_sources()
+    except Exception as e:
+        return [], f"❌ 无法连接 Docker: {html.escape(str(e)[:200])}"
+    found = {'volume': volumes, 'container': containers}
+    targets = [(k, found[k][n]) for k, n in wanted if n in found[k]]
+    missing = [source_key(k, n) for k, n in wanted if n not in found[k]]
+
+    parallel = max(1, int(dconf.get('parallel', PARALLEL)))
+    comp, _ = bk_mgr._compressor_cmd('seekable', conf)
+    # 各来源自带压缩线程池: 按并发数均分 CPU, 避免 parallel × cpu_count 个压缩线程
+    comp['workers'] = comp['workers'] or max(1, (os.cpu_count() or 1) // min(parallel, max(len(targets), 1)))
+    opts = {'remark': conf.get('server_remark', 'vps'), 'timeout': int(conf.get('backup_timeout', 3600)), 'comp': comp}
+    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+    check = jobs.checker()
+    progress = {}
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=parallel, thread_name_prefix="docker-backup") as pool:
+        # 各线程带上任务上下文, 分帧压缩的 CPU 时间计入本任务
+        futs = [pool.submit(contextvars.copy_context().run, _backup_one, k, src, ts, opts, check, progress)
+                for k, src in targets]
+        pending = set(futs)
+        while pending:
+            _report(progress, len(futs) - len(pending), len(futs))
+            _, pending = wait(pending, timeout=2)
+    results = [f.result() for f in futs]
+
+    ok = [r for r in results if r['path']]
+    log_audit("SYS" if is_auto else "USER", "Docker 备份", f"{len(ok)}/{len(targets)} 个来源")
+    clean_docker_backups()
+    lines = [f"🐳 <b>Docker 备份{'完成' if len(ok) == len(wanted) else '结束'}</b>", ""]
+    for r in results:
+        label = f"{KINDS[r['kind']]} <code>{html.escape(r['name'])}</code>"
+        if r['path']:
+            lines.append(f"✅ {label} | {_fmt_mb(r['size'])} (原始 {_fmt_mb(r['raw'])}) | "
+                         f"{bk_mgr._fmt_speed(r['raw'], r['secs'])}, {r['secs']:.1f}s")
+            lines += [f"   └ {line}" for line in r['remote']]
+        else:
+            lines.append(f"❌ {label}: {html.escape(r['error'][:120])}")
+    for key in missing:
+        lines.append(f"⚠️ 不存在: <code>{html.escape(key)}</code>")
+    lines.append(f"\n⏱️ 总耗时 {time.time() - start:.1f}s | 并发 {parallel}"
+                 + (" | ⏸️ 打包期间暂停容器" if dconf.get('pause') else ""))
+    return [r['path'] for r in ok], "\n".join(lines)
+
+async def backup_and_deliver(bot, chat_ids, is_auto=False):
+    """执行 Docker 备份并按配置投递各归档 (docker_backup.deliver); 返回 (归档路径列表, 消息)"""
+    paths, msg = await asyncio.to_thread(run_docker_backup, is_auto)
+    if paths and _conf().get('deliver', True):
+        for p in paths:
+            jobs.report(f"📤 正在发送 {html.escape(os.path.basename(p))}...")
+            ok, note = await volumes.deliver_file(bot, chat_ids, p, f"🐳 <code>{html.escape(os.path.basename(p))}</code>")
+            if not ok:
+                msg += f"\n⚠️ {html.escape(os.path.basename(p))}: {note}"
+    return paths, msg
+
+# ==================== 保留策略 ====================
+def clean_docker_backups():
+    """按保留策略清理 Docker 归档: 每个卷 / 容器单独计算最近 N 个 / 每日 / 每周 / 每月"""
+    try:
+        # 先与磁盘对账: 手动删掉的归档不再占用保留名额
+        gone = []
+        for n, st in catalog.known_backups('docker').items():
+            row = catalog.get_backup(n) if st == 'ok' else None
+            if row and not (row['path'] and os.path.exists(row['path'])):
+                gone.append(n)
+        catalog.mark_deleted(gone)
+        policy = catalog.get_retention()
+        policy['last'] = int(_conf().get('keep', policy['last']))
+        keep, drop = catalog.retention_plan(family='docker', **policy)
+        deleted = []
+        for r in drop:
+            for p in (r['path'], seekable.index_path(r['path'])):
+                if p and os.path.exists(p):
+                    os.remove(p)
+            deleted.append(r['name'])
+        catalog.mark_deleted(deleted)
+        return len(deleted)
+    except Exception as e:
+        print(f"⚠️ Docker 备份清理失败: {e}")
+        return 0
+
+# ==================== 菜单 ====================
+def build_menu():
+    """Docker 备份菜单: 勾选卷 / 容器, 切换暂停, 立即备份"""
+    dconf = _conf()
+    chosen = set(source_key(k, n) for k, n in configured_sources(dconf))
+    try:
+        volumes, containers = list_sources()
+    except Exception as e:
+        return (f"🐳 <b>Docker 备份</b>\n━━━━━━━━━━━━━━━\n❌ 无法连接 Docker: <code>{html.escape(str(e)[:200])}</code>",
+                InlineKeyboardMarkup([[InlineKeyboardButton("🔙 返回备份", callback_data="bk_menu")]]))
+    kb = [[InlineKeyboardButton("▶️ 立即备份所选", callback_data="dkb_do")]]
+    for kind, items in (('volume', volumes), ('container', containers)):
+        for name in sorted(items)[:20]:
+            key = source_key(kind, name)
+            mark = "✅" if key in chosen else "⬜"
+            extra = f" ({len(items[name]['users'])} 容器)" if kind == 'volume' else f" [{items[name]['state']}]"
+            kb.append([InlineKeyboardButton(f"{mark} {KINDS[kind]} {name}{extra}"[:60], callback_data=f"dkb_t_{get_path_id(key)}")])
+    pause = "⏸️ 打包时暂停容器: 开" if dconf.get('pause') else "▶️ 打包时暂停容器: 关"
+    kb.append([InlineKeyboardButton(pause, callback_data="dkb_pause")])
+    kb.append([InlineKeyboardButton("🔙 返回备份", callback_data="bk_menu")])
+    archives = sum(1 for st in catalog.known_backups('docker').values() if st == 'ok')
+    txt = (f"🐳 <b>Docker 备份</b>\n━━━━━━━━━━━━━━━\n"
+           f"💾 卷: <code>{len(volumes)}</code> | 📦 容器: <code>{len(containers)}</code> | 已选 <code>{len(chosen)}</code>\n"
+           f"⚡ 并发: <code>{dconf.get('parallel', PARALLEL)}</code> | 归档: <code>{archives}</code> 个\n"
+           f"📤 自动备份时一并执行, 归档可用 /restore 浏览和选择性还原\n"
+           f"💡 卷通过只读挂载的辅助容器读取, 容器备份为其文件系统 (不含卷)")
+    return txt, InlineKeyboardMarkup(kb)
+
+def toggle_source(source_id):
+    """按菜单ID勾选 / 取消来源; 返回新状态 (True=已选), 找不到返回 None"""
+    volumes, containers = list_sources()
+    conf = load_config()
+    dconf = conf.setdefault('docker_backup', {})
+    for kind, items in (('volume', volumes), ('container', containers)):
+        for name in items:
+            if get_path_id(source_key(kind, name)) != source_id:
+                continue
+            lst = dconf.setdefault(f"{kind}s", [])
+            on = name not in lst
+            if on:
+                lst.append(name)
+            else:
+                lst.remove(name)
+            save_config(conf)
+            return on
+    return None
+
+def toggle_pause():
+    conf = load_config()
+    dconf = conf.setdefault('docker_backup', {})
+    dconf['pause'] = not dconf.get('pause', False)
+    save_config(conf)
+    return dconf['pause']
@@ -1,7 +1,11 @@
 # -*- coding: utf-8 -*-
 # modules/docker_mgr.py (V6.0.3 稳定修正版)
-import subprocess, json, datetime, os, random, string, time
+import subprocess, json, datetime, os, random, string, time, re, html, asyncio
+from collections import deque
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+import modules.docker_api as docker_api
+import modules.jobs as jobs
+from config import load_config
 
 # --- 🛠️ 基础工具 ---
 def run_cmd(cmd):
@@ -122,6 +126,15 @@ def update_wizard_val(uid, key, val):
         else: WIZARD_CACHE[uid][key+'s'].append(val)
     return get_wizard_menu(uid)
 
+async def commit_wizard_async(uid, on_progress=None):
+    """先异步拉取镜像 (带进度), 完成后再创建容器, 避免 docker run 阻塞事件循环"""
+    d = WIZARD_CACHE.get(uid)
+    if not d: return "❌ 丢失"
+    ok, msg = await ensure_image(d['image'], on_progress)
+    if not ok:
+        return f"❌ <b>镜像拉取失败:</b>\n<pre>\n{html.escape(msg[:500])}\n</pre>"
+    return await asyncio.to_thread(commit_wizard, uid)
+
 def commit_wizard(uid):
     d = WIZARD_CACHE.get(uid)
     if not d: return "❌ 丢失"
@@ -142,6 +155,122 @@ def commit_wizard(uid):
         return f"❌ <b>部署失败:</b>\n<pre>\n{out[:500]}\n</pre>"
     except Exception as e: return f"❌ 异常: {e}"
 
+# --- 📥 异步镜像拉取 (去重 + 节流进度) ---
+PULL_INTERVAL = 3       # 进度消息最小刷新间隔 (秒)
+PULL_TIMEOUT = 1800     # 单次拉取最长时间 (秒)
+# {image_ref: asyncio.Task}  同一镜像的并发拉取共享同一个任务
+PULL_JOBS = {}
+# {image_ref: {'layers': {layer_id: [current, total, status]}, 'status': str}}
+PULL_PROGRESS = {}
+
+def _split_ref(ref):
+    """nginx -> (nginx, latest); host:5000/a/b:1.2 -> (host:5000/a/b, 1.2)"""
+    name, sep, tag = ref.rpartition(':')
+    if not sep or '/' in tag:
+        return ref, "latest"
+    return name, tag
+
+def image_exists(ref):
+    try:
+        docker_api.api_get(f"/images/{ref}/json")
+        return True
+    except docker_api.DockerAPIError as e:
+        if e.status == 404: return False
+        raise
+
+# 拉取被拒 (私有仓库未认证 / 凭据助手) 的特征, 出现时改用 docker CLI 拉取
+_AUTH_ERRORS = ("unauthorized", "denied", "authentication required", "not found", "no basic auth credentials")
+
+async def _cli_pull(ref, prog, err):
+    """退回 docker pull: CLI 会使用凭据助手等 Engine API 无法直接获得的凭据; 没有 CLI 时返回原错误"""
+    prog['status'] = "使用 docker CLI 拉取 (私有仓库凭据)..."
+    try:
+        proc = await asyncio.create_subprocess_exec("docker", "pull", ref, stdout=asyncio.subprocess.PIPE,
+                                                    stderr=asyncio.subprocess.STDOUT)
+    except FileNotFoundError:
+        return False, err
+    try:
+        out, _ = await asyncio.wait_for(proc.communicate(), timeout=PULL_TIMEOUT)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        return False, "docker pull 超时"
+    except asyncio.CancelledError:
+        proc.kill()
+        raise
+    lines = out.decode('utf-8', 'replace').strip().splitlines() or [""]
+    if proc.returncode != 0:
+        return False, lines[-1]
+    prog['status'] = lines[-1]
+    return True, lines[-1]
+
+async def _do_pull(ref):
+    name, tag = _split_ref(ref)
+    prog = PULL_PROGRESS[ref] = {'layers': {}, 'status': "连接仓库中..."}
+    auth = docker_api.registry_auth(name)
+    headers = {'X-Registry-Auth': auth} if auth else None
+    try:
+        async for msg in docker_api.astream_json("POST", "/images/create", params={'fromImage': name, 'tag': tag},
+                                                 timeout=PULL_TIMEOUT, headers=headers):
+            if msg.get('error'):
+                if any(k in msg['error'].lower() for k in _AUTH_ERRORS):
+                    return await _cli_pull(ref, prog, msg['error'])
+                return False, msg['error']
+            lid, detail = msg.get('id'), msg.get('progressDetail') or {}
+            if lid and lid != tag:
+                layer = prog['layers'].setdefault(lid, [0, 0, ""])
+                layer[2] = msg.get('status', "")
+                if detail.get('total'):
+                    layer[0], layer[1] = detail.get('current', 0), detail['total']
+                if layer[2] in ("Pull complete", "Already exists") and layer[1]:
+                    layer[0] = layer[1]
+            elif msg.get('status'):
+                prog['status'] = msg['status']
+        return True, prog['status']
+    except docker_api.DockerAPIError as e:
+        if e.status in (401, 403, 404):
+            return await _cli_pull(ref, prog, str(e))
+        return False, str(e)
+    except Exception as e:
+        return False, str(e)
+    finally:
+        PULL_JOBS.pop(ref, None)
+
+def render_pull_progress(ref):
+    prog = PULL_PROGRESS.get(ref, {'layers': {}, 'status': "等待中..."})
+    layers = prog['layers'].values()
+    cur = sum(l[0] for l in layers); tot = sum(l[1] for l in layers)
+    done = len([l for l in layers if l[2] in ("Pull complete", "Already exists")])
+    perc = cur / tot * 100 if tot else 0
+    bar = f"{'▓' * int(perc / 10)}{'░' * (10 - int(perc / 10))} {perc:.0f}%"
+    return (f"📥 <b>正在拉取镜像</b>\n━━━━━━━━━━━━━━━\n"
+            f"🖼️ <code>{html.escape(ref)}</code>\n"
+            f"📦 <code>{bar}</code>\n"
+            f"💾 <code>{cur / 1024**2:.1f} / {tot / 1024**2:.1f} MB</code> | 层: <code>{done}/{len(prog['layers'])}</code>\n"
+            f"ℹ️ {html.escape(prog['status'][:80])}")
+
+def prefetch_image(ref):
+    """在后台提前开始拉取 (已存在或已在拉取时不重复)"""
+    if ref not in PULL_JOBS:
+        PULL_JOBS[ref] = asyncio.get_running_loop().create_task(_do_pull(ref))
+    return PULL_JOBS[ref]
+
+async def ensure_image(ref, on_progress=None, interval=PULL_INTERVAL):
+    """
+    确保镜像在本地存在; 缺失时拉取并按节流间隔回调进度
+    on_progress: async (txt) -> None
+    返回 (成功与否, 消息)
+    """
+    if ref not in PULL_JOBS and await asyncio.to_thread(image_exists, ref):
+        return True, "镜像已存在"
+    task = prefetch_image(ref)
+    while not task.done():
+        await asyncio.wait({task}, timeout=interval)
+        if on_progress and not task.done():
+            try: await on_progress(render_pull_progress(ref))
+            except Exception: pass
+    return task.result()
+
 # --- 3. 核心菜单构建 ---
 def build_main_menu():
     cons = get_containers()
@@ -153,7 +282,8 @@ def build_main_menu():
     kb = [
         [InlineKeyboardButton(f"📦 容器列表 ({len(cons)})", callback_data="dk_list_cons"),
          InlineKeyboardButton("🚀 应用商店", callback_data="dk_store")],
-        [InlineKeyboardButton(f"📚 堆栈管理 ({len(stacks)})", callback_data="dk_list_stacks")],
+        [InlineKeyboardButton(f"📚 堆栈管理 ({len(stacks)})", callback_data="dk_list_stacks"),
+         InlineKeyboardButton("☑️ 批量操作", callback_data="dk_bulk")],
         [InlineKeyboardButton("🖼️ 镜像管理 (安装/更新)", callback_data="dk_res_imgs")],
         [InlineKeyboardButton("🧹 深度清理", callback_data="dk_op_prune"), 
          InlineKeyboardButton("📝 实时事件", callback_data="dk_events")],
@@ -296,6 +426,9 @@ def install_app_template(uid, app_key):
         'envs': app.get('envs', []), 'privileged': app.get('privileged', False)
     }
     WIZARD_EXPIRE[uid] = time.time()
+    # 用户在向导里调整参数的同时就开始后台拉取镜像
+    try: prefetch_image(app['image'])
+    except RuntimeError: pass
     return True
 
 # --- 其他辅助功能 (限制、日志、清理、Stack、Events) ---
@@ -330,17 +463,313 @@ def docker_action(action, target, extra=None):
         subprocess.check_call(cmd, shell=True); return True, "成功"
     except Exception as e: return False, str(e)
 
-def build_logs_preview(cid):
-    try: logs = subprocess.check_output(f"docker logs --tail 30 {cid}", shell=True, stderr=subprocess.STDOUT).decode('utf-8')
-    except: logs = "无法读取"
+# --- ☑️ 批量操作 (多选 + 有界并发) ---
+# {uid: {'sel': set(['c:<cid>', 's:<stack>']), 'ordered': bool}}
+BULK_SELECT = {}
+BULK_ACTIONS = {'start': "▶️ 启动", 'stop': "⏹️ 停止", 'restart': "🔄 重启", 'rm': "🗑️ 删除", 'mem': "⚡ 内存限制"}
+MEM_OPTIONS = {'512m': 512*1024**2, '1g': 1024**3, '2g': 2048*1024**2, '0': 0}
+
+def _bulk(uid):
+    return BULK_SELECT.setdefault(uid, {'sel': set(), 'ordered': True})
+
+def toggle_bulk_item(uid, item):
+    sel = _bulk(uid)['sel']
+    if item in sel: sel.remove(item)
+    else: sel.add(item)
+
+def set_bulk_all(uid, on):
+    st = _bulk(uid)
+    st['sel'] = {f"c:{c['id']}" for c in get_containers()} if on else set()
+
+def toggle_bulk_order(uid):
+    st = _bulk(uid)
+    st['ordered'] = not st['ordered']
+
+def build_bulk_menu(uid):
+    st = _bulk(uid)
+    cons, stacks = get_containers(), get_stacks()
+    txt = (f"☑️ <b>批量操作</b>\n━━━━━━━━━━━━━━━\n"
+           f"已选: <code>{len(st['sel'])}</code> 项 | 并发: <code>{load_config().get('bulk_parallelism', 4)}</code>\n"
+           f"依赖顺序: <code>{'开启' if st['ordered'] else '关闭'}</code>\n"
+           f"💡 点击条目切换选中, 堆栈会展开为其全部容器")
+    kb, row = [], []
+    for c in cons:
+        mark = "✅" if f"c:{c['id']}" in st['sel'] else "⬜"
+        icon = "🟢" if c['state'] == 'running' else "🔴"
+        row.append(InlineKeyboardButton(f"{mark}{icon} {c['name'][:14]}", callback_data=f"dk_bulk_t_{c['id']}"))
+        if len(row) == 2: kb.append(row); row = []
+    if row: kb.append(row)
+    for sk in stacks:
+        name = sk.get('Name', '')
+        mark = "✅" if f"s:{name}" in st['sel'] else "⬜"
+        kb.append([InlineKeyboardButton(f"{mark}📚 {name[:24]}", callback_data=f"dk_bulk_ts_{name}")])
+    kb.append([InlineKeyboardButton("☑️ 全选", callback_data="dk_bulk_all"), InlineKeyboardButton("⬜ 清空", callback_data="dk_bulk_none"),
+               InlineKeyboardButton(f"🔗 顺序: {'开' if st['ordered'] else '关'}", callback_data="dk_bulk_order")])
+    acts = [InlineKeyboardButton(label, callback_data=f"dk_bulk_do_{a}" if a != 'mem' else "dk_bulk_mem") for a, label in BULK_ACTIONS.items()]
+    kb.append(acts[:3]); kb.append(acts[3:])
+    kb.append([InlineKeyboardButton("🔙 返回指挥官", callback_data="dk_m")])
+    return txt, InlineKeyboardMarkup(kb)
+
+def build_bulk_mem_menu():
+    kb = [[InlineKeyboardButton(k.upper() if k != '0' else "🔓 不限制", callback_data=f"dk_bulk_do_mem_{k}") for k in MEM_OPTIONS],
+          [InlineKeyboardButton("🔙 返回", callback_data="dk_bulk")]]
+    return "⚡ <b>为选中容器统一设置内存上限:</b>", InlineKeyboardMarkup(kb)
+
+def resolve_bulk_targets(uid):
+    """把选择集展开为容器列表 [{'id','name','project','service','deps'}] (堆栈按 compose 标签展开)"""
+    sel = _bulk(uid)['sel']
+    want_ids = {i[2:] for i in sel if i.startswith("c:")}
+    want_stacks = {i[2:] for i in sel if i.startswith("s:")}
+    targets = []
+    for c in docker_api.api_get("/containers/json", params={'all': 1}):
+        labels = c.get('Labels') or {}
+        project = labels.get('com.docker.compose.project', '')
+        if c['Id'][:12] not in want_ids and project not in want_stacks:
+            continue
+        deps = [d.split(':')[0] for d in labels.get('com.docker.compose.depends_on', '').split(',') if d]
+        targets.append({'id': c['Id'][:12], 'name': (c.get('Names') or ['/?'])[0].lstrip('/'),
+                        'project': project, 'service': labels.get('com.docker.compose.service', ''), 'deps': deps})
+    return targets
+
+def order_bulk_targets(targets, action):
+    """
+    按 compose depends_on 分层: 同一层内可并发, 层与层之间串行
+    启动/重启: 依赖先行; 停止/删除: 反向
+    """
+    by_key = {(t['project'], t['service']): t for t in targets if t['service']}
+    level = {}
+    def depth(t, seen=()):
+        key = (t['project'], t['service'])
+        if key in level: return level[key]
+        if not t['service'] or key in seen: return 0
+        d = 0
+        for dep in t['deps']:
+            dt = by_key.get((t['project'], dep))
+            if dt: d = max(d, depth(dt, seen + (key,)) + 1)
+        level[key] = d
+        return d
+    layers = {}
+    for t in targets:
+        layers.setdefault(depth(t), []).append(t)
+    ordered = [layers[k] for k in sorted(layers)]
+    return ordered[::-1] if action in ('stop', 'rm') else ordered
+
+async def _bulk_one(action, t, extra, sem):
+    async with sem:
+        t0 = time.monotonic()
+        try:
+            if action == 'rm':
+                await docker_api.arequest("DELETE", f"/containers/{t['id']}", params={'force': 1}, timeout=60)
+            elif action == 'mem':
+                mem = MEM_OPTIONS.get(extra, 0)
+                await docker_api.arequest("POST", f"/containers/{t['id']}/update", json_body={'Memory': mem, 'MemorySwap': mem * 2}, timeout=60)
+            else:
+                await docker_api.arequest("POST", f"/containers/{t['id']}/{action}", timeout=120)
+            ok, msg = True, "成功"
+        except docker_api.DockerAPIError as e:
+            # 304 = 已经处于目标状态
+            ok, msg = (True, "无需变更") if e.status == 304 else (False, e.message[:60])
+        except Exception as e:
+            ok, msg = False, str(e)[:60]
+        return {'name': t['name'], 'ok': ok, 'msg': msg, 'elapsed': time.monotonic() - t0}
+
+async def run_bulk_action(action, targets, extra=None, ordered=True, parallel=None):
+    """并发执行批量操作, 并发数由配置 bulk_parallelism 控制"""
+    parallel = parallel or max(1, int(load_config().get('bulk_parallelism', 4)))
+    sem = asyncio.Semaphore(parallel)
+    layers = order_bulk_targets(targets, action) if ordered else [targets]
+    results = []
+    t0 = time.monotonic()
+    for layer in layers:
+        results += await asyncio.gather(*[_bulk_one(action, t, extra, sem) for t in layer])
+    return results, time.monotonic() - t0
+
+def format_bulk_report(action, results, total):
+    ok = len([r for r in results if r['ok']])
+    label = BULK_ACTIONS.get(action, action)
+    txt = (f"☑️ <b>批量操作完成</b>: {label}\n━━━━━━━━━━━━━━━\n"
+           f"✅ 成功 <code>{ok}</code> / ❌ 失败 <code>{len(results) - ok}</code> | ⏱️ 总耗时 <code>{total:.1f}s</code>\n\n")
+    for r in results[:40]:
+        txt += f"{'✅' if r['ok'] else '❌'} <code>{html.escape(r['name'][:20])}</code> {r['elapsed']:.1f}s"
+        txt += f" · {html.escape(r['msg'])}\n" if not r['ok'] or r['msg'] != "成功" else "\n"
+    if len(results) > 40:
+        txt += f"... 以及另外 {len(results) - 40} 项\n"
+    return txt
+
+# --- 📄 日志查看器 (Engine API + 环形缓冲 + 游标翻页) ---
+LOG_BUFFER_LINES = 2000     # 每个容器最多缓存的日志行数
+LOG_PAGE_LINES = 30         # 每页显示行数
+LOG_FOLLOW_INTERVAL = 3     # 跟随模式下编辑消息的最小间隔 (秒), 避免触发 Telegram 限流
+LOG_FOLLOW_MAX = 600        # 跟随模式最长持续时间 (秒)
+
+# {cid: {'lines': deque([(seq, ts, text), ...]), 'seq': 下一个序号, 'last_ts': 最后一行时间戳, 'tty': bool}}
+LOG_BUFFERS = {}
+# {(chat_id, cid): asyncio.Task}
+LOG_FOLLOWERS = {}
+
+def _log_buf(cid):
+    buf = LOG_BUFFERS.get(cid)
+    if buf is None:
+        buf = LOG_BUFFERS[cid] = {'lines': deque(maxlen=LOG_BUFFER_LINES), 'seq': 0, 'last_ts': "", 'tty': docker_api.is_tty(cid)}
+    return buf
+
+def _append_log_lines(buf, raw_lines):
+    """追加带时间戳的原始行 (timestamps=1 格式: '<RFC3339Nano> 内容'), 跳过已缓存的部分"""
+    added = 0
+    for raw in raw_lines:
+        ts, _, text = raw.partition(' ')
+        ts = _norm_ts(ts)
+        if buf['last_ts'] and ts <= buf['last_ts']:
+            continue
+        buf['lines'].append((buf['seq'], ts, text))
+        buf['seq'] += 1
+        buf['last_ts'] = ts
+        added += 1
+    return added
+
+def fill_log_buffer(cid):
+    """从 Engine API 增量拉取日志填充环形缓冲: 首次取尾部, 之后只取 last_ts 之后的新行"""
+    buf = _log_buf(cid)
+    params = {'stdout': 1, 'stderr': 1, 'timestamps': 1}
+    if buf['last_ts']:
+        params['since'] = _ts_to_unix(buf['last_ts'])
+    else:
+        params['tail'] = LOG_BUFFER_LINES
+    data = docker_api.api_get(f"/containers/{cid}/logs", params=params, raw=True)
+    return _append_log_lines(buf, docker_api.split_log_bytes(data, buf['tty']))
+
+def _norm_ts(ts):
+    """RFC3339Nano 会省略小数末尾的 0, 补齐到 9 位后才能按字符串比较先后"""
+    base, _, frac = ts.rstrip('Z').partition('.')
+    return f"{base}.{frac.split('+')[0].ljust(9, '0')[:9]}"
+
+def _ts_to_unix(ts):
+    try:
+        return int(datetime.datetime.fromisoformat(ts[:19]).replace(tzinfo=datetime.timezone.utc).timestamp())
+    except:
+        return 0
+
+def _render_log_lines(lines):
+    body = "\n".join(html.escape(t) for _, _, t in lines) or "(无日志)"
+    return body[-3500:]
+
+def build_logs_preview(cid, cursor=None, query=None):
+    """
+    日志查看器
+    cursor=None: 最新一页; cursor=N: 显示序号 < N 的上一页
+    query: 在缓冲区内用编译后的正则过滤 (服务端搜索)
+    """
+    try:
+        if cursor is None:
+            fill_log_buffer(cid)
+        buf = _log_buf(cid)
+        lines = list(buf['lines'])
+    except Exception as e:
+        lines, buf = [], None
+        err = str(e)
+    
     c = next((i for i in get_containers() if i['id'].startswith(cid)), None)
-    txt = f"📄 <b>日志预览: {safe_md(c['name'] if c else cid)}</b>\n<pre>\n{logs[-3500:]}\n</pre>"
-    kb = [[InlineKeyboardButton("🔄 刷新", callback_data=f"dk_log_v_{cid}"), InlineKeyboardButton("🔙 返回", callback_data=f"dk_view_{cid}")]]
+    title = safe_md(c['name'] if c else cid)
+    
+    if buf is None:
+        txt = f"📄 <b>日志预览: {title}</b>\n<pre>\n无法读取: {html.escape(err[:300])}\n</pre>"
+        return txt, InlineKeyboardMarkup([[InlineKeyboardButton("🔙 返回", callback_data=f"dk_view_{cid}")]])
+    
+    if query:
+        try: pattern = re.compile(query, re.IGNORECASE)
+        except re.error: pattern = re.compile(re.escape(query), re.IGNORECASE)
+        lines = [l for l in lines if pattern.search(l[2])]
+    
+    if cursor is not None:
+        lines = [l for l in lines if l[0] < cursor]
+    page = lines[-LOG_PAGE_LINES:]
+    older = page and lines and page[0][0] > lines[0][0]
+    
+    head = f"📄 <b>日志: {title}</b>"
+    if query: head += f" 🔍 <code>{html.escape(query)}</code> ({len(lines)} 条匹配)"
+    if page: head += f"\n🧾 #{page[0][0]}–#{page[-1][0]} / 缓存 {len(buf['lines'])} 行"
+    txt = f"{head}\n<pre>\n{_render_log_lines(page)}\n</pre>"
+    
+    nav = []
+    if older and not query:
+        nav.append(InlineKeyboardButton("⬅️ 更早", callback_data=f"dk_log_p_{cid}_{page[0][0]}"))
+    if cursor is not None:
+        nav.append(InlineKeyboardButton("⏭️ 最新", callback_data=f"dk_log_v_{cid}"))
+    kb = []
+    if nav: kb.append(nav)
+    kb.append([InlineKeyboardButton("🔍 搜索", callback_data=f"dk_log_s_{cid}"), InlineKeyboardButton("📡 跟随", callback_data=f"dk_log_f_{cid}")])
+    kb.append([InlineKeyboardButton("🔄 刷新", callback_data=f"dk_log_v_{cid}"), InlineKeyboardButton("🔙 返回", callback_data=f"dk_view_{cid}")])
     return txt, InlineKeyboardMarkup(kb)
 
+async def follow_logs(cid, edit, interval=LOG_FOLLOW_INTERVAL, max_duration=LOG_FOLLOW_MAX):
+    """
+    跟随模式: 订阅 Engine API 日志流写入环形缓冲, 按节流间隔编辑同一条消息
+    edit: async (txt, kb) -> None
+    """
+    buf = _log_buf(cid)
+    stop_kb = InlineKeyboardMarkup([[InlineKeyboardButton("⏹️ 停止跟随", callback_data=f"dk_log_x_{cid}")]])
+    params = {'stdout': 1, 'stderr': 1, 'timestamps': 1, 'follow': 1, 'tail': 0}
+    if buf['last_ts']:
+        params['since'] = _ts_to_unix(buf['last_ts'])
+    
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + max_duration
+    last_edit, dirty, pending = 0.0, True, b""
+    
+    async def render():
+        nonlocal last_edit, dirty
+        page = list(buf['lines'])[-LOG_PAGE_LINES:]
+        txt = f"📡 <b>跟随日志</b> <code>{cid[:12]}</code> (每 {interval}s 刷新)\n<pre>\n{_render_log_lines(page)}\n</pre>"
+        try: await edit(txt, stop_kb)
+        except Exception: pass
+        last_edit, dirty = loop.time(), False
+    
+    stream = docker_api.astream("GET", f"/containers/{cid}/logs", params=params)
+    # 同一个 __anext__ 任务跨多个节流间隔等待: 超时不能取消它, 否则异步生成器随之关闭, 跟随提前结束
+    nxt = None
+    try:
+        while loop.time() < deadline:
+            if nxt is None:
+                nxt = asyncio.ensure_future(stream.__anext__())
+            ready, _ = await asyncio.wait({nxt}, timeout=interval)
+            chunk = None
+            if ready:
+                try:
+                    chunk = nxt.result()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    nxt = None
+            if chunk:
+                if buf['tty']:
+                    pending += chunk; frames = []
+                    if b"\n" in pending:
+                        complete, _, pending = pending.rpartition(b"\n")
+                        frames = [complete + b"\n"]
+                else:
+                    frames, pending = docker_api.demux(pending + chunk)
+                text = b"".join(frames).decode('utf-8', errors='replace')
+                if _append_log_lines(buf, text.splitlines()):
+                    dirty = True
+            if dirty and loop.time() - last_edit >= interval:
+                await render()
+    finally:
+        if nxt is not None:
+            nxt.cancel()
+            await asyncio.gather(nxt, return_exceptions=True)
+        await stream.aclose()
+    # 正常结束 (超时或容器退出) 时补发最后一帧; 被取消时由调用方接管消息
+    await render()
+
 def prune_docker_resources():
-    out = run_cmd("docker system prune -f")
-    return f"✅ <b>清理成功</b>\n\n<pre>\n{out}\n</pre>"
+    """清理未使用的 Docker 资源 (在后台任务中运行, 可取消)"""
+    try:
+        # 实际删除由 dockerd 完成, 给 docker 客户端套上 scope / nice 并不能限制它, 因此不做隔离
+        out = jobs.run("docker system prune -f", timeout=600, isolate=False).stdout.decode('utf-8', 'replace')
+    except subprocess.TimeoutExpired:
+        return "⏱️ <b>清理超时</b> (600 秒)"
+    return (f"✅ <b>清理成功</b>\n\n<pre>\n{html.escape(out)}\n</pre>\n"
+            f"ℹ️ 清理由 dockerd 执行, 不受资源隔离限制")
 
 def build_image_menu():
     imgs = get_images(); in_use = get_in_use_image_ids()
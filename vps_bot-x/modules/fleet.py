@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+# modules/fleet.py - 多 VPS 模式: controller 端
+# 并发向所有 agent 发起签名 RPC 请求, 汇总为集群级视图 (总流量 / 各主机健康)
+import json, time, uuid, asyncio
+import httpx
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from config import load_config
+import modules.agent as agent_mod
+
+RPC_TIMEOUT = 10
+LOCAL_NAME = "本机"
+
+def get_agents():
+    """
+    目标列表: 配置中的 agents (+ 可选的本机)
+    agents: [{"name": "hk-1", "url": "http://10.0.0.2:9101", "token": "..."}]
+    """
+    conf = load_config()
+    agents = [dict(a) for a in conf.get('agents', []) if a.get('url')]
+    if conf.get('fleet_include_local', True):
+        agents.insert(0, {'name': LOCAL_NAME, 'url': None})
+    return agents
+
+async def call(client, agent, method, *args, timeout=None):
+    """调用单个 agent, 返回结果; 失败抛出 RuntimeError"""
+    if agent.get('url') is None:
+        # 本机直接执行, 不经网络
+        fn = agent_mod.RPC_METHODS[method]
+        return await asyncio.wait_for(asyncio.to_thread(fn, *args), timeout or agent_mod.CALL_TIMEOUT)
+    body = json.dumps({'method': method, 'args': list(args)}).encode()
+    ts, nonce = str(time.time()), uuid.uuid4().hex
+    headers = {
+        'Content-Type': 'application/json',
+        'X-Agent-Ts': ts,
+        'X-Agent-Nonce': nonce,
+        'X-Agent-Signature': agent_mod.sign(agent.get('token', ''), ts, nonce, body),
+    }
+    resp = await client.post(agent['url'].rstrip('/') + "/rpc", content=body, headers=headers,
+                             timeout=timeout or agent.get('timeout', RPC_TIMEOUT))
+    try:
+        payload = resp.json()
+    except ValueError:
+        raise RuntimeError(f"HTTP {resp.status_code}")
+    if resp.status_code != 200:
+        raise RuntimeError(payload.get('error', f"HTTP {resp.status_code}"))
+    return payload.get('result')
+
+async def fan_out(method, *args, agents=None, timeout=None):
+    """
+    并发调用所有 agent
+    返回 [(agent, ok, 结果或错误信息, 耗时ms)], 顺序与 agents 一致
+    """
+    agents = agents if agents is not None else get_agents()
+
+    async def one(client, a):
+        t0 = time.perf_counter()
+        try:
+            res = await call(client, a, method, *args, timeout=timeout)
+            return a, True, res, (time.perf_counter() - t0) * 1000
+        except httpx.TimeoutException:
+            return a, False, "超时", (time.perf_counter() - t0) * 1000
+        except Exception as e:
+            return a, False, str(e)[:80] or type(e).__name__, (time.perf_counter() - t0) * 1000
+
+    async with httpx.AsyncClient() as client:
+        return await asyncio.gather(*(one(client, a) for a in agents))
+
+def _pct(v):
+    return f"{v:.0f}%" if isinstance(v, (int, float)) else "-"
+
+def _gb(v):
+    return f"{v:.1f}G" if isinstance(v, (int, float)) else "-"
+
+async def build_fleet_overview():
+    """集群总览: 每台主机的负载/流量/容器, 以及全局合计"""
+    results = await fan_out('system.summary')
+    online = [(a, r) for a, ok, r, _ in results if ok]
+    total_m = sum(r.get('traffic_month_gb') or 0 for _, r in online)
+    total_d = sum(r.get('traffic_day_gb') or 0 for _, r in online)
+    total_run = sum(r.get('docker_running') or 0 for _, r in online)
+    total_con = sum(r.get('docker_total') or 0 for _, r in online)
+
+    txt = (f"🌐 <b>集群总览</b>\n━━━━━━━━━━━━━━━\n"
+           f"🖥️ 在线: <code>{len(online)}</code> / <code>{len(results)}</code> 台\n"
+           f"💰 月流量合计: <code>{total_m:.2f} G</code> | 今日: <code>{total_d:.2f} G</code>\n"
+           f"🐳 容器合计: <code>{total_run}</code> 运行中 / <code>{total_con}</code>\n"
+           f"━━━━━━━━━━━━━━━\n")
+    kb, row = [], []
+    for idx, (a, ok, r, ms) in enumerate(results):
+        if ok:
+            hot = max([v for v in (r.get('cpu'), r.get('ram'), r.get('disk')) if isinstance(v, (int, float))] or [0])
+            icon = "🔴" if hot >= 90 else "🟡" if hot >= 75 else "🟢"
+            quota = f"/{r.get('traffic_limit_gb')}G" if r.get('traffic_limit_gb') else ""
+            txt += (f"{icon} <b>{a['name']}</b> <i>({ms:.0f}ms)</i>\n"
+                    f"   CPU {_pct(r.get('cpu'))} | RAM {_pct(r.get('ram'))} | 盘 {_pct(r.get('disk'))}\n"
+                    f"   流量 {_gb(r.get('traffic_month_gb'))}{quota} | 🐳 {r.get('docker_running', 0)}/{r.get('docker_total', 0)}\n")
+        else:
+            icon = "⚫"
+            txt += f"{icon} <b>{a['name']}</b>: 离线 ({r})\n"
+        row.append(InlineKeyboardButton(f"{icon} {a['name'][:12]}", callback_data=f"fleet_host_{idx}"))
+        if len(row) == 2:
+            kb.append(row); row = []
+    if row: kb.append(row)
+    kb.append([InlineKeyboardButton("🏥 集群健康", callback_data="fleet_health"),
+               InlineKeyboardButton("🔄 刷新", callback_data="fleet_m")])
+    kb.append([InlineKeyboardButton("🔙 返回主菜单", callback_data="back")])
+    return txt, InlineKeyboardMarkup(kb)
+
+async def build_fleet_health():
+    """集群容器健康: 每台主机的评分分布与最差容器"""
+    results = await fan_out('health.data')
+    txt = "🏥 <b>集群容器健康</b>\n━━━━━━━━━━━━━━━\n"
+    for a, ok, r, _ in results:
+        if not ok:
+            txt += f"⚫ <b>{a['name']}</b>: 离线 ({r})\n"
+            continue
+        if not r:
+            txt += f"⚪ <b>{a['name']}</b>: 无容器\n"
+            continue
+        scores = [c['health_score'] for c in r]
+        critical = len([s for s in scores if s < 40])
+        warning = len([s for s in scores if 40 <= s < 70])
+        worst = min(r, key=lambda c: c['health_score'])
+        icon = "❌" if critical else "⚠️" if warning else "✅"
+        txt += (f"{icon} <b>{a['name']}</b>: {len(r)} 个容器 | 平均 {sum(scores) / len(scores):.0f} 分\n"
+                f"   ❌ {critical} | ⚠️ {warning} | 最差: <code>{worst['name'][:20]}</code> ({worst['health_score']})\n")
+    kb = [[InlineKeyboardButton("🔄 刷新", callback_data="fleet_health"),
+           InlineKeyboardButton("🔙 集群总览", callback_data="fleet_m")]]
+    return txt, InlineKeyboardMarkup(kb)
+
+async def build_host_view(idx, method='system.report'):
+    """单台主机的体检报告 / 故障诊断 (由该主机的 agent 生成)"""
+    agents = get_agents()
+    if not 0 <= idx < len(agents):
+        return "❌ 主机不存在 (配置可能已变更)", InlineKeyboardMarkup([[InlineKeyboardButton("🔙 集群总览", callback_data="fleet_m")]])
+    a = agents[idx]
+    (_, ok, r, _), = await fan_out(method, agents=[a], timeout=30)
+    txt = f"🖥️ <b>{a['name']}</b>\n" + (r if ok else f"❌ 请求失败: {r}")
+    kb = [
+        [InlineKeyboardButton("🌡️ 体检", callback_data=f"fleet_host_{idx}"),
+         InlineKeyboardButton("🔧 诊断", callback_data=f"fleet_diag_{idx}")],
+        [InlineKeyboardButton("🔙 集群总览", callback_data="fleet_m")]
+    ]
+    return txt[:4000], InlineKeyboardMarkup(kb)
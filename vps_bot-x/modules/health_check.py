@@ -1,123 +1,319 @@
 # -*- coding: utf-8 -*-
 # modules/health_check.py (V5.9.4 优化版 - 增强诊断能力)
-import subprocess, json, time, requests
-from datetime import datetime, timedelta
+import re, subprocess, json, time, requests, asyncio, threading
+from collections import deque
+from datetime import datetime, timedelta, timezone
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
-# 全局缓存：记录容器重启历史
+# ==================== 增量健康评分引擎 ====================
+# 评分不再每次翻页都重新采集, 而是由 docker events 事件流 + 周期性资源采样
+# 增量更新, 报告界面只读取预先计算好的 HEALTH_STATE
+# 采样命令在线程中执行, 状态修改统一持有 _STATE_LOCK (事件流在事件循环中写, 采样 / 报告可能在工作线程中)
+
+HEALTH_WINDOW = 3600        # 重启/OOM/健康检查翻转的统计窗口 (秒)
+HEALTH_SAMPLES = 60         # 每个容器保留的资源采样点数 (用于 P95)
+HEALTH_STALE = 120          # 状态超过该秒数未刷新则视为过期, 同步补采一次
+
+# 全局缓存：记录容器重启历史 {cid: deque([ts, ...])}
 RESTART_HISTORY = {}
+# 容器健康状态 {cid: {...}}
+HEALTH_STATE = {}
+LAST_SAMPLE_TS = 0
+_STATE_LOCK = threading.RLock()
 
-def get_container_health_data():
-    """
-    采集所有容器的健康数据
-    返回格式: [{'id', 'name', 'state', 'restarts', 'cpu', 'mem', 'uptime', 'health_score'}]
-    """
+def _new_entry(cid, name="", state="unknown"):
+    return {
+        'id': cid,
+        'name': name,
+        'state': state,
+        'status': "",
+        'started_at': None,
+        'oom': deque(),
+        'health': None,            # healthy / unhealthy / starting / None(未配置)
+        'health_flips': deque(),
+        'cpu_samples': deque(maxlen=HEALTH_SAMPLES),
+        'mem_samples': deque(maxlen=HEALTH_SAMPLES),
+        'cpu': "0%",
+        'mem': "0%",
+        'health_score': 0,
+        'manual_stop': False,
+    }
+
+def _get_entry(cid, name=""):
+    cid = cid[:12]
+    entry = HEALTH_STATE.get(cid)
+    if entry is None:
+        entry = HEALTH_STATE[cid] = _new_entry(cid, name)
+        RESTART_HISTORY.setdefault(cid, deque())
+    if name:
+        entry['name'] = name
+    return entry
+
+def _trim(dq, now):
+    """丢弃窗口之外的时间戳"""
+    while dq and now - dq[0] > HEALTH_WINDOW:
+        dq.popleft()
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+def _parse_perc(val):
     try:
-        # 获取容器基础信息
-        cmd = "docker ps -a --format '{{.ID}}|{{.Names}}|{{.State}}|{{.Status}}'"
-        raw = subprocess.check_output(cmd, shell=True, stderr=subprocess.STDOUT).decode('utf-8').strip()
-        
-        containers = []
-        for line in raw.split('\n'):
-            if not line or '|' not in line:
-                continue
-            
-            parts = line.split('|')
-            if len(parts) < 4:
-                continue
-            
-            cid, name, state, status = parts[0], parts[1], parts[2], parts[3]
-            
-            # 提取重启次数
-            restarts = 0
-            if 'Restarting' in status:
-                try:
-                    restarts = int(status.split('(')[1].split(')')[0])
-                except:
-                    pass
-            
-            # 获取运行时长
-            uptime = "未知"
-            if state == "running":
-                if "Up" in status:
-                    uptime = status.split("Up ")[-1].split("(")[0].strip()
-            
-            # 获取资源占用
-            cpu, mem = "0%", "0%"
-            if state == "running":
-                try:
-                    stats_cmd = f"docker stats {cid} --no-stream --format '{{{{.CPUPerc}}}}|{{{{.MemPerc}}}}'"
-                    stats = subprocess.check_output(stats_cmd, shell=True, timeout=3).decode().strip()
-                    if '|' in stats:
-                        cpu, mem = stats.split('|')
-                except:
-                    pass
-            
-            # 计算健康评分 (0-100)
-            score = calculate_health_score(state, restarts, cpu, mem, uptime)
-            
-            containers.append({
-                'id': cid,
-                'name': name,
-                'state': state,
-                'restarts': restarts,
-                'cpu': cpu,
-                'mem': mem,
-                'uptime': uptime,
-                'health_score': score
-            })
-        
-        return containers
-    except Exception as e:
-        print(f"⚠️ 健康检查异常: {e}")
-        return []
+        return float(str(val).replace('%', '').strip())
+    except:
+        return 0.0
+
+def _format_uptime(started_at, now):
+    if not started_at:
+        return "未知"
+    sec = int(now - started_at)
+    if sec >= 86400:
+        return f"{sec // 86400} 天"
+    if sec >= 3600:
+        return f"{sec // 3600} 小时"
+    return f"{max(sec // 60, 0)} 分钟"
 
-def calculate_health_score(state, restarts, cpu, mem, uptime):
+def calculate_health_score(entry, now=None):
     """
     计算健康评分 (0-100)
     规则：
     - 停止状态: 0分
     - 运行中基础分: 60分
-    - 重启次数: 每次重启 -10分
-    - CPU/内存异常: -10分
+    - 窗口内重启: 每次 -10分 (最多 -30)
+    - 窗口内 OOM: 每次 -15分 (最多 -30)
+    - 健康检查 unhealthy: -30分, 健康状态翻转: 每次 -5分 (最多 -15)
+    - CPU/内存 P95 异常: -5 / -10分
     - 运行时长加分
     """
-    if state != "running":
+    now = now or time.time()
+    if entry['state'] != "running":
         return 0
     
     score = 60
     
-    # 重启惩罚 (最多扣30分)
-    score -= min(restarts * 10, 30)
+    restarts = RESTART_HISTORY.get(entry['id'], ())
+    score -= min(len(restarts) * 10, 30)
+    score -= min(len(entry['oom']) * 15, 30)
     
-    # CPU 占用检查
-    try:
-        cpu_val = float(cpu.replace('%', ''))
-        if cpu_val > 90:
-            score -= 10
-        elif cpu_val > 70:
-            score -= 5
-    except:
-        pass
+    if entry['health'] == "unhealthy":
+        score -= 30
+    score -= min(len(entry['health_flips']) * 5, 15)
     
-    # 内存占用检查
-    try:
-        mem_val = float(mem.replace('%', ''))
-        if mem_val > 90:
+    for samples in (entry['cpu_samples'], entry['mem_samples']):
+        p95 = _percentile(samples, 95)
+        if p95 > 90:
             score -= 10
-        elif mem_val > 70:
+        elif p95 > 70:
             score -= 5
-    except:
-        pass
     
     # 运行时长加分
-    if "day" in uptime or "week" in uptime or "month" in uptime:
-        score += 20
-    elif "hour" in uptime:
-        score += 10
+    if entry['started_at']:
+        up = now - entry['started_at']
+        if up >= 86400:
+            score += 20
+        elif up >= 3600:
+            score += 10
     
     return max(0, min(100, score))
 
+def _rescore(entry, now=None):
+    now = now or time.time()
+    _trim(RESTART_HISTORY.setdefault(entry['id'], deque()), now)
+    _trim(entry['oom'], now)
+    _trim(entry['health_flips'], now)
+    entry['health_score'] = calculate_health_score(entry, now)
+
+def on_docker_event(event):
+    """
+    消费一条 docker events (JSON) 事件, 增量更新对应容器的评分
+    由 main.docker_sentinel 的事件流调用
+    """
+    if event.get('Type', 'container') != 'container':
+        return
+    action = event.get('Action') or event.get('status') or ""
+    cid = (event.get('id') or event.get('Actor', {}).get('ID', ''))[:12]
+    if not cid:
+        return
+    attrs = event.get('Actor', {}).get('Attributes', {})
+    now = event.get('time') or time.time()
+    with _STATE_LOCK:
+        _apply_event(cid, action, attrs, now)
+
+def _apply_event(cid, action, attrs, now):
+    if action == "destroy":
+        HEALTH_STATE.pop(cid, None)
+        RESTART_HISTORY.pop(cid, None)
+        return
+    
+    entry = _get_entry(cid, attrs.get('name', ""))
+    
+    if action == "start":
+        # 已经启动过又再次启动 (且不是人工停止后的启动) = 一次重启
+        if entry['started_at'] is not None and not entry['manual_stop']:
+            RESTART_HISTORY[cid].append(now)
+        entry['state'] = "running"
+        entry['started_at'] = now
+        entry['manual_stop'] = False
+    elif action in ("stop", "kill"):
+        entry['manual_stop'] = True
+    elif action == "restart":
+        # restart 事件之前已有一次 start, 这里不重复计数
+        entry['state'] = "running"
+    elif action == "die":
+        entry['state'] = "exited"
+    elif action == "oom":
+        entry['oom'].append(now)
+    elif action.startswith("health_status"):
+        new_health = action.split(":", 1)[-1].strip()
+        if entry['health'] and new_health != entry['health']:
+            entry['health_flips'].append(now)
+        entry['health'] = new_health
+    elif action in ("pause", "unpause"):
+        entry['state'] = "paused" if action == "pause" else "running"
+    
+    _rescore(entry, now)
+
+def _collect_samples():
+    """
+    采集一次资源样本: 一次 docker ps + 一次 docker stats 覆盖所有容器
+    (替代原先逐个容器 docker stats 的做法); 只执行命令, 不修改状态, 可在线程中运行
+    返回 (容器列表, {cid: (cpu, mem)}, {cid: 启动时间}, 采样时间), 失败返回 None
+    """
+    now = time.time()
+    try:
+        cmd = "docker ps -a --format '{{.ID}}|{{.Names}}|{{.State}}|{{.Status}}'"
+        raw = subprocess.check_output(cmd, shell=True, stderr=subprocess.STDOUT, timeout=10).decode('utf-8').strip()
+    except Exception as e:
+        print(f"⚠️ 健康采样异常: {e}")
+        return None
+    
+    rows = []
+    for line in raw.split('\n'):
+        parts = line.split('|')
+        if len(parts) >= 4:
+            rows.append((parts[0][:12], parts[1], parts[2], parts[3]))
+    
+    # 首次发现的运行中容器补查启动时间
+    with _STATE_LOCK:
+        unknown = [cid for cid, _, state, _ in rows
+                   if state == "running" and (cid not in HEALTH_STATE or HEALTH_STATE[cid]['started_at'] is None)]
+    started = {cid: _inspect_started_at(cid) for cid in unknown}
+    
+    stats = {}
+    try:
+        stats_cmd = "docker stats --no-stream --format '{{.ID}}|{{.CPUPerc}}|{{.MemPerc}}'"
+        out = subprocess.check_output(stats_cmd, shell=True, stderr=subprocess.DEVNULL, timeout=15).decode().strip()
+        for line in out.split('\n'):
+            parts = line.split('|')
+            if len(parts) >= 3:
+                stats[parts[0][:12]] = (parts[1], parts[2])
+    except Exception:
+        pass
+    return rows, stats, started, now
+
+def _status_health(status):
+    """从 docker ps 的 Status 取健康检查状态: "Up 2 hours (unhealthy)" -> unhealthy; 未配置健康检查返回 None"""
+    m = re.search(r'\((healthy|unhealthy|health: starting)\)', status or "")
+    if not m:
+        return None
+    return "starting" if m.group(1) == "health: starting" else m.group(1)
+
+def _apply_samples(rows, stats, started, now):
+    """把采样结果合并进 HEALTH_STATE 并重新评分"""
+    global LAST_SAMPLE_TS
+    with _STATE_LOCK:
+        seen = set()
+        for cid, name, state, status in rows:
+            seen.add(cid)
+            entry = _get_entry(cid, name)
+            entry['state'] = state
+            entry['status'] = status
+            # 启动前已处于某个健康状态的容器不会再收到 health_status 事件, 以 docker ps 为准补齐
+            health = _status_health(status)
+            if health:
+                entry['health'] = health
+            if state == "running" and entry['started_at'] is None:
+                entry['started_at'] = started.get(cid) or now
+        
+        # 清理已删除的容器
+        for cid in list(HEALTH_STATE):
+            if cid not in seen:
+                HEALTH_STATE.pop(cid, None)
+                RESTART_HISTORY.pop(cid, None)
+        
+        for cid, (cpu, mem) in stats.items():
+            entry = HEALTH_STATE.get(cid)
+            if entry is None:
+                continue
+            entry['cpu'], entry['mem'] = cpu, mem
+            entry['cpu_samples'].append(_parse_perc(cpu))
+            entry['mem_samples'].append(_parse_perc(mem))
+        
+        for entry in HEALTH_STATE.values():
+            _rescore(entry, now)
+        LAST_SAMPLE_TS = now
+
+def refresh_health_samples():
+    """同步采样并更新评分 (报告界面发现数据过期时调用)"""
+    data = _collect_samples()
+    if data:
+        _apply_samples(*data)
+
+def _inspect_started_at(cid):
+    """读取容器启动时间 (仅在首次发现运行中容器时调用)"""
+    try:
+        raw = subprocess.check_output(f"docker inspect --format '{{{{.State.StartedAt}}}}' {cid}", shell=True, stderr=subprocess.DEVNULL, timeout=5).decode().strip()
+        return datetime.fromisoformat(raw[:19]).replace(tzinfo=timezone.utc).timestamp()
+    except:
+        return None
+
+def get_container_health_data():
+    """
+    读取预计算的容器健康数据
+    返回格式: [{'id', 'name', 'state', 'restarts', 'cpu', 'mem', 'cpu_p95', 'mem_p95', 'oom', 'health', 'uptime', 'health_score'}]
+    """
+    if time.time() - LAST_SAMPLE_TS > HEALTH_STALE:
+        refresh_health_samples()
+    
+    now = time.time()
+    containers = []
+    with _STATE_LOCK:
+        for cid, e in HEALTH_STATE.items():
+            containers.append({
+                'id': cid,
+                'name': e['name'],
+                'state': e['state'],
+                'restarts': len(RESTART_HISTORY.get(cid, ())),
+                'cpu': e['cpu'],
+                'mem': e['mem'],
+                'cpu_p95': _percentile(e['cpu_samples'], 95),
+                'mem_p95': _percentile(e['mem_samples'], 95),
+                'oom': len(e['oom']),
+                'health': e['health'],
+                'uptime': _format_uptime(e['started_at'], now) if e['state'] == "running" else "未知",
+                'health_score': e['health_score']
+            })
+    return containers
+
+async def resample():
+    """立即采样一次: 命令在线程中执行, 结果回到事件循环合并 (用户点击刷新 / 后台循环共用)"""
+    data = await asyncio.to_thread(_collect_samples)
+    if data:
+        _apply_samples(*data)
+
+async def health_engine_loop(interval=30):
+    """后台采样循环, 保证报告界面读取到的评分始终是新的"""
+    while True:
+        try:
+            await resample()
+        except Exception as e:
+            print(f"⚠️ 健康引擎异常: {e}")
+        await asyncio.sleep(interval)
+
 def get_health_report_view(page=0):
     """生成健康报告界面 (带分页)"""
     containers = get_container_health_data()
@@ -171,7 +367,13 @@ def get_health_report_view(page=0):
                 f"CPU: <code>{c['cpu']}</code> | MEM: <code>{c['mem']}</code>\n")
         
         if c['restarts'] > 0:
-            txt += f"   ⚠️ 重启次数: <code>{c['restarts']}</code> 次\n"
+            txt += f"   ⚠️ 近1小时重启: <code>{c['restarts']}</code> 次\n"
+        if c['oom'] > 0:
+            txt += f"   💥 近1小时 OOM: <code>{c['oom']}</code> 次\n"
+        if c['health'] == "unhealthy":
+            txt += f"   🩺 健康检查: <code>unhealthy</code>\n"
+        if c['state'] == 'running' and (c['cpu_p95'] or c['mem_p95']):
+            txt += f"   📈 P95: CPU <code>{c['cpu_p95']:.1f}%</code> | MEM <code>{c['mem_p95']:.1f}%</code>\n"
         if c['state'] == 'running':
             txt += f"   ⏱️ 运行: {c['uptime']}\n"
         txt += "\n"
@@ -191,7 +393,7 @@ def get_health_report_view(page=0):
     if nav:
         kb.append(nav)
     
-    kb.append([InlineKeyboardButton("🔄 刷新检查", callback_data="health_check")])
+    kb.append([InlineKeyboardButton("🔄 刷新检查", callback_data="health_rf")])
     kb.append([InlineKeyboardButton("🔙 返回系统体检", callback_data="sys_report")])
     
     return txt, InlineKeyboardMarkup(kb)
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+# modules/isolation.py - 重任务的资源隔离
+# tar / 压缩 / apt / journalctl / docker prune 等由 Bot 启动的重任务不与业务进程争抢 CPU 和磁盘:
+# 有 systemd 时放进临时 scope (cgroup), 按 CPUWeight / IOWeight / 带宽上限约束 (CPUQuota 仅在配置后启用);
+# 否则退回 nice + ionice; 进程内的压缩线程只能降低 nice 值
+import os, shlex, shutil, logging
+from config import load_config
+
+# 默认值 (可由配置 isolation 覆盖)
+DEFAULTS = {
+    'mode': 'auto',         # auto (有 systemd 用 scope, 否则 nice) / systemd / nice / off
+    'cpu_weight': 20,       # CPU 权重 (1-10000, 默认 100): 空闲时不限速, 繁忙时让出 CPU
+    'cpu_quota': 0,         # 每个线程的 CPU 硬上限 (%, 100 = 一个核), 0 不限; 多线程命令按线程数放大
+    'io_weight': 10,        # IO 权重 (1-10000, 默认 100)
+    'read_mbps': 0,         # 读带宽上限 (MB/s), 0 不限
+    'write_mbps': 0,        # 写带宽上限 (MB/s), 0 不限
+    'io_path': '/',         # 带宽上限作用的设备 (该路径所在的块设备)
+    'memory_max_mb': 0,     # 内存上限 (MB), 0 不限
+    'nice': 10,
+    'ionice_class': 3,      # 2 = best-effort, 3 = idle (只在磁盘空闲时读写)
+}
+
+_SYSTEMD = []               # 检测结果缓存
+
+def _conf():
+    c = dict(DEFAULTS)
+    c.update(load_config().get('isolation', {}) or {})
+    return c
+
+def systemd_available():
+    """systemd-run --scope 需要 systemd 作为 init 且以 root 运行"""
+    if not _SYSTEMD:
+        _SYSTEMD.append(bool(shutil.which("systemd-run")) and os.path.isdir("/run/systemd/system")
+                        and os.geteuid() == 0)
+    return _SYSTEMD[0]
+
+def method(conf=None):
+    """实际使用的隔离方式: systemd / nice / off"""
+    mode = (conf or _conf())['mode']
+    if mode == 'off':
+        return 'off'
+    if mode in ('auto', 'systemd') and systemd_available():
+        return 'systemd'
+    if mode == 'systemd':
+        logging.warning("isolation.mode=systemd 但 systemd-run 不可用, 退回 nice/ionice")
+    return 'nice' if shutil.which("nice") else 'off'
+
+def prefix(conf=None, threads=1):
+    """
+    命令前缀 (参数列表); 不隔离时为空
+    threads: 命令使用的线程数 (如 zstd -T0 / pigz), 配置了 cpu_quota 时按此放大, 避免多线程压缩被压到不足一个核
+    """
+    c = conf or _conf()
+    how = method(c)
+    if how == 'systemd':
+        args = ["systemd-run", "--scope", "--quiet", "--collect", f"--nice={int(c['nice'])}",
+                "-p", f"CPUWeight={int(c['cpu_weight'])}", "-p", f"IOWeight={int(c['io_weight'])}"]
+        if c['cpu_quota']:
+            threads = max(1, min(int(threads), os.cpu_count() or 1))
+            args += ["-p", f"CPUQuota={int(c['cpu_quota']) * threads}%"]
+        if c['read_mbps']:
+            args += ["-p", f"IOReadBandwidthMax={c['io_path']} {int(c['read_mbps'])}M"]
+        if c['write_mbps']:
+            args += ["-p", f"IOWriteBandwidthMax={c['io_path']} {int(c['write_mbps'])}M"]
+        if c['memory_max_mb']:
+            args += ["-p", f"MemoryMax={int(c['memory_max_mb'])}M"]
+        return args
+    if how == 'nice':
+        args = ["nice", "-n", str(int(c['nice']))]
+        if shutil.which("ionice"):
+            args += ["ionice", "-c", str(int(c['ionice_class']))] + (["-n", "7"] if int(c['ionice_class']) == 2 else [])
+        return args
+    return []
+
+def wrap(cmd, shell=False, threads=1):
+    """
+    给命令加上隔离前缀, 返回 (命令, shell)
+    shell 字符串整体交给 sh -c, 使管道 / && 中的每个命令都在同一 scope 内
+    """
+    pre = prefix(threads=threads)
+    if not pre:
+        return cmd, shell
+    if shell or isinstance(cmd, str):
+        return pre + ["sh", "-c", cmd], False
+    return pre + list(cmd), False
+
+def shell_prefix():
+    """供 subprocess.getoutput 等 shell 命令行使用的前缀字符串 (末尾带空格)"""
+    pre = prefix()
+    return " ".join(shlex.quote(a) for a in pre) + " " if pre else ""
+
+def lower_thread_priority():
+    """
+    线程池 initializer: 降低当前线程的 nice 值 (Linux 上 setpriority 作用于单个线程)
+    进程内的压缩线程无法放进 scope, 至少让出 CPU
+    """
+    c = _conf()
+    if method(c) == 'off':
+        return
+    try:
+        os.setpriority(os.PRIO_PROCESS, 0, min(19, os.getpriority(os.PRIO_PROCESS, 0) + int(c['nice'])))
+    except (OSError, AttributeError):
+        pass
+
+def describe(conf=None):
+    """报告用的一行说明"""
+    c = conf or _conf()
+    how = method(c)
+    if how == 'systemd':
+        parts = [f"CPU 权重 {int(c['cpu_weight'])}", f"IO 权重 {int(c['io_weight'])}"]
+        if c['cpu_quota']:
+            parts.append(f"CPU 上限 {int(c['cpu_quota'])}%/线程")
+        if c['read_mbps']:
+            parts.append(f"读 {int(c['read_mbps'])}MB/s")
+        if c['write_mbps']:
+            parts.append(f"写 {int(c['write_mbps'])}MB/s")
+        if c['memory_max_mb']:
+            parts.append(f"内存 {int(c['memory_max_mb'])}MB")
+        return "systemd scope (" + ", ".join(parts) + ")"
+    if how == 'nice':
+        return f"nice {int(c['nice'])}" + (f" + ionice c{int(c['ionice_class'])}" if shutil.which("ionice") else "")
+    return "未隔离"
@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+# modules/jobs.py - 后台任务管理
+# 备份 / 智能清理 / Docker 清理 / 容器内命令 / 解压等耗时操作作为受监管的后台任务运行:
+# 按类型限制并发, 进度通过编辑同一条消息汇报, 可随时取消, 并保留最近任务记录;
+# 子进程以 wait4 回收, 资源用量 (CPU / 内存峰值 / 磁盘读写) 汇总到任务的完成报告
+import os, time, signal, asyncio, logging, resource, tempfile, subprocess, contextvars
+from collections import OrderedDict
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from config import load_config
+import modules.isolation as isolation
+
+# 各类型默认并发上限 (可用配置 job_limits 覆盖), 未登记的类型为 1
+JOB_LIMITS = {'backup': 1, 'restore': 1, 'clean': 1, 'prune': 1, 'docker_exec': 3, 'unzip': 2}
+JOB_TYPES = {'backup': '📦 备份', 'restore': '♻️ 还原', 'clean': '🧹 清理', 'prune': '🐳 Docker 清理',
+             'docker_exec': '💻 容器命令', 'unzip': '🗜️ 解压'}
+PROGRESS_INTERVAL = 3   # 进度消息最短编辑间隔 (秒), 避免触发 Telegram 限流
+KEEP_FINISHED = 20      # 保留的已结束任务数
+
+STATE_ICON = {'queued': '⏳', 'running': '🔄', 'done': '✅', 'failed': '❌', 'cancelled': '🛑'}
+
+# {job_id: {'id', 'type', 'title', 'state', 'created', 'started', 'ended', 'progress', 'result',
+#           'chat_id', 'message_id', 'task', 'procs', 'cancelled', 'usage'}}
+JOBS = OrderedDict()
+SEMAPHORES = {}         # {type: asyncio.Semaphore}
+_SEQ = [0]
+
+# 当前任务: asyncio.to_thread 会复制上下文, 工作线程里的 report() / run() 也能找到所属任务
+CURRENT = contextvars.ContextVar('job', default=None)
+
+class Cancelled(Exception):
+    """任务已被取消 (工作线程内由 run() 抛出)"""
+
+def _limit(jtype):
+    return int(load_config().get('job_limits', {}).get(jtype, JOB_LIMITS.get(jtype, 1)))
+
+def _sem(jtype):
+    if jtype not in SEMAPHORES:
+        SEMAPHORES[jtype] = asyncio.Semaphore(_limit(jtype))
+    return SEMAPHORES[jtype]
+
+def _fmt_secs(secs):
+    secs = int(secs)
+    return f"{secs // 60}m{secs % 60:02d}s" if secs >= 60 else f"{secs}s"
+
+def _duration(job):
+    if not job['started']:
+        return 0
+    return (job['ended'] or time.time()) - job['started']
+
+def report(text):
+    """工作代码中调用: 更新当前任务的进度说明 (不在任务中时忽略)"""
+    job = CURRENT.get()
+    if job:
+        job['progress'] = text
+
+def check():
+    """纯 Python 的长循环中定期调用: 所属任务已取消时抛出 Cancelled"""
+    job = CURRENT.get()
+    if job and job['cancelled']:
+        raise Cancelled()
+
+def checker():
+    """返回绑定当前任务的 check(): 供不继承上下文的线程 (线程池 / 解析线程) 使用"""
+    job = CURRENT.get()
+    def _check():
+        if job and job['cancelled']:
+            raise Cancelled()
+    return _check
+
+def track(*procs):
+    """登记当前任务启动的子进程, 取消任务时一并结束 (子进程需以 start_new_session=True 启动)"""
+    job = CURRENT.get()
+    if job:
+        job['procs'].extend(p for p in procs if p)
+        if job['cancelled']:
+            _kill(job)
+
+def _killpg(p):
+    """结束子进程所在的整个进程组: 只杀 sh -c 外壳时, 它派生的命令会继续运行"""
+    if p.returncode is not None:
+        return
+    try:
+        os.killpg(p.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        p.kill()    # 已退出, 或未以独立会话启动 (不存在该进程组)
+
+def _kill(job):
+    for p in job['procs']:
+        try:
+            _killpg(p)
+        except Exception:
+            pass
+
+def _new_usage():
+    return {'utime': 0.0, 'stime': 0.0, 'maxrss': 0, 'inblock': 0, 'oublock': 0, 'procs': 0, 'unisolated': False}
+
+def _account(job, ru):
+    u = job['usage']
+    u['utime'] += ru.ru_utime
+    u['stime'] += ru.ru_stime
+    u['maxrss'] = max(u['maxrss'], ru.ru_maxrss)
+    u['inblock'] += ru.ru_inblock
+    u['oublock'] += ru.ru_oublock
+    u['procs'] += 1
+
+def add_usage(utime=0.0):
+    """进程内的工作线程 (如分帧压缩) 计入的 CPU 时间"""
+    job = CURRENT.get()
+    if job:
+        job['usage']['utime'] += utime
+
+def wait(p, timeout=None):
+    """
+    代替 Popen.wait(): 用 wait4 回收子进程, 把它的资源用量计入当前任务
+    超时抛出 TimeoutExpired (子进程不会被结束)
+    """
+    job = CURRENT.get()
+    deadline = None if timeout is None else time.monotonic() + timeout
+    delay = 0.005
+    while p.returncode is None:
+        try:
+            pid, status, ru = os.wait4(p.pid, os.WNOHANG)
+        except ChildProcessError:
+            return p.wait()  # 已被其他线程的 poll() 回收, 用量无法统计
+        if pid:
+            p.returncode = os.waitstatus_to_exitcode(status)
+            if job:
+                _account(job, ru)
+            break
+        if deadline is not None and time.monotonic() > deadline:
+            raise subprocess.TimeoutExpired(p.args, timeout)
+        time.sleep(delay)
+        delay = min(delay * 2, 0.1)
+    return p.returncode
+
+def run(cmd, timeout=60, shell=True, isolate=True, **kw):
+    """
+    在工作线程中执行命令 (subprocess.run 的可取消版本)
+    isolate: 按 isolation 配置放进 systemd scope 或 nice/ionice 下运行
+    未指定 stdout 时输出 (含 stderr) 写入临时文件, 不会因管道写满而阻塞
+    超时抛出 TimeoutExpired, 所属任务被取消时抛出 Cancelled
+    """
+    job = CURRENT.get()
+    if job and job['cancelled']:
+        raise Cancelled()
+    if isolate:
+        cmd, shell = isolation.wrap(cmd, shell)
+    elif job:
+        job['usage']['unisolated'] = True
+    with tempfile.TemporaryFile() as out:
+        capture = 'stdout' not in kw
+        if capture:
+            kw['stdout'] = out
+        kw.setdefault('stderr', subprocess.STDOUT)
+        # 独立会话: 进程组号即 p.pid, 取消 / 超时时整组结束
+        p = subprocess.Popen(cmd, shell=shell, start_new_session=True, **kw)
+        track(p)
+        try:
+            wait(p, timeout)
+        except subprocess.TimeoutExpired:
+            _killpg(p)
+            wait(p)
+            raise
+        finally:
+            if job and p in job['procs']:
+                job['procs'].remove(p)
+        if job and job['cancelled']:
+            raise Cancelled()
+        out.seek(0)
+        return subprocess.CompletedProcess(cmd, p.returncode, out.read() if capture else None)
+
+def _fmt_usage(u):
+    cpu = u['utime'] + u['stime']
+    txt = f"📈 <b>资源占用</b>: CPU <code>{cpu:.1f}s</code> (用户 {u['utime']:.1f} / 系统 {u['stime']:.1f})"
+    if u['procs']:
+        # ru_maxrss 单位为 KB: 子进程 exec 前复制的 Bot 自身内存也计入, 不超过 Bot 自身峰值时不显示
+        if u['maxrss'] > resource.getrusage(resource.RUSAGE_SELF).ru_maxrss:
+            txt += f" | 峰值内存 <code>{u['maxrss'] / 1024:.0f} MB</code>"
+        # 块读写以 512 字节计, 只统计实际落到磁盘的读写 (不含页缓存命中)
+        txt += f" | 磁盘 读 {u['inblock'] * 512 / 1024**2:.1f} MB / 写 {u['oublock'] * 512 / 1024**2:.1f} MB"
+    # 有命令未隔离 (如工作在 dockerd 中完成的 prune) 时如实说明, 不报告为已隔离
+    return txt + f"\n🛡️ 隔离: {'部分命令未隔离' if u['unisolated'] else isolation.describe()}"
+
+def _render(job):
+    icon = STATE_ICON[job['state']]
+    txt = (f"{icon} <b>{job['title']}</b>\n━━━━━━━━━━━━━━━\n"
+           f"🆔 任务: <code>#{job['id']}</code> | {JOB_TYPES.get(job['type'], job['type'])}\n")
+    if job['state'] == 'queued':
+        txt += f"⏳ 排队中 (同类任务并发上限 {_limit(job['type'])})\n"
+    else:
+        txt += f"⏱️ 已运行: <code>{_fmt_secs(_duration(job))}</code>\n"
+    if job['progress']:
+        txt += f"\n{job['progress']}"
+    kb = [[InlineKeyboardButton("🛑 取消任务", callback_data=f"job_cancel_{job['id']}")],
+          [InlineKeyboardButton("🧵 后台任务", callback_data="jobs_m")]]
+    return txt, InlineKeyboardMarkup(kb)
+
+async def _edit(bot, job, txt, kb):
+    try:
+        await bot.edit_message_text(txt, chat_id=job['chat_id'], message_id=job['message_id'],
+                                    reply_markup=kb, parse_mode="HTML")
+    except Exception as e:
+        # 内容未变化 / 消息已被删除时忽略
+        if "not modified" not in str(e):
+            logging.warning(f"任务 #{job['id']} 进度消息更新失败: {e}")
+
+async def _ticker(bot, job):
+    """运行期间定期刷新进度消息 (只在内容变化时编辑)"""
+    last = None
+    while True:
+        txt, kb = _render(job)
+        if txt != last:
+            await _edit(bot, job, txt, kb)
+            last = txt
+        await asyncio.sleep(PROGRESS_INTERVAL)
+
+def _trim():
+    finished = [j for j in JOBS.values() if j['state'] in ('done', 'failed', 'cancelled')]
+    for j in finished[:max(0, len(finished) - KEEP_FINISHED)]:
+        JOBS.pop(j['id'], None)
+
+async def _run(jtype, title, work, bot=None, chat_id=None, message_id=None):
+    """
+    在独立 Task 中运行 work() (由 submit 创建): 受同类型并发上限约束, 可被 cancel() 取消
+    work: 无参协程函数, 返回 (结果文本, 键盘或 None)
+    传入 bot/chat_id/message_id 时, 排队与运行进度、最终结果都编辑到该消息上
+    返回 work() 的结果; 取消时返回 (取消说明, None), 失败时返回 (错误说明, None)
+    """
+    _SEQ[0] += 1
+    job = {'id': _SEQ[0], 'type': jtype, 'title': title, 'state': 'queued', 'created': time.time(),
+           'started': None, 'ended': None, 'progress': "", 'result': "", 'chat_id': chat_id,
+           'message_id': message_id, 'task': asyncio.current_task(), 'procs': [], 'cancelled': False,
+           'usage': _new_usage()}
+    JOBS[job['id']] = job
+    CURRENT.set(job)
+    show = bot is not None and message_id is not None
+    ticker = asyncio.create_task(_ticker(bot, job)) if show else None
+    result = (None, None)
+    try:
+        async with _sem(jtype):
+            job['state'], job['started'] = 'running', time.time()
+            result = await work()
+        job['state'] = 'done'
+    except (asyncio.CancelledError, Cancelled):
+        job['state'] = 'cancelled'
+        result = (f"🛑 <b>{title}</b>\n任务已取消", None)
+    except Exception as e:
+        logging.error(f"后台任务 #{job['id']} ({jtype}) 失败: {e}")
+        job['state'] = 'failed'
+        result = (f"❌ <b>{title}</b>\n执行出错: <code>{str(e)[:500]}</code>", None)
+    finally:
+        job['ended'] = time.time()
+        job['procs'].clear()
+        if ticker:
+            ticker.cancel()
+        _trim()
+    txt, kb = result
+    job['result'] = (txt or "").split("\n")[0][:80]
+    if txt and job['state'] == 'done' and (job['usage']['procs'] or job['usage']['utime']):
+        txt = f"{txt}\n\n{_fmt_usage(job['usage'])}"
+        result = (txt, kb)
+    if show and txt:
+        await _edit(bot, job, txt, kb or InlineKeyboardMarkup([[InlineKeyboardButton("🧵 后台任务", callback_data="jobs_m")]]))
+    return result
+
+def submit(jtype, title, work, bot=None, chat_id=None, message_id=None):
+    """
+    在后台启动任务并立即返回其 Task: 按钮处理函数不必等待;
+    定时任务等需要结果的调用方可 await 返回值 (取消任务不会取消调用方)
+    """
+    return asyncio.create_task(_run(jtype, title, work, bot, chat_id, message_id))
+
+def cancel(job_id):
+    """取消任务: 结束已登记的子进程并取消协程; 返回是否找到可取消的任务"""
+    job = JOBS.get(job_id)
+    if not job or job['state'] not in ('queued', 'running'):
+        return False
+    job['cancelled'] = True
+    _kill(job)
+    if job['task'] and not job['task'].done():
+        job['task'].cancel()
+    return True
+
+def build_jobs_menu():
+    """后台任务菜单: 运行中 / 排队中 / 最近结束的任务及耗时"""
+    active = [j for j in JOBS.values() if j['state'] in ('queued', 'running')]
+    recent = [j for j in reversed(JOBS.values()) if j['state'] not in ('queued', 'running')][:10]
+    txt = "🧵 <b>后台任务</b>\n━━━━━━━━━━━━━━━\n"
+    kb = []
+    if active:
+        txt += "<b>运行中</b>\n"
+        for j in active:
+            state = "排队中" if j['state'] == 'queued' else _fmt_secs(_duration(j))
+            txt += f"{STATE_ICON[j['state']]} #{j['id']} {j['title']} | ⏱️ {state}\n"
+            if j['progress']:
+                txt += f"   └ {j['progress'].splitlines()[0][:60]}\n"
+            kb.append([InlineKeyboardButton(f"🛑 取消 #{j['id']} {j['title']}"[:40], callback_data=f"job_cancel_{j['id']}")])
+    else:
+        txt += "💤 当前没有运行中的任务\n"
+    if recent:
+        txt += "\n<b>最近任务</b>\n"
+        for j in recent:
+            ended = time.strftime('%H:%M:%S', time.localtime(j['ended']))
+            cpu = j['usage']['utime'] + j['usage']['stime']
+            txt += (f"{STATE_ICON[j['state']]} #{j['id']} {j['title']} | ⏱️ {_fmt_secs(_duration(j))}"
+                    + (f" | CPU {cpu:.1f}s" if cpu else "") + f" | {ended}\n")
+    limits = " / ".join(f"{name} {_limit(t)}" for t, name in JOB_TYPES.items())
+    txt += f"\n⚙️ 并发上限: {limits}"
+    kb.append([InlineKeyboardButton("🔄 刷新", callback_data="jobs_m"), InlineKeyboardButton("🔙 返回工具箱", callback_data="tool_box")])
+    return txt, InlineKeyboardMarkup(kb)
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 # modules/network.py (V6.0.0 内网智能管理版)
 import subprocess, re, os, requests, math, ipaddress, netifaces, html, json
+import modules.isolation as isolation
 from datetime import datetime
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from config import load_ports, save_ports, SSH_FILE, load_config
@@ -630,7 +631,7 @@ def get_traffic_history():
         [InlineKeyboardButton("⏳ 小时趋势", callback_data="sys_traffic_h"), 
          InlineKeyboardButton("📅 30日账单 (现)", callback_data="sys_traffic_d"), 
          InlineKeyboardButton("🐳 实时监控", callback_data="sys_traffic_r")],
-        [InlineKeyboardButton("🔄 刷新", callback_data="sys_traffic_d"), 
+        [InlineKeyboardButton("🔄 刷新", callback_data="sys_traffic_d_rf"), 
          InlineKeyboardButton("🔙 返回", callback_data="back")]
     ]
     
@@ -644,7 +645,7 @@ def get_traffic_realtime():
                 for line in dk_raw.split('\n') if '|' in line]
     
     # nethogs 进程监控 (移除sudo)
-    nethogs_cmd = "timeout 3 nethogs -t -c 2 2>/dev/null || echo 'nethogs_unavailable'"
+    nethogs_cmd = f"{isolation.shell_prefix()}timeout 3 nethogs -t -c 2 2>/dev/null || echo 'nethogs_unavailable'"
     nethogs_raw = subprocess.getoutput(nethogs_cmd)
     
     process_dict = {}
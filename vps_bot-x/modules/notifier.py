@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+# modules/notifier.py - 统一出站消息队列
+# 每个会话一个令牌桶 + 优先级队列, 同类告警的首条立即发出, 窗口期内的后续告警折叠为一条摘要,
+# 处理 RetryAfter 限流, 监控循环只负责入队, 不再被发送阻塞
+import time, asyncio, logging, itertools
+from telegram.error import RetryAfter, TimedOut, NetworkError
+from config import load_config
+
+# 优先级通道 (数值越小越先发)
+PRIO_CRITICAL = 0
+PRIO_NORMAL = 1
+PRIO_LOW = 2
+
+CHAT_RATE = 1.0         # 单会话每秒补充令牌数 (Telegram 单聊约 1 条/秒)
+CHAT_BURST = 3          # 单会话令牌桶容量
+GLOBAL_RATE = 25.0      # 全局每秒上限 (官方约 30 条/秒, 留余量)
+DIGEST_WINDOW = 15      # 同类告警的折叠窗口 (秒)
+MAX_RETRIES = 3
+MSG_LIMIT = 4096
+
+BOT = None
+QUEUES = {}             # {chat_id: asyncio.PriorityQueue}
+WORKERS = {}            # {chat_id: asyncio.Task}
+BUCKETS = {}            # {chat_id 或 '*': {'tokens', 'ts', 'rate', 'burst'}}
+DIGESTS = {}            # {(chat_id, kind): {'items': [...], 'prio', 'task'}}, items 为首条之后的后续告警
+STATS = {'sent': 0, 'digested': 0, 'retry_after': 0, 'failed': 0}
+_SEQ = itertools.count()
+
+def start(bot):
+    """在 post_init 中调用, 绑定发送用的 bot"""
+    global BOT
+    BOT = bot
+
+def _conf_value(key, default):
+    try:
+        return load_config().get(key, default)
+    except Exception:
+        return default
+
+def _bucket(key, rate, burst):
+    b = BUCKETS.get(key)
+    if b is None:
+        b = BUCKETS[key] = {'tokens': float(burst), 'ts': time.monotonic(), 'rate': rate, 'burst': burst}
+    return b
+
+async def _take(key, rate, burst):
+    """从令牌桶取一个令牌, 不足时睡眠到可用"""
+    b = _bucket(key, rate, burst)
+    while True:
+        now = time.monotonic()
+        b['tokens'] = min(b['burst'], b['tokens'] + (now - b['ts']) * b['rate'])
+        b['ts'] = now
+        if b['tokens'] >= 1:
+            b['tokens'] -= 1
+            return
+        await asyncio.sleep((1 - b['tokens']) / b['rate'])
+
+def _penalize(key, seconds):
+    """收到 RetryAfter 后清空令牌, 并把补充起点推迟到限流结束"""
+    b = BUCKETS.get(key)
+    if b:
+        b['tokens'] = 0
+        b['ts'] = time.monotonic() + seconds
+
+def _retry_seconds(err):
+    ra = err.retry_after
+    return ra.total_seconds() if hasattr(ra, 'total_seconds') else float(ra)
+
+def _enqueue(chat_id, prio, payload):
+    q = QUEUES.get(chat_id)
+    if q is None:
+        q = QUEUES[chat_id] = asyncio.PriorityQueue()
+    q.put_nowait((prio, next(_SEQ), payload))
+    w = WORKERS.get(chat_id)
+    if w is None or w.done():
+        WORKERS[chat_id] = asyncio.create_task(_worker(chat_id))
+
+async def _send(chat_id, payload):
+    await _take('*', GLOBAL_RATE, GLOBAL_RATE)
+    await _take(chat_id, _conf_value('notify_rate', CHAT_RATE), CHAT_BURST)
+    await BOT.send_message(chat_id=chat_id, text=payload['text'], parse_mode=payload.get('parse_mode', "HTML"),
+                           reply_markup=payload.get('reply_markup'), disable_web_page_preview=True)
+
+async def _worker(chat_id):
+    """单会话发送协程: 按优先级取消息, 令牌桶限速, 遇限流整体暂停"""
+    q = QUEUES[chat_id]
+    while not q.empty():
+        prio, seq, payload = await q.get()
+        try:
+            await _send(chat_id, payload)
+            STATS['sent'] += 1
+        except RetryAfter as e:
+            wait = _retry_seconds(e) + 0.5
+            STATS['retry_after'] += 1
+            logging.warning(f"Telegram 限流, {wait:.0f}s 后重试 (chat {chat_id})")
+            _penalize(chat_id, wait)
+            q.put_nowait((prio, seq, payload))     # 保持原序号, 限流结束后仍按原顺序发出
+            await asyncio.sleep(wait)
+        except (TimedOut, NetworkError) as e:
+            payload['tries'] = payload.get('tries', 0) + 1
+            if payload['tries'] < MAX_RETRIES:
+                q.put_nowait((prio, seq, payload))
+                await asyncio.sleep(2 ** payload['tries'])
+            else:
+                STATS['failed'] += 1
+                logging.error(f"消息发送失败 (chat {chat_id}): {e}")
+        except Exception as e:
+            STATS['failed'] += 1
+            logging.error(f"消息发送失败 (chat {chat_id}): {e}")
+    WORKERS.pop(chat_id, None)
+
+def _build_digest(kind, items):
+    """把窗口内的同类告警拼成一条摘要"""
+    head = f"📦 <b>告警摘要</b> ({len(items)} 条 · {kind})\n━━━━━━━━━━━━━━━\n"
+    body, shown = "", 0
+    for text in items:
+        block = text.strip() + "\n┈┈┈┈┈┈┈┈\n"
+        if len(head) + len(body) + len(block) > MSG_LIMIT - 80:
+            break
+        body += block
+        shown += 1
+    if shown < len(items):
+        body += f"… 另有 {len(items) - shown} 条已省略"
+    return head + body
+
+async def _flush_digest(key, window):
+    await asyncio.sleep(window)
+    entry = DIGESTS.pop(key, None)
+    if not entry:
+        return
+    chat_id, kind = key
+    items = entry['items']
+    if not items:
+        return
+    if len(items) == 1:
+        _enqueue(chat_id, entry['prio'], items[0])
+    else:
+        STATS['digested'] += len(items) - 1
+        _enqueue(chat_id, entry['prio'], {'text': _build_digest(kind, [p['text'] for p in items])})
+
+def notify(text, chat_ids, kind=None, prio=PRIO_NORMAL, reply_markup=None, window=None):
+    """
+    发送通知 (仅入队, 立即返回)
+    kind: 告警类型; 首条立即发出, 之后 window 秒内的同类告警在窗口结束时合并为摘要; 为 None 则不合并
+    prio: PRIO_CRITICAL / PRIO_NORMAL / PRIO_LOW; 紧急告警从不折叠延迟
+    """
+    if BOT is None:
+        logging.error("notifier 未初始化, 消息丢弃")
+        return
+    if isinstance(chat_ids, int):
+        chat_ids = [chat_ids]
+    if window is None:
+        window = _conf_value('digest_window', DIGEST_WINDOW)
+    for chat_id in chat_ids:
+        payload = {'text': text[:MSG_LIMIT], 'reply_markup': reply_markup}
+        if not kind or window <= 0 or prio == PRIO_CRITICAL:
+            _enqueue(chat_id, prio, payload)
+            continue
+        key = (chat_id, kind)
+        entry = DIGESTS.get(key)
+        if entry:
+            entry['items'].append(payload)
+            entry['prio'] = min(entry['prio'], prio)
+        else:
+            # 前沿: 首条不等待窗口, 直接入队; 窗口只收集后续的同类告警
+            _enqueue(chat_id, prio, payload)
+            DIGESTS[key] = {'items': [], 'prio': prio,
+                            'task': asyncio.create_task(_flush_digest(key, window))}
+
+def get_stats_text():
+    pending = sum(q.qsize() for q in QUEUES.values())
+    folding = sum(len(e['items']) for e in DIGESTS.values())
+    return (f"📮 出站队列: 待发 <code>{pending}</code> | 折叠中 <code>{folding}</code>\n"
+            f"   已发 {STATS['sent']} | 合并 {STATS['digested']} | 限流 {STATS['retry_after']} | 失败 {STATS['failed']}")
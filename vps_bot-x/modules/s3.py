@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+# modules/s3.py - S3 兼容对象存储的最小客户端 (AWS / MinIO / R2 / B2 ...)
+# 只实现备份需要的几个接口: 单次 PUT、分段上传 (创建 / 上传分段 / 完成 / 放弃)、HEAD、DELETE;
+# 请求用 SigV4 签名, 载荷哈希即分段的 SHA-256, 服务端据此校验每个分段; 使用 path-style 地址
+import hmac, time, base64, hashlib, logging
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+from urllib.parse import quote, urlparse
+import httpx
+
+TIMEOUT = 120
+MAX_TRIES = 3
+EMPTY_SHA256 = hashlib.sha256(b"").hexdigest()
+
+class S3Error(Exception):
+    """对象存储返回错误 (含 HTTP 200 但正文为 <Error> 的情况)"""
+    def __init__(self, status, code, message):
+        super().__init__(f"{status} {code}: {message}")
+        self.status, self.code = status, code
+
+def _q(s, safe='-_.~'):
+    return quote(str(s), safe=safe)
+
+def _hmac(key, msg):
+    return hmac.new(key, msg.encode('utf-8'), hashlib.sha256).digest()
+
+def _xml_text(body, tag):
+    """取 XML 中第一个 tag 的文本 (忽略命名空间)"""
+    try:
+        for el in ET.fromstring(body).iter():
+            if el.tag.rsplit('}', 1)[-1] == tag:
+                return el.text
+    except ET.ParseError:
+        pass
+    return None
+
+class Client:
+    def __init__(self, endpoint, bucket, access_key, secret_key, region="us-east-1", timeout=TIMEOUT):
+        self.endpoint = endpoint.rstrip('/')
+        self.host = urlparse(self.endpoint).netloc
+        self.bucket, self.region = bucket, region or "us-east-1"
+        self.access_key, self.secret_key = access_key, secret_key
+        self.http = httpx.Client(timeout=timeout)
+
+    def close(self):
+        self.http.close()
+
+    def _path(self, key):
+        return f"/{_q(self.bucket)}/{_q(key, safe='-_.~/')}"
+
+    @staticmethod
+    def _query(query):
+        return '&'.join(f"{_q(k)}={_q(v)}" for k, v in sorted(query.items()))
+
+    def _sign(self, method, path, query, headers, payload_hash):
+        """SigV4: 返回带 Authorization 的请求头"""
+        now = datetime.now(timezone.utc)
+        amz_date, day = now.strftime('%Y%m%dT%H%M%SZ'), now.strftime('%Y%m%d')
+        hdrs = {k.lower(): str(v).strip() for k, v in headers.items()}
+        hdrs.update({'host': self.host, 'x-amz-date': amz_date, 'x-amz-content-sha256': payload_hash})
+        signed = ';'.join(sorted(hdrs))
+        canonical = '\n'.join([
+            method, path,
+            self._query(query),
+            ''.join(f"{k}:{hdrs[k]}\n" for k in sorted(hdrs)),
+            signed, payload_hash])
+        scope = f"{day}/{self.region}/s3/aws4_request"
+        to_sign = '\n'.join(['AWS4-HMAC-SHA256', amz_date, scope, hashlib.sha256(canonical.encode()).hexdigest()])
+        key = _hmac(('AWS4' + self.secret_key).encode(), day)
+        for part in (self.region, 's3', 'aws4_request'):
+            key = _hmac(key, part)
+        sig = hmac.new(key, to_sign.encode(), hashlib.sha256).hexdigest()
+        hdrs['authorization'] = (f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, "
+                                 f"SignedHeaders={signed}, Signature={sig}")
+        hdrs.pop('host')  # 由 httpx 按 URL 填写 (与签名一致)
+        return hdrs
+
+    def request(self, method, key, query=None, body=b"", headers=None, payload_hash=None):
+        """签名并发送请求, 失败 (网络错误 / 5xx / 限流) 时退避重试; 返回 httpx.Response"""
+        query = query or {}
+        payload_hash = payload_hash or (hashlib.sha256(body).hexdigest() if body else EMPTY_SHA256)
+        path = self._path(key)
+        # 查询串自行编码后拼进 URL, 保证与签名时的规范形式一致
+        url = self.endpoint + path + (f"?{self._query(query)}" if query else "")
+        for attempt in range(1, MAX_TRIES + 1):
+            hdrs = self._sign(method, path, query, headers or {}, payload_hash)
+            try:
+                resp = self.http.request(method, url, content=body, headers=hdrs)
+            except httpx.TransportError as e:
+                if attempt == MAX_TRIES:
+                    raise
+                logging.warning(f"S3 {method} {key} 网络错误, 重试 ({attempt}/{MAX_TRIES}): {e}")
+            else:
+                # CompleteMultipartUpload 可能以 200 返回 <Error>
+                code = _xml_text(resp.content, 'Code') if resp.content[:200].find(b"<Error") >= 0 else None
+                if resp.status_code < 300 and not code:
+                    return resp
+                err = S3Error(resp.status_code, code or resp.reason_phrase,
+                              _xml_text(resp.content, 'Message') or resp.text[:200])
+                if 300 <= resp.status_code < 500 and resp.status_code != 429 or attempt == MAX_TRIES:
+                    raise err
+                logging.warning(f"S3 {method} {key} 失败, 重试 ({attempt}/{MAX_TRIES}): {err}")
+            time.sleep(2 ** attempt)
+
+    # ---------- 对象 ----------
+    def put_object(self, key, data, metadata=None):
+        headers = {f"x-amz-meta-{k}": v for k, v in (metadata or {}).items()}
+        headers['content-md5'] = _b64md5(data)
+        return self.request("PUT", key, body=data, headers=headers).headers.get('etag', '').strip('"')
+
+    def head_object(self, key):
+        return self.request("HEAD", key).headers
+
+    def delete_object(self, key):
+        self.request("DELETE", key)
+
+    # ---------- 分段上传 ----------
+    def create_multipart(self, key, metadata=None):
+        headers = {f"x-amz-meta-{k}": v for k, v in (metadata or {}).items()}
+        resp = self.request("POST", key, query={'uploads': ''}, headers=headers)
+        upload_id = _xml_text(resp.content, 'UploadId')
+        if not upload_id:
+            raise S3Error(resp.status_code, "NoUploadId", resp.text[:200])
+        return upload_id
+
+    def upload_part(self, key, upload_id, number, data, sha256=None):
+        """上传一个分段; 载荷 SHA-256 与 Content-MD5 都由服务端校验; 返回 ETag"""
+        resp = self.request("PUT", key, query={'partNumber': str(number), 'uploadId': upload_id}, body=data,
+                            headers={'content-md5': _b64md5(data)}, payload_hash=sha256)
+        return resp.headers.get('etag', '').strip('"')
+
+    def complete_multipart(self, key, upload_id, etags):
+        """etags: [(分段号, ETag)]; 返回服务端给出的整体 ETag"""
+        body = ("<CompleteMultipartUpload>" +
+                "".join(f"<Part><PartNumber>{n}</PartNumber><ETag>\"{e}\"</ETag></Part>" for n, e in sorted(etags)) +
+                "</CompleteMultipartUpload>").encode()
+        resp = self.request("POST", key, query={'uploadId': upload_id}, body=body)
+        return (_xml_text(resp.content, 'ETag') or "").strip('"')
+
+    def abort_multipart(self, key, upload_id):
+        try:
+            self.request("DELETE", key, query={'uploadId': upload_id})
+        except Exception as e:
+            logging.warning(f"放弃分段上传失败 {key}: {e}")
+
+def _b64md5(data):
+    return base64.b64encode(hashlib.md5(data).digest()).decode()
+
+def multipart_etag(part_md5s):
+    """分段上传完成后的 ETag: md5(各段 md5 拼接)-段数 (未启用 SSE-KMS 时 S3 / MinIO 均如此)"""
+    return f"{hashlib.md5(b''.join(part_md5s)).hexdigest()}-{len(part_md5s)}"
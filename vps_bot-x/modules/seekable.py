@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+# modules/seekable.py - 可随机访问的备份归档
+# tar 流按固定原始长度切成互相独立的 gzip 帧 (多成员 gzip, 标准 tar/gzip 仍可整体解压),
+# 归档旁的索引记录每帧的原始/压缩偏移与每个成员在 tar 流中的位置;
+# 列目录只读索引, 还原单个文件或子目录时只解压覆盖这些成员的帧
+import os, json, gzip, time, zlib, queue, bisect, tarfile, tempfile, threading, subprocess
+from concurrent.futures import ThreadPoolExecutor
+import modules.jobs as jobs
+import modules.isolation as isolation
+
+INDEX_SUFFIX = ".idx.json.gz"   # 归档旁的帧/成员索引
+FRAME_SIZE = 4 * 1024 * 1024    # 每帧原始字节数 (越小随机读越省, 压缩率略降)
+READ_CHUNK = 1024 * 1024
+
+def index_path(archive):
+    return archive + INDEX_SUFFIX
+
+def load_index(archive):
+    try:
+        with gzip.open(index_path(archive), 'rt', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+def save_index(archive, data):
+    tmp = index_path(archive) + ".part"
+    with gzip.open(tmp, 'wt', encoding='utf-8', compresslevel=6) as f:
+        json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp, index_path(archive))
+
+def _gzip_frame(data, level):
+    # wbits=31: 带 gzip 头尾的完整成员, 可单独解压; zlib 压缩时释放 GIL, 线程池即可并行
+    t0 = time.thread_time()
+    c = zlib.compressobj(level, zlib.DEFLATED, 31)
+    out = c.compress(data) + c.flush()
+    return out, time.thread_time() - t0
+
+class _Tee:
+    """tarfile 的读取源: 透传 tar 输出, 同时把原始字节按帧切分送去压缩 (队列满时阻塞, 控制内存)"""
+    def __init__(self, src, out_q, pool, level, frame_size):
+        self.src, self.out_q, self.pool, self.level, self.frame_size = src, out_q, pool, level, frame_size
+        self.buf, self.pos, self.closed = bytearray(), 0, False
+
+    def read(self, n=-1):
+        if self.closed:
+            raise EOFError("归档写入已中止")
+        data = self.src.read(READ_CHUNK if n is None or n < 0 else n)
+        self.buf += data
+        while len(self.buf) >= self.frame_size:
+            self._cut(bytes(self.buf[:self.frame_size]))
+            del self.buf[:self.frame_size]
+        return data
+
+    def _cut(self, frame):
+        self.out_q.put((self.pos, len(frame), self.pool.submit(_gzip_frame, frame, self.level)))
+        self.pos += len(frame)
+
+    def finish(self):
+        # tarfile 读到结束块即停止, 剩余的填充零块也要进入归档
+        while self.read(READ_CHUNK):
+            pass
+        if self.buf:
+            self._cut(bytes(self.buf))
+            self.buf.clear()
+
+def _parse(tee, members, out_q):
+    """解析线程: 逐个读取 tar 成员头, 记录 [名称, 头偏移, 结束偏移, 大小, 类型, 链接目标]"""
+    try:
+        tf = tarfile.open(fileobj=tee, mode='r|', bufsize=READ_CHUNK)
+        for ti in tf:
+            # offset 指向成员第一个头块 (含 GNU 长文件名 / PAX 扩展头), 数据按 512 字节对齐
+            has_data = ti.isreg() or ti.type not in tarfile.SUPPORTED_TYPES
+            end = ti.offset_data + (-(-ti.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE if has_data else 0)
+            members.append([ti.name, ti.offset, end, ti.size, ti.type.decode('ascii', 'replace'), ti.linkname or None])
+            tf.members.clear()  # 流式模式下不保留 TarInfo, 避免大目录占用内存
+        tee.finish()
+        out_q.put(None)
+    except BaseException as e:
+        if not tee.closed:  # 消费方已退出时无人读取, 不再入队
+            out_q.put(e)
+
+def frames(src, index, level=6, workers=None, frame_size=FRAME_SIZE):
+    """
+    把 tar 输出 (src) 转为独立 gzip 帧, 按顺序产出压缩字节块; 结束后 index 中填好 frames/members
+    压缩在线程池中并行, 解析与压缩都受有界队列背压, 内存占用约为 2 × workers 帧
+    """
+    workers = workers or os.cpu_count() or 1
+    out_q = queue.Queue(maxsize=workers * 2)
+    index.update({'version': 1, 'format': 'gzip-frames', 'frame_size': frame_size, 'frames': [], 'members': []})
+    cpu = 0.0
+    # 压缩线程无法放进 cgroup, 至少降低其 nice 值
+    with ThreadPoolExecutor(max_workers=workers, initializer=isolation.lower_thread_priority) as pool:
+        tee = _Tee(src, out_q, pool, level, frame_size)
+        parser = threading.Thread(target=_parse, args=(tee, index['members'], out_q), daemon=True, name="tar-index")
+        parser.start()
+        comp_off = 0
+        try:
+            while (item := out_q.get()) is not None:
+                if isinstance(item, BaseException):
+                    raise item
+                raw_off, raw_len, fut = item
+                data, secs = fut.result()
+                cpu += secs
+                index['frames'].append([raw_off, raw_len, comp_off, len(data)])
+                comp_off += len(data)
+                yield data
+            parser.join()
+        finally:
+            jobs.add_usage(cpu)  # 进程内压缩的 CPU 时间计入所属任务
+            # 提前结束 (写盘失败 / 超时): 让解析线程在下次读取时退出, 并腾出队列避免它阻塞在 put 上
+            tee.closed = True
+            while not out_q.empty():
+                out_q.get_nowait()
+
+def select(index, paths):
+    """
+    按路径选择成员: 精确匹配文件, 或匹配目录下的整棵子树; 路径前导 / 可省略
+    硬链接成员连同其目标一起选中, 否则单独还原时 tar 无法建立链接
+    """
+    wanted = [p.strip('/') for p in paths if p.strip('/')]
+    members = index['members']
+    picked = {i for i, m in enumerate(members)
+              if any(m[0].rstrip('/') == w or m[0].startswith(w + '/') for w in wanted)}
+    by_name = {m[0]: i for i, m in enumerate(members)}
+    for i in list(picked):
+        m = members[i]
+        if m[4] == tarfile.LNKTYPE.decode() and m[5] in by_name:
+            picked.add(by_name[m[5]])
+    return [members[i] for i in sorted(picked)]
+
+def _ranges(selected):
+    """成员在 tar 流中的 [头偏移, 结束偏移), 相邻区间合并"""
+    out = []
+    for m in sorted(selected, key=lambda m: m[1]):
+        if out and m[1] <= out[-1][1]:
+            out[-1][1] = max(out[-1][1], m[2])
+        else:
+            out.append([m[1], m[2]])
+    return out
+
+def read_ranges(archive, index, ranges):
+    """只解压覆盖 ranges 的帧, 依次产出这些区间的原始字节; 返回值经 StopIteration 给出解压帧数"""
+    frames_ = index['frames']
+    starts = [f[0] for f in frames_]
+    cached, data, used = -1, b"", 0
+    with open(archive, 'rb') as f:
+        for lo, hi in ranges:
+            while lo < hi:
+                i = bisect.bisect_right(starts, lo) - 1
+                raw_off, raw_len, comp_off, comp_len = frames_[i]
+                if i != cached:
+                    f.seek(comp_off)
+                    data, cached = zlib.decompress(f.read(comp_len), 31), i
+                    used += 1
+                piece = data[lo - raw_off:min(hi, raw_off + raw_len) - raw_off]
+                if not piece:
+                    raise ValueError("索引与归档不一致")
+                yield piece
+                lo += len(piece)
+    return used
+
+def extract(archive, index, selected, target, timeout=3600):
+    """
+    把选中的成员拼成一个最小 tar 流交给 tar 解包 (权限 / 属主 / 链接处理与整包还原一致)
+    返回 (解压帧数, 总帧数)
+    """
+    os.makedirs(target, exist_ok=True)
+    gen = read_ranges(archive, index, _ranges(selected))
+    used = 0
+    with tempfile.TemporaryFile() as tar_log:
+        proc = subprocess.Popen(isolation.wrap(["tar", "-xf", "-", "-C", target])[0], stdin=subprocess.PIPE, stderr=tar_log, start_new_session=True)
+        jobs.track(proc)
+        try:
+            while True:
+                try:
+                    proc.stdin.write(next(gen))
+                except StopIteration as stop:
+                    used = stop.value
+                    break
+            proc.stdin.write(b"\0" * tarfile.BLOCKSIZE * 2)  # 结束块
+        except BrokenPipeError:
+            pass  # tar 提前退出, 以退出码为准
+        finally:
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+            try:
+                jobs.wait(proc, timeout=timeout)
+            finally:
+                if proc.poll() is None:
+                    proc.kill()
+                    jobs.wait(proc)
+        tar_log.seek(0)
+        err = tar_log.read().decode('utf-8', 'replace')
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, "tar", stderr=err)
+    return used, len(index['frames'])
+
+def list_dir(index, prefix=""):
+    """
+    目录式浏览 (只读索引): 返回 prefix 下一级的 [(名称, 是否目录, 字节数, 文件数)]
+    """
+    prefix = prefix.strip('/')
+    base = prefix + '/' if prefix else ''
+    entries = {}
+    for name, _, _, size, typ, _ in index['members']:
+        name = name.rstrip('/')
+        if not name.startswith(base) or name == prefix:
+            continue
+        rest = name[len(base):]
+        head, sep, _ = rest.partition('/')
+        e = entries.setdefault(head, [head, False, 0, 0])
+        if sep or typ == tarfile.DIRTYPE.decode():
+            e[1] = True
+        if typ in (tarfile.REGTYPE.decode(), tarfile.AREGTYPE.decode()):
+            e[2] += size
+            e[3] += 1
+    return sorted((tuple(e) for e in entries.values()), key=lambda e: (not e[1], e[0]))
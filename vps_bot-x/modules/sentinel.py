@@ -6,6 +6,9 @@ from config import load_config, save_config, ALLOWED_USER_ID, AUDIT_FILE
 from utils import log_audit
 from telegram.ext import ContextTypes
 import modules.backup as bk_mgr
+import modules.volumes as volumes
+import modules.notifier as notifier
+import modules.alert_state as alert_state
 
 # 全局状态追踪
 FAILED_LOGINS = {}  # SSH 失败登录追踪
@@ -18,6 +21,9 @@ async def sentinel_loop(context: ContextTypes.DEFAULT_TYPE):
     """
     global LAST_BACKUP_CHECK
     
+    if notifier.BOT is None:
+        notifier.start(context.bot)
+    
     while True:
         try:
             await asyncio.sleep(30)  # 30秒检查一次
@@ -94,11 +100,7 @@ async def check_ssh_attacks(context: ContextTypes.DEFAULT_TYPE):
                        f"🛡️ 状态: 已自动封禁\n"
                        f"⏰ 时间: <code>{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</code>")
                 
-                await context.bot.send_message(
-                    chat_id=ALLOWED_USER_ID,
-                    text=msg,
-                    parse_mode="HTML"
-                )
+                notifier.notify(msg, ALLOWED_USER_ID, kind="SSH 爆破封禁", prio=notifier.PRIO_CRITICAL)
         
         # 清理超过24小时的追踪记录
         now = datetime.now()
@@ -166,41 +168,28 @@ async def check_scheduled_backup(context: ContextTypes.DEFAULT_TYPE):
                         should_run = True
         
         if should_run:
-            # 执行备份
-            file_path, msg = bk_mgr.run_backup_task(is_auto=True)
-            
-            # 更新最后执行时间
-            auto['last_run'] = now.isoformat()
-            conf['auto_backup'] = auto
-            save_config(conf)
+            # 执行备份 (超过分卷大小时边打包边分卷上传)
+            file_path, msg, note = None, "", None
+            try:
+                file_path, msg, note = await volumes.backup_as_job(
+                    context.bot, ALLOWED_USER_ID, "⏰ <b>定时备份完成</b>", "定时备份")
+            except Exception as e:
+                msg = f"✅ 备份已生成, 但发送失败: {str(e)}"
+            finally:
+                # 更新最后执行时间
+                auto['last_run'] = now.isoformat()
+                conf['auto_backup'] = auto
+                save_config(conf)
             
             if file_path:
-                # 发送备份文件
-                try:
-                    with open(file_path, 'rb') as f:
-                        await context.bot.send_document(
-                            chat_id=ALLOWED_USER_ID,
-                            document=f,
-                            caption=f"⏰ <b>定时备份完成</b>\n\n{msg}",
-                            parse_mode="HTML"
-                        )
-                    
-                    # 删除临时文件
-                    os.remove(file_path)
-                    
-                except Exception as e:
-                    await context.bot.send_message(
-                        chat_id=ALLOWED_USER_ID,
-                        text=f"⚠️ 定时备份完成,但发送失败: {str(e)}",
-                        parse_mode="HTML"
-                    )
+                if note and not note.startswith("🧩"):
+                    notifier.notify(f"⚠️ 定时备份完成,但分卷发送未完成\n{note}", ALLOWED_USER_ID)
+            elif msg.startswith("✅"):
+                # 仓库模式 / 无变化跳过: 没有归档文件, 只汇报结果
+                notifier.notify(f"⏰ <b>定时备份完成</b>\n\n{msg}", ALLOWED_USER_ID)
             else:
                 # 备份失败,发送告警
-                await context.bot.send_message(
-                    chat_id=ALLOWED_USER_ID,
-                    text=f"❌ <b>定时备份失败</b>\n\n{msg}",
-                    parse_mode="HTML"
-                )
+                notifier.notify(f"❌ <b>定时备份失败</b>\n\n{msg}", ALLOWED_USER_ID)
     
     except Exception as e:
         print(f"⚠️ 定时备份检查异常: {e}")
@@ -208,7 +197,7 @@ async def check_scheduled_backup(context: ContextTypes.DEFAULT_TYPE):
 async def check_system_resources(context: ContextTypes.DEFAULT_TYPE):
     """
     系统资源预警
-    检查 CPU/内存/磁盘 是否超过阈值
+    检查 CPU/内存/磁盘 是否超过阈值 (经 alert_state 状态机, 只推送触发与恢复)
     """
     try:
         import psutil
@@ -220,43 +209,42 @@ async def check_system_resources(context: ContextTypes.DEFAULT_TYPE):
         
         # CPU 检查
         cpu = psutil.cpu_percent(interval=1)
-        if cpu > cpu_limit:
+        st = alert_state.evaluate('cpu', 'host', cpu, enter=cpu_limit)
+        if st == alert_state.FIRING:
             msg = f"⚠️ <b>CPU 负载预警</b>\n\n🌡️ 当前: <code>{cpu:.1f}%</code>\n🛑 阈值: <code>{cpu_limit}%</code>"
-            await context.bot.send_message(
-                chat_id=ALLOWED_USER_ID,
-                text=msg,
-                parse_mode="HTML"
-            )
+            notifier.notify(msg, ALLOWED_USER_ID, kind="CPU 负载")
             log_audit("SENTINEL", "CPU预警", f"{cpu:.1f}%")
+        elif st == alert_state.RESOLVED:
+            msg = f"✅ <b>CPU 负载恢复</b>\n\n🌡️ 当前: <code>{cpu:.1f}%</code>\n⏱️ 持续: <code>{alert_state.duration_text('cpu', 'host')}</code>"
+            notifier.notify(msg, ALLOWED_USER_ID, kind="CPU 负载")
         
         # 内存检查
         ram = psutil.virtual_memory()
-        if ram.percent > ram_limit:
+        st = alert_state.evaluate('ram', 'host', ram.percent, enter=ram_limit)
+        if st == alert_state.FIRING:
             msg = (f"⚠️ <b>内存使用预警</b>\n\n"
                    f"💾 当前: <code>{ram.percent:.1f}%</code>\n"
                    f"🛑 阈值: <code>{ram_limit}%</code>\n"
                    f"📊 可用: <code>{ram.available / 1024**3:.2f} GB</code>")
-            await context.bot.send_message(
-                chat_id=ALLOWED_USER_ID,
-                text=msg,
-                parse_mode="HTML"
-            )
+            notifier.notify(msg, ALLOWED_USER_ID, kind="内存使用")
             log_audit("SENTINEL", "内存预警", f"{ram.percent:.1f}%")
+        elif st == alert_state.RESOLVED:
+            msg = f"✅ <b>内存使用恢复</b>\n\n💾 当前: <code>{ram.percent:.1f}%</code>\n⏱️ 持续: <code>{alert_state.duration_text('ram', 'host')}</code>"
+            notifier.notify(msg, ALLOWED_USER_ID, kind="内存使用")
         
         # 磁盘检查 (超过95%告警)
         disk = shutil.disk_usage("/")
         disk_percent = disk.used / disk.total * 100
-        if disk_percent > 95:
+        st = alert_state.evaluate('disk_critical', '/', disk_percent)
+        if st == alert_state.FIRING:
             msg = (f"🚨 <b>磁盘空间严重不足</b>\n\n"
                    f"💾 已用: <code>{disk_percent:.1f}%</code>\n"
                    f"📊 剩余: <code>{(disk.total - disk.used) / 1024**3:.2f} GB</code>\n"
                    f"💡 建议立即清理")
-            await context.bot.send_message(
-                chat_id=ALLOWED_USER_ID,
-                text=msg,
-                parse_mode="HTML"
-            )
+            notifier.notify(msg, ALLOWED_USER_ID, kind="磁盘空间", prio=notifier.PRIO_CRITICAL)
             log_audit("SENTINEL", "磁盘预警", f"{disk_percent:.1f}%")
+        elif st == alert_state.RESOLVED:
+            notifier.notify(f"✅ <b>磁盘空间恢复</b>\n\n💾 已用: <code>{disk_percent:.1f}%</code>", ALLOWED_USER_ID, kind="磁盘空间")
     
     except Exception as e:
         print(f"⚠️ 资源检查异常: {e}")
@@ -264,16 +252,14 @@ async def check_system_resources(context: ContextTypes.DEFAULT_TYPE):
 async def check_docker_health(context: ContextTypes.DEFAULT_TYPE):
     """
     Docker 容器健康检查
-    检测容器是否异常退出
+    检测容器是否异常退出 (每个容器只在首次发现时告警, 重新运行或被删除后视为恢复)
     """
     try:
-        # 获取最近退出的容器
+        # 获取已退出的容器
         cmd = "docker ps -a --filter 'status=exited' --format '{{.ID}}|{{.Names}}|{{.Status}}' --no-trunc"
         output = subprocess.getoutput(cmd)
         
-        if not output.strip():
-            return
-        
+        failed = set()
         for line in output.split('\n'):
             if '|' not in line:
                 continue
@@ -284,18 +270,21 @@ async def check_docker_health(context: ContextTypes.DEFAULT_TYPE):
             # 检查退出码
             if 'Exited (0)' not in status:
                 # 非正常退出
+                failed.add(cid)
+                if alert_state.evaluate_flag('container_exit', cid, True) != alert_state.FIRING:
+                    continue
                 msg = (f"⚠️ <b>容器异常退出</b>\n\n"
                        f"📦 名称: <code>{name}</code>\n"
                        f"🆔 ID: <code>{cid}</code>\n"
                        f"📉 状态: <code>{status}</code>")
                 
-                await context.bot.send_message(
-                    chat_id=ALLOWED_USER_ID,
-                    text=msg,
-                    parse_mode="HTML"
-                )
+                notifier.notify(msg, ALLOWED_USER_ID, kind="容器异常退出", prio=notifier.PRIO_CRITICAL)
                 
                 log_audit("SENTINEL", "容器异常", f"{name} - {status}")
+        
+        # 不再处于异常退出状态的容器 (已重启/已删除)
+        for cid, _ in alert_state.sweep('container_exit', failed):
+            notifier.notify(f"✅ <b>容器已恢复</b>\n\n🆔 ID: <code>{cid}</code>", ALLOWED_USER_ID, kind="容器异常退出")
     
     except Exception as e:
         print(f"⚠️ Docker 健康检查异常: {e}")
@@ -316,11 +305,7 @@ async def check_network_health(context: ContextTypes.DEFAULT_TYPE):
         
         if result.returncode != 0:
             msg = "⚠️ <b>网络连接异常</b>\n\n无法连接到外网,请检查网络设置"
-            await context.bot.send_message(
-                chat_id=ALLOWED_USER_ID,
-                text=msg,
-                parse_mode="HTML"
-            )
+            notifier.notify(msg, ALLOWED_USER_ID, kind="网络异常")
             log_audit("SENTINEL", "网络异常", "外网不可达")
     
     except Exception as e:
@@ -335,6 +320,7 @@ def get_sentinel_status():
     status = {
         'ssh_bans': len(FAILED_LOGINS),
         'last_backup': LAST_BACKUP_CHECK.isoformat() if LAST_BACKUP_CHECK else "从未执行",
+        'firing_alerts': len(alert_state.get_firing()),
         'monitoring': True
     }
     return status
\ No newline at end of file
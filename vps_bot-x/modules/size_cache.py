@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+# modules/size_cache.py - 备份路径体积估算缓存
+# 菜单渲染只读缓存, 不触发磁盘 I/O; 过期后在后台线程中用并行 os.scandir 重新统计,
+# 取代每次打开菜单都对每个路径执行 du -sb (大目录 5 秒超时显示 "未知")
+import os, time, logging, threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from config import load_config
+import modules.backup as bk_mgr
+import modules.isolation as isolation
+
+SIZE_TTL = 600          # 缓存有效期 (秒), 过期后读取仍返回旧值并触发后台刷新
+SCAN_WORKERS = 8        # 并行 scandir 线程数 (目录读取以系统调用为主, 会释放 GIL)
+
+SIZE_CACHE = {}         # {path: {'size', 'files', 'ts', 'secs'}}
+REFRESHING = set()      # 正在后台统计的路径
+_LOCK = threading.Lock()
+
+def _scan_dir(path, excludes):
+    """读取单个目录: 返回 (直属文件字节数, 文件数, 子目录列表)"""
+    size, count, subdirs = 0, 0, []
+    try:
+        with os.scandir(path) as it:
+            for e in it:
+                try:
+                    # 与打包时的排除规则保持一致
+                    if excludes and bk_mgr._excluded(e.path, excludes):
+                        continue
+                    if e.is_dir(follow_symlinks=False):
+                        subdirs.append(e.path)
+                    else:
+                        size += e.stat(follow_symlinks=False).st_size
+                        count += 1
+                except OSError:
+                    continue
+    except OSError:
+        pass
+    return size, count, subdirs
+
+def walk_size(root, excludes=(), workers=SCAN_WORKERS):
+    """并行遍历目录树, 返回 (总字节数, 文件数); 不跟随符号链接"""
+    if not os.path.isdir(root) or os.path.islink(root):
+        try:
+            return os.lstat(root).st_size, 1
+        except OSError:
+            return 0, 0
+    total, files = 0, 0
+    # 后台统计大目录 (替代 du): 遍历线程降低 nice 值
+    with ThreadPoolExecutor(max_workers=workers, initializer=isolation.lower_thread_priority) as pool:
+        pending = {pool.submit(_scan_dir, root, excludes)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                size, count, subdirs = fut.result()
+                total += size
+                files += count
+                pending |= {pool.submit(_scan_dir, d, excludes) for d in subdirs}
+    return total, files
+
+def _refresh(path, excludes, workers):
+    start = time.time()
+    try:
+        size, files = walk_size(path, excludes, workers)
+        with _LOCK:
+            SIZE_CACHE[path] = {'size': size, 'files': files, 'ts': time.time(), 'secs': time.time() - start}
+    except Exception as e:
+        logging.error(f"体积统计失败 {path}: {e}")
+    finally:
+        with _LOCK:
+            REFRESHING.discard(path)
+
+def refresh(paths=None, force=False):
+    """为过期 (或 force) 的路径启动后台统计, 立即返回"""
+    conf = load_config()
+    paths = conf.get('backup_paths', []) if paths is None else paths
+    ttl = conf.get('size_cache_ttl', SIZE_TTL)
+    excludes = conf.get('backup_exclude', [])
+    workers = int(conf.get('size_scan_workers', SCAN_WORKERS))
+    now = time.time()
+    for p in paths:
+        with _LOCK:
+            entry = SIZE_CACHE.get(p)
+            if p in REFRESHING or (entry and not force and now - entry['ts'] < ttl):
+                continue
+            REFRESHING.add(p)
+        threading.Thread(target=_refresh, args=(p, excludes, workers), daemon=True, name=f"size:{p}").start()
+
+def invalidate(*paths):
+    """备份路径或内容变化后 (新增路径 / 备份完成) 触发重新统计"""
+    refresh(list(paths) if paths else None, force=True)
+
+def estimate(paths=None):
+    """
+    读取缓存中的合计体积 (不做 I/O), 顺带触发过期路径的后台刷新
+    返回: (总字节数, 已统计路径数, 路径总数, 最旧一条的时间戳或 None, 是否有统计进行中)
+    """
+    conf = load_config()
+    paths = [p for p in (conf.get('backup_paths', []) if paths is None else paths) if os.path.exists(p)]
+    refresh(paths)
+    with _LOCK:
+        entries = [SIZE_CACHE[p] for p in paths if p in SIZE_CACHE]
+        busy = any(p in REFRESHING for p in paths)
+    total = sum(e['size'] for e in entries)
+    oldest = min((e['ts'] for e in entries), default=None)
+    return total, len(entries), len(paths), oldest, busy
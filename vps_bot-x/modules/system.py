@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
 # modules/system.py (V5.9.5 最终优化版)
-import psutil, subprocess, json, re, shutil, os
+import psutil, subprocess, json, re, shutil, os, time, asyncio
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
 from datetime import datetime, timedelta
 from config import load_config, save_config
 import modules.docker_mgr as dk_mgr
+import modules.alert_state as alert_state
+import modules.jobs as jobs
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
 # --- 1. 核心数据采集 ---
@@ -103,115 +106,189 @@ def check_traffic_alert():
         return used
     return None
 
-# --- 1.5 🔧 一键故障诊断 ---
+# --- 1.2 ⚡ 并发采集 (每个数据源独立超时, 支持渐进渲染) ---
 
-def get_auto_diagnosis():
+PENDING = "⏳"          # 尚未返回
+TIMEOUT = "⌛ 超时"      # 超过该数据源的时限
+FAILED = "❌ 失败"      # 采集抛出异常
+REPORT_BUDGET = 1.0     # 首屏等待预算 (秒), 之后先展示已完成的部分
+RENDER_INTERVAL = 1.0   # 渐进刷新消息的最小间隔 (秒)
+
+def _fmt(data, key, fn):
+    """数据源已返回则格式化, 否则显示 等待/超时/失败 占位符"""
+    v = data.get(key, PENDING)
+    if v in (PENDING, TIMEOUT, FAILED):
+        return v
+    try:
+        return fn(v)
+    except Exception:
+        return FAILED
+
+def _ready(data, key):
+    return data.get(key, PENDING) not in (PENDING, TIMEOUT, FAILED)
+
+def gather_sync(sources):
     """
-    一键诊断系统问题
-    检查项目：磁盘、内存、僵尸进程、网络、Docker
+    同步版并发采集 (供定时任务 / 视图缓存在线程中调用)
+    sources: {名称: (函数, 时限秒)}; 返回 {名称: 结果 | TIMEOUT | FAILED}
+    """
+    pool = ThreadPoolExecutor(max_workers=len(sources))
+    futs = {name: pool.submit(fn) for name, (fn, _) in sources.items()}
+    start = time.monotonic()
+    data = {}
+    for name, fut in futs.items():
+        try:
+            data[name] = fut.result(timeout=max(0, start + sources[name][1] - time.monotonic()))
+        except FuturesTimeout:
+            data[name] = TIMEOUT
+        except Exception:
+            data[name] = FAILED
+    # 超时的数据源不再等待, 线程自行结束
+    pool.shutdown(wait=False, cancel_futures=True)
+    return data
+
+async def gather_progressive(sources, render, on_update=None, budget=REPORT_BUDGET, interval=RENDER_INTERVAL):
     """
+    异步版并发采集: 所有数据源同时启动, budget 秒后先用已完成部分调用 on_update(txt, kb),
+    之后每有数据源完成就 (节流) 再次刷新; 返回最终的 render(data)
+    总耗时取决于最慢的数据源, 而不是所有数据源之和
+    """
+    data = {}
+    async def run(name, fn, deadline):
+        try:
+            data[name] = await asyncio.wait_for(asyncio.to_thread(fn), deadline)
+        except asyncio.TimeoutError:
+            data[name] = TIMEOUT
+        except Exception:
+            data[name] = FAILED
+
+    tasks = {asyncio.create_task(run(name, fn, dl)) for name, (fn, dl) in sources.items()}
+    _, pending = await asyncio.wait(tasks, timeout=budget)
+    last = 0
+    while pending:
+        if on_update and time.monotonic() - last >= interval:
+            try:
+                await on_update(*render(data))
+            except Exception:
+                pass
+            last = time.monotonic()
+        _, pending = await asyncio.wait(pending, timeout=interval, return_when=asyncio.FIRST_COMPLETED)
+    return render(data)
+
+# --- 1.5 🔧 一键故障诊断 ---
+
+def _top_mem_procs():
+    return [(p.info['name'], p.info['memory_percent'] or 0) for p in sorted(
+        psutil.process_iter(['name', 'memory_percent']),
+        key=lambda p: p.info['memory_percent'] or 0,
+        reverse=True
+    )[:3]]
+
+def _diag_memory():
+    mem = psutil.virtual_memory()
+    top = _top_mem_procs() if mem.percent > 90 else []
+    return mem, psutil.swap_memory(), top
+
+def _diag_ping():
+    return subprocess.run(["ping", "-c", "1", "-W", "2", "8.8.8.8"], capture_output=True, timeout=3).returncode == 0
+
+def _diagnosis_sources():
+    return {
+        'disk':   (lambda: shutil.disk_usage("/"), 2),
+        'mem':    (_diag_memory, 3),
+        'cpu':    (lambda: psutil.cpu_percent(interval=1), 3),
+        'zombie': (lambda: len([p for p in psutil.process_iter(['status']) if p.info['status'] == 'zombie']), 3),
+        'docker': (lambda: subprocess.getoutput("docker ps 2>&1"), 5),
+        'ping':   (_diag_ping, 4),
+        'ssh':    (lambda: subprocess.getoutput("grep 'Failed password' /var/log/auth.log 2>/dev/null | tail -5"), 3),
+        'uptime': (lambda: subprocess.getoutput("uptime -p"), 2),
+    }
+
+DIAG_LABELS = {'disk': '磁盘', 'mem': '内存', 'cpu': 'CPU', 'zombie': '僵尸进程', 'docker': 'Docker',
+               'ping': '网络', 'ssh': 'SSH', 'uptime': '运行时间'}
+
+def render_diagnosis(data):
+    """根据已采集的数据生成诊断报告 (未返回的检查项显示为检测中)"""
     issues = []
     warnings = []
     goods = []
+    disk_percent = mem_percent = 0
     
     # 1. 磁盘检查
-    disk = shutil.disk_usage("/")
-    disk_percent = disk.used / disk.total * 100
-    disk_free_gb = (disk.total - disk.used) / 1024**3
-    
-    if disk_percent > 90:
-        issues.append(f"❌ <b>磁盘严重不足</b> ({disk_percent:.1f}% 已用)")
-        issues.append(f"   建议: 清理日志或删除无用文件")
-    elif disk_percent > 80:
-        warnings.append(f"⚠️ 磁盘空间紧张 ({disk_percent:.1f}% 已用)")
-    else:
-        goods.append(f"✅ 磁盘空间充足 (剩余 {disk_free_gb:.1f} GB)")
+    if _ready(data, 'disk'):
+        disk = data['disk']
+        disk_percent = disk.used / disk.total * 100
+        disk_free_gb = (disk.total - disk.used) / 1024**3
+        if disk_percent > 90:
+            issues.append(f"❌ <b>磁盘严重不足</b> ({disk_percent:.1f}% 已用)")
+            issues.append(f"   建议: 清理日志或删除无用文件")
+        elif disk_percent > 80:
+            warnings.append(f"⚠️ 磁盘空间紧张 ({disk_percent:.1f}% 已用)")
+        else:
+            goods.append(f"✅ 磁盘空间充足 (剩余 {disk_free_gb:.1f} GB)")
     
     # 2. 内存检查
-    mem = psutil.virtual_memory()
-    swap = psutil.swap_memory()
-    
-    if mem.percent > 90:
-        issues.append(f"❌ <b>内存严重不足</b> ({mem.percent:.1f}% 已用)")
-        # 找出内存占用最高的进程
-        try:
-            procs = sorted(
-                psutil.process_iter(['name', 'memory_percent']), 
-                key=lambda p: p.info['memory_percent'] or 0,
-                reverse=True
-            )[:3]
-            issues.append(f"   占用最高:")
-            for p in procs:
-                issues.append(f"     • {p.info['name']}: {p.info['memory_percent']:.1f}%")
-        except:
-            pass
-    elif mem.percent > 75:
-        warnings.append(f"⚠️ 内存使用偏高 ({mem.percent:.1f}%)")
-    else:
-        goods.append(f"✅ 内存充足 ({mem.available / 1024**3:.1f} GB 可用)")
-    
-    if swap.percent > 50:
-        warnings.append(f"⚠️ 交换区使用 {swap.percent:.1f}% (性能可能下降)")
+    if _ready(data, 'mem'):
+        mem, swap, top = data['mem']
+        mem_percent = mem.percent
+        if mem.percent > 90:
+            issues.append(f"❌ <b>内存严重不足</b> ({mem.percent:.1f}% 已用)")
+            if top:
+                issues.append(f"   占用最高:")
+                for name, perc in top:
+                    issues.append(f"     • {name}: {perc:.1f}%")
+        elif mem.percent > 75:
+            warnings.append(f"⚠️ 内存使用偏高 ({mem.percent:.1f}%)")
+        else:
+            goods.append(f"✅ 内存充足 ({mem.available / 1024**3:.1f} GB 可用)")
+        if swap.percent > 50:
+            warnings.append(f"⚠️ 交换区使用 {swap.percent:.1f}% (性能可能下降)")
     
     # 3. CPU 检查
-    cpu_percent = psutil.cpu_percent(interval=1)
-    if cpu_percent > 90:
-        issues.append(f"❌ <b>CPU 负载过高</b> ({cpu_percent:.1f}%)")
-    elif cpu_percent > 70:
-        warnings.append(f"⚠️ CPU 使用偏高 ({cpu_percent:.1f}%)")
-    else:
-        goods.append(f"✅ CPU 正常 ({cpu_percent:.1f}%)")
+    if _ready(data, 'cpu'):
+        cpu_percent = data['cpu']
+        if cpu_percent > 90:
+            issues.append(f"❌ <b>CPU 负载过高</b> ({cpu_percent:.1f}%)")
+        elif cpu_percent > 70:
+            warnings.append(f"⚠️ CPU 使用偏高 ({cpu_percent:.1f}%)")
+        else:
+            goods.append(f"✅ CPU 正常 ({cpu_percent:.1f}%)")
     
     # 4. 僵尸进程检查
-    try:
-        zombies = [p for p in psutil.process_iter(['status']) if p.info['status'] == 'zombie']
-        if len(zombies) > 0:
-            warnings.append(f"⚠️ 检测到 {len(zombies)} 个僵尸进程")
-    except:
-        pass
+    if _ready(data, 'zombie') and data['zombie'] > 0:
+        warnings.append(f"⚠️ 检测到 {data['zombie']} 个僵尸进程")
     
     # 5. Docker 检查
-    try:
-        docker_ps = subprocess.getoutput("docker ps 2>&1")
+    if _ready(data, 'docker'):
+        docker_ps = data['docker']
         if "Cannot connect" in docker_ps or "permission denied" in docker_ps:
             issues.append(f"❌ <b>Docker 服务异常</b>")
             issues.append(f"   建议: 执行 <code>systemctl restart docker</code>")
         else:
             goods.append(f"✅ Docker 服务正常")
-    except:
+    elif data.get('docker') in (TIMEOUT, FAILED):
         warnings.append(f"⚠️ 无法检测 Docker 状态")
     
     # 6. 网络检查
-    try:
-        resp = subprocess.run(
-            ["ping", "-c", "1", "-W", "2", "8.8.8.8"], 
-            capture_output=True, 
-            timeout=3
-        )
-        if resp.returncode == 0:
+    if _ready(data, 'ping'):
+        if data['ping']:
             goods.append(f"✅ 网络连接正常")
         else:
             warnings.append(f"⚠️ 外网连接异常")
-    except:
+    elif data.get('ping') in (TIMEOUT, FAILED):
         warnings.append(f"⚠️ 网络检测超时")
     
     # 7. SSH 安全检查
-    try:
-        ssh_log = subprocess.getoutput("grep 'Failed password' /var/log/auth.log 2>/dev/null | tail -5")
-        if ssh_log:
-            failed_count = len(ssh_log.split('\n'))
-            if failed_count >= 5:
-                warnings.append(f"⚠️ 检测到 SSH 爆破尝试 (近期 {failed_count} 次)")
-    except:
-        pass
-    
-    # 8. ✅ 新增: 系统运行时间检查
-    try:
-        uptime_info = subprocess.getoutput("uptime -p")
-        if uptime_info:
-            goods.append(f"⏱️ 系统运行时间: {uptime_info.replace('up ', '')}")
-    except:
-        pass
+    if _ready(data, 'ssh') and data['ssh']:
+        failed_count = len(data['ssh'].split('\n'))
+        if failed_count >= 5:
+            warnings.append(f"⚠️ 检测到 SSH 爆破尝试 (近期 {failed_count} 次)")
+    
+    # 8. 系统运行时间检查
+    if _ready(data, 'uptime') and data['uptime']:
+        goods.append(f"⏱️ 系统运行时间: {data['uptime'].replace('up ', '')}")
+    
+    waiting = [DIAG_LABELS[k] for k in DIAG_LABELS if data.get(k, PENDING) == PENDING]
     
     # 生成报告
     txt = "🔧 <b>一键故障诊断报告</b>\n━━━━━━━━━━━━━━━\n\n"
@@ -228,14 +305,16 @@ def get_auto_diagnosis():
         txt += "✅ <b>正常项目</b>:\n"
         txt += "\n".join(goods) + "\n\n"
     
-    if not issues and not warnings:
+    if waiting:
+        txt += f"⏳ <b>检测中</b>: {', '.join(waiting)}\n\n"
+    elif not issues and not warnings:
         txt += "🎉 <b>系统运行完美！未发现任何问题。</b>\n"
     
     # 智能建议
     txt += "━━━━━━━━━━━━━━━\n💡 <b>智能建议</b>:\n"
     if disk_percent > 80:
         txt += "• 执行系统清理可释放空间\n"
-    if mem.percent > 80:
+    if mem_percent > 80:
         txt += "• 考虑重启高占用容器\n"
     if issues or warnings:
         txt += "• 建议定期运行诊断工具\n"
@@ -251,55 +330,67 @@ def get_auto_diagnosis():
     
     return txt, InlineKeyboardMarkup(kb)
 
+def get_auto_diagnosis():
+    """
+    一键诊断系统问题 (同步版, 各检查项并发执行)
+    检查项目：磁盘、内存、僵尸进程、网络、Docker
+    """
+    return render_diagnosis(gather_sync(_diagnosis_sources()))
+
+async def get_auto_diagnosis_async(on_update=None):
+    """一键诊断 (渐进版): 先展示已完成的检查项, 慢的检查项完成后原地刷新"""
+    return await gather_progressive(_diagnosis_sources(), render_diagnosis, on_update)
+
 # --- 2. 🌡️ 系统体检报告 ---
 
-def get_system_report():
-    """生成详尽的体检报告文本"""
+def _docker_counts():
+    docks = dk_mgr.get_containers()
+    return len([d for d in docks if d['state'] == 'running']), len(docks)
+
+def _count_bans():
+    """统计防火墙封禁数 (只统计DROP规则)"""
+    fw_out = subprocess.getoutput("iptables -S INPUT 2>/dev/null | grep 'DROP'")
+    # 只匹配 -j DROP 的规则,排除 0.0.0.0/0 这种全局规则
+    ban_ips = re.findall(r'-A INPUT -s ([\d\./]+).*?-j DROP', fw_out)
+    return len([ip for ip in ban_ips if ip != "0.0.0.0/0"])
+
+def _report_sources():
+    return {
+        'ip':        (get_public_ip, 5),
+        'cpu':       (lambda: psutil.cpu_percent(interval=0.5), 2),
+        'ram':       (psutil.virtual_memory, 2),
+        'disk':      (lambda: shutil.disk_usage("/"), 2),
+        'traffic_m': (lambda: get_traffic_stats('month'), 5),
+        'traffic_d': (lambda: get_traffic_stats('day'), 5),
+        'docker':    (_docker_counts, 5),
+        'bans':      (_count_bans, 3),
+    }
+
+def render_system_report(data):
+    """根据已采集的数据渲染体检报告 (未返回的数据源显示占位符)"""
     conf = load_config()
-    ip = get_public_ip()
-    cpu = psutil.cpu_percent(interval=0.5)
-    ram = psutil.virtual_memory()
-    disk = shutil.disk_usage("/")
-    
-    used_m = get_traffic_stats('month')
-    used_d = get_traffic_stats('day')
     limit = conf.get('traffic_limit_gb', 1000)
     
     # 进度条逻辑
-    perc = (used_m / limit * 100) if limit > 0 else 0
-    bar_len = 10
-    filled = int(perc / (100 / bar_len))
-    bar = f"{'▓' * filled}{'░' * (bar_len - filled)} {perc:.1f}%"
-    
-    # Docker 状态
-    try:
-        docks = dk_mgr.get_containers()
-        d_run = len([d for d in docks if d['state'] == 'running'])
-        d_total = len(docks)
-    except:
-        d_run, d_total = 0, 0
+    def bar(used_m):
+        perc = (used_m / limit * 100) if limit > 0 else 0
+        bar_len = 10
+        filled = int(perc / (100 / bar_len))
+        return f"{'▓' * filled}{'░' * (bar_len - filled)} {perc:.1f}%"
     
-    # 统计防火墙封禁数 (只统计DROP规则)
-    try:
-        fw_out = subprocess.getoutput("iptables -S INPUT 2>/dev/null | grep 'DROP'")
-        # 只匹配 -j DROP 的规则,排除 0.0.0.0/0 这种全局规则
-        ban_ips = re.findall(r'-A INPUT -s ([\d\./]+).*?-j DROP', fw_out)
-        ban_ips = [ip for ip in ban_ips if ip != "0.0.0.0/0"]
-        ban_count = len(ban_ips)
-    except:
-        ban_count = 0
+    ban_count = data['bans'] if _ready(data, 'bans') else 0
 
     txt = (f"🏥 <b>VPS 系统体检报告</b>\n"
            f"━━━━━━━━━━━━━━━\n"
            f"📛 <b>备注</b>: <code>{conf.get('server_remark', 'MyVPS')}</code>\n"
-           f"🌐 <b>IP</b>: <code>{ip}</code>\n"
-           f"🌡️ <b>负载</b>: <code>{cpu}%</code> CPU | <code>{ram.percent}%</code> RAM\n"
-           f"💾 <b>硬盘</b>: <code>{int(disk.used/1024**3)}G</code> / <code>{int(disk.total/1024**3)}G</code>\n"
-           f"🐳 <b>Docker</b>: <code>{d_run}</code> 运行中 / <code>{d_total}</code> 总计\n"
-           f"💰 <b>月流量</b>: <code>{used_m:.2f} G</code> / <code>{limit} G</code>\n"
-           f"🚨 <b>今日流量</b>: <code>{used_d:.2f} G</code>\n"
-           f"📈 <b>使用率</b>: <code>{bar}</code>\n"
-           f"🛡️ <b>防火墙</b>: 已封禁 <code>{ban_count}</code> 个恶意 IP\n")
+           f"🌐 <b>IP</b>: <code>{_fmt(data, 'ip', str)}</code>\n"
+           f"🌡️ <b>负载</b>: <code>{_fmt(data, 'cpu', lambda v: f'{v}%')}</code> CPU | <code>{_fmt(data, 'ram', lambda v: f'{v.percent}%')}</code> RAM\n"
+           f"💾 <b>硬盘</b>: <code>{_fmt(data, 'disk', lambda v: f'{int(v.used/1024**3)}G</code> / <code>{int(v.total/1024**3)}G')}</code>\n"
+           f"🐳 <b>Docker</b>: {_fmt(data, 'docker', lambda v: f'<code>{v[0]}</code> 运行中 / <code>{v[1]}</code> 总计')}\n"
+           f"💰 <b>月流量</b>: <code>{_fmt(data, 'traffic_m', lambda v: f'{v:.2f} G')}</code> / <code>{limit} G</code>\n"
+           f"🚨 <b>今日流量</b>: <code>{_fmt(data, 'traffic_d', lambda v: f'{v:.2f} G')}</code>\n"
+           f"📈 <b>使用率</b>: <code>{_fmt(data, 'traffic_m', bar)}</code>\n"
+           f"🛡️ <b>防火墙</b>: 已封禁 <code>{_fmt(data, 'bans', str)}</code> 个恶意 IP\n")
             
     # 构建按钮(添加黑名单快速入口)
     kb_rows = [
@@ -312,13 +403,49 @@ def get_system_report():
         kb_rows.append([InlineKeyboardButton(f"🚫 查看黑名单 ({ban_count}个)", callback_data="ban_list")])
     
     kb_rows.extend([
-        [InlineKeyboardButton("🔄 重新体检", callback_data="sys_report")],
+        [InlineKeyboardButton("🔄 重新体检", callback_data="sys_report_rf")],
         [InlineKeyboardButton("🔙 返回主菜单", callback_data="back")]
     ])
     
     kb = InlineKeyboardMarkup(kb_rows)
     return txt, kb
 
+def get_system_report():
+    """生成详尽的体检报告文本 (同步版, 供定时简报与视图缓存使用)"""
+    return render_system_report(gather_sync(_report_sources()))
+
+async def get_system_report_async(on_update=None):
+    """体检报告 (渐进版): 各数据源并发采集, 慢的数据源 (公网IP/vnstat) 返回后原地刷新"""
+    return await gather_progressive(_report_sources(), render_system_report, on_update)
+
+
+def get_summary():
+    """
+    结构化的主机摘要 (多 VPS 模式下由 agent 返回给 controller 汇总)
+    数据源与体检报告相同, 同样并发采集
+    """
+    data = gather_sync(_report_sources())
+    conf = load_config()
+    ram = data['ram'] if _ready(data, 'ram') else None
+    disk = data['disk'] if _ready(data, 'disk') else None
+    docker = data['docker'] if _ready(data, 'docker') else (0, 0)
+    return {
+        'remark': conf.get('server_remark', 'MyVPS'),
+        'ip': data['ip'] if _ready(data, 'ip') else None,
+        'cpu': data['cpu'] if _ready(data, 'cpu') else None,
+        'ram': ram.percent if ram else None,
+        'disk': round(disk.used / disk.total * 100, 1) if disk else None,
+        'disk_free_gb': round(disk.free / 1024**3, 1) if disk else None,
+        'traffic_month_gb': round(data['traffic_m'], 2) if _ready(data, 'traffic_m') else None,
+        'traffic_day_gb': round(data['traffic_d'], 2) if _ready(data, 'traffic_d') else None,
+        'traffic_limit_gb': conf.get('traffic_limit_gb', 1000),
+        'docker_running': docker[0],
+        'docker_total': docker[1],
+        'bans': data['bans'] if _ready(data, 'bans') else None,
+        'uptime': int(time.time() - psutil.boot_time()),
+        'load': os.getloadavg()[0] if hasattr(os, 'getloadavg') else None,
+    }
+
 # --- 3. 🧹 智能扫地僧 ---
 
 CLEAN_STATES = {}
@@ -385,12 +512,13 @@ def run_smart_clean(uid):
     for k, v in CLEAN_TASKS.items():
         if st[k]:
             try:
+                jobs.report("\n".join(res + [f"🔄 {v['name']}: 执行中..."]))
                 # 获取清理前的磁盘使用
                 disk_before = shutil.disk_usage("/").used
                 
-                # 执行清理命令
-                subprocess.run(v['cmd'], shell=True, check=True, timeout=60, 
-                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                # 执行清理命令 (可随任务取消)
+                if jobs.run(v['cmd'], timeout=60, stdout=subprocess.DEVNULL).returncode != 0:
+                    raise subprocess.CalledProcessError(1, v['cmd'])
                 
                 # 计算释放空间
                 disk_after = shutil.disk_usage("/").used
@@ -403,6 +531,8 @@ def run_smart_clean(uid):
                     
             except subprocess.TimeoutExpired:
                 res.append(f"⏱️ {v['name']}: 超时")
+            except jobs.Cancelled:
+                raise
             except Exception as e:
                 res.append(f"❌ {v['name']}: 失败")
     
@@ -420,23 +550,36 @@ def run_smart_clean(uid):
     return report, kb
 
 def check_system_limits():
-    """检查系统资源是否超过极限 (90%)"""
+    """
+    检查系统资源是否超过极限
+    经 alert_state 状态机过滤: 只在进入告警 / 恢复正常时返回消息
+    """
     alerts = []
+    conf = load_config()
     
     # 1. CPU
     cpu = psutil.cpu_percent(interval=0.5)
-    if cpu > 90:
+    st = alert_state.evaluate('cpu', 'host', cpu, enter=conf.get('cpu_limit', 90))
+    if st == alert_state.FIRING:
         alerts.append(f"🔥 <b>CPU 负载过高</b>: <code>{cpu}%</code>")
+    elif st == alert_state.RESOLVED:
+        alerts.append(f"✅ <b>CPU 负载已恢复</b>: <code>{cpu}%</code> (持续 {alert_state.duration_text('cpu', 'host')})")
         
     # 2. RAM
     ram = psutil.virtual_memory()
-    if ram.percent > 90:
+    st = alert_state.evaluate('ram', 'host', ram.percent, enter=conf.get('ram_limit', 90))
+    if st == alert_state.FIRING:
         alerts.append(f"🧠 <b>內存即將耗盡</b>: <code>{ram.percent}%</code> (剩餘 {ram.available/1024**2:.1f}MB)")
+    elif st == alert_state.RESOLVED:
+        alerts.append(f"✅ <b>內存已恢復</b>: <code>{ram.percent}%</code> (持续 {alert_state.duration_text('ram', 'host')})")
         
     # 3. Disk
     disk = shutil.disk_usage("/")
     disk_p = (disk.used / disk.total) * 100
-    if disk_p > 90:
+    st = alert_state.evaluate('disk', '/', disk_p)
+    if st == alert_state.FIRING:
         alerts.append(f"💾 <b>磁盤空間不足</b>: <code>{disk_p:.1f}%</code> (剩餘 {disk.free/1024**3:.2f}GB)")
+    elif st == alert_state.RESOLVED:
+        alerts.append(f"✅ <b>磁盤空間已恢復</b>: <code>{disk_p:.1f}%</code>")
         
     return alerts
\ No newline at end of file
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+# modules/uploads.py - 上传文件接收与解压
+# 下载前检查剩余空间, 先写同目录临时文件再原子改名 (可选 SHA-256 校验);
+# 压缩包在后台任务中流式解压, 汇报进度并限制解压总量, 防止大文件或压缩炸弹占满磁盘
+import os, re, html, time, shutil, asyncio, hashlib, zipfile, tarfile, tempfile, logging
+from config import load_config
+from utils import get_path_id
+import modules.jobs as jobs
+import modules.bot_api as bot_api
+
+RESERVE_MB = 512            # 下载/解压后至少保留的剩余空间
+EXTRACT_MAX_MB = 4096       # 单个压缩包解压总量上限
+COPY_CHUNK = 1024 * 1024
+ARCHIVE_EXTS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')
+
+UPLOADS = {}                # {upload_id: 文件路径}, 供 "立即解压" 按钮引用 (callback_data 限 64 字节)
+
+class LimitExceeded(Exception):
+    """解压总量超过上限或剩余空间不足"""
+
+def _reserve():
+    return int(load_config().get('upload_reserve_mb', RESERVE_MB)) * 1024 * 1024
+
+def _fmt_mb(n):
+    return f"{n / 1024**2:.1f} MB"
+
+def is_archive(name):
+    return name.lower().endswith(ARCHIVE_EXTS)
+
+def register(path):
+    uid = get_path_id(path)
+    UPLOADS[uid] = path
+    return uid
+
+def check_space(folder, size):
+    """下载前检查: 返回 (是否足够, 说明)"""
+    free = shutil.disk_usage(folder).free
+    if size + _reserve() > free:
+        return False, (f"❌ <b>磁盘空间不足</b>\n📊 文件: <code>{_fmt_mb(size)}</code> | 剩余: <code>{_fmt_mb(free)}</code>\n"
+                       f"💡 需保留 {_fmt_mb(_reserve())} 余量")
+    return True, ""
+
+def parse_checksum(caption):
+    """从文件说明中提取期望的 SHA-256 (sha256:<hex> 或单独的 64 位十六进制)"""
+    m = re.search(r'\b([0-9a-fA-F]{64})\b', caption or "")
+    return m.group(1).lower() if m else None
+
+class _HashWriter:
+    """下载写入目标: 边写临时文件边计算 SHA-256"""
+    def __init__(self, f):
+        self.f, self.sha, self.size = f, hashlib.sha256(), 0
+
+    def write(self, data):
+        self.sha.update(data)
+        self.size += len(data)
+        return self.f.write(data)
+
+def _copy_local(src, w):
+    """本地模式: 服务器已把文件落在本机磁盘, 分块复制 (不整块读入内存)"""
+    with open(src, 'rb') as f:
+        while buf := f.read(COPY_CHUNK):
+            w.write(buf)
+
+async def receive(tg_file, folder, file_name, expected_size=None, expected_sha=None):
+    """
+    下载到 folder 下的临时文件, 校验大小 / 校验和后原子改名为 file_name
+    返回: (最终路径, SHA-256, 耗时); 校验失败抛出 ValueError (临时文件已清理)
+    """
+    name = os.path.basename(file_name) or "upload.bin"
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=f".{name}.", suffix=".part", dir=folder)
+    start = time.time()
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            w = _HashWriter(f)
+            src = bot_api.local_path(tg_file)
+            if src:
+                await asyncio.to_thread(_copy_local, src, w)
+            else:
+                await tg_file.download_to_memory(out=w)
+            f.flush()
+            os.fsync(f.fileno())
+        if expected_size and w.size != expected_size:
+            raise ValueError(f"大小不符: 收到 {w.size} 字节, 应为 {expected_size}")
+        digest = w.sha.hexdigest()
+        if expected_sha and digest != expected_sha:
+            raise ValueError(f"SHA-256 不符: {digest}")
+        final = os.path.join(folder, name)
+        os.replace(tmp, final)
+        return final, digest, time.time() - start
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def _extract_limit(dest_parent):
+    conf = load_config()
+    cap = int(conf.get('upload_extract_max_mb', EXTRACT_MAX_MB)) * 1024 * 1024
+    room = shutil.disk_usage(dest_parent).free - _reserve()
+    return max(0, min(cap, room)), cap
+
+def _safe_target(root, name):
+    target = os.path.realpath(os.path.join(root, name))
+    if target != root and not target.startswith(root + os.sep):
+        raise ValueError(f"非法路径: {name}")
+    return target
+
+class _Progress:
+    """按压缩包读取位置汇报进度 (在工作线程中调用)"""
+    def __init__(self, f, total):
+        self.f, self.total, self.files, self.out = f, max(total, 1), 0, 0
+
+    def tick(self, files=0, out=0):
+        jobs.check()
+        self.files += files
+        self.out += out
+        pct = min(100, self.f.tell() * 100 // self.total)
+        jobs.report(f"🗜️ 进度: <code>{pct}%</code> | {self.files} 个文件 | 已解压 {_fmt_mb(self.out)}")
+
+def _extract_zip(f, root, limit, prog):
+    with zipfile.ZipFile(f) as zf:
+        for info in zf.infolist():
+            target = _safe_target(root, info.filename)
+            if info.is_dir():
+                os.makedirs(target, exist_ok=True)
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            # 逐块复制并计数: 不信任压缩包里声明的大小
+            with zf.open(info) as src, open(target, 'wb') as dst:
+                while buf := src.read(COPY_CHUNK):
+                    if prog.out + len(buf) > limit:
+                        raise LimitExceeded()
+                    dst.write(buf)
+                    prog.tick(out=len(buf))
+            prog.tick(files=1)
+
+def _checked_member(root, member):
+    """
+    没有解压过滤器 (PEP 706) 的旧版 Python 上的等价检查:
+    拒绝越界路径、链接与设备文件, 去掉特殊权限位, 属主改为当前用户
+    """
+    if not (member.isreg() or member.isdir()):
+        raise ValueError(f"不支持的成员类型 (链接 / 设备): {member.name}")
+    _safe_target(root, member.name)
+    member.mode &= 0o755
+    member.uid, member.gid, member.uname, member.gname = os.getuid(), os.getgid(), "", ""
+    return member
+
+def _extract_tar(f, root, limit, prog):
+    # 流式读取 (r|*): 不需要先扫描整个压缩包; data 过滤器拒绝绝对路径 / 越界链接 / 设备文件
+    # 旧版 Python (3.8.17 / 3.9.17 / 3.10.12 / 3.11.4 之前) 没有 filter 参数, 改用 _checked_member
+    has_filter = hasattr(tarfile, 'data_filter')
+    with tarfile.open(fileobj=f, mode='r|*') as tf:
+        for member in tf:
+            if member.isreg() and prog.out + member.size > limit:
+                raise LimitExceeded()
+            if has_filter:
+                tf.extract(member, root, filter='data')
+            else:
+                tf.extract(_checked_member(root, member), root)
+            prog.tick(files=1 if member.isreg() else 0, out=member.size if member.isreg() else 0)
+
+def extract_archive(src):
+    """
+    后台任务中调用: 把压缩包解压到同目录下的同名文件夹
+    先解压到临时目录, 成功后改名; 超限 / 出错 / 取消时删除已解压的内容
+    返回: (结果文本, None)
+    """
+    name = os.path.basename(src)
+    stem = re.sub(r'\.(zip|tar|tar\.gz|tgz|tar\.bz2|tar\.xz)$', '', name, flags=re.I)
+    parent = os.path.dirname(src)
+    dest = os.path.join(parent, stem)
+    if os.path.exists(dest):
+        dest = f"{dest}_{get_path_id(src + str(os.path.getmtime(src)))}"
+    limit, cap = _extract_limit(parent)
+    work = tempfile.mkdtemp(prefix=f".{stem}.", suffix=".extract", dir=parent)
+    root = os.path.realpath(work)
+    try:
+        with open(src, 'rb') as f:
+            prog = _Progress(f, os.path.getsize(src))
+            prog.tick()
+            if name.lower().endswith('.zip'):
+                _extract_zip(f, root, limit, prog)
+            else:
+                _extract_tar(f, root, limit, prog)
+        os.rename(work, dest)
+    except LimitExceeded:
+        reason = "超过解压上限" if limit >= cap else "剩余空间不足"
+        return (f"⛔ <b>解压已中止</b> ({reason})\n📦 <code>{html.escape(name)}</code>\n"
+                f"📊 上限: <code>{_fmt_mb(limit)}</code> | 已解压内容已清除"), None
+    except (zipfile.BadZipFile, tarfile.TarError, ValueError) as e:
+        return f"❌ <b>解压失败</b>\n<code>{html.escape(str(e)[:300])}</code>", None
+    finally:
+        if os.path.exists(work):
+            shutil.rmtree(work, ignore_errors=True)
+    logging.info(f"解压完成 {src} -> {dest}")
+    return (f"✅ <b>解压完成</b>\n📂 <code>{html.escape(dest)}</code>\n"
+            f"📊 {prog.files} 个文件, {_fmt_mb(prog.out)}"), None
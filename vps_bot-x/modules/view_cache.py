@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# modules/view_cache.py - 菜单视图缓存 (stale-while-revalidate)
+# 视图按 (名称, 参数) 缓存; 未过期直接返回, 过期则先返回旧内容并在后台线程刷新,
+# 修改操作通过 invalidate() 精确失效对应视图; 用户点击「刷新」时用 rebuild() 跳过缓存
+import time, asyncio, logging
+
+# 各视图的新鲜期 (秒), 未登记的视图使用 DEFAULT_TTL
+VIEW_TTL = {
+    'sys_report': 10,
+    'ports': 60,
+    'dk_main': 30,
+    'health': 30,
+    'traffic_history': 300,
+}
+DEFAULT_TTL = 30
+MAX_STALE = 600         # 超过此时长的旧内容不再直接返回, 同步重建
+
+VIEW_CACHE = {}         # {(name, args): {'value': (txt, kb), 'ts': 构建时间}}
+REFRESHING = {}         # {(name, args): asyncio.Task} 后台刷新去重
+GENERATION = {}         # {name: 失效代数}, 防止失效前发起的刷新把旧结果写回
+
+def _store(key, value, gen):
+    if GENERATION.get(key[0], 0) == gen:
+        VIEW_CACHE[key] = {'value': value, 'ts': time.time()}
+
+async def _build(key, fn, args):
+    gen = GENERATION.get(key[0], 0)
+    value = await asyncio.to_thread(fn, *args)
+    _store(key, value, gen)
+    return value
+
+def _refresh_in_background(key, fn, args):
+    if key in REFRESHING:
+        return
+    async def runner():
+        try:
+            await _build(key, fn, args)
+        except Exception as e:
+            logging.error(f"视图后台刷新失败 {key[0]}: {e}")
+        finally:
+            REFRESHING.pop(key, None)
+    REFRESHING[key] = asyncio.create_task(runner())
+
+async def get_view(name, fn, *args):
+    """
+    获取视图 (txt, kb)
+    fn 为同步构建函数, 在线程中执行, 不阻塞事件循环
+    """
+    key = (name, args)
+    entry = VIEW_CACHE.get(key)
+    if entry:
+        age = time.time() - entry['ts']
+        if age < VIEW_TTL.get(name, DEFAULT_TTL):
+            return entry['value']
+        if age < MAX_STALE:
+            _refresh_in_background(key, fn, args)
+            return entry['value']
+    return await _build(key, fn, args)
+
+async def rebuild(name, fn, *args):
+    """用户主动刷新: 丢弃该视图的缓存并同步重建 (菜单导航仍走 get_view 的旧内容优先)"""
+    invalidate(name)
+    return await _build((name, args), fn, args)
+
+def invalidate(*names):
+    """使指定视图的全部参数组合失效 (修改端口/容器等操作后调用)"""
+    for name in names:
+        GENERATION[name] = GENERATION.get(name, 0) + 1
+        for key in [k for k in VIEW_CACHE if k[0] == name]:
+            VIEW_CACHE.pop(key, None)
+
+def peek(name, *args):
+    """是否存在可直接返回的缓存 (新鲜或允许返回的旧内容)"""
+    entry = VIEW_CACHE.get((name, args))
+    return bool(entry) and time.time() - entry['ts'] < MAX_STALE
+
+def put(name, value, *args):
+    """写入由外部 (如渐进渲染) 构建好的视图"""
+    VIEW_CACHE[(name, args)] = {'value': value, 'ts': time.time()}
@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+# modules/volumes.py - 备份分卷与并发投递
+# 超过 Telegram 上限的归档按固定大小切成编号分卷 (name.001, name.002 ...):
+# 备份时边生成边切卷, 每卷写完立即上传; 有界并发 + 单卷重试,
+# 进度记录在 <归档>.upload.json, 进程崩溃重启后从未完成的分卷续传
+import os, glob, json, html, time, shutil, asyncio, hashlib, logging, threading
+from pathlib import Path
+from telegram import InputFile
+from telegram.error import RetryAfter, TimedOut, NetworkError
+from config import load_config
+import modules.backup as bk_mgr
+import modules.notifier as notifier
+import modules.catalog as catalog
+import modules.jobs as jobs
+import modules.bot_api as bot_api
+
+VOLUME_MB = 48              # 默认分卷大小 (云端 Bot API 上传上限 50MB, 留出 multipart 开销)
+UPLOAD_PARALLEL = 2         # 同时上传的分卷数
+MAX_TRIES = 4               # 单卷最多尝试次数
+SEND_TIMEOUT = 300
+STATE_SUFFIX = ".upload.json"
+
+def volume_size(conf=None):
+    """
+    分卷大小: 不超过当前端点的上传上限 (云端 50MB, 自建本地服务器 2000MB) 减 1MB
+    本地模式的分卷先写成独立文件再按路径发送, 不占用内存
+    """
+    conf = conf or load_config()
+    cap = bot_api.upload_limit() - 1024**2
+    mb = float(conf.get('backup_volume_mb', VOLUME_MB))
+    if bot_api.is_local() and mb == VOLUME_MB:
+        # 本地模式下未改动默认值时整卷发送到上限; 显式配置的其它 backup_volume_mb 仍然生效
+        mb = cap / 1024**2
+    return int(max(1024**2, min(mb * 1024**2, cap)))
+
+def volume_name(archive, idx):
+    return f"{os.path.basename(archive)}.{idx:03d}"
+
+def _fmt_mb(n):
+    return f"{n / 1024**2:.1f}MB"
+
+# ==================== 续传状态 ====================
+def _state_path(archive):
+    return archive + STATE_SUFFIX
+
+def _save_state(state):
+    path = _state_path(state['archive'])
+    with open(path + ".part", 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(path + ".part", path)
+
+def _drop_state(archive):
+    try:
+        os.remove(_state_path(archive))
+    except OSError:
+        pass
+
+def _new_state(archive, chat_ids, caption, vsize):
+    return {'archive': archive, 'chat_ids': list(chat_ids), 'caption': caption,
+            'volume_size': vsize, 'volumes': {}, 'done': False, 'started': time.time()}
+
+def _file_ranges(path, vsize):
+    """对已存在的文件计算分卷 (偏移 / 大小 / SHA-256) 与整体 SHA-256"""
+    vols, whole = {}, hashlib.sha256()
+    with open(path, 'rb') as f:
+        idx = 1
+        while True:
+            off = f.tell()
+            h, left = hashlib.sha256(), vsize
+            while left:
+                buf = f.read(min(bk_mgr.HASH_CHUNK, left))
+                if not buf:
+                    break
+                h.update(buf)
+                whole.update(buf)
+                left -= len(buf)
+            if left == vsize:
+                break
+            vols[str(idx)] = {'offset': off, 'size': vsize - left, 'sha256': h.hexdigest(), 'sent': []}
+            idx += 1
+    return vols, whole.hexdigest()
+
+def _record(archive, chat_ids, status="ok", detail=None):
+    """投递结果写入备份目录库"""
+    for chat_id in chat_ids:
+        catalog.record_destination(os.path.basename(archive), f"telegram:{chat_id}", status, detail)
+
+# ==================== 上传 ====================
+async def _send_path(bot, chat_id, path, caption):
+    """
+    发送磁盘上的整个文件, 返回耗时
+    自建服务器本地模式下只传路径 (PTB 发送 file:// URI, 服务器直接读盘, 不经 HTTP 再复制一遍)
+    """
+    start = time.time()
+    if bot_api.is_local():
+        await bot.send_document(chat_id=chat_id, document=Path(path), caption=caption, parse_mode="HTML",
+                                read_timeout=SEND_TIMEOUT, write_timeout=SEND_TIMEOUT)
+    else:
+        with open(path, 'rb') as f:
+            await bot.send_document(chat_id=chat_id, document=f, caption=caption, parse_mode="HTML",
+                                    read_timeout=SEND_TIMEOUT, write_timeout=SEND_TIMEOUT)
+    return time.time() - start
+
+async def _send_with_retry(bot, chat_id, data, filename, caption=None):
+    """发送单个文档 (字节或本地模式下的文件路径), 限流时按 RetryAfter 等待, 网络错误指数退避"""
+    for attempt in range(1, MAX_TRIES + 1):
+        try:
+            doc = data if isinstance(data, Path) else InputFile(data, filename=filename)
+            return await bot.send_document(chat_id=chat_id, document=doc,
+                                           caption=caption, parse_mode="HTML",
+                                           read_timeout=SEND_TIMEOUT, write_timeout=SEND_TIMEOUT)
+        except RetryAfter as e:
+            await asyncio.sleep(notifier._retry_seconds(e) + 1)
+        except (TimedOut, NetworkError) as e:
+            if attempt == MAX_TRIES:
+                raise
+            logging.warning(f"分卷 {filename} 第 {attempt} 次上传失败: {e}")
+            await asyncio.sleep(2 ** attempt)
+    raise RuntimeError(f"{filename} 多次限流, 放弃")
+
+def _spool_dir(archive):
+    return archive + ".vols"
+
+def _spool_volume(fd, vol, path):
+    """
+    本地模式: 把分卷按块复制成独立文件 (服务器只能按路径读整个文件), 边复制边校验
+    内存占用只有一个块; 磁盘上同时存在的分卷文件不超过并发上传数
+    """
+    h, done = hashlib.sha256(), 0
+    with open(path, 'wb') as out:
+        while done < vol['size']:
+            buf = os.pread(fd, min(bk_mgr.HASH_CHUNK, vol['size'] - done), vol['offset'] + done)
+            if not buf:
+                break
+            h.update(buf)
+            out.write(buf)
+            done += len(buf)
+    return h.hexdigest() == vol['sha256']
+
+async def _upload_volume(bot, state, fd, idx, sem):
+    """把一个分卷发给所有尚未收到的会话; 每成功一次立即落盘进度"""
+    vol = state['volumes'][str(idx)]
+    name = volume_name(state['archive'], idx)
+    async with sem:
+        data = None
+        try:
+            if bot_api.is_local():
+                # 本地服务器: 分卷写成文件后按路径发送, 不把上 GB 的分卷读进内存再经 HTTP 复制
+                os.makedirs(_spool_dir(state['archive']), exist_ok=True)
+                data = Path(_spool_dir(state['archive']), name)
+                ok = await asyncio.to_thread(_spool_volume, fd, vol, data)
+            else:
+                data = await asyncio.to_thread(os.pread, fd, vol['size'], vol['offset'])
+                ok = hashlib.sha256(data).hexdigest() == vol['sha256']
+            if not ok:
+                raise RuntimeError(f"{name} 校验失败 (归档被修改?)")
+            for chat_id in state['chat_ids']:
+                if chat_id in vol['sent']:
+                    continue
+                await _send_with_retry(bot, chat_id, data, name, caption=f"🧩 <code>{name}</code> ({_fmt_mb(vol['size'])})")
+                vol['sent'].append(chat_id)
+                _save_state(state)
+        finally:
+            if isinstance(data, Path):
+                data.unlink(missing_ok=True)
+
+def _manifest(state):
+    """分卷清单: 消息正文 + 可直接 sha256sum -c 的校验文件"""
+    base = os.path.basename(state['archive'])
+    vols = sorted(state['volumes'].items(), key=lambda kv: int(kv[0]))
+    lines = [f"{v['sha256']}  {volume_name(base, int(i))}" for i, v in vols]
+    lines.append(f"{state['archive_sha256']}  {base}")
+    txt = (f"🧩 <b>分卷备份清单</b>\n━━━━━━━━━━━━━━━\n"
+           f"📦 <code>{html.escape(base)}</code>\n"
+           f"📊 总大小 <code>{_fmt_mb(state['total'])}</code> | {len(vols)} 卷 × ≤{_fmt_mb(state['volume_size'])}\n"
+           f"🔐 SHA-256: <code>{state['archive_sha256'][:16]}…</code>\n\n"
+           f"🔧 <b>重组方法</b> (下载全部分卷与校验文件到同一目录):\n"
+           f"<code>sha256sum -c {html.escape(base)}.sha256 --ignore-missing</code>\n"
+           f"<code>cat {html.escape(base)}.[0-9][0-9][0-9] &gt; {html.escape(base)}</code>\n"
+           f"<code>sha256sum -c {html.escape(base)}.sha256 --ignore-missing</code>")
+    return txt, ("\n".join(lines) + "\n").encode()
+
+async def _finish(bot, state, fd, tasks):
+    """等待全部分卷上传, 成功后发送清单; 失败的分卷保留状态等待续传"""
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    errors = [r for r in results if isinstance(r, Exception)]
+    os.close(fd)
+    shutil.rmtree(_spool_dir(state['archive']), ignore_errors=True)
+    if errors:
+        logging.error(f"分卷上传未完成 {state['archive']}: {errors[0]}")
+        _record(state['archive'], state['chat_ids'], "partial", f"{len(errors)} 卷失败")
+        return False, f"⚠️ {len(errors)} 个分卷上传失败, 重启后自动续传\n<code>{html.escape(str(errors[0])[:150])}</code>"
+    txt, sums = _manifest(state)
+    base = os.path.basename(state['archive'])
+    for chat_id in state['chat_ids']:
+        if state.get('caption'):
+            await bot.send_message(chat_id=chat_id, text=state['caption'], parse_mode="HTML")
+        await _send_with_retry(bot, chat_id, sums, f"{base}.sha256", caption=txt)
+    state['done'] = True
+    _drop_state(state['archive'])
+    _record(state['archive'], state['chat_ids'], detail=f"{len(state['volumes'])} 卷")
+    # 边打包边上传时为端到端吞吐; 续传的状态沿用首次开始时间
+    rate = bot_api.fmt_rate(state['total'] * len(state['chat_ids']), time.time() - state.get('started', time.time()))
+    return True, f"🧩 已分 {len(state['volumes'])} 卷发送 ({_fmt_mb(state['total'])}, {rate})"
+
+async def deliver_file(bot, chat_ids, path, caption):
+    """
+    投递已存在的文件: 不超过分卷大小直接发送, 否则切卷并发上传并附清单
+    返回: (是否完成, 说明)
+    """
+    vsize = volume_size()
+    if isinstance(chat_ids, int):
+        chat_ids = [chat_ids]
+    size = os.path.getsize(path)
+    if size <= vsize:
+        secs = 0
+        for chat_id in chat_ids:
+            secs += await _send_path(bot, chat_id, path, caption)
+        _record(path, chat_ids)
+        return True, f"✅ 发送成功 ({_fmt_mb(size)}, {bot_api.fmt_rate(size * len(chat_ids), secs)})"
+    state = _new_state(path, chat_ids, caption, vsize)
+    state['volumes'], state['archive_sha256'] = await asyncio.to_thread(_file_ranges, path, vsize)
+    state['total'] = os.path.getsize(path)
+    _save_state(state)
+    return await _resume_state(bot, state)
+
+async def _resume_state(bot, state):
+    fd = os.open(state['archive'], os.O_RDONLY)
+    sem = asyncio.Semaphore(int(load_config().get('backup_upload_parallel', UPLOAD_PARALLEL)))
+    tasks = [asyncio.create_task(_upload_volume(bot, state, fd, int(i), sem)) for i in state['volumes']]
+    return await _finish(bot, state, fd, tasks)
+
+async def backup_and_deliver(bot, chat_ids, title, is_auto=False):
+    """
+    执行备份并投递: 归档超过分卷大小时, 压缩输出边写盘边切卷, 每卷写完立即开始上传,
+    上传与打包重叠进行; 归档较小时按原方式整体发送
+    返回: (归档路径或 None, 备份消息, 投递说明或 None)
+    """
+    if isinstance(chat_ids, int):
+        chat_ids = [chat_ids]
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    vsize = volume_size()
+    ctx = {'fd': None, 'closed': False}
+    fd_lock = threading.Lock()
+
+    def on_volume(ev):
+        # 备份线程中调用: 首个分卷产生时打开读句柄, 之后归档改名不影响按偏移读取
+        with fd_lock:
+            if 'index' in ev and ctx['fd'] is None and not ctx['closed']:
+                ctx['fd'] = os.open(ev['path'], os.O_RDONLY)
+        loop.call_soon_threadsafe(events.put_nowait, ev)
+
+    async def abort_uploads():
+        # 停止分卷上传并等待其退出后关闭读句柄; 打包线程此后不再打开新句柄
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        with fd_lock:
+            ctx['closed'] = True
+            if ctx['fd'] is not None:
+                os.close(ctx['fd'])
+                ctx['fd'] = None
+        if archive:
+            shutil.rmtree(_spool_dir(archive), ignore_errors=True)
+
+    async def produce():
+        try:
+            return await asyncio.to_thread(bk_mgr.run_backup_task, is_auto, on_volume, vsize)
+        finally:
+            # 线程内的回调先于结果入队, 结束标记必然排在所有分卷事件之后
+            events.put_nowait(None)
+
+    sem = asyncio.Semaphore(int(load_config().get('backup_upload_parallel', UPLOAD_PARALLEL)))
+    tasks, state, archive = [], None, None
+    jobs.report("📦 正在打包...")
+    job = asyncio.create_task(produce())
+    try:
+        while (ev := await events.get()) is not None:
+            if 'index' not in ev:
+                archive = ev['archive']
+                continue
+            if state is None:
+                state = _new_state(archive, chat_ids, title, vsize)
+            state['volumes'][str(ev['index'])] = {'offset': ev['offset'], 'size': ev['size'], 'sha256': ev['sha256'], 'sent': []}
+            if ev['last']:
+                state['total'], state['archive_sha256'] = ev['total'], ev['archive_sha256']
+            _save_state(state)
+            jobs.report(f"🧩 已生成 {len(state['volumes'])} 个分卷, 边打包边上传...")
+            tasks.append(asyncio.create_task(_upload_volume(bot, state, ctx['fd'], ev['index'], sem)))
+        path, msg = await job
+    except asyncio.CancelledError:
+        # 任务被取消: 流水线子进程已由任务管理器结束, 这里停止分卷上传; 未完成的进度文件留给续传清理
+        await abort_uploads()
+        raise
+    jobs.report("📤 正在发送..." if state is None else "📤 分卷上传收尾...")
+    if state is None:
+        # 未切卷: 小文件整体发送 (或备份失败 / 仓库模式)
+        if path:
+            secs = 0
+            for chat_id in chat_ids:
+                secs += await _send_path(bot, chat_id, path, f"{title}\n{msg}"[:1024])
+            size = os.path.getsize(path)
+            logging.info(f"备份已发送 {os.path.basename(path)}: {_fmt_mb(size)}, {bot_api.fmt_rate(size * len(chat_ids), secs)}")
+            _record(path, chat_ids)
+        return path, msg, None
+    if not path:
+        # 打包失败: 已上传的分卷作废
+        await abort_uploads()
+        _drop_state(state['archive'])
+        return None, msg, None
+    state['caption'] = f"{title}\n{msg}"
+    _save_state(state)
+    ok, note = await _finish(bot, state, ctx['fd'], tasks)
+    return path, msg, note
+
+async def backup_as_job(bot, chat_ids, title, job_title, is_auto=True):
+    """
+    定时备份入口: 作为 'backup' 类型后台任务运行 (与手动备份共用并发上限, 可在任务菜单中取消)
+    返回值同 backup_and_deliver; 取消或异常时返回 (None, 说明, None)
+    """
+    out = {}
+
+    async def work():
+        out['res'] = await backup_and_deliver(bot, chat_ids, title, is_auto)
+        txt = out['res'][1]
+        # 已选择 Docker 卷 / 容器时一并备份 (各自成档, 随后单独投递)
+        import modules.docker_backup as docker_backup
+        if docker_backup.configured_sources():
+            _, dmsg = await docker_backup.backup_and_deliver(bot, chat_ids, is_auto)
+            if not dmsg.startswith("🐳 <b>Docker 备份完成"):
+                notifier.notify(dmsg, chat_ids)
+            txt += f"\n\n{dmsg}"
+        return txt, None
+
+    txt, _ = await jobs.submit('backup', job_title, work)
+    return out.get('res') or (None, txt, None)
+
+async def resume_uploads(bot):
+    """启动时调用: 续传上次中断的分卷投递"""
+    pattern = os.path.join(bk_mgr.get_backup_dir(), "*" + STATE_SUFFIX)
+    for sp in glob.glob(pattern):
+        try:
+            with open(sp, encoding='utf-8') as f:
+                state = json.load(f)
+            archive = state['archive']
+            if state.get('done') or not os.path.exists(archive):
+                # 打包过程中崩溃: 归档不完整, 无法续传
+                os.remove(sp)
+                continue
+            # 崩溃时可能尚有分卷未记录, 按最终文件重新计算并合并已发送记录
+            vols, whole = await asyncio.to_thread(_file_ranges, archive, state['volume_size'])
+            for i, v in vols.items():
+                old = state['volumes'].get(i)
+                if old and old['sha256'] == v['sha256']:
+                    v['sent'] = old['sent']
+            state['volumes'], state['archive_sha256'] = vols, whole
+            state['total'] = os.path.getsize(archive)
+            _save_state(state)
+            ok, note = await _resume_state(bot, state)
+            logging.info(f"分卷续传 {os.path.basename(archive)}: {note}")
+        except Exception as e:
+            logging.error(f"分卷续传失败 {sp}: {e}")
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# router.py - 按钮回调分发表 (精确匹配 + 前缀字典树)
+# 替代 btn_handler 中的长 if/elif 链: 解析耗时只与 callback_data 长度有关,
+# 前缀按"最长匹配"决策, 不再依赖 elif 的书写顺序 (如 ghost_ban_ip_ 与 ghost_ban_)
+import time, logging
+
+EXACT_ROUTES = {}       # {callback_data: route}
+PREFIX_TRIE = {}        # 嵌套字典, 节点上的 None 键保存该前缀对应的 route
+ROUTE_STATS = {}        # {route_name: {'hits', 'errors', 'total_ms', 'max_ms'}}
+
+def _parse_args(rest, types):
+    """
+    按类型元组解析前缀之后的参数 (以 '_' 分隔)
+    最后一个参数吸收剩余全部内容 (允许内容本身含 '_'); 缺失的参数补 None
+    """
+    if not types:
+        return ()
+    parts = rest.split('_', len(types) - 1) if rest else []
+    args = []
+    for i, typ in enumerate(types):
+        args.append(typ(parts[i]) if i < len(parts) else None)
+    return tuple(args)
+
+def route(key, args=None, prefix=False, name=None):
+    """
+    注册按钮处理函数
+    @route("dk_m")                              精确匹配
+    @route("dk_view_", args=(str,), prefix=True) 前缀匹配, 参数依次传给处理函数
+    处理函数签名: async def handler(u, c, *args)
+    """
+    def deco(fn):
+        r = {'name': name or key, 'fn': fn, 'args': tuple(args or ()), 'prefix': key}
+        if prefix:
+            node = PREFIX_TRIE
+            for ch in key:
+                node = node.setdefault(ch, {})
+            node[None] = r
+        else:
+            EXACT_ROUTES[key] = r
+        return fn
+    return deco
+
+def resolve(data):
+    """返回 (route, 参数元组); 无匹配返回 (None, ())"""
+    r = EXACT_ROUTES.get(data)
+    if r:
+        return r, ()
+    node, best, depth = PREFIX_TRIE, None, 0
+    for i, ch in enumerate(data):
+        node = node.get(ch)
+        if node is None:
+            break
+        if None in node:
+            best, depth = node[None], i + 1
+    if best is None:
+        return None, ()
+    return best, _parse_args(data[depth:], best['args'])
+
+async def dispatch(u, c, data):
+    """解析并执行回调, 记录每条路由的命中次数与耗时"""
+    try:
+        r, args = resolve(data)
+    except (ValueError, TypeError):
+        logging.warning(f"回调参数解析失败: {data}")
+        return False
+    if r is None:
+        logging.info(f"未注册的回调: {data}")
+        return False
+
+    st = ROUTE_STATS.setdefault(r['name'], {'hits': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+    t0 = time.perf_counter()
+    try:
+        await r['fn'](u, c, *args)
+    except Exception:
+        st['errors'] += 1
+        raise
+    finally:
+        ms = (time.perf_counter() - t0) * 1000
+        st['hits'] += 1
+        st['total_ms'] += ms
+        st['max_ms'] = max(st['max_ms'], ms)
+    return True
+
+def get_stats_text(limit=15):
+    """路由统计 (按累计耗时排序)"""
+    if not ROUTE_STATS:
+        return "📈 <b>路由统计</b>\n━━━━━━━━━━━━━━━\n📭 暂无数据"
+    rows = sorted(ROUTE_STATS.items(), key=lambda x: x[1]['total_ms'], reverse=True)[:limit]
+    txt = "📈 <b>路由统计</b> (按累计耗时)\n━━━━━━━━━━━━━━━\n"
+    for name, st in rows:
+        avg = st['total_ms'] / st['hits'] if st['hits'] else 0
+        txt += f"<code>{name[:22]}</code>\n   命中 {st['hits']} | 平均 {avg:.0f}ms | 最大 {st['max_ms']:.0f}ms"
+        txt += f" | ❌{st['errors']}\n" if st['errors'] else "\n"
+    return txt
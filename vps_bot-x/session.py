@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# session.py - 按会话 (chat) 隔离的对话状态
+# 取代 main.py 中的 STATE / SET_ACTION / WIZARD_STATE / CURRENT_UPLOAD_DIR 全局变量,
+# 多个管理员同时操作时互不干扰; LRU 存储, 等待输入类状态超时自动失效
+import time
+from collections import OrderedDict
+
+MAX_SESSIONS = 256      # LRU 容量
+INPUT_TTL = 1800        # 等待输入的状态 (state / set_action / wizard) 闲置多久后失效 (秒)
+
+# 新会话的默认值 (main.py 启动时写入 upload_dir)
+DEFAULTS = {
+    'state': None,          # 等待的文本输入类型, 如 WAIT_PORT_ADD
+    'set_action': None,     # WAIT_SETTING 对应的设置项
+    'wizard': None,         # 容器向导当前等待的字段, 如 WIZ_NAME
+    'upload_dir': None,     # 文件上传目录 (会话级偏好, 不随 INPUT_TTL 失效)
+}
+INPUT_KEYS = ('state', 'set_action', 'wizard')
+
+SESSIONS = OrderedDict()    # {chat_id: {...DEFAULTS, 'ts': 最近活动时间}}
+
+def get(chat_id):
+    """获取会话 (不存在则创建), 同时刷新 LRU 顺序与活动时间"""
+    now = time.time()
+    s = SESSIONS.get(chat_id)
+    if s is None:
+        s = SESSIONS[chat_id] = dict(DEFAULTS, ts=now)
+        while len(SESSIONS) > MAX_SESSIONS:
+            SESSIONS.popitem(last=False)
+    else:
+        SESSIONS.move_to_end(chat_id)
+        if now - s['ts'] > INPUT_TTL:
+            for k in INPUT_KEYS:
+                s[k] = None
+    s['ts'] = now
+    return s
+
+def of(u):
+    """根据 Update 取当前会话"""
+    return get(u.effective_chat.id)
+
+def reset_input(s):
+    """清除等待输入的状态 (返回主菜单时调用)"""
+    for k in INPUT_KEYS:
+        s[k] = None
@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+# tests/conftest.py - 让测试直接导入项目根目录下的 modules/*
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# tests/test_alert_state.py - 告警状态机: 迟滞 / 冷却 / 恢复
+import pytest
+
+import modules.alert_state as alert_state
+
+
+@pytest.fixture(autouse=True)
+def _clean():
+    alert_state.ALERTS.clear()
+    yield
+    alert_state.ALERTS.clear()
+
+
+def test_crash_loop_notifies_once_within_cooldown():
+    t, events = 1000, []
+    for _ in range(5):
+        events.append(alert_state.evaluate_flag('container_exit', 'c1', True, now=t))
+        t += 30
+        events += [st for _, st in alert_state.sweep('container_exit', set(), now=t)]
+        t += 30
+    assert events.count(alert_state.FIRING) == 1
+    assert events.count(alert_state.RESOLVED) == 1
+
+
+def test_sweep_drops_entry_after_cooldown():
+    alert_state.evaluate_flag('container_exit', 'c1', True, now=1000)
+    alert_state.sweep('container_exit', set(), now=1010)
+    assert ('container_exit', 'c1') in alert_state.ALERTS
+    alert_state.sweep('container_exit', set(), now=1000 + 3600)
+    assert ('container_exit', 'c1') not in alert_state.ALERTS
+    assert alert_state.evaluate_flag('container_exit', 'c1', True, now=5000) == alert_state.FIRING
+
+
+def test_hysteresis_and_for_duration():
+    assert alert_state.evaluate('cpu', 'host', 95, now=1000) is None        # pending
+    assert alert_state.evaluate('cpu', 'host', 95, now=1120) == alert_state.FIRING
+    assert alert_state.evaluate('cpu', 'host', 85, now=1130) is None       # 未跌破恢复阈值
+    assert alert_state.evaluate('cpu', 'host', 79, now=1140) == alert_state.RESOLVED
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# tests/test_backup_repo.py - 内容定义切分: 切点稳定性 / 块大小边界
+import hashlib
+import random
+
+import modules.backup_repo as backup_repo
+
+MB = 1024 * 1024
+
+
+def _chunks(data):
+    out, start = [], 0
+    for end in backup_repo.cut_points(data):
+        out.append(hashlib.sha256(data[start:end]).digest())
+        start = end
+    return out
+
+
+def _random(size, seed=20240601):
+    return random.Random(seed).randbytes(size)
+
+
+def test_cuts_cover_data_and_respect_bounds():
+    data = _random(40 * MB)
+    cuts = backup_repo.cut_points(data)
+    assert cuts[-1] == len(data)
+    assert cuts == sorted(set(cuts))
+    sizes = [b - a for a, b in zip([0] + cuts, cuts)]
+    assert all(s <= backup_repo.MAX_CHUNK for s in sizes)
+    assert all(s >= backup_repo.MIN_CHUNK for s in sizes[:-1])
+    # 平均块大小应接近 MIN_CHUNK + 2^AVG_BITS, 而不是退化为定长 MAX_CHUNK
+    assert len(cuts) > len(data) // backup_repo.MAX_CHUNK * 2
+
+
+def test_small_insert_keeps_most_chunks():
+    data = _random(40 * MB)
+    edited = data[:5 * MB] + b"INSERTED" + data[5 * MB:]
+    before, after = _chunks(data), _chunks(edited)
+    shared = len(set(before) & set(after))
+    # 插入只影响所在的块 (至多再波及下一块), 其余块完全复用
+    assert shared >= len(before) - 2
+
+
+def test_data_without_anchors_falls_back_to_fixed_size():
+    data = bytes(10 * MB)
+    cuts = backup_repo.cut_points(data)
+    step = backup_repo.MAX_CHUNK
+    assert cuts == [step, 2 * step, len(data)]
+
+
+def test_short_input_is_single_chunk():
+    assert backup_repo.cut_points(b"") == []
+    assert backup_repo.cut_points(b"x" * 1000) == [1000]
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# tests/test_fleet.py - 多 VPS 模式: controller <-> agent 签名 RPC
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+
+import modules.agent as agent_mod
+import modules.fleet as fleet
+
+TOKEN = "test-token"
+
+
+@pytest.fixture(autouse=True)
+def _methods(monkeypatch):
+    methods = dict(agent_mod.RPC_METHODS)
+    methods['test.add'] = lambda a, b: {'sum': a + b}
+    methods['test.boom'] = lambda: 1 / 0
+    monkeypatch.setattr(agent_mod, 'RPC_METHODS', methods)
+    agent_mod.NONCES.clear()
+
+
+def _with_agent(coro_fn):
+    """在随机端口启动 agent, 执行 coro_fn(url), 结束后关闭"""
+    async def run():
+        server = await asyncio.start_server(lambda r, w: agent_mod._handle(r, w, TOKEN), "127.0.0.1", 0)
+        url = f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+        async with server:
+            return await coro_fn(url)
+    return asyncio.run(run())
+
+
+def test_signed_call_round_trip():
+    async def go(url):
+        agents = [{'name': 'a1', 'url': url, 'token': TOKEN}]
+        return await fleet.fan_out('test.add', 2, 3, agents=agents)
+
+    (a, ok, res, ms), = _with_agent(go)
+    assert ok and res == {'sum': 5}
+    assert a['name'] == 'a1' and ms >= 0
+
+
+def test_errors_are_reported_per_agent():
+    async def go(url):
+        agents = [
+            {'name': 'bad-token', 'url': url, 'token': 'wrong'},
+            {'name': 'ok', 'url': url, 'token': TOKEN},
+            {'name': 'offline', 'url': 'http://127.0.0.1:1', 'token': TOKEN},
+        ]
+        return (await fleet.fan_out('test.add', 1, 1, agents=agents),
+                await fleet.fan_out('test.boom', agents=agents[1:2]),
+                await fleet.fan_out('no.such', agents=agents[1:2]))
+
+    results, boom, unknown = _with_agent(go)
+    assert [ok for _, ok, _, _ in results] == [False, True, False]
+    assert results[0][2] == 'unauthorized'
+    assert 'ZeroDivisionError' in boom[0][2]
+    assert 'unknown method' in unknown[0][2]
+
+
+def test_replayed_and_stale_requests_rejected():
+    body = json.dumps({'method': 'ping', 'args': []}).encode()
+
+    def headers(ts, nonce):
+        return {'X-Agent-Ts': ts, 'X-Agent-Nonce': nonce,
+                'X-Agent-Signature': agent_mod.sign(TOKEN, ts, nonce, body)}
+
+    async def go(url):
+        async with httpx.AsyncClient() as client:
+            ts = str(time.time())
+            first = await client.post(url + "/rpc", content=body, headers=headers(ts, "n1"))
+            replay = await client.post(url + "/rpc", content=body, headers=headers(ts, "n1"))
+            stale_ts = str(time.time() - agent_mod.MAX_SKEW - 5)
+            stale = await client.post(url + "/rpc", content=body, headers=headers(stale_ts, "n2"))
+            tampered = await client.post(url + "/rpc", content=body + b" ", headers=headers(ts, "n3"))
+            wrong_path = await client.post(url + "/x", content=body, headers=headers(ts, "n4"))
+        return first.status_code, replay.status_code, stale.status_code, tampered.status_code, wrong_path.status_code
+
+    assert _with_agent(go) == (200, 401, 401, 401, 404)
+
+
+def test_local_agent_runs_in_process():
+    (a, ok, res, _), = asyncio.run(fleet.fan_out('test.add', 4, 5, agents=[{'name': fleet.LOCAL_NAME, 'url': None}]))
+    assert ok and res == {'sum': 9}
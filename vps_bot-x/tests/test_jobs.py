@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# tests/test_jobs.py - 后台任务: 超时 / 取消时结束整个进程组
+import asyncio
+import os
+import subprocess
+import time
+
+import pytest
+
+import modules.jobs as jobs
+
+
+def _alive(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+def _wait_gone(pid, timeout=3):
+    deadline = time.monotonic() + timeout
+    while _alive(pid) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return not _alive(pid)
+
+
+def _read_pid(path, timeout=3):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if os.path.exists(path) and open(path).read().strip():
+            return int(open(path).read())
+        time.sleep(0.02)
+    raise AssertionError("子进程未写出 pid")
+
+
+def test_timeout_kills_grandchildren(tmp_path):
+    pidfile = tmp_path / "pid"
+    with pytest.raises(subprocess.TimeoutExpired):
+        jobs.run(f"sleep 7 & echo $! > {pidfile}; wait", timeout=1, isolate=False)
+    assert _wait_gone(_read_pid(pidfile))
+
+
+def test_cancel_kills_grandchildren(tmp_path):
+    pidfile = tmp_path / "pid"
+
+    async def work():
+        await asyncio.to_thread(jobs.run, f"sleep 7 & echo $! > {pidfile}; wait", 30, isolate=False)
+        return "done", None
+
+    async def main():
+        task = jobs.submit('clean', 'test', work)
+        pid = await asyncio.to_thread(_read_pid, pidfile)
+        job = next(j for j in jobs.JOBS.values() if j['task'] is task)
+        assert jobs.cancel(job['id'])
+        await task
+        return pid, job
+
+    pid, job = asyncio.run(main())
+    assert job['state'] == 'cancelled'
+    assert _wait_gone(pid)
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+# tests/test_notifier.py - 出站队列: 同类告警折叠 / RetryAfter 限流
+import asyncio
+import datetime
+
+import pytest
+from telegram.error import RetryAfter
+
+import modules.notifier as notifier
+
+
+class FakeBot:
+    def __init__(self, fail_first=0, retry_after=0):
+        self.sent = []
+        self.fail_first = fail_first
+        self.retry_after = retry_after
+
+    async def send_message(self, chat_id, text, **kw):
+        if self.fail_first:
+            self.fail_first -= 1
+            raise RetryAfter(datetime.timedelta(seconds=self.retry_after))
+        self.sent.append((chat_id, text))
+
+
+@pytest.fixture(autouse=True)
+def _reset(monkeypatch):
+    for d in (notifier.QUEUES, notifier.WORKERS, notifier.BUCKETS, notifier.DIGESTS):
+        d.clear()
+    for k in notifier.STATS:
+        notifier.STATS[k] = 0
+    monkeypatch.setattr(notifier, '_conf_value', lambda key, default: default)
+    monkeypatch.setattr(notifier, 'CHAT_RATE', 1000.0)
+    monkeypatch.setattr(notifier, 'CHAT_BURST', 1000)
+    yield
+    notifier.BOT = None
+
+
+async def _drain():
+    while notifier.DIGESTS or any(not w.done() for w in notifier.WORKERS.values()):
+        await asyncio.sleep(0.01)
+
+
+def test_first_alert_immediate_rest_folded_into_digest():
+    bot = FakeBot()
+
+    async def run():
+        notifier.start(bot)
+        for i in range(4):
+            notifier.notify(f"容器 c{i} 退出", 1, kind="容器异常退出", window=0.05)
+        await asyncio.sleep(0.02)
+        assert bot.sent == [(1, "容器 c0 退出")]     # 前沿: 首条不等待窗口
+        await _drain()
+
+    asyncio.run(run())
+    assert len(bot.sent) == 2
+    digest = bot.sent[1][1]
+    assert "3 条" in digest and "c1" in digest and "c3" in digest and "c0" not in digest
+    assert notifier.STATS['digested'] == 2
+
+
+def test_single_follow_up_is_sent_as_is():
+    bot = FakeBot()
+
+    async def run():
+        notifier.start(bot)
+        notifier.notify("a", 1, kind="k", window=0.02)
+        notifier.notify("b", 1, kind="k", window=0.02)
+        await _drain()
+
+    asyncio.run(run())
+    assert [t for _, t in bot.sent] == ["a", "b"]
+    assert notifier.STATS['digested'] == 0
+
+
+def test_critical_and_kindless_never_fold():
+    bot = FakeBot()
+
+    async def run():
+        notifier.start(bot)
+        for i in range(3):
+            notifier.notify(f"crit {i}", 1, kind="k", prio=notifier.PRIO_CRITICAL, window=1)
+            notifier.notify(f"plain {i}", 1, window=1)
+        await _drain()
+
+    asyncio.run(run())
+    assert len(bot.sent) == 6
+    assert not notifier.DIGESTS
+
+
+def test_digest_respects_message_limit():
+    text = notifier._build_digest("k", ["x" * 1000] * 10)
+    assert len(text) <= notifier.MSG_LIMIT
+    assert "另有" in text
+
+
+def test_retry_after_requeues_in_original_order():
+    bot = FakeBot(fail_first=1, retry_after=0)
+
+    async def run():
+        notifier.start(bot)
+        notifier.notify("low", 1, prio=notifier.PRIO_LOW)
+        notifier.notify("first", 1)
+        notifier.notify("second", 1)
+        await _drain()
+
+    asyncio.run(run())
+    # 被限流的消息保持原序号重新入队, 不会被插队
+    assert [t for _, t in bot.sent] == ["first", "second", "low"]
+    assert notifier.STATS['retry_after'] == 1
+    assert notifier.STATS['failed'] == 0
+
+
+def test_penalize_empties_bucket_until_retry_window_ends():
+    b = notifier._bucket(7, 1.0, 3)
+    notifier._penalize(7, 5)
+    assert b['tokens'] == 0
+    assert b['ts'] > notifier.time.monotonic() + 4
+    assert notifier._retry_seconds(RetryAfter(datetime.timedelta(seconds=3))) == 3
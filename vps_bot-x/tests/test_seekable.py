@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# tests/test_seekable.py - 分帧归档: 整体解压 / 按路径选择 / 部分还原
+import gzip
+import io
+import os
+import random
+import tarfile
+
+import pytest
+
+import modules.seekable as seekable
+
+FRAME = 64 * 1024
+LONG = "deep/" + "n" * 120 + "/file.txt"    # 超过 ustar 100 字节, 生成 GNU/PAX 扩展头
+
+
+@pytest.fixture
+def archive(tmp_path):
+    """构造源目录 -> tar -> 分帧归档 + 索引, 返回 (归档路径, 索引, 源目录, 原始 tar 字节)"""
+    rnd = random.Random(7)
+    src = tmp_path / "src"
+    files = {
+        "app/config.json": b'{"a": 1}',
+        "app/data/big.bin": rnd.randbytes(300 * 1024),
+        "app/data/small.txt": b"hello",
+        "logs/empty.log": b"",
+        "other/noise.bin": rnd.randbytes(200 * 1024),
+        LONG: b"long name",
+    }
+    for name, data in files.items():
+        path = src / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+    os.link(src / "app/data/small.txt", src / "app/hard.txt")
+
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w", format=tarfile.GNU_FORMAT) as tf:
+        for name in ["app", "logs", "other", "deep"]:
+            tf.add(src / name, arcname=name)
+    raw = buf.getvalue()
+
+    index = {}
+    out = tmp_path / "backup.tar.gz"
+    out.write_bytes(b"".join(seekable.frames(io.BytesIO(raw), index, level=1, workers=2, frame_size=FRAME)))
+    seekable.save_index(str(out), index)
+    return str(out), seekable.load_index(str(out)), src, raw
+
+
+def test_whole_archive_is_plain_gzip(archive):
+    path, index, _, raw = archive
+    with gzip.open(path, 'rb') as f:
+        assert f.read() == raw
+    frames = index['frames']
+    assert frames[0][0] == 0 and sum(f[1] for f in frames) == len(raw)
+    assert frames[-1][2] + frames[-1][3] == os.path.getsize(path)
+
+
+def test_select_file_subtree_and_hardlink(archive):
+    _, index, _, _ = archive
+    names = lambda ms: sorted(m[0] for m in ms)
+    assert names(seekable.select(index, ["/app/config.json"])) == ["app/config.json"]
+    assert names(seekable.select(index, ["app/data/"])) == ["app/data", "app/data/big.bin", "app/data/small.txt"]
+    # 只选硬链接时一并选中链接目标, 否则 tar 无法建立链接
+    picked = names(seekable.select(index, ["app/hard.txt"]))
+    assert len(picked) == 2 and "app/hard.txt" in picked
+    assert seekable.select(index, ["app/conf"]) == []    # 前缀不是完整路径段时不匹配
+
+
+@pytest.mark.parametrize("paths", [["app/data/small.txt"], ["app/data"], [LONG], ["logs"], ["app/hard.txt"]])
+def test_extract_round_trip(archive, tmp_path, paths):
+    path, index, src, _ = archive
+    selected = seekable.select(index, paths)
+    target = tmp_path / "restore"
+    used, total = seekable.extract(path, index, selected, str(target))
+    assert 0 < used <= total
+    for m in selected:
+        if m[4] in ("0", "1"):
+            assert (target / m[0]).read_bytes() == (src / m[0]).read_bytes()
+    restored = {str(p.relative_to(target)) for p in target.rglob("*") if p.is_file()}
+    assert restored == {m[0] for m in selected if m[4] in ("0", "1")}
+
+
+def test_extract_small_file_reads_few_frames(archive, tmp_path):
+    path, index, _, _ = archive
+    used, total = seekable.extract(path, index, seekable.select(index, ["app/config.json"]), str(tmp_path / "r"))
+    assert used <= 2 < total
+
+
+def test_list_dir(archive):
+    _, index, _, _ = archive
+    top = {e[0]: e for e in seekable.list_dir(index)}
+    assert set(top) == {"app", "logs", "other", "deep"}
+    assert all(e[1] for e in top.values())
+    app = {e[0]: e for e in seekable.list_dir(index, "/app/")}
+    assert app["data"][1] and app["data"][2] == 300 * 1024 + 5 and app["data"][3] == 2
+    assert app["config.json"][1:] == (False, 8, 1)
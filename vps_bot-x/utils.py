@@ -81,32 +81,19 @@ def get_path_id(path):
 async def split_and_send(file_path, caption):
     """
     发送文件到 Telegram
-    简化版实现,处理大文件分片
+    超过上传上限时切成编号分卷并发上传, 最后附带重组清单 (见 modules/volumes.py);
+    配置了自建 Bot API 服务器时使用同一端点, 上限随之提升
     """
-    url = f"https://api.telegram.org/bot{TOKEN}/sendDocument"
+    import modules.volumes as volumes
+    import modules.bot_api as bot_api
     
     if not os.path.exists(file_path):
         return "❌ 文件不存在"
     
-    file_size = os.path.getsize(file_path)
-    
-    # Telegram 文件大小限制: 50MB
-    if file_size > 49 * 1024 * 1024:
-        return f"❌ 文件过大 ({file_size / 1024**2:.1f} MB),请手动处理"
-    
     try:
-        with open(file_path, 'rb') as f:
-            response = requests.post(
-                url, 
-                data={'chat_id': ALLOWED_USER_ID, 'caption': caption}, 
-                files={'document': f}, 
-                timeout=120
-            )
-            
-            if response.status_code == 200:
-                return "✅ 发送成功"
-            else:
-                return f"❌ 发送失败: {response.text[:100]}"
+        async with bot_api.make_bot() as bot:
+            ok, note = await volumes.deliver_file(bot, ALLOWED_USER_ID, file_path, caption)
+        return note if ok else f"❌ 发送未完成: {note}"
     except Exception as e:
         return f"❌ 发送失败: {str(e)}"
 